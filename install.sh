@@ -421,6 +421,10 @@ preserve_custom_env_vars() {
         "CODEX_DOCS_PASSWORD"
         "XUI_TLS_VERIFY"
         "XUI_TLS_CA_BUNDLE"
+        "XUI_ASYNC_CLIENT"
+        "WEB_SERVER"
+        "WEB_SERVER_THREADS"
+        "WEB_SERVER_CONNECTION_LIMIT"
     )
     
     for var in "${custom_vars[@]}"; do
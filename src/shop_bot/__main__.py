@@ -4,20 +4,22 @@
 """
 
 import logging
-import threading
 import asyncio
 import signal
 import os
 import time
 
 from shop_bot.webhook_server.app import create_webhook_app
-from shop_bot.data_manager.scheduler import periodic_subscription_check
+from shop_bot.webhook_server.server import start_web_server
+from shop_bot.webhook_server.async_runner import run_async, stop_background_loop
+from shop_bot.modules import xui_api
+from shop_bot.data_manager.scheduler import periodic_subscription_check, notification_outbox_dispatcher
 from shop_bot.data_manager import database
 from shop_bot.data_manager.async_database import initialize_async_db, close_async_db
 from shop_bot.data_manager.backup import initialize_backup_system, shutdown_backup_system
 from shop_bot.utils.performance_monitor import get_performance_monitor, start_metrics_cleanup
 from shop_bot.bot_controller import BotController
-from shop_bot.utils import setup_logging, app_logger, security_logger, payment_logger, database_logger
+from shop_bot.utils import setup_logging, shutdown_logging, app_logger, security_logger, payment_logger, database_logger
 
 def main():
     # Настройка централизованного логирования
@@ -87,12 +89,27 @@ def main():
 
     bot_controller = BotController()
     flask_app = create_webhook_app(bot_controller)
+    web_server_holder = {}
     
+    def _stop_web_async_loop():
+        # aiohttp-сессии панелей, открытые из веб-маршрутов, живут в фоновом loop веб-сервера
+        try:
+            run_async(xui_api.close_async_panel_clients(), timeout=5)
+        except Exception as e:
+            logger.warning(f"Failed to close panel clients of the web loop: {e}")
+        stop_background_loop()
+
     async def shutdown(sig: signal.Signals, loop: asyncio.AbstractEventLoop):
         # Определяем тип сигнала для более понятного сообщения
         signal_type = "🛑 Сигнал завершения (SIGTERM)" if sig == signal.SIGTERM else "🛑 Сигнал прерывания (SIGINT)"
         logger.warning(f"{signal_type} - Корректное завершение работы приложения...")
         
+        # Перестаём принимать HTTP-запросы (админ-панель и вебхуки)
+        web_server = web_server_holder.get('server')
+        if web_server is not None:
+            await asyncio.to_thread(web_server.stop)
+        await asyncio.to_thread(_stop_web_async_loop)
+        
         # Останавливаем систему бэкапов
         shutdown_backup_system()
         
@@ -120,15 +137,6 @@ def main():
         bot_controller.set_loop(loop)
         flask_app.config['EVENT_LOOP'] = loop
 
-        # Подключаем loop к TelegramLoggerHandler, если он уже создан
-        try:
-            for h in logging.getLogger().handlers:
-                set_loop = getattr(h, 'set_loop', None)
-                if callable(set_loop):
-                    set_loop(loop)
-        except Exception:
-            pass
-        
         # Настраиваем логирование Werkzeug в зависимости от окружения
         import logging
         werkzeug_logger = logging.getLogger('werkzeug')
@@ -140,13 +148,11 @@ def main():
         for sig in (signal.SIGINT, signal.SIGTERM):
             loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(shutdown(sig, loop)))
         
-        flask_thread = threading.Thread(
-            target=lambda: flask_app.run(host='0.0.0.0', port=50000, use_reloader=False, debug=False),
-            daemon=True
-        )
-        flask_thread.start()
+        # Production WSGI-сервер (waitress) в фоновом потоке этого процесса:
+        # вебхуки передают платежи в loop ботов через run_coroutine_threadsafe
+        web_server_holder['server'] = start_web_server(flask_app, host='0.0.0.0', port=50000)
         
-        logger.info("Flask server started in a background thread on http://0.0.0.0:50000")
+        logger.info(f"Web server ({web_server_holder['server'].config.kind}) started in a background thread on http://0.0.0.0:50000")
         
         # Автозапуск ботов при старте приложения (без захода на панель)
         try:
@@ -188,6 +194,7 @@ def main():
         logger.info("Application is running. Bots are managed automatically and via web panel.")
         
         asyncio.create_task(periodic_subscription_check(bot_controller))
+        asyncio.create_task(notification_outbox_dispatcher(bot_controller))
         
         # Запускаем мониторинг производительности
         asyncio.create_task(start_metrics_cleanup())
@@ -200,6 +207,7 @@ def main():
     finally:
         logger.warning("🛑 Dark Maximus: Завершение работы приложения")
         logger.info("Application is shutting down.")
+        shutdown_logging()
 
 if __name__ == "__main__":
     main()
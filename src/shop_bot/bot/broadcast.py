@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Рассылки администратора всем пользователям
+
+Рассылка выполняется фоновой задачей, не занимая обработчик: получатели
+читаются из БД пачками в рабочем потоке (database.get_broadcast_recipients),
+не блокируя event loop, сообщения
+копируются несколькими конкурентными отправителями через общий
+ограничитель скорости (глобальный token bucket + интервал на чат) с
+соблюдением TelegramRetryAfter. Курсор и счётчики сохраняются в таблицу
+broadcasts, поэтому прерванная перезапуском рассылка продолжается с места
+остановки; прогресс периодически обновляется в сообщении администратору.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from shop_bot.data_manager import database
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота и 1 сообщение/с в один чат
+BROADCAST_GLOBAL_RATE = 25
+BROADCAST_PER_CHAT_INTERVAL = 1.0
+BROADCAST_CONCURRENCY = 8
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_PERSIST_INTERVAL = 2.0
+BROADCAST_PROGRESS_INTERVAL = 5.0
+
+_running: dict[int, "BroadcastEngine"] = {}
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов (ответ Telegram retry_after)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramRateLimiter:
+    """Глобальный лимит бота и минимальный интервал между сообщениями в один чат."""
+
+    def __init__(self, global_rate: float = BROADCAST_GLOBAL_RATE, per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL):
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self._chat_last_sent: dict[int, float] = {}
+
+    async def acquire(self, chat_id: int) -> None:
+        last_sent = self._chat_last_sent.get(chat_id)
+        if last_sent is not None:
+            delay = last_sent + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await self.bucket.acquire()
+        self._chat_last_sent[chat_id] = time.monotonic()
+
+    def release(self, chat_id: int) -> None:
+        """Забывает чат после окончательной отправки (словарь не растёт с числом получателей)."""
+        self._chat_last_sent.pop(chat_id, None)
+
+    def retry_after(self, seconds: float) -> None:
+        self.bucket.pause(seconds)
+
+
+class BroadcastEngine:
+    """Выполнение одной рассылки из таблицы broadcasts."""
+
+    def __init__(self, bot: Bot, broadcast: dict, concurrency: int = BROADCAST_CONCURRENCY,
+                 limiter: TelegramRateLimiter | None = None):
+        self.bot = bot
+        self.broadcast_id = broadcast['broadcast_id']
+        self.admin_chat_id = broadcast['admin_chat_id']
+        self.from_chat_id = broadcast['from_chat_id']
+        self.message_id = broadcast['message_id']
+        self.reply_markup = (
+            InlineKeyboardMarkup.model_validate_json(broadcast['reply_markup']) if broadcast.get('reply_markup') else None
+        )
+        self.progress_message_id = broadcast.get('progress_message_id')
+        self.total = broadcast.get('total') or 0
+        self.skipped_banned = broadcast.get('skipped_banned') or 0
+        self.last_user_id = broadcast.get('last_user_id') or 0
+        self.counts = {
+            'sent': broadcast.get('sent') or 0,
+            'failed': broadcast.get('failed') or 0,
+            'blocked': broadcast.get('blocked') or 0,
+        }
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter or TelegramRateLimiter()
+        # Отправленные по порядку получатели: [telegram_id, результат или None].
+        # Курсор и счётчики двигаются только по непрерывному префиксу обработанных,
+        # поэтому после возобновления никто не получает сообщение дважды по курсору
+        # и не учитывается в счётчиках повторно
+        self._window: deque[list] = deque()
+        self._started = time.monotonic()
+        self._processed_at_start = self.processed
+        self.task: asyncio.Task | None = None
+
+    @property
+    def processed(self) -> int:
+        return sum(self.counts.values())
+
+    async def _send(self, user_id: int) -> str:
+        try:
+            for attempt in range(BROADCAST_MAX_RETRIES + 1):
+                await self.limiter.acquire(user_id)
+                try:
+                    await self.bot.copy_message(
+                        chat_id=user_id,
+                        from_chat_id=self.from_chat_id,
+                        message_id=self.message_id,
+                        reply_markup=self.reply_markup
+                    )
+                    return 'sent'
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Broadcast #{self.broadcast_id}: flood control, retry after {e.retry_after}s")
+                    self.limiter.retry_after(e.retry_after)
+                except TelegramForbiddenError:
+                    return 'blocked'
+                except TelegramBadRequest as e:
+                    logger.warning(f"Broadcast #{self.broadcast_id}: failed to send to user {user_id}: {e}")
+                    return 'failed'
+                except Exception as e:
+                    logger.warning(
+                        f"Broadcast #{self.broadcast_id}: failed to send to user {user_id} (attempt {attempt + 1}): {e}"
+                    )
+            return 'failed'
+        finally:
+            self.limiter.release(user_id)
+
+    async def _iter_recipients(self):
+        """Получатели после курсора; каждая пачка читается из БД через asyncio.to_thread."""
+        last_id = self.last_user_id
+        batch_size = database.BROADCAST_RECIPIENTS_BATCH
+        while True:
+            batch = await asyncio.to_thread(database.get_broadcast_recipients, last_id, batch_size)
+            for user_id in batch:
+                yield user_id
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1]
+
+    def _advance_cursor(self) -> None:
+        while self._window and self._window[0][1]:
+            user_id, result = self._window.popleft()
+            self.counts[result] += 1
+            self.last_user_id = user_id
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            try:
+                result = await self._send(entry[0])
+            except Exception as e:
+                logger.error(f"Broadcast #{self.broadcast_id}: unexpected error for user {entry[0]}: {e}")
+                result = 'failed'
+            entry[1] = result
+            self._advance_cursor()
+
+    def _persist(self, status: str | None = None) -> None:
+        database.update_broadcast_progress(
+            self.broadcast_id, self.last_user_id, self.counts['sent'], self.counts['failed'], self.counts['blocked'],
+            status=status
+        )
+
+    def progress_text(self, finished: bool = False, failed: bool = False) -> str:
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        rate = (self.processed - self._processed_at_start) / elapsed
+        if failed:
+            header = f"❌ Рассылка #{self.broadcast_id} прервана ошибкой"
+        elif finished:
+            header = "✅ Рассылка завершена!"
+        else:
+            header = f"⏳ Рассылка #{self.broadcast_id} выполняется..."
+        return (
+            f"{header}\n\n"
+            f"📨 Обработано: {self.processed} из {self.total}\n"
+            f"👍 Отправлено: {self.counts['sent']}\n"
+            f"👎 Не удалось отправить: {self.counts['failed']}\n"
+            f"⛔ Бот заблокирован: {self.counts['blocked']}\n"
+            f"🚫 Пропущено (забанены): {self.skipped_banned}\n"
+            f"⚡ Скорость: {rate:.1f} сообщ./с"
+        )
+
+    async def _report(self, finished: bool = False, failed: bool = False) -> None:
+        text = self.progress_text(finished, failed)
+        try:
+            if self.progress_message_id and not finished:
+                await self.bot.edit_message_text(text, chat_id=self.admin_chat_id, message_id=self.progress_message_id)
+            else:
+                await self.bot.send_message(self.admin_chat_id, text)
+        except TelegramBadRequest as e:
+            # "message is not modified" и удалённое сообщение прогресса не мешают рассылке
+            logger.debug(f"Broadcast #{self.broadcast_id}: progress update skipped: {e}")
+        except Exception as e:
+            logger.warning(f"Broadcast #{self.broadcast_id}: failed to report progress: {e}")
+
+    async def _periodic(self) -> None:
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(BROADCAST_PERSIST_INTERVAL)
+            self._persist()
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await self._report()
+
+    async def _stop_workers(self, workers: list[asyncio.Task]) -> None:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def run(self) -> dict:
+        """Выполняет рассылку до конца.
+
+        При отмене задачи прогресс сохраняется для возобновления; при любой
+        другой ошибке (например, чтения получателей из БД) отправители
+        останавливаются, рассылка сохраняется со статусом failed, а
+        администратор получает итог.
+        """
+        logger.info(f"Broadcast #{self.broadcast_id}: starting after user {self.last_user_id} ({self.processed}/{self.total} done)")
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        periodic = asyncio.create_task(self._periodic())
+        try:
+            async for user_id in self._iter_recipients():
+                entry = [user_id, None]
+                self._window.append(entry)
+                await queue.put(entry)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            await self._stop_workers(workers)
+            self._persist()
+            logger.info(f"Broadcast #{self.broadcast_id}: interrupted after user {self.last_user_id}, will resume")
+            raise
+        except Exception as e:
+            await self._stop_workers(workers)
+            self._persist(status='failed')
+            logger.error(f"Broadcast #{self.broadcast_id}: failed after user {self.last_user_id}: {e}", exc_info=True)
+            await self._report(finished=True, failed=True)
+            raise
+        finally:
+            periodic.cancel()
+            await asyncio.gather(periodic, return_exceptions=True)
+
+        self._persist(status='completed')
+        logger.info(f"Broadcast #{self.broadcast_id}: completed {self.counts}")
+        await self._report(finished=True)
+        return dict(self.counts)
+
+
+def _start_engine(bot: Bot, broadcast: dict) -> BroadcastEngine:
+    engine = BroadcastEngine(bot, broadcast)
+    engine.task = asyncio.create_task(engine.run(), name=f"broadcast-{engine.broadcast_id}")
+    _running[engine.broadcast_id] = engine
+    engine.task.add_done_callback(lambda _task: _running.pop(engine.broadcast_id, None))
+    return engine
+
+
+def start_broadcast(bot: Bot, admin_chat_id: int, from_chat_id: int, message_id: int,
+                    reply_markup: InlineKeyboardMarkup | None = None, progress_message_id: int | None = None) -> int | None:
+    """Создаёт рассылку и запускает её фоновой задачей. Возвращает broadcast_id."""
+    broadcast_id = database.create_broadcast(
+        admin_chat_id, from_chat_id, message_id,
+        reply_markup.model_dump_json() if reply_markup else None,
+        progress_message_id
+    )
+    if broadcast_id is None:
+        return None
+    _start_engine(bot, database.get_broadcast(broadcast_id))
+    return broadcast_id
+
+
+def resume_broadcasts(bot: Bot) -> list[int]:
+    """Возобновляет рассылки, прерванные остановкой бота (вызывается при запуске бота)."""
+    resumed = []
+    for broadcast in database.get_unfinished_broadcasts():
+        if broadcast['broadcast_id'] in _running:
+            continue
+        _start_engine(bot, broadcast)
+        resumed.append(broadcast['broadcast_id'])
+    if resumed:
+        logger.info(f"Resumed interrupted broadcasts: {resumed}")
+    return resumed
+
+
+async def stop_broadcasts() -> None:
+    """Прерывает выполняющиеся рассылки с сохранением прогресса (при остановке бота)."""
+    tasks = [engine.task for engine in list(_running.values()) if engine.task]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_running_broadcasts() -> dict[int, BroadcastEngine]:
+    return dict(_running)
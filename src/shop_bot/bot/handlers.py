@@ -38,6 +38,7 @@ from aiogram.enums import ChatMemberStatus, ParseMode
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from shop_bot.bot import keyboards
+from shop_bot.bot.broadcast import start_broadcast
 from shop_bot.bot.keyboards import normalize_web_app_url, _is_local_address
 from shop_bot.modules import xui_api
 from shop_bot.data_manager.database import (
@@ -2288,40 +2289,21 @@ def get_user_router() -> Router:
             final_keyboard = builder.as_markup()
 
         await state.clear()
-        
-        users = get_all_users()
-        logger.info(f"Broadcast: Starting to iterate over {len(users)} users.")
-
-        sent_count = 0
-        failed_count = 0
-        banned_count = 0
 
-        for user in users:
-            user_id = user['telegram_id']
-            if user.get('is_banned'):
-                banned_count += 1
-                continue
-            
-            try:
-                await bot.copy_message(
-                    chat_id=user_id,
-                    from_chat_id=original_message.chat.id,
-                    message_id=original_message.message_id,
-                    reply_markup=final_keyboard
-                )
-
-                sent_count += 1
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                failed_count += 1
-                logger.warning(f"Failed to send broadcast message to user {user_id}: {e}")
-        
-        await callback.message.answer(
-            f"✅ Рассылка завершена!\n\n"
-            f"👍 Отправлено: {sent_count}\n"
-            f"👎 Не удалось отправить: {failed_count}\n"
-            f"🚫 Пропущено (забанены): {banned_count}"
+        # Рассылка идёт фоновой задачей: обработчик сразу освобождается, а прогресс
+        # обновляется в этом сообщении (см. shop_bot.bot.broadcast)
+        broadcast_id = start_broadcast(
+            bot,
+            admin_chat_id=callback.message.chat.id,
+            from_chat_id=original_message.chat.id,
+            message_id=original_message.message_id,
+            reply_markup=final_keyboard,
+            progress_message_id=callback.message.message_id,
         )
+        if broadcast_id is None:
+            await callback.message.answer("❌ Не удалось запустить рассылку. Подробности в логах.")
+        else:
+            logger.info(f"Broadcast #{broadcast_id} started by admin {callback.from_user.id}")
         await show_main_menu(callback.message)
 
     @user_router.callback_query(StateFilter(Broadcast), F.data == "cancel_broadcast")
@@ -7635,10 +7617,9 @@ async def process_successful_payment(bot: Bot, metadata: dict, tx_hash: str | No
         elif action == "extend":
             # Для продления используем транзакцию для атомарности
             try:
-                from shop_bot.data_manager.database import DB_FILE
-                with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                from shop_bot.data_manager.database import _get_db_connection
+                with _get_db_connection() as conn:
                     cursor = conn.cursor()
-                    cursor.execute("PRAGMA busy_timeout=30000")
                     cursor.execute("BEGIN IMMEDIATE")
                     
                     try:
@@ -5,8 +5,11 @@ Middleware для Telegram-бота с кэшированием
 
 import asyncio
 import logging
+import time
 from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
 from aiogram.types import TelegramObject, Message, CallbackQuery, Chat
 from functools import lru_cache
 from datetime import datetime, timedelta
@@ -14,75 +17,33 @@ from shop_bot.utils.performance_monitor import get_performance_monitor
 
 logger = logging.getLogger(__name__)
 
-# Кэш для проверки бана пользователей
-_user_ban_cache: Dict[int, tuple[bool, datetime]] = {}
-CACHE_TTL = 300  # 5 минут
-
 class BanMiddleware(BaseMiddleware):
-    """Middleware для проверки бана пользователей с кэшированием"""
-    
-    def __init__(self):
-        super().__init__()
-        self._cache_cleanup_task = None
-    
-    def _start_cache_cleanup(self):
-        """Запуск задачи очистки кэша"""
-        try:
-            if self._cache_cleanup_task is None or self._cache_cleanup_task.done():
-                self._cache_cleanup_task = asyncio.create_task(self._cleanup_cache())
-        except RuntimeError:
-            # Event loop еще не запущен, запустим позже
-            pass
-    
-    async def _cleanup_cache(self):
-        """Очистка устаревших записей из кэша"""
-        while True:
-            try:
-                await asyncio.sleep(60)  # Проверяем каждую минуту
-                current_time = datetime.now()
-                expired_users = [
-                    user_id for user_id, (_, cache_time) in _user_ban_cache.items()
-                    if current_time - cache_time > timedelta(seconds=CACHE_TTL)
-                ]
-                for user_id in expired_users:
-                    _user_ban_cache.pop(user_id, None)
-                if expired_users:
-                    logger.debug(f"Cleaned up {len(expired_users)} expired cache entries")
-            except Exception as e:
-                logger.error(f"Error in cache cleanup: {e}")
-    
+    """Middleware для проверки бана пользователей с кэшированием.
+
+    Статус берётся из database.BanCache: набор забаненных ID держится в
+    памяти и сбрасывается при бане/разбане (в том числе из других
+    процессов через ban_version), поэтому обычный путь не обращается к БД.
+    """
+
     async def _is_user_banned_cached(self, user_id: int) -> bool:
         """Проверка бана пользователя с кэшированием"""
-        current_time = datetime.now()
-        
-        # Проверяем кэш
-        if user_id in _user_ban_cache:
-            is_banned, cache_time = _user_ban_cache[user_id]
-            if current_time - cache_time < timedelta(seconds=CACHE_TTL):
-                return is_banned
-        
-        # Если нет в кэше или кэш устарел, запрашиваем из БД
-        try:
-            from shop_bot.data_manager.async_database import get_user_async
-            user_data = await get_user_async(user_id)
-            is_banned = user_data and user_data.get('is_banned', False)
-            
-            # Обновляем кэш
-            _user_ban_cache[user_id] = (is_banned, current_time)
+        from shop_bot.data_manager.database import get_ban_cache
+        ban_cache = get_ban_cache()
+        is_banned = ban_cache.peek(user_id)
+        if is_banned is not None:
             return is_banned
+        try:
+            return await asyncio.to_thread(ban_cache.is_banned, user_id)
         except Exception as e:
             logger.error(f"Error checking user ban status for {user_id}: {e}")
             return False
-    
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        # Запускаем очистку кэша, если еще не запущена
-        self._start_cache_cleanup()
-        
         user = data.get('event_from_user')
         if not user:
             return await handler(event, data)
@@ -168,6 +129,29 @@ class PerformanceMiddleware(BaseMiddleware):
             except Exception as e:
                 logger.error(f"PerformanceMiddleware: failed to record metric: {e}", exc_info=True)
 
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Request-middleware сессии бота: время и исход вызовов Telegram Bot API.
+
+    Каждый вызов пишется в монитор как telegram_api:<метод> (sendMessage,
+    answerCallbackQuery, ...), откуда /metrics берёт частоту и задержки
+    отправки. Long polling (getUpdates) не учитывается: его длительность —
+    это время ожидания обновлений, а не задержка API.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        success = False
+        try:
+            result = await make_request(bot, method)
+            success = True
+            return result
+        finally:
+            get_performance_monitor().record_metric_sync(
+                f"telegram_api:{method.__api_method__}", time.perf_counter() - started, success=success
+            )
+
 class RateLimitMiddleware(BaseMiddleware):
     """Middleware для ограничения частоты запросов"""
     
@@ -18,8 +18,8 @@ from aiohttp import ClientTimeout, TCPConnector
 
 from shop_bot.data_manager import database
 from shop_bot.bot.handlers import get_user_router
-from shop_bot.bot.middlewares import BanMiddleware, PerformanceMiddleware, RateLimitMiddleware
-from shop_bot.bot import handlers, support_handlers
+from shop_bot.bot.middlewares import BanMiddleware, PerformanceMiddleware, RateLimitMiddleware, TelegramApiMetricsMiddleware
+from shop_bot.bot import broadcast, handlers, support_handlers
 from shop_bot.bot.support_handlers import get_support_router
 
 logger = logging.getLogger(__name__)
@@ -134,6 +134,8 @@ def _create_telegram_session(timeout: ClientTimeout) -> AiohttpSession:
     а не объектом ClientTimeout, так как aiogram пытается сложить его с polling_timeout.
     Устанавливаем timeout как число для совместимости с aiogram dispatcher.
     
+    Вызовы Bot API проходят через TelegramApiMetricsMiddleware (задержки и ошибки для /metrics).
+    
     Args:
         timeout: Таймауты для HTTP запросов (ClientTimeout объект)
         
@@ -149,6 +151,7 @@ def _create_telegram_session(timeout: ClientTimeout) -> AiohttpSession:
         # aiohttp автоматически создаст ClientTimeout из числа при создании сессии
         timeout_value = timeout.total if isinstance(timeout, ClientTimeout) else timeout
         session.timeout = timeout_value
+        session.middleware(TelegramApiMetricsMiddleware())
         
         logger.debug(f"Telegram session created with timeout={timeout_value}s and explicit SSL context (certifi)")
         return session
@@ -159,6 +162,7 @@ def _create_telegram_session(timeout: ClientTimeout) -> AiohttpSession:
         # Устанавливаем timeout как число
         timeout_value = timeout.total if isinstance(timeout, ClientTimeout) else timeout
         session.timeout = timeout_value
+        session.middleware(TelegramApiMetricsMiddleware())
         return session
 
 
@@ -195,6 +199,10 @@ class BotController:
                     "Если возникнет конфликт, проверьте наличие других экземпляров бота."
                 )
             
+            if name == "ShopBot":
+                # Рассылки, прерванные прошлой остановкой бота, продолжаются с сохранённого курсора
+                broadcast.resume_broadcasts(bot)
+
             print(f"DEBUG: Starting polling for {name} with bot {bot.id}")
             # В aiogram 3.21.0 timeout должен быть числом для вычисления request_timeout
             # Используем polling_timeout=10 (дефолт) и не устанавливаем timeout на сессии
@@ -223,6 +231,8 @@ class BotController:
             logger.error(f"BotController: An error occurred during polling for '{name}': {e}", exc_info=True)
         finally:
             logger.info(f"BotController: Polling for '{name}' has gracefully stopped.")
+            if name == "ShopBot":
+                await broadcast.stop_broadcasts()
             if bot:
                 await bot.close()
             if name == "ShopBot":
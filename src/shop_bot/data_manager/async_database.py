@@ -52,6 +52,7 @@ class AsyncDatabaseManager:
             for _ in range(self.max_connections):
                 conn = await aiosqlite.connect(self.db_path)
                 await conn.execute("PRAGMA journal_mode=DELETE")
+                await conn.execute("PRAGMA busy_timeout=30000")
                 await conn.execute("PRAGMA synchronous=NORMAL")
                 await conn.execute("PRAGMA cache_size=10000")
                 await conn.execute("PRAGMA temp_store=MEMORY")
@@ -10,17 +10,48 @@ import logging
 import asyncio
 import threading
 import time
+from contextlib import closing
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 import gzip
+import hashlib
 import json
+import struct
+import uuid
+import zlib
 
-from shop_bot.data_manager.database import DB_FILE
+from shop_bot.data_manager.database import DB_FILE, close_db_connections, invalidate_settings_cache
 from shop_bot.utils import app_logger, database_logger
+from shop_bot.utils.performance_monitor import get_performance_monitor
 
 logger = logging.getLogger(__name__)
 
+# Страниц за шаг backup API и пауза между шагами: запись в БД не ждёт весь снимок
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_SLEEP = 0.005
+# Сколько раз постраничное копирование может начаться заново из-за записи
+# в источник, прежде чем снимок будет снят за один проход
+BACKUP_MAX_RESTARTS = 3
+# До этого размера снимок для сжатия держится в памяти, а не во временном файле
+BACKUP_MEMORY_SNAPSHOT_LIMIT = 64 * 1024 * 1024
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_COMPRESS_LEVEL = 6
+
+# Инкрементальные бэкапы: цепочки base + дельты изменённых страниц
+INCREMENTAL_DIR_NAME = "incremental"
+CHAIN_MANIFEST_FILE = "chain.json"
+# Хеши страниц хранятся отдельным файлом для каждой точки, имя файла
+# записано в манифесте: если процесс упадёт между записью хешей и
+# манифеста, следующая дельта сравнивается с хешами последней точки из
+# манифеста, а не с хешами точки, которой в цепочке нет.
+# CHAIN_HASHES_FILE — общий файл хешей цепочек, созданных до этого
+CHAIN_HASHES_FILE = "pages.hash"
+CHAIN_POINT_HASHES_FILE = "pages_{seq:04d}.hash"
+PAGE_HASH_SIZE = 16
+DELTA_PAGE_HEADER = struct.Struct(">I")
+BACKUP_FULL_EVERY = 7
+
 def _parse_bool(value: Any, default: bool = True) -> bool:
     """Нормализует булево значение из строки/числа/булева.
     Принимает True/False, 'true'/'false', 'True'/'False', '1'/'0', 1/0, 'yes'/'no', 'on'/'off'.
@@ -38,6 +69,11 @@ def _parse_bool(value: Any, default: bool = True) -> bool:
         return False
     return default
 
+
+class _SnapshotRestarted(Exception):
+    """Постраничное копирование слишком часто начиналось заново"""
+
+
 class DatabaseBackupManager:
     """Менеджер бэкапов базы данных"""
     
@@ -52,22 +88,38 @@ class DatabaseBackupManager:
         self.backup_interval_hours = 24  # По умолчанию каждые 24 часа
         self.compression_enabled = True
         self.verify_backups = True
+        self.quick_check = False
+        self.step_pages = BACKUP_STEP_PAGES
+        self.step_sleep = BACKUP_STEP_SLEEP
+        self.memory_snapshot_limit = BACKUP_MEMORY_SNAPSHOT_LIMIT
+        self.incremental_enabled = False
+        self.full_backup_every = BACKUP_FULL_EVERY
+        self._incremental_lock = threading.Lock()
         
         # Статистика
         self.last_backup_time = None
         self.backup_count = 0
         self.failed_backups = 0
+        self.last_backup_metrics: Optional[Dict[str, Any]] = None
     
     def create_backup(self, backup_name: Optional[str] = None) -> Dict[str, Any]:
         """
         Создает бэкап базы данных
         
+        Снимок снимается SQLite backup API порциями по step_pages страниц с
+        паузой step_sleep между шагами, поэтому запись в БД не простаивает.
+        При сжатии небольшая БД копируется в память и сжимается оттуда,
+        без несжатого файла на диске; большая — через временный снимок.
+        
         Args:
             backup_name: Имя файла бэкапа (если не указано, генерируется автоматически)
             
         Returns:
             Dict с информацией о бэкапе
         """
+        started = time.perf_counter()
+        monitor = get_performance_monitor()
+        snapshot_tmp = None
         try:
             if not DB_FILE.exists():
                 raise FileNotFoundError(f"Database file not found: {DB_FILE}")
@@ -78,94 +130,54 @@ class DatabaseBackupManager:
                 backup_name = f"users_backup_{timestamp}.db"
             
             backup_path = self.backup_dir / backup_name
-
-            # Создаем бэкап через SQLite backup API (атомарный снимок без гонок записи)
-            # Всегда создаем сначала несжатый .db, проверяем целостность, затем по необходимости сжимаем
             uncompressed_backup_path = backup_path.with_suffix('.db') if backup_path.suffix != '.db' else backup_path
 
             # Убедимся, что директория существует
             uncompressed_backup_path.parent.mkdir(parents=True, exist_ok=True)
 
-            # Выполняем резервное копирование через API с retry логикой при блокировке
-            max_retries = 3
-            retry_delays = [1.0, 2.0, 3.0]
-            backup_success = False
-            
-            for attempt in range(max_retries):
-                try:
-                    with sqlite3.connect(DB_FILE, timeout=30) as src_conn:
-                        try:
-                            # На случай WAL — сделаем чекпойнт; игнорируем ошибку, если режим не WAL
-                            try:
-                                src_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
-                            except sqlite3.Error as e:
-                                logger.debug(f"Failed to checkpoint WAL in backup: {e}")
-
-                            src_conn.execute("PRAGMA busy_timeout=5000")
-                            with sqlite3.connect(uncompressed_backup_path) as dst_conn:
-                                dst_conn.execute("PRAGMA busy_timeout=5000")
-                                src_conn.backup(dst_conn)
-                        finally:
-                            src_conn.commit()
-                    
-                    backup_success = True
-                    break
-                    
-                except sqlite3.OperationalError as db_error:
-                    if "database is locked" in str(db_error).lower() and attempt < max_retries - 1:
-                        wait_time = retry_delays[attempt]
-                        logger.warning(
-                            f"Database is locked during backup (attempt {attempt + 1}/{max_retries}). "
-                            f"Retrying in {wait_time}s..."
-                        )
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise
+            source_size = DB_FILE.stat().st_size
+            in_memory = self.compression_enabled and source_size <= self.memory_snapshot_limit
+            # Временные файлы начинаются с точки и не попадают в list_backups до готовности
+            snapshot_tmp = None if in_memory else uncompressed_backup_path.with_name(f".{uncompressed_backup_path.name}.tmp")
 
-            # Глубокая проверка целостности бэкапа и авто-восстановление индексов при необходимости
-            if self.verify_backups:
-                try:
-                    self._verify_backup(uncompressed_backup_path)
-                except Exception as integrity_err:
-                    # Попробуем переиндексировать копию и проверить ещё раз
-                    try:
-                        with sqlite3.connect(uncompressed_backup_path) as fix_conn:
-                            cur = fix_conn.cursor()
-                            cur.execute("REINDEX")
-                            cur.execute("ANALYZE")
-                            fix_conn.commit()
-                        # Повторная проверка
-                        self._verify_backup(uncompressed_backup_path)
-                    except Exception as e:
-                        logger.debug(f"Failed to reindex backup copy: {e}")
-                        # Если переиндексация не помогла — пробрасываем исходную ошибку
-                        raise integrity_err
+            snapshot, pages, steps = self._take_snapshot(snapshot_tmp)
 
-            # Сжимаем бэкап, если включено сжатие (после успешной проверки)
+            # Сжимаем снимок потоком (после успешной проверки) и публикуем файл атомарно
             if self.compression_enabled:
-                compressed_path = uncompressed_backup_path.with_suffix('.db.gz')
-                with open(uncompressed_backup_path, 'rb') as f_in:
-                    with gzip.open(compressed_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                # Удаляем несжатый файл после успешного сжатия
-                if uncompressed_backup_path.exists():
-                    uncompressed_backup_path.unlink()
-                backup_path = compressed_path
+                phase_started = time.perf_counter()
+                backup_path = uncompressed_backup_path.with_suffix('.db.gz')
+                self._compress_snapshot(snapshot, snapshot_tmp, backup_path)
+                snapshot = None
+                monitor.record_metric_sync("backup_phase:compress", time.perf_counter() - phase_started)
             else:
                 backup_path = uncompressed_backup_path
+                os.replace(snapshot_tmp, backup_path)
             
+            duration = time.perf_counter() - started
+            backup_size = backup_path.stat().st_size
+
             # Обновляем статистику
             self.last_backup_time = datetime.now()
             self.backup_count += 1
+            self.last_backup_metrics = {
+                'duration': round(duration, 3),
+                'source_size': source_size,
+                'backup_size': backup_size,
+                'pages': pages,
+                'steps': steps,
+                'throughput_mb_s': round(source_size / duration / (1024 * 1024), 2) if duration > 0 else None,
+                'snapshot': 'memory' if in_memory else 'file',
+                'verify_mode': ('quick_check' if self.quick_check else 'integrity_check') if self.verify_backups else None,
+            }
             
             backup_info = {
                 'success': True,
                 'backup_name': backup_name,
                 'backup_path': str(backup_path),
-                'backup_size': backup_path.stat().st_size,
+                'backup_size': backup_size,
                 'created_at': self.last_backup_time.isoformat(),
-                'compressed': self.compression_enabled
+                'compressed': self.compression_enabled,
+                **self.last_backup_metrics
             }
             
             database_logger.log_database_operation(
@@ -174,11 +186,20 @@ class DatabaseBackupManager:
                 backup_info
             )
             
-            logger.info(f"Database backup created successfully: {backup_path}")
+            monitor.record_metric_sync("backup_create", duration)
+            monitor.record_count_sync("backup_source_bytes", source_size)
+            monitor.record_count_sync("backup_output_bytes", backup_size)
+            logger.info(
+                f"Database backup created successfully: {backup_path} "
+                f"({source_size / (1024 * 1024):.1f} MB in {duration:.2f}s, {steps} steps)"
+            )
             return backup_info
             
         except Exception as e:
             self.failed_backups += 1
+            monitor.record_metric_sync(
+                "backup_create", time.perf_counter() - started, success=False, error=str(e)
+            )
             error_info = {
                 'success': False,
                 'error': str(e),
@@ -193,6 +214,148 @@ class DatabaseBackupManager:
             
             logger.error(f"Failed to create database backup: {e}")
             return error_info
+        finally:
+            if snapshot_tmp is not None and snapshot_tmp.exists():
+                snapshot_tmp.unlink()
+
+    def _take_snapshot(self, snapshot_tmp: Optional[Path]) -> tuple[Optional[bytes], int, int]:
+        """Снимок БД с повтором при блокировке и проверкой целостности
+
+        Если snapshot_tmp не задан, снимок делается в памяти и возвращается
+        байтами; иначе он остаётся в файле snapshot_tmp.
+
+        Returns:
+            (байты снимка или None, страниц, шагов)
+        """
+        monitor = get_performance_monitor()
+
+        # Выполняем резервное копирование через API с retry логикой при блокировке
+        max_retries = 3
+        retry_delays = [1.0, 2.0, 3.0]
+        
+        for attempt in range(max_retries):
+            dst_conn = sqlite3.connect(":memory:" if snapshot_tmp is None else snapshot_tmp)
+            try:
+                phase_started = time.perf_counter()
+                pages, steps = self._copy_snapshot(dst_conn)
+                monitor.record_metric_sync("backup_phase:snapshot", time.perf_counter() - phase_started)
+                break
+            except sqlite3.OperationalError as db_error:
+                dst_conn.close()
+                if "database is locked" in str(db_error).lower() and attempt < max_retries - 1:
+                    wait_time = retry_delays[attempt]
+                    logger.warning(
+                        f"Database is locked during backup (attempt {attempt + 1}/{max_retries}). "
+                        f"Retrying in {wait_time}s..."
+                    )
+                    time.sleep(wait_time)
+                    continue
+                else:
+                    raise
+            except Exception:
+                dst_conn.close()
+                raise
+
+        try:
+            # Проверка целостности снимка и авто-восстановление индексов при необходимости
+            if self.verify_backups:
+                phase_started = time.perf_counter()
+                try:
+                    self._check_integrity(dst_conn)
+                except Exception as integrity_err:
+                    # Попробуем переиндексировать копию и проверить ещё раз
+                    try:
+                        cur = dst_conn.cursor()
+                        cur.execute("REINDEX")
+                        cur.execute("ANALYZE")
+                        dst_conn.commit()
+                        self._check_integrity(dst_conn)
+                    except Exception as e:
+                        logger.debug(f"Failed to reindex backup copy: {e}")
+                        # Если переиндексация не помогла — пробрасываем исходную ошибку
+                        raise integrity_err
+                monitor.record_metric_sync("backup_phase:verify", time.perf_counter() - phase_started)
+
+            snapshot = dst_conn.serialize() if snapshot_tmp is None else None
+        finally:
+            dst_conn.close()
+        return snapshot, pages, steps
+
+    def _compress_snapshot(self, snapshot: Optional[bytes], snapshot_tmp: Optional[Path], target: Path):
+        """Потоково сжимает снимок (байты или файл) в target через временный файл"""
+        gzip_tmp = target.with_name(f".{target.name}.tmp")
+        try:
+            with gzip.open(gzip_tmp, 'wb', compresslevel=BACKUP_COMPRESS_LEVEL) as f_out:
+                if snapshot is not None:
+                    with memoryview(snapshot) as view:
+                        for offset in range(0, len(view), BACKUP_CHUNK_SIZE):
+                            f_out.write(view[offset:offset + BACKUP_CHUNK_SIZE])
+                else:
+                    with open(snapshot_tmp, 'rb') as f_in:
+                        shutil.copyfileobj(f_in, f_out, BACKUP_CHUNK_SIZE)
+            os.replace(gzip_tmp, target)
+        finally:
+            if gzip_tmp.exists():
+                gzip_tmp.unlink()
+
+    def _copy_snapshot(self, dst_conn: sqlite3.Connection) -> tuple[int, int]:
+        """Постранично копирует БД в dst_conn, возвращает (страниц, шагов)
+
+        В режиме WAL источник держит открытую транзакцию чтения: снимок
+        фиксирован, записи других соединений между шагами не ждут его
+        окончания. В режиме DELETE (основной для бота, см. docs/reference/database.md)
+        такая транзакция заблокировала бы запись на всё время копирования,
+        поэтому блокировка держится только внутри шага, а запись между
+        шагами перезапускает копирование. После BACKUP_MAX_RESTARTS
+        перезапусков снимок снимается за один проход, как раньше.
+        """
+        progress_state = {'pages': 0, 'steps': 0, 'remaining': None, 'restarts': 0}
+
+        def progress(status, remaining, total):
+            progress_state['pages'] = total
+            progress_state['steps'] += 1
+            # Оставшихся страниц не стало меньше — копирование началось заново
+            if progress_state['remaining'] is not None and remaining >= progress_state['remaining']:
+                progress_state['restarts'] += 1
+                if progress_state['restarts'] > BACKUP_MAX_RESTARTS:
+                    raise _SnapshotRestarted()
+            progress_state['remaining'] = remaining
+            if remaining and self.step_sleep > 0:
+                time.sleep(self.step_sleep)
+
+        with closing(sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)) as src_conn:
+            src_conn.execute("PRAGMA busy_timeout=5000")
+            dst_conn.execute("PRAGMA busy_timeout=5000")
+            journal_mode = src_conn.execute("PRAGMA journal_mode").fetchone()[0]
+            if journal_mode.upper() == 'WAL':
+                try:
+                    src_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                except sqlite3.Error as e:
+                    logger.debug(f"Failed to checkpoint WAL in backup: {e}")
+                src_conn.execute("BEGIN")
+                try:
+                    src_conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                    src_conn.backup(dst_conn, pages=self.step_pages, progress=progress)
+                finally:
+                    src_conn.execute("ROLLBACK")
+            else:
+                try:
+                    src_conn.backup(dst_conn, pages=self.step_pages, progress=progress)
+                except _SnapshotRestarted:
+                    logger.warning(
+                        f"Backup restarted {progress_state['restarts']} times due to concurrent writes, "
+                        f"copying snapshot in a single pass"
+                    )
+                    src_conn.backup(dst_conn)
+                    progress_state['steps'] += 1
+        return progress_state['pages'], progress_state['steps']
+
+    def _check_integrity(self, conn: sqlite3.Connection):
+        """PRAGMA quick_check или integrity_check (по настройке quick_check)"""
+        pragma = "quick_check" if self.quick_check else "integrity_check"
+        result = conn.execute(f"PRAGMA {pragma}").fetchone()
+        if result[0] != 'ok':
+            raise Exception(f"Database {pragma} failed: {result[0]}")
     
     def _verify_backup(self, backup_path: Path) -> bool:
         """Проверяет целостность бэкапа"""
@@ -205,26 +368,16 @@ class DatabaseBackupManager:
                     with open(tmp_path, 'wb') as f_out:
                         shutil.copyfileobj(f_in, f_out)
                 try:
-                    conn = sqlite3.connect(tmp_path)
-                    cursor = conn.cursor()
-                    cursor.execute("PRAGMA integrity_check")
-                    result = cursor.fetchone()
-                    conn.close()
-                    if result[0] != 'ok':
-                        raise Exception(f"Database integrity check failed: {result[0]}")
+                    with closing(sqlite3.connect(tmp_path)) as conn:
+                        self._check_integrity(conn)
                 finally:
                     # Удаляем временный файл
                     if tmp_path.exists():
                         tmp_path.unlink()
             else:
                 # Проверяем SQLite файл
-                conn = sqlite3.connect(backup_path)
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA integrity_check")
-                result = cursor.fetchone()
-                conn.close()
-                if result[0] != 'ok':
-                    raise Exception(f"Database integrity check failed: {result[0]}")
+                with closing(sqlite3.connect(backup_path)) as conn:
+                    self._check_integrity(conn)
             
             return True
             
@@ -237,7 +390,7 @@ class DatabaseBackupManager:
         Восстанавливает базу данных из бэкапа
         
         Args:
-            backup_path: Путь к файлу бэкапа
+            backup_path: Путь к файлу бэкапа или к точке инкрементальной цепочки
             create_backup_before_restore: Создать бэкап перед восстановлением
             
         Returns:
@@ -254,15 +407,32 @@ class DatabaseBackupManager:
                 if not current_backup['success']:
                     raise Exception("Failed to create backup before restore")
             
-            # Восстанавливаем из бэкапа
-            if backup_file.suffix == '.gz':
-                # Распаковываем сжатый файл
+            # Восстанавливаем из бэкапа через SQLite backup API: перезапись
+            # файла поверх открытых соединений пула повредила бы БД
+            source_path = backup_file
+            if (backup_file.parent / CHAIN_MANIFEST_FILE).exists():
+                # Точка инкрементальной цепочки: собираем base и дельты до неё
+                source_path = backup_file.parent / f".{backup_file.name}.restore.tmp"
+                self._rebuild_point(backup_file, source_path)
+            elif backup_file.suffix == '.gz':
+                # Распаковываем сжатый файл во временный соседний файл
+                source_path = backup_file.with_suffix('.restore.tmp')
                 with gzip.open(backup_file, 'rb') as f_in:
-                    with open(DB_FILE, 'wb') as f_out:
+                    with open(source_path, 'wb') as f_out:
                         shutil.copyfileobj(f_in, f_out)
-            else:
-                # Копируем обычный файл
-                shutil.copy2(backup_file, DB_FILE)
+            try:
+                src_conn = sqlite3.connect(source_path)
+                dst_conn = sqlite3.connect(DB_FILE, timeout=30)
+                try:
+                    src_conn.backup(dst_conn)
+                finally:
+                    dst_conn.close()
+                    src_conn.close()
+            finally:
+                if source_path != backup_file and source_path.exists():
+                    source_path.unlink()
+            close_db_connections()
+            invalidate_settings_cache()
             
             # Проверяем целостность восстановленной БД
             if self.verify_backups:
@@ -299,6 +469,336 @@ class DatabaseBackupManager:
             logger.error(f"Failed to restore database from {backup_path}: {e}")
             return error_info
     
+    def stream_snapshot(self) -> "SnapshotStream":
+        """
+        Согласованный снимок БД для скачивания в виде gzip-потока
+        
+        Снимок снимается сразу тем же постраничным backup API, что и бэкапы,
+        поэтому ошибки видны до начала ответа. Сжатие идёт лениво, по мере
+        чтения потока фрагментами BACKUP_CHUNK_SIZE: память ограничена
+        memory_snapshot_limit, большая БД читается из временного снимка,
+        который удаляется при закрытии потока.
+        """
+        started = time.perf_counter()
+        if not DB_FILE.exists():
+            raise FileNotFoundError(f"Database file not found: {DB_FILE}")
+        snapshot_tmp = None
+        if DB_FILE.stat().st_size > self.memory_snapshot_limit:
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            snapshot_tmp = self.backup_dir / f".download_{uuid.uuid4().hex}.tmp"
+        try:
+            snapshot, pages, steps = self._take_snapshot(snapshot_tmp)
+        except Exception:
+            if snapshot_tmp is not None and snapshot_tmp.exists():
+                snapshot_tmp.unlink()
+            raise
+        get_performance_monitor().record_metric_sync("database_download_snapshot", time.perf_counter() - started)
+        return SnapshotStream(snapshot, snapshot_tmp)
+
+    # ==================== Инкрементальные бэкапы ====================
+
+    @property
+    def incremental_dir(self) -> Path:
+        return self.backup_dir / INCREMENTAL_DIR_NAME
+
+    def create_incremental_backup(self) -> Dict[str, Any]:
+        """
+        Создает точку восстановления в цепочке инкрементальных бэкапов
+        
+        Цепочка — это полный сжатый снимок (base) и дельты: в дельту
+        попадают только страницы, хеш которых изменился с прошлой точки.
+        Новая цепочка начинается каждые full_backup_every точек и при смене
+        размера страницы.
+        
+        Returns:
+            Dict с информацией о точке восстановления
+        """
+        started = time.perf_counter()
+        monitor = get_performance_monitor()
+        snapshot_tmp = None
+        with self._incremental_lock:
+            try:
+                if not DB_FILE.exists():
+                    raise FileNotFoundError(f"Database file not found: {DB_FILE}")
+                self.incremental_dir.mkdir(parents=True, exist_ok=True)
+
+                source_size = DB_FILE.stat().st_size
+                if source_size > self.memory_snapshot_limit:
+                    snapshot_tmp = self.incremental_dir / ".snapshot.tmp"
+                snapshot, pages, steps = self._take_snapshot(snapshot_tmp)
+                page_size = self._snapshot_page_size(snapshot, snapshot_tmp)
+
+                chain_dir = self._latest_chain_dir()
+                chain = self._load_chain(chain_dir) if chain_dir else None
+                new_chain = (
+                    chain is None
+                    or len(chain['points']) >= self.full_backup_every
+                    or chain['page_size'] != page_size
+                )
+                now = datetime.now()
+                if new_chain:
+                    chain_dir = self.incremental_dir / f"chain_{now.strftime('%Y%m%d_%H%M%S_%f')}"
+                    chain_dir.mkdir()
+                    chain = {'page_size': page_size, 'points': []}
+                    previous_hashes = b""
+                    previous_hashes_file = None
+                else:
+                    previous_hashes_file = chain['points'][-1].get('hashes', CHAIN_HASHES_FILE)
+                    previous_hashes = (chain_dir / previous_hashes_file).read_bytes()
+
+                seq = len(chain['points'])
+                phase_started = time.perf_counter()
+                page_hashes = bytearray()
+                checksum = hashlib.sha256()
+                changed = 0
+                if new_chain:
+                    point_path = chain_dir / f"{seq:04d}_{now.strftime('%Y%m%d_%H%M%S')}.base.db.gz"
+                    for page in self._iter_chunks(snapshot, snapshot_tmp, page_size):
+                        checksum.update(page)
+                        page_hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+                    changed = pages
+                    self._compress_snapshot(snapshot, snapshot_tmp, point_path)
+                else:
+                    point_path = chain_dir / f"{seq:04d}_{now.strftime('%Y%m%d_%H%M%S')}.delta.gz"
+                    delta_tmp = point_path.with_name(f".{point_path.name}.tmp")
+                    try:
+                        with gzip.open(delta_tmp, 'wb', compresslevel=BACKUP_COMPRESS_LEVEL) as f_out:
+                            header = {'page_size': page_size, 'page_count': pages}
+                            f_out.write(json.dumps(header).encode() + b"\n")
+                            for page_no, page in enumerate(self._iter_chunks(snapshot, snapshot_tmp, page_size), start=1):
+                                checksum.update(page)
+                                digest = hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+                                page_hashes += digest
+                                offset = (page_no - 1) * PAGE_HASH_SIZE
+                                if previous_hashes[offset:offset + PAGE_HASH_SIZE] != digest:
+                                    f_out.write(DELTA_PAGE_HEADER.pack(page_no))
+                                    f_out.write(page)
+                                    changed += 1
+                        os.replace(delta_tmp, point_path)
+                    finally:
+                        if delta_tmp.exists():
+                            delta_tmp.unlink()
+                snapshot = None
+                monitor.record_metric_sync("backup_phase:delta", time.perf_counter() - phase_started)
+
+                point = {
+                    'seq': seq,
+                    'file': point_path.name,
+                    'kind': 'base' if new_chain else 'delta',
+                    'created_at': now.isoformat(),
+                    'page_count': pages,
+                    'changed_pages': changed,
+                    'source_size': pages * page_size,
+                    'size': point_path.stat().st_size,
+                    'sha256': checksum.hexdigest(),
+                    'hashes': CHAIN_POINT_HASHES_FILE.format(seq=seq),
+                }
+                chain['points'].append(point)
+                # Сначала хеши новой точки, затем манифест, который на них ссылается;
+                # хеши предыдущей точки больше не нужны только после записи манифеста
+                self._write_atomic(chain_dir / point['hashes'], bytes(page_hashes))
+                self._write_atomic(chain_dir / CHAIN_MANIFEST_FILE, json.dumps(chain, indent=2).encode())
+                if previous_hashes_file:
+                    (chain_dir / previous_hashes_file).unlink(missing_ok=True)
+
+                duration = time.perf_counter() - started
+                self.last_backup_time = now
+                self.backup_count += 1
+                self.last_backup_metrics = {
+                    'duration': round(duration, 3),
+                    'source_size': source_size,
+                    'backup_size': point['size'],
+                    'pages': pages,
+                    'changed_pages': changed,
+                    'steps': steps,
+                    'throughput_mb_s': round(source_size / duration / (1024 * 1024), 2) if duration > 0 else None,
+                    'snapshot': 'memory' if snapshot_tmp is None else 'file',
+                    'verify_mode': ('quick_check' if self.quick_check else 'integrity_check') if self.verify_backups else None,
+                }
+                backup_info = {
+                    'success': True,
+                    'backup_name': point_path.name,
+                    'backup_path': str(point_path),
+                    'chain': chain_dir.name,
+                    'kind': point['kind'],
+                    'created_at': now.isoformat(),
+                    'compressed': True,
+                    **self.last_backup_metrics
+                }
+
+                database_logger.log_database_operation(
+                    "incremental_backup_created",
+                    "users",
+                    backup_info
+                )
+
+                monitor.record_metric_sync("backup_create", duration)
+                monitor.record_count_sync("backup_source_bytes", source_size)
+                monitor.record_count_sync("backup_output_bytes", point['size'])
+                logger.info(
+                    f"Incremental backup point created: {point_path} "
+                    f"({point['kind']}, {changed}/{pages} pages, {point['size']} bytes in {duration:.2f}s)"
+                )
+                return backup_info
+
+            except Exception as e:
+                self.failed_backups += 1
+                monitor.record_metric_sync(
+                    "backup_create", time.perf_counter() - started, success=False, error=str(e)
+                )
+                error_info = {
+                    'success': False,
+                    'error': str(e),
+                    'created_at': datetime.now().isoformat()
+                }
+
+                database_logger.log_database_operation(
+                    "backup_failed",
+                    "users",
+                    error_info
+                )
+
+                logger.error(f"Failed to create incremental backup: {e}")
+                return error_info
+            finally:
+                if snapshot_tmp is not None and snapshot_tmp.exists():
+                    snapshot_tmp.unlink()
+
+    def list_restore_points(self) -> List[Dict[str, Any]]:
+        """Возвращает точки восстановления инкрементальных цепочек (новые первыми)"""
+        points = []
+        for chain_dir in self._chain_dirs():
+            try:
+                chain = self._load_chain(chain_dir)
+            except Exception as e:
+                logger.warning(f"Skipping unreadable backup chain {chain_dir}: {e}")
+                continue
+            for point in chain['points']:
+                points.append({
+                    **point,
+                    'chain': chain_dir.name,
+                    'path': str(chain_dir / point['file']),
+                })
+        points.sort(key=lambda x: x['created_at'], reverse=True)
+        return points
+
+    def find_restore_point(self, point_in_time: datetime) -> Optional[Dict[str, Any]]:
+        """Последняя точка восстановления, созданная не позже point_in_time"""
+        for point in self.list_restore_points():
+            if datetime.fromisoformat(point['created_at']) <= point_in_time:
+                return point
+        return None
+
+    def restore_point_in_time(self, point_in_time: datetime, create_backup_before_restore: bool = True) -> Dict[str, Any]:
+        """Восстанавливает БД на состояние последней точки не позже point_in_time"""
+        point = self.find_restore_point(point_in_time)
+        if point is None:
+            error = f"No restore point at or before {point_in_time.isoformat()}"
+            logger.error(error)
+            return {'success': False, 'error': error, 'restored_at': datetime.now().isoformat()}
+        return self.restore_backup(point['path'], create_backup_before_restore)
+
+    def _rebuild_point(self, point_file: Path, target: Path):
+        """Собирает файл БД точки восстановления: base + дельты по порядку"""
+        chain = self._load_chain(point_file.parent)
+        names = [point['file'] for point in chain['points']]
+        if point_file.name not in names:
+            raise FileNotFoundError(f"Restore point is not in chain manifest: {point_file}")
+        points = chain['points'][:names.index(point_file.name) + 1]
+        page_size = chain['page_size']
+
+        with gzip.open(point_file.parent / points[0]['file'], 'rb') as f_in:
+            with open(target, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, BACKUP_CHUNK_SIZE)
+        with open(target, 'r+b') as f_out:
+            for point in points[1:]:
+                with gzip.open(point_file.parent / point['file'], 'rb') as f_in:
+                    header = json.loads(f_in.readline())
+                    while True:
+                        raw = f_in.read(DELTA_PAGE_HEADER.size)
+                        if not raw:
+                            break
+                        (page_no,) = DELTA_PAGE_HEADER.unpack(raw)
+                        f_out.seek((page_no - 1) * page_size)
+                        f_out.write(f_in.read(page_size))
+                f_out.truncate(header['page_count'] * page_size)
+
+        checksum = hashlib.sha256()
+        with open(target, 'rb') as f_in:
+            for chunk in iter(lambda: f_in.read(BACKUP_CHUNK_SIZE), b""):
+                checksum.update(chunk)
+        if checksum.hexdigest() != points[-1]['sha256']:
+            raise Exception(f"Rebuilt restore point checksum mismatch: {point_file.name}")
+
+    def _get_incremental_statistics(self) -> Dict[str, Any]:
+        """Размер цепочек на диске и экономия относительно полных сжатых бэкапов"""
+        points = self.list_restore_points()
+        on_disk = sum(point['size'] for point in points)
+        full_equivalent = 0
+        for chain_dir in self._chain_dirs():
+            try:
+                chain = self._load_chain(chain_dir)
+            except Exception:
+                continue
+            base = chain['points'][0]
+            # Полный бэкап каждой точки оцениваем по степени сжатия base
+            ratio = base['size'] / base['source_size'] if base['source_size'] else 1.0
+            full_equivalent += sum(int(point['source_size'] * ratio) for point in chain['points'])
+        saved = max(0, full_equivalent - on_disk)
+        return {
+            'chains': len(self._chain_dirs()),
+            'restore_points': len(points),
+            'size': on_disk,
+            'full_equivalent_size': full_equivalent,
+            'space_saved': saved,
+            'space_saved_percent': round(saved * 100 / full_equivalent, 1) if full_equivalent else 0.0,
+        }
+
+    def _chain_dirs(self) -> List[Path]:
+        if not self.incremental_dir.exists():
+            return []
+        return sorted(
+            path for path in self.incremental_dir.glob("chain_*")
+            if (path / CHAIN_MANIFEST_FILE).exists()
+        )
+
+    def _latest_chain_dir(self) -> Optional[Path]:
+        chain_dirs = self._chain_dirs()
+        return chain_dirs[-1] if chain_dirs else None
+
+    @staticmethod
+    def _load_chain(chain_dir: Path) -> Dict[str, Any]:
+        return json.loads((chain_dir / CHAIN_MANIFEST_FILE).read_text(encoding='utf-8'))
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _snapshot_page_size(snapshot: Optional[bytes], snapshot_tmp: Optional[Path]) -> int:
+        """Размер страницы из заголовка файла SQLite (значение 1 означает 65536)"""
+        if snapshot is not None:
+            header = snapshot[:100]
+        else:
+            with open(snapshot_tmp, 'rb') as f_in:
+                header = f_in.read(100)
+        page_size = int.from_bytes(header[16:18], 'big')
+        return 65536 if page_size == 1 else page_size
+
+    @staticmethod
+    def _iter_chunks(snapshot: Optional[bytes], snapshot_tmp: Optional[Path], size: int):
+        """Снимок (байты или файл) фрагментами по size байт — по страницам или для потока"""
+        if snapshot is not None:
+            with memoryview(snapshot) as view:
+                for offset in range(0, len(view), size):
+                    yield view[offset:offset + size]
+        else:
+            with open(snapshot_tmp, 'rb') as f_in:
+                for chunk in iter(lambda: f_in.read(size), b""):
+                    yield chunk
+    
     def list_backups(self) -> List[Dict[str, Any]]:
         """Возвращает список доступных бэкапов"""
         backups = []
@@ -359,6 +859,14 @@ class DatabaseBackupManager:
                     deleted_count += 1
                     logger.info(f"Deleted old backup: {backup_file}")
             
+            # Цепочки удаляются целиком по последней точке; текущая цепочка остаётся всегда
+            for chain_dir in self._chain_dirs()[:-1]:
+                last_point = self._load_chain(chain_dir)['points'][-1]
+                if datetime.fromisoformat(last_point['created_at']) < cutoff_date:
+                    shutil.rmtree(chain_dir)
+                    deleted_count += 1
+                    logger.info(f"Deleted old backup chain: {chain_dir}")
+            
             if deleted_count > 0:
                 database_logger.log_database_operation(
                     "backups_cleaned",
@@ -385,7 +893,10 @@ class DatabaseBackupManager:
             while self.is_running:
                 try:
                     # Создаем бэкап
-                    backup_info = self.create_backup()
+                    if self.incremental_enabled:
+                        backup_info = self.create_incremental_backup()
+                    else:
+                        backup_info = self.create_backup()
                     
                     if backup_info['success']:
                         logger.info("Automatic backup completed successfully")
@@ -421,7 +932,9 @@ class DatabaseBackupManager:
         logger.info("Automatic backups stopped")
     
     def update_settings(self, interval_hours: int = None, retention_days: int = None, 
-                       compression_enabled: bool = None, verify_backups: bool = None):
+                       compression_enabled: bool = None, verify_backups: bool = None,
+                       quick_check: bool = None, incremental_enabled: bool = None,
+                       full_backup_every: int = None):
         """
         Обновляет настройки бекапов без перезапуска системы
         
@@ -430,6 +943,9 @@ class DatabaseBackupManager:
             retention_days: Новое количество дней хранения
             compression_enabled: Включить/выключить сжатие
             verify_backups: Включить/выключить проверку целостности
+            quick_check: Проверять через PRAGMA quick_check вместо integrity_check
+            incremental_enabled: Включить/выключить инкрементальные бэкапы
+            full_backup_every: Через сколько точек начинать новую цепочку с полным снимком
         """
         if interval_hours is not None:
             self.backup_interval_hours = interval_hours
@@ -446,10 +962,23 @@ class DatabaseBackupManager:
         if verify_backups is not None:
             self.verify_backups = verify_backups
             logger.info(f"Backup verification {'enabled' if verify_backups else 'disabled'}")
+        
+        if quick_check is not None:
+            self.quick_check = quick_check
+            logger.info(f"Backup verification mode: {'quick_check' if quick_check else 'integrity_check'}")
+        
+        if incremental_enabled is not None:
+            self.incremental_enabled = incremental_enabled
+            logger.info(f"Incremental backups {'enabled' if incremental_enabled else 'disabled'}")
+        
+        if full_backup_every is not None:
+            self.full_backup_every = full_backup_every
+            logger.info(f"Full backup every {full_backup_every} restore points")
 
     def get_backup_statistics(self) -> Dict[str, Any]:
         """Возвращает статистику бэкапов"""
         backups = self.list_backups()
+        incremental = self._get_incremental_statistics()
         
         return {
             'total_backups': len(backups),
@@ -462,10 +991,45 @@ class DatabaseBackupManager:
             'backup_dir': str(self.backup_dir),
             'compression_enabled': self.compression_enabled,
             'verify_backups': self.verify_backups,
-            'total_size': sum(backup['size'] for backup in backups),
+            'quick_check': self.quick_check,
+            'last_backup_metrics': self.last_backup_metrics,
+            'incremental_enabled': self.incremental_enabled,
+            'full_backup_every': self.full_backup_every,
+            'incremental': incremental,
+            'restore_points': self.list_restore_points(),
+            'total_size': sum(backup['size'] for backup in backups) + incremental['size'],
             'backups': backups  # Добавляем список бекапов
         }
 
+class SnapshotStream:
+    """gzip-поток готового снимка БД для HTTP-ответа
+
+    Итерация отдаёт сжатые фрагменты; close() (его вызывает WSGI-сервер и
+    при обрыве соединения) удаляет временный снимок, даже если поток так и
+    не начали читать.
+    """
+
+    def __init__(self, snapshot: Optional[bytes], snapshot_tmp: Optional[Path]):
+        self._snapshot = snapshot
+        self._snapshot_tmp = snapshot_tmp
+
+    def __iter__(self):
+        # wbits=31 — формат gzip, совместимый с .gz бэкапов
+        compressor = zlib.compressobj(BACKUP_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        try:
+            for chunk in DatabaseBackupManager._iter_chunks(self._snapshot, self._snapshot_tmp, BACKUP_CHUNK_SIZE):
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            self.close()
+
+    def close(self):
+        self._snapshot = None
+        if self._snapshot_tmp is not None and self._snapshot_tmp.exists():
+            self._snapshot_tmp.unlink()
+
 # Глобальный экземпляр менеджера бэкапов
 backup_manager = DatabaseBackupManager()
 
@@ -480,6 +1044,9 @@ def initialize_backup_system():
         retention_days_raw = get_backup_setting('backup_retention_days')
         compression_raw = get_backup_setting('backup_compression')
         verify_raw = get_backup_setting('backup_verify')
+        quick_check_raw = get_backup_setting('backup_quick_check')
+        incremental_raw = get_backup_setting('backup_incremental')
+        full_every_raw = get_backup_setting('backup_full_every')
 
         # Нормализация типов
         backup_enabled = _parse_bool(backup_enabled_raw, default=True)
@@ -493,11 +1060,20 @@ def initialize_backup_system():
             retention_days = 30
         compression = _parse_bool(compression_raw, default=True)
         verify = _parse_bool(verify_raw, default=True)
+        quick_check = _parse_bool(quick_check_raw, default=False)
+        incremental = _parse_bool(incremental_raw, default=False)
+        try:
+            full_every = int(full_every_raw) if full_every_raw else BACKUP_FULL_EVERY
+        except (TypeError, ValueError):
+            full_every = BACKUP_FULL_EVERY
         
         # Обновляем настройки менеджера
         backup_manager.retention_days = retention_days
         backup_manager.compression_enabled = compression
         backup_manager.verify_backups = verify
+        backup_manager.quick_check = quick_check
+        backup_manager.incremental_enabled = incremental
+        backup_manager.full_backup_every = full_every
         
         if backup_enabled:
             # Создаем первый бэкап при запуске (опционально, не прерываем инициализацию при ошибке)
@@ -19,9 +19,13 @@ from pathlib import Path
 
 import json
 
+import base64
+
 import bcrypt
 
+import threading
 import time
+from collections import OrderedDict
 from typing import Optional
 import unicodedata
 import re
@@ -179,19 +183,207 @@ def _column_exists(cursor, table_name: str, column_name: str) -> bool:
         return False
 
 
+# Параметры пула синхронных соединений.
+# Режим журналирования остаётся DELETE: файл БД монтируется в несколько
+# контейнеров, а -wal/-shm у каждого были бы свои (docs/reference/database.md).
+DB_BUSY_TIMEOUT_SECONDS = 30
+DB_POOL_MAX_IDLE = 8
+DB_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=DELETE",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=10000",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_SECONDS * 1000}",
+)
+
+
+class _StatementCounter:
+    """Trace-callback соединения: считает запуски SQL-операторов (включая BEGIN/COMMIT и шаги триггеров)."""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str) -> None:
+        self.count += 1
+
+
+class _PooledConnection(sqlite3.Connection):
+    """Соединение пула: помнит путь к БД, из которой было открыто."""
+
+    _pool_path: str | None = None
+    _statement_counter: _StatementCounter | None = None
+
+
+class SQLiteConnectionPool:
+    """Процессный пул синхронных соединений SQLite.
+
+    Соединение выдаётся потоку в монопольное пользование и возвращается
+    в LIFO-стек свободных соединений. PRAGMA применяются один раз при
+    открытии. Пул ведётся отдельно для каждого пути к БД (тесты подменяют
+    DB_FILE) и сбрасывается, если файл БД был пересоздан или процесс
+    был форкнут.
+    """
+
+    def __init__(self, max_idle: int = DB_POOL_MAX_IDLE, timeout: float = DB_BUSY_TIMEOUT_SECONDS):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: dict[str, list[sqlite3.Connection]] = {}
+        self._file_ids: dict[str, tuple[int, int]] = {}
+        self._pid = os.getpid()
+        self._stats = {
+            "opened": 0, "reused": 0, "discarded": 0,
+            "checkouts": 0, "statements": 0, "connection_seconds": 0.0,
+        }
+
+    @staticmethod
+    def _file_id(path: str) -> tuple[int, int] | None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            path, timeout=self.timeout, check_same_thread=False, factory=_PooledConnection
+        )
+        conn._pool_path = path
+        for pragma in DB_CONNECTION_PRAGMAS:
+            try:
+                conn.execute(pragma)
+            except sqlite3.Error as e:
+                logger.debug(f"Failed to apply '{pragma}' to pooled connection: {e}")
+        conn._statement_counter = _StatementCounter()
+        conn.set_trace_callback(conn._statement_counter)
+        return conn
+
+    def _drop_idle_locked(self, path: str | None = None) -> list[sqlite3.Connection]:
+        if path is None:
+            dropped = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+            self._file_ids.clear()
+        else:
+            dropped = self._idle.pop(path, [])
+            self._file_ids.pop(path, None)
+        self._stats["discarded"] += len(dropped)
+        return dropped
+
+    def acquire(self, db_path=None) -> sqlite3.Connection:
+        """Выдаёт соединение из пула (или открывает новое)."""
+        path = str(db_path if db_path is not None else DB_FILE)
+        file_id = self._file_id(path)
+        stale: list[sqlite3.Connection] = []
+        conn = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork соединения родителя использовать нельзя, просто забываем их
+                self._idle.clear()
+                self._file_ids.clear()
+                self._pid = os.getpid()
+            if self._file_ids.get(path) != file_id:
+                stale = self._drop_idle_locked(path)
+            idle = self._idle.get(path)
+            if idle:
+                conn = idle.pop()
+                self._stats["reused"] += 1
+        for old_conn in stale:
+            with contextlib.suppress(sqlite3.Error):
+                old_conn.close()
+        if conn is None:
+            conn = self._open(path)
+            with self._lock:
+                self._stats["opened"] += 1
+                if file_id is None:
+                    file_id = self._file_id(path)
+                self._file_ids.setdefault(path, file_id)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, held_seconds: float = 0.0) -> None:
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию.
+
+        held_seconds — сколько соединение было занято; вместе с числом
+        выполненных операторов попадает в статистику для /metrics.
+        """
+        path = getattr(conn, "_pool_path", None)
+        counter = getattr(conn, "_statement_counter", None)
+        statements = 0
+        if counter is not None:
+            statements, counter.count = counter.count, 0
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            if conn.isolation_level != "":
+                conn.isolation_level = ""
+        except sqlite3.Error:
+            # Соединение закрыто вызывающим кодом или повреждено
+            path = None
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["statements"] += statements
+            self._stats["connection_seconds"] += held_seconds
+            if path is not None and self._pid == os.getpid():
+                idle = self._idle.setdefault(path, [])
+                if len(idle) < self.max_idle:
+                    idle.append(conn)
+                    return
+        with contextlib.suppress(sqlite3.Error):
+            conn.close()
+
+    def close_all(self) -> None:
+        """Закрывает все свободные соединения (занятые закроются при возврате)."""
+        with self._lock:
+            dropped = self._drop_idle_locked()
+        for conn in dropped:
+            with contextlib.suppress(sqlite3.Error):
+                conn.close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "idle": sum(len(conns) for conns in self._idle.values()),
+                "max_idle": self.max_idle,
+            }
+
+
+_connection_pool = SQLiteConnectionPool()
+
+
 @contextlib.contextmanager
-def _get_db_connection():
-    """Контекстный менеджер для получения соединения с БД с гарантированным закрытием.
-    
-    Используется для исправления ResourceWarning в Python 3.13+.
+def _get_db_connection(db_path=None):
+    """Контекстный менеджер для получения соединения из пула.
+
+    Как и ``with sqlite3.connect(...)``, фиксирует транзакцию при успешном
+    выходе и откатывает её при исключении; соединение возвращается в пул.
     """
-    conn = None
+    conn = _connection_pool.acquire(db_path)
+    started = time.perf_counter()
     try:
-        conn = sqlite3.connect(DB_FILE)
         yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        with contextlib.suppress(sqlite3.Error):
+            conn.rollback()
+        raise
     finally:
-        if conn:
-            conn.close()
+        _connection_pool.release(conn, time.perf_counter() - started)
+
+
+def close_db_connections() -> None:
+    """Закрывает свободные соединения пула (при остановке или замене файла БД)."""
+    _connection_pool.close_all()
+
+
+def get_connection_pool_stats() -> dict:
+    """Статистика пула соединений: открыто, переиспользовано, сброшено, свободно,
+    а также число выдач соединения, выполненных SQL-операторов и суммарное
+    время занятости соединений (секунды)."""
+    return _connection_pool.get_stats()
 
 
 # Локальная самодиагностика/восстановление БД при мягких повреждениях индексов
@@ -550,6 +742,16 @@ def initialize_db():
 
             ''')
 
+            _create_settings_version_table(cursor)
+
+            _create_ban_version_table(cursor)
+
+            _create_renewal_queue_table(cursor)
+
+            _create_broadcasts_table(cursor)
+
+            _create_notification_outbox_table(cursor)
+
             cursor.execute('''
 
                 CREATE TABLE IF NOT EXISTS notifications (
@@ -580,6 +782,8 @@ def initialize_db():
 
             ''')
 
+            _create_user_counters_table(cursor)
+
             cursor.execute('''
 
                 CREATE TABLE IF NOT EXISTS support_threads (
@@ -920,6 +1124,11 @@ def initialize_db():
 
             create_database_indexes(cursor)
 
+            # Счётчики строк создаются после миграций: миграция может пересоздать таблицу
+            _create_row_counts_table(cursor)
+            _create_daily_stats_table(cursor)
+            _create_users_search_table(cursor)
+
             # Создание группы "Пользователи" по умолчанию
             users_group_code = _generate_group_code("Пользователи")
             cursor.execute("INSERT OR IGNORE INTO user_groups (group_name, group_description, is_default, group_code) VALUES (?, ?, ?, ?)", 
@@ -944,6 +1153,8 @@ def initialize_db():
             conn.close()
             
             logger.info(f"[PID {process_id}] Database initialized successfully.")
+            # Значения по умолчанию записаны в обход update_setting()
+            invalidate_settings_cache()
             
             # Освобождаем блокировку перед возвратом
             if lock_file and lock_acquired:
@@ -1103,12 +1314,18 @@ def create_database_indexes(cursor):
 
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_vpn_keys_is_trial ON vpn_keys(is_trial)")
 
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vpn_keys_created_date ON vpn_keys(created_date)")
+
         # Проверяем существование колонок перед созданием индексов
         cursor.execute("PRAGMA table_info(vpn_keys)")
         vpn_keys_columns = [row[1] for row in cursor.fetchall()]
         
         if 'status' in vpn_keys_columns:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_vpn_keys_status ON vpn_keys(status)")
+            # Переходы статусов по времени истечения (update_keys_status_by_expiry)
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_vpn_keys_status_expiry ON vpn_keys(status, {_KEY_EXPIRY_SQL})"
+            )
         
         if 'enabled' in vpn_keys_columns:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_vpn_keys_enabled ON vpn_keys(enabled)")
@@ -1675,6 +1892,16 @@ def run_migration(conn: Optional[sqlite3.Connection] = None):
 
 
 
+        # Колонки квоты трафика (раньше добавлялись при каждом чтении списка ключей)
+        for quota_column, quota_type in (
+            ('quota_total_gb', 'REAL'),
+            ('traffic_down_bytes', 'INTEGER'),
+            ('quota_remaining_bytes', 'INTEGER'),
+        ):
+            if quota_column not in vpn_keys_columns:
+                cursor.execute(f"ALTER TABLE vpn_keys ADD COLUMN {quota_column} {quota_type}")
+                logging.info(f" -> The column '{quota_column}' is successfully added to vpn_keys table.")
+
         if 'start_date' not in vpn_keys_columns:
 
             cursor.execute("ALTER TABLE vpn_keys ADD COLUMN start_date TIMESTAMP")
@@ -2577,6 +2804,8 @@ def run_migration(conn: Optional[sqlite3.Connection] = None):
         # Коммитим изменения только если мы создали соединение сами
         if should_close_conn:
             conn.commit()
+        # Миграция добавляет настройки в обход update_setting()
+        invalidate_settings_cache()
 
     except sqlite3.Error as e:
 
@@ -2697,7 +2926,7 @@ def delete_host(host_name: str):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -2719,7 +2948,7 @@ def update_host(old_host_name: str, new_host_name: str, url: str, user: str, pas
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -2773,7 +3002,7 @@ def get_host(host_name: str) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -2827,7 +3056,7 @@ def get_host_by_code(host_code: str) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -2851,7 +3080,7 @@ def get_all_hosts() -> list[dict]:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -2884,20 +3113,359 @@ def get_all_keys() -> list[dict]:
         return []
 
 
+def get_recent_keys(limit: int = 50) -> list[dict]:
+    """Последние созданные ключи (новые первыми)."""
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM vpn_keys ORDER BY created_date DESC LIMIT ?", (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get recent keys: {e}")
+        return []
+
 
-def get_setting(key: str) -> str | None:
+def get_keys_expiring_between(start: datetime, end: datetime) -> list[dict]:
+    """Возвращает ключи, у которых expiry_date попадает в окно [start, end].
 
+    Выборка идёт диапазоном по индексу idx_vpn_keys_expiry_date. Даты в БД
+    хранятся строками в разных ISO-формах (с пробелом или 'T', с таймзоной
+    или без), поэтому границы диапазона берутся по дате с запасом в сутки,
+    а точная фильтрация выполняется в Python.
+    """
+    lower = (start - timedelta(days=1)).strftime("%Y-%m-%d")
+    upper = (end + timedelta(days=1)).strftime("%Y-%m-%d")
     try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM vpn_keys WHERE expiry_date >= ? AND expiry_date < ? ORDER BY expiry_date",
+                (lower, upper)
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get keys expiring between {start} and {end}: {e}")
+        return []
 
-        with sqlite3.connect(DB_FILE) as conn:
+    result = []
+    for row in rows:
+        try:
+            expiry_date = datetime.fromisoformat(str(row['expiry_date']))
+        except (TypeError, ValueError):
+            continue
+        if expiry_date.tzinfo is not None:
+            expiry_date = expiry_date.astimezone(timezone.utc).replace(tzinfo=None)
+        if start <= expiry_date <= end:
+            result.append(row)
+    return result
+
+
+def get_plans_by_hosts(host_names) -> dict[str, list[dict]]:
+    """Загружает тарифы нескольких хостов одним запросом.
+
+    Возвращает словарь {host_name: [plan, ...]} в том же формате и порядке,
+    что и get_plans_for_host(). Хосты без тарифов присутствуют с пустым списком.
+    """
+    hosts = sorted({name for name in host_names if name})
+    result: dict[str, list[dict]] = {name: [] for name in hosts}
+    if not hosts:
+        return result
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            placeholders = ",".join("?" * len(hosts))
+            cursor.execute(
+                f"SELECT * FROM plans WHERE host_name IN ({placeholders}) ORDER BY host_name, months, days, hours",
+                hosts
+            )
+            for row in cursor.fetchall():
+                plan_dict = dict(row)
+                if plan_dict.get('display_mode_groups'):
+                    try:
+                        plan_dict['display_mode_groups'] = json.loads(plan_dict['display_mode_groups'])
+                    except (json.JSONDecodeError, TypeError):
+                        plan_dict['display_mode_groups'] = None
+                else:
+                    plan_dict['display_mode_groups'] = None
+                result.setdefault(plan_dict['host_name'], []).append(plan_dict)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get plans for hosts {hosts}: {e}")
+    return result
+
+
+def get_users_renewal_state(user_ids) -> dict[int, dict]:
+    """Возвращает баланс и флаг глобального автопродления для набора пользователей.
 
+    Результат: {telegram_id: {'balance': float, 'auto_renewal_enabled': bool}}.
+    Пользователи, отсутствующие в БД, в словарь не попадают; NULL в
+    auto_renewal_enabled трактуется как включённое автопродление, как в
+    get_auto_renewal_enabled().
+    """
+    ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    result: dict[int, dict] = {}
+    if not ids:
+        return result
+    try:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(users)")
+            has_auto_renewal = 'auto_renewal_enabled' in [row[1] for row in cursor.fetchall()]
+            auto_renewal_column = "auto_renewal_enabled" if has_auto_renewal else "NULL"
+            # Лимит переменных SQLite: разбиваем большой список на пачки
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(
+                    f"SELECT telegram_id, balance, {auto_renewal_column} FROM users WHERE telegram_id IN ({placeholders})",
+                    chunk
+                )
+                for telegram_id, balance, auto_renewal in cursor.fetchall():
+                    result[telegram_id] = {
+                        'balance': float(balance) if balance is not None else 0.0,
+                        'auto_renewal_enabled': True if auto_renewal is None else bool(auto_renewal),
+                    }
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get renewal state for {len(ids)} users: {e}")
+    return result
 
-            cursor.execute("SELECT value FROM bot_settings WHERE key = ?", (key,))
 
-            result = cursor.fetchone()
+def get_logged_notification_markers(key_ids, notif_types) -> set[tuple[int, int, int, str]]:
+    """Возвращает уже записанные маркеры уведомлений для набора ключей.
+
+    Результат — множество кортежей (user_id, key_id, marker_hours, type),
+    аналог пачечного вызова scheduler._marker_logged(). Если в таблице
+    notifications ещё нет колонок key_id/marker_hours, возвращается пустое множество.
+    """
+    ids = sorted({int(key_id) for key_id in key_ids if key_id is not None})
+    types = sorted(set(notif_types))
+    markers: set[tuple[int, int, int, str]] = set()
+    if not ids or not types:
+        return markers
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(notifications)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'key_id' not in columns or 'marker_hours' not in columns:
+                return markers
+            type_placeholders = ",".join("?" * len(types))
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(
+                    f"SELECT user_id, key_id, marker_hours, type FROM notifications "
+                    f"WHERE key_id IN ({placeholders}) AND type IN ({type_placeholders}) AND marker_hours IS NOT NULL",
+                    [*chunk, *types]
+                )
+                markers.update(
+                    (row[0], row[1], row[2], row[3]) for row in cursor.fetchall()
+                )
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get notification markers for {len(ids)} keys: {e}")
+    return markers
+
+
+
+# ============================================================================
+# Кэш настроек (bot_settings / backup_settings)
+# ============================================================================
+
+_SETTINGS_VERSION_TABLES = ("bot_settings", "backup_settings")
+
+
+def _create_settings_version_table(cursor: sqlite3.Cursor):
+    """Создаёт счётчик версии настроек и триггеры, увеличивающие его при любой записи.
+
+    Счётчик меняется при записи из любого процесса (бот, user-cabinet, docs-proxy)
+    и из любого кода, в том числе прямыми SQL-запросами.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Случайное начальное значение: у пересозданной БД версия не совпадёт с закэшированной
+    cursor.execute(
+        "INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, abs(random() % 1000000000))"
+    )
+    for table in _SETTINGS_VERSION_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE settings_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+
+# Как часто проверяется settings_version (настройки, изменённые другими процессами)
+SETTINGS_VERSION_CHECK_INTERVAL = 2.0
+
+
+class SettingsCache:
+    """Кэш настроек в памяти процесса с проверкой версии.
+
+    bot_settings и backup_settings загружаются целиком одним запросом.
+    Версия из settings_version проверяется не чаще check_interval; в
+    промежутках значения отдаются из памяти без обращения к БД. Запись
+    через update_setting() и update_backup_setting(), инициализация и
+    миграция БД сбрасывают кэш явно.
+    """
+
+    _TRUE_VALUES = ("1", "true", "yes", "on")
+
+    def __init__(self, check_interval: float = SETTINGS_VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._bot_settings: dict[str, str | None] | None = None
+        self._backup_settings: dict[str, str | None] = {}
+        self._version: int | None = None
+        self._db_path: str | None = None
+        self._checked_at: float | None = None
+        # Растёт при каждом invalidate(): загрузка, начатая до сброса, не
+        # должна сохранить прочитанные ею (уже устаревшие) значения
+        self._generation = 0
+        self._stats = {"hits": 0, "loads": 0, "invalidations": 0}
+
+    @staticmethod
+    def _read_version(cursor: sqlite3.Cursor) -> int | None:
+        try:
+            cursor.execute("SELECT version FROM settings_version WHERE id = 1")
+            row = cursor.fetchone()
+        except sqlite3.Error:
+            # Старая БД без счётчика: кэш не используем, читаем напрямую
+            return None
+        return row[0] if row else None
+
+    def _load(self) -> tuple[dict, dict]:
+        db_path = str(DB_FILE)
+        with self._lock:
+            if (
+                self._bot_settings is not None
+                and self._db_path == db_path
+                and self._checked_at is not None
+                and time.monotonic() - self._checked_at < self.check_interval
+            ):
+                self._stats["hits"] += 1
+                return self._bot_settings, self._backup_settings
+            generation = self._generation
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            version = self._read_version(cursor)
+            with self._lock:
+                if (
+                    version is not None
+                    and self._bot_settings is not None
+                    and self._version == version
+                    and self._db_path == db_path
+                ):
+                    self._checked_at = time.monotonic()
+                    self._stats["hits"] += 1
+                    return self._bot_settings, self._backup_settings
+
+            cursor.execute("SELECT key, value FROM bot_settings")
+            bot_settings = {row[0]: row[1] for row in cursor.fetchall()}
+            try:
+                cursor.execute("SELECT key, value FROM backup_settings")
+                backup_settings = {row[0]: row[1] for row in cursor.fetchall()}
+            except sqlite3.Error:
+                backup_settings = {}
+
+        with self._lock:
+            self._stats["loads"] += 1
+            if version is not None and generation == self._generation:
+                self._bot_settings = bot_settings
+                self._backup_settings = backup_settings
+                self._version = version
+                self._db_path = db_path
+                self._checked_at = time.monotonic()
+        return bot_settings, backup_settings
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        value = self._load()[0].get(key)
+        return default if value is None else value
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self.get(key)
+        if value is None:
+            return default
+        return str(value).strip().lower() in self._TRUE_VALUES
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        value = self.get(key)
+        try:
+            return int(value) if value not in (None, "") else default
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        value = self.get(key)
+        try:
+            return float(value) if value not in (None, "") else default
+        except (TypeError, ValueError):
+            return default
+
+    def get_backup(self, key: str) -> str | None:
+        return self._load()[1].get(key)
+
+    def snapshot(self) -> dict:
+        """Копия всех bot_settings (для страниц, которым нужны десятки ключей)."""
+        return dict(self._load()[0])
+
+    def backup_snapshot(self) -> dict:
+        return dict(self._load()[1])
+
+    def invalidate(self):
+        with self._lock:
+            self._bot_settings = None
+            self._backup_settings = {}
+            self._version = None
+            self._checked_at = None
+            self._generation += 1
+            self._stats["invalidations"] += 1
+
+    @property
+    def version(self) -> int | None:
+        """Версия настроек, с которой загружен кэш (None, если кэш пуст)."""
+        return self._version
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "version": self._version}
+
+
+_settings_cache = SettingsCache()
 
-            return result[0] if result else None
+
+def get_settings_cache() -> SettingsCache:
+    return _settings_cache
+
+
+def invalidate_settings_cache():
+    """Сбрасывает кэш настроек (после прямой записи в bot_settings/backup_settings)."""
+    _settings_cache.invalidate()
+
+
+def get_settings_version() -> int | None:
+    """Текущая версия настроек в БД; другие процессы сравнивают её со своей."""
+    try:
+        with _get_db_connection() as conn:
+            return SettingsCache._read_version(conn.cursor())
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get settings version: {e}")
+        return None
+
+
+def get_setting(key: str) -> str | None:
+
+    try:
+
+        return _settings_cache.get(key)
 
     except sqlite3.Error as e:
 
@@ -2964,19 +3532,7 @@ def get_all_settings() -> dict:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
-
-            conn.row_factory = sqlite3.Row
-
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT key, value FROM bot_settings")
-
-            rows = cursor.fetchall()
-
-            for row in rows:
-
-                settings[row['key']] = row['value']
+        settings = _settings_cache.snapshot()
 
     except sqlite3.Error as e:
 
@@ -2990,7 +3546,7 @@ def update_setting(key: str, value: str):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
             
@@ -3011,6 +3567,10 @@ def update_setting(key: str, value: str):
 
         logging.error(f"Failed to update setting '{key}': {e}")
 
+    finally:
+
+        _settings_cache.invalidate()
+
 
 # ============================================================================
 # Timezone Support Functions
@@ -3089,7 +3649,7 @@ def get_user_timezone(user_id: int) -> str:
         Fallback на admin_timezone при отсутствии/ошибке.
     """
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT timezone FROM users WHERE telegram_id = ?", (user_id,))
             result = cursor.fetchone()
@@ -3124,7 +3684,7 @@ def set_user_timezone(user_id: int, timezone: str) -> bool:
             # В Windows может не быть timezone данных, это нормально для разработки
             logger.warning(f"Could not validate timezone '{timezone}': {e} (this is OK in Windows dev environment)")
         
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE users SET timezone = ? WHERE telegram_id = ?",
@@ -3150,11 +3710,7 @@ def set_user_timezone(user_id: int, timezone: str) -> bool:
 def get_backup_setting(key: str) -> str | None:
     """Получить настройку бекапа"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT value FROM backup_settings WHERE key = ?", (key,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        return _settings_cache.get_backup(key)
     except sqlite3.Error as e:
         logging.error(f"Failed to get backup setting '{key}': {e}")
         return None
@@ -3163,7 +3719,7 @@ def get_backup_setting(key: str) -> str | None:
 def update_backup_setting(key: str, value: str):
     """Обновить настройку бекапа"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT OR REPLACE INTO backup_settings (key, value, updated_at) 
@@ -3173,16 +3729,14 @@ def update_backup_setting(key: str, value: str):
             logging.info(f"Backup setting '{key}' updated.")
     except sqlite3.Error as e:
         logging.error(f"Failed to update backup setting '{key}': {e}")
+    finally:
+        _settings_cache.invalidate()
 
 
 def get_all_backup_settings() -> dict:
     """Получить все настройки бекапов"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT key, value FROM backup_settings")
-            rows = cursor.fetchall()
-            return {row[0]: row[1] for row in rows}
+        return _settings_cache.backup_snapshot()
     except sqlite3.Error as e:
         logging.error(f"Failed to get backup settings: {e}")
         return {}
@@ -3202,7 +3756,8 @@ def migrate_backup_settings(conn: sqlite3.Connection):
         # Список настроек бекапов для миграции
         backup_keys = [
             'backup_enabled', 'backup_interval_hours', 'backup_retention_days',
-            'backup_compression', 'backup_verify'
+            'backup_compression', 'backup_verify', 'backup_quick_check',
+            'backup_incremental', 'backup_full_every'
         ]
         
         # Получаем существующие настройки из bot_settings
@@ -3224,7 +3779,10 @@ def migrate_backup_settings(conn: sqlite3.Connection):
             'backup_interval_hours': '24',
             'backup_retention_days': '30',
             'backup_compression': 'true',
-            'backup_verify': 'true'
+            'backup_verify': 'true',
+            'backup_quick_check': 'false',
+            'backup_incremental': 'false',
+            'backup_full_every': '7'
         }
         
         for key, default_value in default_backup_settings.items():
@@ -3357,7 +3915,7 @@ def get_plan_by_id(plan_id: int) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -3395,7 +3953,7 @@ def delete_plan(plan_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -3415,7 +3973,7 @@ def update_plan(plan_id: int, plan_name: str, months: int, days: int, price: flo
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -3479,7 +4037,7 @@ def has_user_used_plan(user_id: int, plan_id: int) -> bool:
     Проверяет наличие оплаченных транзакций (status='paid') с данным plan_id в metadata.
     """
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Проверяем транзакции с status='paid' и plan_id в metadata
@@ -3509,7 +4067,7 @@ def get_user_used_plans_batch(user_id: int) -> set[int]:
         Множество plan_id, которые пользователь использовал ранее
     """
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Получаем все metadata из оплаченных транзакций пользователя
@@ -3752,7 +4310,7 @@ def create_promo_code(
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -3896,7 +4454,7 @@ def update_promo_code(
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -3969,7 +4527,7 @@ def update_promo_code(
 def get_promo_usage_id(promo_id: int, user_id: int, bot: str) -> int | None:
     """Получить usage_id для последней записи использования промокода со статусом 'applied'"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT usage_id FROM promo_code_usage 
@@ -3986,11 +4544,9 @@ def get_promo_usage_id(promo_id: int, user_id: int, bot: str) -> int | None:
 def update_promo_usage_status(usage_id: int, plan_id: int | None = None) -> bool:
     """Обновить статус использования промокода с 'applied' на 'used'"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем режим журналирования
-            cursor.execute("PRAGMA journal_mode=DELETE")
             
             # Начинаем транзакцию с блокировкой
             cursor.execute("BEGIN IMMEDIATE")
@@ -4028,7 +4584,7 @@ def can_delete_promo_code(promo_id: int) -> tuple[bool, int]:
     Возвращает (можно_удалить, количество_использований)
     """
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM promo_code_usage WHERE promo_id = ?', (promo_id,))
             usage_count = cursor.fetchone()[0]
@@ -4040,7 +4596,7 @@ def can_delete_promo_code(promo_id: int) -> tuple[bool, int]:
             logging.warning("Detected SQLite corruption symptoms on can_delete_promo_code; attempting REINDEX/ANALYZE/VACUUM and retry once")
             if _repair_database_indexes():
                 try:
-                    with sqlite3.connect(DB_FILE) as conn:
+                    with _get_db_connection() as conn:
                         cursor = conn.cursor()
                         cursor.execute('SELECT COUNT(*) FROM promo_code_usage WHERE promo_id = ?', (promo_id,))
                         usage_count = cursor.fetchone()[0]
@@ -4053,7 +4609,7 @@ def can_delete_promo_code(promo_id: int) -> tuple[bool, int]:
 def delete_promo_code(promo_id: int) -> bool:
 
     def _delete_once() -> bool:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             # Проверяем, использовался ли промокод
             cursor.execute('SELECT COUNT(*) FROM promo_code_usage WHERE promo_id = ?', (promo_id,))
@@ -4091,7 +4647,7 @@ def get_promo_code(promo_id: int) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -4165,7 +4721,7 @@ def get_promo_code_by_code(code: str, bot: str | None = None, include_inactive:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -4227,7 +4783,7 @@ def get_all_promo_codes() -> list[dict]:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -4316,7 +4872,7 @@ def has_promo_code_usage(promo_id: int, bot: str) -> bool:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -4357,12 +4913,10 @@ def record_promo_code_usage(
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
             
-            # Устанавливаем режим журналирования
-            cursor.execute("PRAGMA journal_mode=DELETE")
             
             # Начинаем транзакцию с блокировкой
             cursor.execute("BEGIN IMMEDIATE")
@@ -4488,12 +5042,10 @@ def remove_promo_code_usage(promo_id: int, bot: str) -> bool:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
             
-            # Устанавливаем режим журналирования
-            cursor.execute("PRAGMA journal_mode=DELETE")
             
             # Начинаем транзакцию
             cursor.execute("BEGIN IMMEDIATE")
@@ -4532,7 +5084,7 @@ def remove_promo_code_usage(promo_id: int, bot: str) -> bool:
 def get_promo_code_usage_by_user(promo_id: int, user_id: int, bot: str) -> dict | None:
     """Получить информацию об использовании промокода конкретным пользователем"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -4554,7 +5106,7 @@ def get_promo_code_usage(promo_id: int) -> list[dict]:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -4610,7 +5162,7 @@ def get_promo_code_usage(promo_id: int) -> list[dict]:
 def get_promo_code_usage_history(promo_id: int) -> list[dict]:
     """Получить историю использования промокода"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -4633,7 +5185,7 @@ def get_promo_code_usage_history(promo_id: int) -> list[dict]:
 def get_all_promo_code_usage_history() -> list[dict]:
     """Получить всю историю использования промокодов"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -4656,7 +5208,7 @@ def get_all_promo_code_usage_history() -> list[dict]:
 def get_user_promo_codes(user_id: int, bot: str) -> list[dict]:
     """Получить список использованных промокодов пользователя"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -4679,11 +5231,9 @@ def get_user_promo_codes(user_id: int, bot: str) -> list[dict]:
 def remove_user_promo_code_usage(user_id: int, usage_id: int, bot: str) -> bool:
     """Удалить использование промокода конкретным пользователем по usage_id"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем режим журналирования
-            cursor.execute("PRAGMA journal_mode=DELETE")
             
             # Начинаем транзакцию
             cursor.execute("BEGIN IMMEDIATE")
@@ -4736,7 +5286,7 @@ def validate_promo_code(code: str, bot: str) -> dict:
         if not code_value:
             return {'valid': False, 'message': 'Промокод не может быть пустым'}
         
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -4846,7 +5396,7 @@ def add_to_referral_balance(user_id: int, amount: float):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -4868,7 +5418,7 @@ def set_referral_balance(user_id: int, value: float):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -4886,7 +5436,7 @@ def set_referral_balance_all(user_id: int, value: float):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -4904,7 +5454,7 @@ def get_referral_balance(user_id: int) -> float:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -4926,7 +5476,7 @@ def get_referral_count(user_id: int) -> int:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -4986,7 +5536,7 @@ def get_auto_renewal_enabled(user_id: int) -> bool:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5014,7 +5564,7 @@ def get_auto_renewal_enabled(user_id: int) -> bool:
 
                 # Пытаемся добавить колонку напрямую
 
-                with sqlite3.connect(DB_FILE) as conn2:
+                with _get_db_connection() as conn2:
 
                     cursor2 = conn2.cursor()
 
@@ -5254,7 +5804,7 @@ def set_terms_agreed(telegram_id: int, agreed: bool = True):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5276,7 +5826,7 @@ def set_documents_agreed(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5296,7 +5846,7 @@ def set_terms_agreed(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5318,7 +5868,7 @@ def set_subscription_status(telegram_id: int, status: str):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5340,7 +5890,7 @@ def revoke_user_consent(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5360,7 +5910,7 @@ def update_user_stats(telegram_id: int, amount_spent: float, months_purchased: i
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5378,7 +5928,7 @@ def get_user_count() -> int:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5402,7 +5952,7 @@ def get_total_keys_count() -> int:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5426,7 +5976,7 @@ def get_total_spent_sum() -> float:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5446,7 +5996,7 @@ def get_total_notifications_count() -> int:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5472,7 +6022,7 @@ def get_total_earned_sum() -> float:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5498,16 +6048,10 @@ def create_pending_transaction(payment_id: str, user_id: int, amount_rub: float,
     
     try:
 
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in create_pending_transaction: {e}")
 
             # Используем локальное время (UTC+3)
 
@@ -5546,7 +6090,7 @@ def create_pending_ton_transaction(payment_id: str, user_id: int, amount_rub: fl
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5584,7 +6128,7 @@ def create_pending_stars_transaction(payment_id: str, user_id: int, amount_rub:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5622,7 +6166,7 @@ def update_transaction_status(payment_id: str, status: str, tx_hash: str = None)
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5664,7 +6208,7 @@ def update_transaction_on_payment(payment_id: str, status: str, amount_rub: floa
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -5742,15 +6286,9 @@ def update_yookassa_transaction_atomic(payment_id: str, old_status: str, new_sta
     Это предотвращает race conditions при одновременной обработке webhook'ов.
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in update_yookassa_transaction_atomic: {e}")
             
             # Начинаем транзакцию с блокировкой
             cursor.execute("BEGIN IMMEDIATE")
@@ -5806,16 +6344,10 @@ def update_yookassa_transaction(payment_id: str, status: str, amount_rub: float,
 
     try:
 
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in update_yookassa_transaction: {e}")
 
             # Обновляем основную информацию и дополнительные поля YooKassa
             # Если api_response передан, обновляем его
@@ -5878,15 +6410,9 @@ def save_webhook_to_db(webhook_type: str, event_type: str, payment_id: str | Non
         ID созданной записи webhook или 0 при ошибке
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in save_webhook_to_db: {e}")
             
             # Используем локальное время (UTC+3)
             from datetime import timezone, timedelta
@@ -5937,15 +6463,9 @@ def cleanup_old_webhooks(days_to_keep: int = 90) -> int:
         Количество удаленных записей
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in cleanup_old_webhooks: {e}")
             
             # Используем локальное время (UTC+3)
             from datetime import timezone, timedelta
@@ -5976,7 +6496,7 @@ def get_transaction_by_payment_id(payment_id: str) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -6016,7 +6536,7 @@ def find_ton_transaction_by_amount(amount_ton: float) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -6070,7 +6590,7 @@ def find_and_complete_ton_transaction(payment_id: str, amount_ton: float, tx_has
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -6149,7 +6669,7 @@ def log_transaction(username: str, transaction_id: str | None, payment_id: str |
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
@@ -6197,115 +6717,76 @@ def log_transaction(username: str, transaction_id: str | None, payment_id: str |
 
 
 
-def get_paginated_transactions(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+_TRANSACTIONS_PAGE_COLUMNS = "t.*, u.username AS joined_username, u.telegram_id AS joined_user_id"
+_TRANSACTIONS_PAGE_FROM = "FROM transactions t LEFT JOIN users u ON t.user_id = u.telegram_id"
 
-    offset = (page - 1) * per_page
 
-    transactions = []
+def _transaction_from_row(row: sqlite3.Row) -> dict:
+    """Строка списка транзакций: даты, метаданные и username из users."""
+    transaction_dict = dict(row)
 
-    total = 0
+    # Преобразуем created_date в datetime объект (UTC aware)
+    if transaction_dict.get('created_date'):
+        transaction_dict['created_date'] = _parse_db_datetime(transaction_dict['created_date'])
 
-    try:
+    metadata_str = transaction_dict.get('metadata')
+    if metadata_str:
+        try:
+            metadata = json.loads(metadata_str)
+            transaction_dict['metadata'] = metadata
+            transaction_dict['host_name'] = metadata.get('host_name', 'N/A')
+            transaction_dict['plan_name'] = metadata.get('plan_name', 'N/A')
+        except json.JSONDecodeError:
+            transaction_dict['host_name'] = 'Error'
+            transaction_dict['plan_name'] = 'Error'
+    else:
+        transaction_dict['host_name'] = 'N/A'
+        transaction_dict['plan_name'] = 'N/A'
 
-        with sqlite3.connect(DB_FILE) as conn:
+    # Username привносим из таблицы users (joined_username), если есть
+    if transaction_dict.get('joined_username'):
+        transaction_dict['username'] = transaction_dict.get('joined_username')
+    return transaction_dict
 
-            conn.row_factory = sqlite3.Row
 
+def get_paginated_transactions(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+    """Страница транзакций по номеру; общее число берётся из row_counts."""
+    offset = (page - 1) * per_page
+    transactions = []
+    total = get_table_row_count('transactions')
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-
-            
-
-            cursor.execute("SELECT COUNT(*) FROM transactions")
-
-            total = cursor.fetchone()[0]
-
-
-
-            query = """
-
-                SELECT 
-
-                    t.*, 
-
-                    u.username AS joined_username,
-
-                    u.telegram_id AS joined_user_id
-
-                FROM transactions t 
-
-                LEFT JOIN users u ON t.user_id = u.telegram_id 
-
-                ORDER BY t.created_date DESC 
-
-                LIMIT ? OFFSET ?
-
-            """
-
-            cursor.execute(query, (per_page, offset))
-
-            
-
-            for row in cursor.fetchall():
-
-                transaction_dict = dict(row)
-
-                
-
-                # Преобразуем created_date в datetime объект (UTC aware)
-                if transaction_dict.get('created_date'):
-                    transaction_dict['created_date'] = _parse_db_datetime(transaction_dict['created_date'])
-
-                
-
-                metadata_str = transaction_dict.get('metadata')
-
-                if metadata_str:
-
-                    try:
-
-                        metadata = json.loads(metadata_str)
-
-                        transaction_dict['metadata'] = metadata
-
-                        transaction_dict['host_name'] = metadata.get('host_name', 'N/A')
-
-                        transaction_dict['plan_name'] = metadata.get('plan_name', 'N/A')
-
-                    except json.JSONDecodeError:
-
-                        transaction_dict['host_name'] = 'Error'
-
-                        transaction_dict['plan_name'] = 'Error'
-
-                        pass
-
-                else:
-
-                    transaction_dict['host_name'] = 'N/A'
-
-                    transaction_dict['plan_name'] = 'N/A'
-
-                
-
-                # Username привносим из таблицы users (joined_username), если есть
-
-                if transaction_dict.get('joined_username'):
-
-                    transaction_dict['username'] = transaction_dict.get('joined_username')
-
-                
-
-                transactions.append(transaction_dict)
-
-            
-
+            cursor.execute(
+                f"SELECT {_TRANSACTIONS_PAGE_COLUMNS} {_TRANSACTIONS_PAGE_FROM} ORDER BY t.created_date DESC, t.transaction_id DESC LIMIT ? OFFSET ?",
+                (per_page, offset)
+            )
+            transactions = [_transaction_from_row(row) for row in cursor.fetchall()]
     except sqlite3.Error as e:
-
         logging.error(f"Failed to get paginated transactions: {e}")
+    return transactions, total
 
-    
 
-    return transactions, total
+def get_transactions_page(limit: int = 15, cursor: str | None = None, direction: str = 'next') -> dict:
+    """Страница транзакций с keyset-пагинацией по (created_date, transaction_id), новые первыми.
+
+    Returns:
+        {'items': [...], 'next_cursor': str | None, 'prev_cursor': str | None, 'total': int}
+    """
+    page = {'items': [], 'next_cursor': None, 'prev_cursor': None, 'total': get_table_row_count('transactions')}
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            rows, page['next_cursor'], page['prev_cursor'] = _fetch_keyset_page(
+                conn.cursor(), _TRANSACTIONS_PAGE_COLUMNS, _TRANSACTIONS_PAGE_FROM, [], [],
+                sort_expr="t.created_date", id_expr="t.transaction_id", id_field='transaction_id',
+                descending=True, limit=limit, page_cursor=cursor, direction=direction
+            )
+            page['items'] = [_transaction_from_row(row) for row in rows]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get transactions page: {e}")
+    return page
 
 
 
@@ -6313,7 +6794,7 @@ def set_trial_used(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -6335,7 +6816,7 @@ def set_trial_days_given(telegram_id: int, days: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -6357,7 +6838,7 @@ def increment_trial_reuses(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -6379,7 +6860,7 @@ def reset_trial_used(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -6401,7 +6882,7 @@ def admin_reset_trial_completely(telegram_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -6503,7 +6984,7 @@ def get_trial_info(telegram_id: int) -> dict:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -6547,15 +7028,9 @@ def create_key_with_stats_atomic(user_id: int, host_name: str, xui_client_uuid:
     Возвращает key_id при успехе, None при ошибке.
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in create_key_with_stats_atomic: {e}")
             
             # Начинаем транзакцию с блокировкой
             cursor.execute("BEGIN IMMEDIATE")
@@ -6657,14 +7132,8 @@ def add_new_key(user_id: int, host_name: str, xui_client_uuid: str, key_email: s
 
     conn = None
     try:
-        conn = sqlite3.connect(DB_FILE, timeout=30)
+        conn = _connection_pool.acquire()
         cursor = conn.cursor()
-        
-        # Устанавливаем PRAGMA для предотвращения блокировок
-        try:
-            cursor.execute("PRAGMA busy_timeout=30000")
-        except sqlite3.Error as e:
-            logging.debug(f"Failed to set PRAGMA busy_timeout in add_new_key: {e}")
 
         # Импортируем необходимые модули
         from datetime import timezone, timedelta
@@ -6817,7 +7286,7 @@ def add_new_key(user_id: int, host_name: str, xui_client_uuid: str, key_email: s
         return None
     finally:
         if conn:
-            conn.close()
+            _connection_pool.release(conn)
 
 
 
@@ -6825,7 +7294,7 @@ def delete_key_by_email(email: str):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
             
@@ -7021,15 +7490,9 @@ def create_user_token(user_id: int, key_id: int) -> str:
         # Получаем текущее время в UTC
         now = datetime.now(timezone.utc).isoformat()
         
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in create_user_token: {e}")
             
             # Вставляем токен в БД
             cursor.execute('''
@@ -7059,16 +7522,10 @@ def validate_user_token(token: str) -> dict | None:
         Словарь с данными пользователя и ключа или None если токен недействителен
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in validate_user_token: {e}")
             
             # Получаем информацию о токене
             cursor.execute('''
@@ -7141,7 +7598,7 @@ def update_token_usage(token: str) -> bool:
         
         now = datetime.now(timezone.utc).isoformat()
         
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -7181,7 +7638,7 @@ def get_user_tokens(user_id: int) -> list:
         Список словарей с информацией о токенах
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -7218,16 +7675,10 @@ def get_or_create_permanent_token(user_id: int, key_id: int) -> str:
     from datetime import datetime, timezone
     
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in get_or_create_permanent_token: {e}")
             
             # Проверяем наличие токена в БД
             cursor.execute('''
@@ -7298,7 +7749,7 @@ def get_permanent_token_by_key_id(key_id: int) -> str | None:
         Токен доступа или None если не найден
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -7331,7 +7782,7 @@ def get_tokens_for_key(key_id: int) -> list[dict]:
         Список словарей с токенами и метаданными
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
@@ -7367,16 +7818,10 @@ def validate_permanent_token(token: str) -> dict | None:
     token_preview = token[:10] + "..." if len(token) > 10 else token
     
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA in validate_permanent_token: {e}")
             
             # Получаем информацию о токене
             logging.debug(f"Validating permanent token: {token_preview}")
@@ -7533,7 +7978,7 @@ def get_message_template(template_key: str, provision_mode: str = None) -> dict
             return cached_data
     
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -7577,7 +8022,7 @@ def get_all_message_templates(category: str = None) -> list[dict]:
         Список словарей с данными шаблонов
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -7624,7 +8069,7 @@ def create_message_template(
         ID созданного шаблона или None при ошибке
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -7669,7 +8114,7 @@ def update_message_template(
         True если успешно, False при ошибке
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             updates = []
@@ -7723,7 +8168,7 @@ def delete_message_template(template_id: int) -> bool:
         True если успешно, False при ошибке
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('DELETE FROM message_templates WHERE template_id = ?', (template_id,))
@@ -7748,7 +8193,7 @@ def get_message_template_statistics() -> dict:
         Словарь со статистикой
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('SELECT COUNT(*) FROM message_templates')
@@ -7781,7 +8226,7 @@ def get_key_by_email(key_email: str):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -7805,7 +8250,7 @@ def update_key_info(key_id: int, new_xui_uuid: str, new_expiry_ms: int, subscrip
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -7839,7 +8284,7 @@ def update_key_trial_status(key_id: int, is_trial: int):
         is_trial: Новое значение is_trial (0 или 1)
     """
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Получаем текущий ключ для получения remaining_seconds
@@ -7892,14 +8337,9 @@ def get_next_key_number(user_id: int) -> int:
         Следующий номер ключа
     """
     try:
-        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA busy_timeout in get_next_key_number: {e}")
             
             # Атомарно получаем текущий счетчик и инкрементируем его
             cursor.execute("SELECT keys_count FROM users WHERE telegram_id = ?", (user_id,))
@@ -7945,13 +8385,13 @@ def get_keys_for_host(host_name: str) -> list[dict]:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
             cursor = conn.cursor()
 
-            cursor.execute("SELECT * FROM vpn_keys WHERE host_name = ?", (host_name,))
+            cursor.execute("SELECT * FROM vpn_keys WHERE host_name = ? ORDER BY created_date DESC", (host_name,))
 
             keys = cursor.fetchall()
 
@@ -7969,7 +8409,7 @@ def get_all_vpn_users():
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -7993,7 +8433,7 @@ def update_key_status_from_server(key_email: str, xui_client_data):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -8077,184 +8517,34 @@ def update_key_status_from_server(key_email: str, xui_client_data):
 
 
 def get_daily_stats_for_charts(days: int = 30) -> dict:
-
-    stats = {'users': {}, 'keys': {}, 'earned': {}, 'notifications': {}}
-
+    """Графики дашборда за последние days дней из дневной статистики daily_stats"""
+    by_day = {}
     try:
-
-        with sqlite3.connect(DB_FILE) as conn:
-
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT day, {', '.join(_DAILY_STATS_COLUMNS)} FROM daily_stats WHERE day >= date('now', ?)",
+                (f'-{days} days',)
+            )
+            by_day = {row['day']: dict(row) for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get daily stats for charts: {e}")
+    return _daily_chart_data(by_day, days)
 
-            query_users = """
 
-                SELECT date(registration_date) as day, COUNT(*)
 
-                FROM users
+def get_recent_transactions(limit: int = 15) -> list[dict]:
 
-                WHERE registration_date >= date('now', ?)
+    transactions = []
 
-                GROUP BY day
+    try:
 
-                ORDER BY day;
+        with _get_db_connection() as conn:
 
-            """
+            conn.row_factory = sqlite3.Row
 
-            cursor.execute(query_users, (f'-{days} days',))
-
-            for row in cursor.fetchall():
-
-                stats['users'][row[0]] = row[1]
-
-
-
-            query_keys = """
-
-                SELECT date(created_date) as day, COUNT(*)
-
-                FROM vpn_keys
-
-                WHERE created_date >= date('now', ?)
-
-                GROUP BY day
-
-                ORDER BY day;
-
-            """
-
-            cursor.execute(query_keys, (f'-{days} days',))
-
-            for row in cursor.fetchall():
-
-                stats['keys'][row[0]] = row[1]
-
-
-
-            # Заработано в RUB по дням (только оплаченные)
-
-            query_earned = """
-
-                SELECT date(created_date) as day, COALESCE(SUM(amount_rub), 0)
-
-                FROM transactions
-
-                WHERE created_date >= date('now', ?) AND status = 'paid'
-
-                GROUP BY day
-
-                ORDER BY day;
-
-            """
-
-            cursor.execute(query_earned, (f'-{days} days',))
-
-            for row in cursor.fetchall():
-
-                stats['earned'][row[0]] = row[1] or 0
-
-
-
-            # Новые уведомления по дням
-
-            query_notifications = """
-
-                SELECT date(created_date) as day, COUNT(*)
-
-                FROM notifications
-
-                WHERE created_date >= date('now', ?)
-
-                GROUP BY day
-
-                ORDER BY day;
-
-            """
-
-            cursor.execute(query_notifications, (f'-{days} days',))
-
-            for row in cursor.fetchall():
-
-                stats['notifications'][row[0]] = row[1]
-
-    except sqlite3.Error as e:
-
-        logging.error(f"Failed to get daily stats for charts: {e}")
-
-
-
-    # Преобразуем в формат для графиков
-
-    from datetime import datetime, timedelta
-
-
-
-    # Создаем список всех дат за последние N дней
-
-    dates = []
-
-    for i in range(days):
-
-        date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-
-        dates.append(date)
-
-    dates.reverse()  # От старых к новым
-
-
-
-    # Создаем массивы данных для графиков
-
-    new_users = []
-
-    new_keys = []
-
-    earned_sum = []
-
-    new_notifications = []
-
-
-
-    for date in dates:
-
-        new_users.append(stats['users'].get(date, 0))
-
-        new_keys.append(stats['keys'].get(date, 0))
-
-        earned_sum.append(round(stats['earned'].get(date, 0) or 0, 2))
-
-        new_notifications.append(stats['notifications'].get(date, 0))
-
-
-
-    return {
-
-        'dates': dates,
-
-        'new_users': new_users,
-
-        'new_keys': new_keys,
-
-        'earned_sum': earned_sum,
-
-        'new_notifications': new_notifications
-
-    }
-
-
-
-
-
-def get_recent_transactions(limit: int = 15) -> list[dict]:
-
-    transactions = []
-
-    try:
-
-        with sqlite3.connect(DB_FILE) as conn:
-
-            conn.row_factory = sqlite3.Row
-
-            cursor = conn.cursor()
+            cursor = conn.cursor()
 
             query = """
 
@@ -8303,12 +8593,6 @@ def log_notification(user_id: int, username: str | None, notif_type: str, title:
 
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA настройки для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except sqlite3.Error as e:
-                logging.debug(f"Failed to set PRAGMA settings in log_notification: {e}")
 
             from datetime import timezone, timedelta
 
@@ -8342,80 +8626,66 @@ def log_notification(user_id: int, username: str | None, notif_type: str, title:
 
 
 
-def get_paginated_notifications(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+_NOTIFICATIONS_PAGE_COLUMNS = "n.*, u.username AS joined_username"
+_NOTIFICATIONS_PAGE_FROM = "FROM notifications n LEFT JOIN users u ON n.user_id = u.telegram_id"
 
-    offset = (page - 1) * per_page
 
-    notifications: list[dict] = []
+def _notification_from_row(row: sqlite3.Row) -> dict:
+    """Строка списка уведомлений: meta, username из users и дата."""
+    item = dict(row)
+    # Try parse meta
+    meta_str = item.get('meta')
+    if meta_str:
+        try:
+            item['meta'] = json.loads(meta_str)
+        except Exception:
+            item['meta'] = {}
+    # Prefer joined username
+    if item.get('joined_username'):
+        item['username'] = item['joined_username']
+    # Normalize created_date
+    item['created_date'] = _parse_db_datetime(item.get('created_date'))
+    return item
 
-    total = 0
 
+def get_paginated_notifications(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+    """Страница уведомлений по номеру; общее число берётся из row_counts."""
+    offset = (page - 1) * per_page
+    notifications: list[dict] = []
+    total = get_table_row_count('notifications')
     try:
-
-        with sqlite3.connect(DB_FILE) as conn:
-
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
-
             cursor = conn.cursor()
-
-            cursor.execute("SELECT COUNT(*) FROM notifications")
-
-            total = cursor.fetchone()[0] or 0
-
             cursor.execute(
-
-                """
-
-                SELECT n.*, u.username AS joined_username
-
-                FROM notifications n
-
-                LEFT JOIN users u ON n.user_id = u.telegram_id
-
-                ORDER BY n.created_date DESC
-
-                LIMIT ? OFFSET ?
-
-                """,
-
+                f"SELECT {_NOTIFICATIONS_PAGE_COLUMNS} {_NOTIFICATIONS_PAGE_FROM} ORDER BY n.created_date DESC, n.notification_id DESC LIMIT ? OFFSET ?",
                 (per_page, offset)
-
             )
+            notifications = [_notification_from_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get paginated notifications: {e}")
+    return notifications, total
 
-            for row in cursor.fetchall():
-
-                item = dict(row)
-
-                # Try parse meta
-
-                meta_str = item.get('meta')
-
-                if meta_str:
-
-                    try:
-
-                        item['meta'] = json.loads(meta_str)
-
-                    except Exception:
-
-                        item['meta'] = {}
-
-                # Prefer joined username
-
-                if item.get('joined_username'):
-
-                    item['username'] = item['joined_username']
-
-                # Normalize created_date
-                item['created_date'] = _parse_db_datetime(item.get('created_date'))
 
-                notifications.append(item)
+def get_notifications_page(limit: int = 15, cursor: str | None = None, direction: str = 'next') -> dict:
+    """Страница уведомлений с keyset-пагинацией по (created_date, notification_id), новые первыми.
 
+    Returns:
+        {'items': [...], 'next_cursor': str | None, 'prev_cursor': str | None, 'total': int}
+    """
+    page = {'items': [], 'next_cursor': None, 'prev_cursor': None, 'total': get_table_row_count('notifications')}
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            rows, page['next_cursor'], page['prev_cursor'] = _fetch_keyset_page(
+                conn.cursor(), _NOTIFICATIONS_PAGE_COLUMNS, _NOTIFICATIONS_PAGE_FROM, [], [],
+                sort_expr="n.created_date", id_expr="n.notification_id", id_field='notification_id',
+                descending=True, limit=limit, page_cursor=cursor, direction=direction
+            )
+            page['items'] = [_notification_from_row(row) for row in rows]
     except sqlite3.Error as e:
-
-        logging.error(f"Failed to get paginated notifications: {e}")
-
-    return notifications, total
+        logging.error(f"Failed to get notifications page: {e}")
+    return page
 
 
 
@@ -8425,7 +8695,7 @@ def get_notification_by_id(notification_id: int) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -8496,7 +8766,7 @@ def add_support_thread(user_id: int, thread_id: int):
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -8514,7 +8784,7 @@ def get_support_thread_id(user_id: int) -> int | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -8536,7 +8806,7 @@ def get_user_id_by_thread(thread_id: int) -> int | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -8558,7 +8828,7 @@ def get_latest_transaction(user_id: int) -> dict | None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -8581,73 +8851,83 @@ def get_latest_transaction(user_id: int) -> dict | None:
 
 
 def search_users(query: str, limit: int = 10) -> list[dict]:
-
+    """Поиск пользователей по части Telegram ID, username, имени или email ключа.
+
+    Запросы от USER_SEARCH_MIN_TRIGRAM символов ищутся по триграммному
+    индексу users_search: совпадения ранжируются bm25 с весом колонок
+    ID > username > имя > email, из них берутся лучшие USER_SEARCH_CANDIDATES.
+    Точное совпадение Telegram ID всегда первое, за ним точное совпадение
+    username. Более короткие запросы (и БД без FTS5) обрабатываются прежним
+    LIKE по users.
+    """
     query = (query or '').strip()
-
     if not query:
-
         return []
-
     try:
-
-        try:
-
-            limit_value = int(limit)
-
-        except (TypeError, ValueError):
-
-            limit_value = 10
-
-        limit_value = max(1, min(limit_value, 50))
-
-        with sqlite3.connect(DB_FILE) as conn:
-
+        limit_value = int(limit)
+    except (TypeError, ValueError):
+        limit_value = 10
+    limit_value = max(1, min(limit_value, 50))
+
+    columns = """
+        u.telegram_id,
+        u.username,
+        u.is_banned,
+        u.agreed_to_documents,
+        u.subscription_status,
+        COALESCE(u.balance, 0) AS balance
+    """
+    try:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
-
             cursor = conn.cursor()
-
-            like_id = f"%{query}%"
-
-            like_username = f"%{query.lower()}%"
-
+            if len(query) >= USER_SEARCH_MIN_TRIGRAM:
+                try:
+                    cursor.execute(
+                        f"""
+                        SELECT {columns}
+                        FROM (
+                            SELECT user_id, MIN(score) AS score FROM (
+                                SELECT * FROM (
+                                    SELECT rowid AS user_id, bm25(users_search, 10.0, 5.0, 2.0, 1.0) AS score
+                                    FROM users_search
+                                    WHERE users_search MATCH ?
+                                    ORDER BY score
+                                    LIMIT ?
+                                )
+                                UNION ALL
+                                SELECT telegram_id, -1e300 FROM users WHERE telegram_id = ?
+                                UNION ALL
+                                SELECT telegram_id, -1e299 FROM users WHERE username = ?
+                            )
+                            GROUP BY user_id
+                        ) c
+                        JOIN users u ON u.telegram_id = c.user_id
+                        ORDER BY c.score, u.telegram_id DESC
+                        LIMIT ?
+                        """,
+                        (
+                            '"' + query.replace('"', '""') + '"', USER_SEARCH_CANDIDATES,
+                            int(query) if query.isdigit() else None, query.lstrip('@'), limit_value
+                        )
+                    )
+                    return [dict(row) for row in cursor.fetchall()]
+                except sqlite3.OperationalError as e:
+                    logger.warning(f"Users search index is unavailable, falling back to LIKE: {e}")
             cursor.execute(
-
-                """
-
-                SELECT u.telegram_id,
-
-                       u.username,
-
-                       u.is_banned,
-
-                       u.agreed_to_documents,
-
-                       u.subscription_status,
-
-                       COALESCE(u.balance, 0) AS balance
-
+                f"""
+                SELECT {columns}
                 FROM users u
-
                 WHERE CAST(u.telegram_id AS TEXT) LIKE ?
-
                    OR (u.username IS NOT NULL AND LOWER(u.username) LIKE ?)
-
                 ORDER BY u.registration_date DESC
-
                 LIMIT ?
-
                 """,
-
-                (like_id, like_username, limit_value)
-
+                (f"%{query}%", f"%{query.lower()}%", limit_value)
             )
-
             return [dict(row) for row in cursor.fetchall()]
-
     except sqlite3.Error as e:
-
         logger.error(f"Failed to search users with query '{query}': {e}")
-
         return []
 
 
@@ -8656,7 +8936,7 @@ def get_all_users() -> list[dict]:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -8721,212 +9001,1027 @@ def get_all_users() -> list[dict]:
 
         return []
 
+# ============================================
+# Дневная статистика для дашборда
+# ============================================
 
+# Источники daily_stats: таблица -> (колонка даты, {колонка статистики: значение строки}, отслеживаемые колонки).
+# В значении {row} заменяется на NEW или OLD
+_DAILY_STATS_SOURCES = {
+    'users': ('registration_date', {'new_users': "1"}, ()),
+    'vpn_keys': ('created_date', {'new_keys': "1"}, ()),
+    'notifications': ('created_date', {'new_notifications': "1"}, ()),
+    'transactions': ('created_date', {
+        'earned_paid': "CASE WHEN {row}.status = 'paid' THEN COALESCE({row}.amount_rub, 0) ELSE 0 END",
+        'earned_completed': "CASE WHEN {row}.status = 'completed' THEN COALESCE({row}.amount_rub, 0) ELSE 0 END",
+    }, ('status', 'amount_rub')),
+}
+_DAILY_STATS_COLUMNS = ('new_users', 'new_keys', 'earned_paid', 'earned_completed', 'new_notifications')
 
-def ban_user(telegram_id: int):
 
-    try:
+def _daily_stats_triggers(table: str) -> dict[str, str]:
+    """Определения триггеров daily_stats для таблицы-источника: {имя триггера: определение}."""
+    date_column, values, watched = _DAILY_STATS_SOURCES[table]
 
-        with sqlite3.connect(DB_FILE) as conn:
+    def day(row: str) -> str:
+        # Строки без даты учитываются в итогах под пустым днём
+        return f"COALESCE(date({row}.{date_column}), '')"
 
-            cursor = conn.cursor()
+    def add(row: str) -> str:
+        columns = ', '.join(values)
+        row_values = ', '.join(value.format(row=row) for value in values.values())
+        increments = ', '.join(f"{column} = {column} + excluded.{column}" for column in values)
+        return (
+            f"INSERT INTO daily_stats (day, {columns}) VALUES ({day(row)}, {row_values}) "
+            f"ON CONFLICT(day) DO UPDATE SET {increments};"
+        )
 
-            cursor.execute("UPDATE users SET is_banned = 1 WHERE telegram_id = ?", (telegram_id,))
+    def subtract(row: str) -> str:
+        decrements = ', '.join(f"{column} = {column} - ({value.format(row=row)})" for column, value in values.items())
+        return f"UPDATE daily_stats SET {decrements} WHERE day = {day(row)};"
 
-            conn.commit()
+    return {
+        f"trg_{table}_daily_stats_insert": f"AFTER INSERT ON {table} BEGIN {add('NEW')} END",
+        f"trg_{table}_daily_stats_delete": f"AFTER DELETE ON {table} BEGIN {subtract('OLD')} END",
+        f"trg_{table}_daily_stats_update": (
+            f"AFTER UPDATE OF {', '.join((date_column,) + watched)} ON {table} "
+            f"BEGIN {subtract('OLD')} {add('NEW')} END"
+        ),
+    }
 
-    except sqlite3.Error as e:
 
-        logging.error(f"Failed to ban user {telegram_id}: {e}")
+def _create_daily_stats_table(cursor: sqlite3.Cursor):
+    """Создаёт дневную статистику дашборда и триггеры, поддерживающие её.
 
+    Новые пользователи, ключи, уведомления и суммы оплат по дням меняются
+    триггерами при записи в исходные таблицы, поэтому дашборду не нужны
+    GROUP BY date(...) по всей истории. Если таблица новая или триггеры
+    отсутствуют (например, миграция пересоздала таблицу), триггеры
+    пересоздаются, а статистика заполняется по текущим данным.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'")
+    is_new = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            new_keys INTEGER NOT NULL DEFAULT 0,
+            earned_paid REAL NOT NULL DEFAULT 0,
+            earned_completed REAL NOT NULL DEFAULT 0,
+            new_notifications INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    triggers = {}
+    for table in _DAILY_STATS_SOURCES:
+        triggers.update({name: (table, body) for name, body in _daily_stats_triggers(table).items()})
+    cursor.execute(
+        f"SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger' AND name IN ({','.join('?' * len(triggers))})",
+        list(triggers)
+    )
+    existing = dict(cursor.fetchall())
+    if not is_new and all(existing.get(name) == table for name, (table, _) in triggers.items()):
+        return
+    for name, (_, body) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {body}")
+    rebuild_daily_stats(cursor)
 
 
-def unban_user(telegram_id: int):
+def rebuild_daily_stats(cursor: sqlite3.Cursor | None = None) -> int:
+    """Пересчитывает daily_stats по всей истории users, vpn_keys, transactions и notifications.
 
+    Returns:
+        Количество дней в статистике
+    """
+    def _rebuild(cur: sqlite3.Cursor) -> int:
+        parts = []
+        for table, (date_column, values, _) in _DAILY_STATS_SOURCES.items():
+            aggregates = ', '.join(
+                f"SUM({values[column].format(row=table)}) AS {column}" if column in values else f"0 AS {column}"
+                for column in _DAILY_STATS_COLUMNS
+            )
+            parts.append(f"SELECT COALESCE(date({date_column}), '') AS day, {aggregates} FROM {table} GROUP BY 1")
+        cur.execute("DELETE FROM daily_stats")
+        cur.execute(f"""
+            INSERT INTO daily_stats (day, {', '.join(_DAILY_STATS_COLUMNS)})
+            SELECT day, {', '.join(f'SUM({column})' for column in _DAILY_STATS_COLUMNS)}
+            FROM ({' UNION ALL '.join(parts)})
+            GROUP BY day
+        """)
+        return cur.rowcount
+
+    if cursor is not None:
+        return _rebuild(cursor)
     try:
+        with _get_db_connection() as conn:
+            return _rebuild(conn.cursor())
+    except sqlite3.Error as e:
+        logging.error(f"Failed to rebuild daily stats: {e}")
+        return 0
 
-        with sqlite3.connect(DB_FILE) as conn:
-
-            cursor = conn.cursor()
 
-            cursor.execute("UPDATE users SET is_banned = 0 WHERE telegram_id = ?", (telegram_id,))
+def _daily_chart_data(by_day: dict, days: int) -> dict:
+    """Ряды графиков дашборда за последние days дней (от старых к новым)."""
+    dates = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    dates.reverse()
+    empty = dict.fromkeys(_DAILY_STATS_COLUMNS, 0)
+    rows = [by_day.get(date, empty) for date in dates]
+    return {
+        'dates': dates,
+        'new_users': [row['new_users'] for row in rows],
+        'new_keys': [row['new_keys'] for row in rows],
+        'earned_sum': [round(row['earned_paid'] or 0, 2) for row in rows],
+        'new_notifications': [row['new_notifications'] for row in rows],
+    }
 
-            conn.commit()
 
+def get_dashboard_stats(days: int = 30) -> dict:
+    """Итоги и графики дашборда одним запросом к daily_stats.
+
+    Returns:
+        {'stats': {'user_count', 'total_keys', 'total_spent', 'host_count', 'total_notifications'},
+         'chart_data': {'dates', 'new_users', 'new_keys', 'earned_sum', 'new_notifications'}}
+    """
+    stats = {'user_count': 0, 'total_keys': 0, 'total_spent': 0.0, 'host_count': 0, 'total_notifications': 0}
+    by_day = {}
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT 0 AS is_total, day, {', '.join(_DAILY_STATS_COLUMNS)}, NULL AS host_count
+                FROM daily_stats
+                WHERE day >= date('now', ?)
+                UNION ALL
+                SELECT 1, NULL, {', '.join(f'COALESCE(SUM({column}), 0)' for column in _DAILY_STATS_COLUMNS)},
+                       (SELECT COUNT(*) FROM xui_hosts)
+                FROM daily_stats
+            """, (f'-{days} days',))
+            for row in cursor.fetchall():
+                if not row['is_total']:
+                    by_day[row['day']] = dict(row)
+                    continue
+                stats.update({
+                    'user_count': row['new_users'],
+                    'total_keys': row['new_keys'],
+                    'total_spent': round(row['earned_completed'] or 0, 2),
+                    'host_count': row['host_count'],
+                    'total_notifications': row['new_notifications'],
+                })
     except sqlite3.Error as e:
+        logging.error(f"Failed to get dashboard stats: {e}")
+    return {'stats': stats, 'chart_data': _daily_chart_data(by_day, days)}
 
-        logging.error(f"Failed to unban user {telegram_id}: {e}")
 
+# ============================================
+# Полнотекстовый поиск пользователей
+# ============================================
+
+# Минимальная длина запроса для поиска по триграммному индексу users_search
+USER_SEARCH_MIN_TRIGRAM = 3
+# Сколько лучших по bm25 совпадений индекса соединяется с users
+USER_SEARCH_CANDIDATES = 200
+
+_USER_SEARCH_EMAILS = "(SELECT group_concat(key_email, ' ') FROM vpn_keys WHERE user_id = {user_id})"
+_USER_SEARCH_TRIGGERS = {
+    'trg_users_search_insert': ('users', f'''
+        AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_search (rowid, telegram_id, username, fullname, emails)
+            VALUES (NEW.telegram_id, CAST(NEW.telegram_id AS TEXT), NEW.username, NEW.fullname,
+                    {_USER_SEARCH_EMAILS.format(user_id='NEW.telegram_id')});
+        END
+    '''),
+    'trg_users_search_update': ('users', f'''
+        AFTER UPDATE OF telegram_id, username, fullname ON users
+        BEGIN
+            DELETE FROM users_search WHERE rowid = OLD.telegram_id;
+            INSERT INTO users_search (rowid, telegram_id, username, fullname, emails)
+            VALUES (NEW.telegram_id, CAST(NEW.telegram_id AS TEXT), NEW.username, NEW.fullname,
+                    {_USER_SEARCH_EMAILS.format(user_id='NEW.telegram_id')});
+        END
+    '''),
+    'trg_users_search_delete': ('users', '''
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM users_search WHERE rowid = OLD.telegram_id;
+        END
+    '''),
+    'trg_vpn_keys_search_insert': ('vpn_keys', f'''
+        AFTER INSERT ON vpn_keys WHEN NEW.user_id IS NOT NULL
+        BEGIN
+            UPDATE users_search SET emails = {_USER_SEARCH_EMAILS.format(user_id='NEW.user_id')} WHERE rowid = NEW.user_id;
+        END
+    '''),
+    'trg_vpn_keys_search_update': ('vpn_keys', f'''
+        AFTER UPDATE OF key_email, user_id ON vpn_keys
+        BEGIN
+            UPDATE users_search SET emails = {_USER_SEARCH_EMAILS.format(user_id='OLD.user_id')} WHERE rowid = OLD.user_id;
+            UPDATE users_search SET emails = {_USER_SEARCH_EMAILS.format(user_id='NEW.user_id')} WHERE rowid = NEW.user_id;
+        END
+    '''),
+    'trg_vpn_keys_search_delete': ('vpn_keys', f'''
+        AFTER DELETE ON vpn_keys WHEN OLD.user_id IS NOT NULL
+        BEGIN
+            UPDATE users_search SET emails = {_USER_SEARCH_EMAILS.format(user_id='OLD.user_id')} WHERE rowid = OLD.user_id;
+        END
+    '''),
+}
 
 
-def delete_user_keys(user_id: int):
+def _create_users_search_table(cursor: sqlite3.Cursor):
+    """Создаёт триграммный FTS5-индекс поиска пользователей и триггеры синхронизации.
 
+    Индекс users_search (rowid = telegram_id) содержит Telegram ID, username,
+    имя и email ключей пользователя и обновляется триггерами users и
+    vpn_keys. Если индекс новый или триггеры отсутствуют, индекс
+    перестраивается по текущим данным. Без поддержки FTS5 в SQLite поиск
+    остаётся на LIKE.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_search'")
+    is_new = cursor.fetchone() is None
     try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(
+                telegram_id, username, fullname, emails,
+                tokenize = 'trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logging.warning(f"FTS5 trigram index is unavailable, user search falls back to LIKE: {e}")
+        return
+    cursor.execute(
+        f"SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger' AND name IN ({','.join('?' * len(_USER_SEARCH_TRIGGERS))})",
+        list(_USER_SEARCH_TRIGGERS)
+    )
+    existing = dict(cursor.fetchall())
+    if not is_new and all(existing.get(name) == table for name, (table, _) in _USER_SEARCH_TRIGGERS.items()):
+        return
+    for name, (_, body) in _USER_SEARCH_TRIGGERS.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {body}")
+    rebuild_users_search(cursor)
 
-        with sqlite3.connect(DB_FILE) as conn:
 
-            cursor = conn.cursor()
-            
-            # Сначала получаем key_id всех ключей пользователя для удаления токенов
-            cursor.execute("SELECT key_id FROM vpn_keys WHERE user_id = ?", (user_id,))
-            key_ids = [row[0] for row in cursor.fetchall()]
-            
-            # Удаляем токены для всех ключей пользователя
-            if key_ids:
-                placeholders = ','.join(['?'] * len(key_ids))
-                cursor.execute(f"DELETE FROM user_tokens WHERE key_id IN ({placeholders})", key_ids)
-                deleted_tokens = cursor.rowcount
-                logging.info(f"Deleted {deleted_tokens} tokens for user {user_id} before deleting keys")
+def rebuild_users_search(cursor: sqlite3.Cursor | None = None) -> int:
+    """Перестраивает индекс users_search по таблицам users и vpn_keys.
 
-            # Удаляем ключи
-            cursor.execute("DELETE FROM vpn_keys WHERE user_id = ?", (user_id,))
-            deleted_keys = cursor.rowcount
+    Returns:
+        Количество пользователей в индексе
+    """
+    def _rebuild(cur: sqlite3.Cursor) -> int:
+        cur.execute("DELETE FROM users_search")
+        cur.execute('''
+            INSERT INTO users_search (rowid, telegram_id, username, fullname, emails)
+            SELECT u.telegram_id, CAST(u.telegram_id AS TEXT), u.username, u.fullname, e.emails
+            FROM users u
+            LEFT JOIN (
+                SELECT user_id, group_concat(key_email, ' ') AS emails
+                FROM vpn_keys WHERE user_id IS NOT NULL GROUP BY user_id
+            ) e ON e.user_id = u.telegram_id
+        ''')
+        return cur.rowcount
+
+    if cursor is not None:
+        return _rebuild(cursor)
+    try:
+        with _get_db_connection() as conn:
+            return _rebuild(conn.cursor())
+    except sqlite3.Error as e:
+        logging.error(f"Failed to rebuild users search index: {e}")
+        return 0
 
-            conn.commit()
-            logging.info(f"Deleted {deleted_keys} keys for user {user_id}")
 
+# ============================================
+# Keyset-пагинация и счётчики строк
+# ============================================
+
+# Таблицы, число строк которых поддерживается триггерами в row_counts
+_ROW_COUNT_TABLES = ('transactions', 'notifications', 'vpn_keys', 'users')
+
+
+def _create_row_counts_table(cursor: sqlite3.Cursor):
+    """Создаёт счётчики строк больших таблиц и триггеры, поддерживающие их.
+
+    Списки веб-панели берут общее число записей отсюда вместо COUNT(*) на
+    каждой странице. Если триггеры таблицы отсутствуют или остались на
+    переименованной миграцией таблице, они пересоздаются, а счётчик
+    пересчитывается.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS row_counts (
+            table_name TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in _ROW_COUNT_TABLES:
+        triggers = {
+            f"trg_{table}_row_count_insert": f'''
+                AFTER INSERT ON {table}
+                BEGIN
+                    UPDATE row_counts SET row_count = row_count + 1 WHERE table_name = '{table}';
+                END
+            ''',
+            f"trg_{table}_row_count_delete": f'''
+                AFTER DELETE ON {table}
+                BEGIN
+                    UPDATE row_counts SET row_count = row_count - 1 WHERE table_name = '{table}';
+                END
+            ''',
+        }
+        cursor.execute(
+            f"SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger' AND name IN ({','.join('?' * len(triggers))})",
+            list(triggers)
+        )
+        existing = dict(cursor.fetchall())
+        cursor.execute("SELECT 1 FROM row_counts WHERE table_name = ?", (table,))
+        if cursor.fetchone() and all(existing.get(name) == table for name in triggers):
+            continue
+        for name, body in triggers.items():
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"CREATE TRIGGER {name} {body}")
+        cursor.execute(
+            f"INSERT OR REPLACE INTO row_counts (table_name, row_count) SELECT ?, COUNT(*) FROM {table}", (table,)
+        )
+
+
+def get_table_row_count(table_name: str) -> int:
+    """Число строк таблицы из row_counts (без COUNT(*) по таблице)."""
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT row_count FROM row_counts WHERE table_name = ?", (table_name,))
+            row = cursor.fetchone()
+            if row is not None:
+                return row[0]
+            if table_name not in _ROW_COUNT_TABLES:
+                return 0
+            # Счётчик ещё не создан (БД не инициализирована) — считаем напрямую
+            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+            return cursor.fetchone()[0] or 0
     except sqlite3.Error as e:
+        logging.error(f"Failed to get row count for {table_name}: {e}")
+        return 0
 
-        logging.error(f"Failed to delete keys for user {user_id}: {e}")
 
+def _fetch_keyset_page(
+    cursor: sqlite3.Cursor,
+    columns_sql: str,
+    from_sql: str,
+    conditions: list[str],
+    params: list,
+    sort_expr: str,
+    id_expr: str,
+    id_field: str,
+    descending: bool,
+    limit: int,
+    page_cursor: str | None,
+    direction: str = 'next',
+) -> tuple[list[dict], str | None, str | None]:
+    """Выбирает страницу по (sort_expr, id_expr) после курсора page_cursor.
+
+    Запрос собирается из columns_sql и from_sql (FROM ... с JOIN), условий
+    фильтра conditions, условия курсора, порядка и LIMIT. Назад
+    (direction='prev') — та же выборка в обратном порядке от первой строки
+    текущей страницы. id_field — имя колонки id в результате; cursor должен
+    возвращать sqlite3.Row.
 
+    Returns:
+        (строки страницы по порядку сортировки, next_cursor, prev_cursor)
+    """
+    backwards = direction == 'prev'
+    position = _decode_keyset_cursor(page_cursor)
+    if position is not None:
+        condition, condition_params = _keyset_condition(sort_expr, id_expr, descending != backwards, *position)
+        conditions = conditions + [condition]
+        params = params + condition_params
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = "DESC" if descending != backwards else "ASC"
+    cursor.execute(
+        f"""
+        SELECT {columns_sql}, {sort_expr} AS keyset_sort_value
+        {from_sql}
+        {where}
+        ORDER BY {sort_expr} {order}, {id_expr} {order}
+        LIMIT ?
+        """,
+        params + [limit + 1]
+    )
+    rows = [dict(row) for row in cursor.fetchall()]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    # Страница, открытая по курсору, всегда имеет соседнюю страницу с той стороны, откуда пришли
+    has_next = position is not None if backwards else has_more
+    has_prev = has_more if backwards else position is not None
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = _encode_keyset_cursor(rows[-1]['keyset_sort_value'], rows[-1][id_field])
+    if rows and has_prev:
+        prev_cursor = _encode_keyset_cursor(rows[0]['keyset_sort_value'], rows[0][id_field])
+    for row in rows:
+        row.pop('keyset_sort_value', None)
+    return rows, next_cursor, prev_cursor
+
+
+def _encode_keyset_cursor(value, last_id: int) -> str:
+    """Непрозрачный курсор страницы: значение сортировки и id последней строки."""
+    payload = json.dumps([value, last_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def _decode_keyset_cursor(cursor: str | None) -> tuple | None:
+    """Разбирает курсор _encode_keyset_cursor; некорректный курсор считается отсутствующим."""
+    if not cursor:
+        return None
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return value, int(last_id)
+    except (ValueError, TypeError):
+        return None
 
-def get_paginated_keys(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
 
-    """Получает ключи с пагинацией"""
+def _keyset_condition(sort_expr: str, id_expr: str, descending: bool, value, last_id: int) -> tuple[str, list]:
+    """Условие WHERE для строк после (value, last_id) в порядке sort_expr, id_expr.
+
+    NULL в SQLite меньше любого значения: при убывании такие строки идут в конце,
+    при возрастании — в начале.
+    """
+    op = '<' if descending else '>'
+    if value is None:
+        if descending:
+            return f"({sort_expr} IS NULL AND {id_expr} < ?)", [last_id]
+        return f"(({sort_expr} IS NULL AND {id_expr} > ?) OR {sort_expr} IS NOT NULL)", [last_id]
+    condition = f"{sort_expr} {op} ? OR ({sort_expr} = ? AND {id_expr} {op} ?)"
+    if descending:
+        condition += f" OR {sort_expr} IS NULL"
+    return f"({condition})", [value, value, last_id]
+
+
+# ============================================
+# Постраничный список пользователей
+# ============================================
+
+# Колонки сортировки списка пользователей: выражение SQL по псевдонимам
+# u (users) и c (user_counters)
+USER_SORT_FIELDS = {
+    'registration_date': "u.registration_date",
+    'telegram_id': "u.telegram_id",
+    'balance': "COALESCE(u.balance, 0)",
+    'keys': "COALESCE(c.user_keys_count, 0)",
+    'notifications': "COALESCE(c.notifications_count, 0)",
+}
+# Таблицы, строки которых считаются в user_counters: колонка счётчика
+_USER_COUNTER_SOURCES = {
+    'vpn_keys': 'user_keys_count',
+    'notifications': 'notifications_count',
+}
 
-    offset = (page - 1) * per_page
 
-    keys = []
+def _create_user_counters_table(cursor: sqlite3.Cursor):
+    """Создаёт счётчики ключей и уведомлений пользователя и триггеры, поддерживающие их.
+
+    Счётчики меняются триггерами при любой вставке, удалении или переносе
+    строки vpn_keys/notifications, поэтому списку пользователей не нужны
+    JOIN и GROUP BY по этим таблицам. При первом создании таблица
+    заполняется по текущим данным.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_counters'")
+    is_new = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER PRIMARY KEY,
+            user_keys_count INTEGER NOT NULL DEFAULT 0,
+            notifications_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table, column in _USER_COUNTER_SOURCES.items():
+        increment = f'''
+            INSERT INTO user_counters (user_id, {column}) VALUES (NEW.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET {column} = {column} + 1;
+        '''
+        decrement = f"UPDATE user_counters SET {column} = {column} - 1 WHERE user_id = OLD.user_id;"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_user_counters_insert
+            AFTER INSERT ON {table} WHEN NEW.user_id IS NOT NULL
+            BEGIN {increment} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_user_counters_delete
+            AFTER DELETE ON {table} WHEN OLD.user_id IS NOT NULL
+            BEGIN {decrement} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_user_counters_update
+            AFTER UPDATE OF user_id ON {table} WHEN OLD.user_id IS NOT NEW.user_id
+            BEGIN
+                {decrement}
+                INSERT INTO user_counters (user_id, {column}) SELECT NEW.user_id, 1 WHERE NEW.user_id IS NOT NULL
+                ON CONFLICT(user_id) DO UPDATE SET {column} = {column} + 1;
+            END
+        ''')
+    if is_new:
+        rebuild_user_counters(cursor)
+
+
+def rebuild_user_counters(cursor: sqlite3.Cursor | None = None) -> int:
+    """Пересчитывает user_counters по таблицам vpn_keys и notifications.
 
-    total = 0
+    Returns:
+        Количество пользователей со счётчиками
+    """
+    def _rebuild(cur: sqlite3.Cursor) -> int:
+        cur.execute("DELETE FROM user_counters")
+        cur.execute('''
+            INSERT INTO user_counters (user_id, user_keys_count, notifications_count)
+            SELECT user_id, SUM(keys), SUM(notifications) FROM (
+                SELECT user_id, COUNT(*) AS keys, 0 AS notifications
+                FROM vpn_keys WHERE user_id IS NOT NULL GROUP BY user_id
+                UNION ALL
+                SELECT user_id, 0, COUNT(*)
+                FROM notifications WHERE user_id IS NOT NULL GROUP BY user_id
+            )
+            GROUP BY user_id
+        ''')
+        return cur.rowcount
 
+    if cursor is not None:
+        return _rebuild(cursor)
     try:
+        with _get_db_connection() as conn:
+            return _rebuild(conn.cursor())
+    except sqlite3.Error as e:
+        logging.error(f"Failed to rebuild user counters: {e}")
+        return 0
 
-        with sqlite3.connect(DB_FILE) as conn:
 
+def _users_filter(search: str | None, status: str | None, group_id: int | None) -> tuple[list[str], list]:
+    conditions: list[str] = []
+    params: list = []
+    search = (search or '').strip()
+    if search:
+        pattern = f"%{search.lstrip('@')}%"
+        if search.isdigit():
+            conditions.append("(u.telegram_id = ? OR u.username LIKE ? OR u.fullname LIKE ?)")
+            params.extend([int(search), pattern, pattern])
+        else:
+            conditions.append("(u.username LIKE ? OR u.fullname LIKE ? OR u.fio LIKE ?)")
+            params.extend([pattern, pattern, pattern])
+    if status == 'banned':
+        conditions.append("COALESCE(u.is_banned, 0) = 1")
+    elif status == 'active':
+        conditions.append("COALESCE(u.is_banned, 0) = 0")
+    if group_id is not None:
+        conditions.append("u.group_id = ?")
+        params.append(group_id)
+    return conditions, params
+
+
+def get_users_page(
+    limit: int = 50,
+    cursor: str | None = None,
+    direction: str = 'next',
+    sort: str = 'registration_date',
+    order: str = 'desc',
+    search: str | None = None,
+    status: str | None = None,
+    group_id: int | None = None,
+) -> dict:
+    """Страница списка пользователей с keyset-пагинацией.
+
+    Строки упорядочены по (sort, telegram_id); cursor — значение из
+    next_cursor/prev_cursor предыдущего ответа, direction — 'next' или
+    'prev'. Количество ключей и уведомлений берётся из user_counters,
+    общее число пользователей без фильтров — из row_counts.
+
+    Returns:
+        {'users': [...], 'next_cursor': str | None, 'prev_cursor': str | None, 'total': int}
+    """
+    sort = sort if sort in USER_SORT_FIELDS else 'registration_date'
+    page = {'users': [], 'next_cursor': None, 'prev_cursor': None, 'total': 0}
+
+    conditions, params = _users_filter(search, status, group_id)
+    try:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            if conditions:
+                cur.execute(f"SELECT COUNT(*) FROM users u WHERE {' AND '.join(conditions)}", params)
+                page['total'] = cur.fetchone()[0] or 0
+            else:
+                page['total'] = get_table_row_count('users')
 
-            cursor = conn.cursor()
+            rows, page['next_cursor'], page['prev_cursor'] = _fetch_keyset_page(
+                cur,
+                """
+                u.*,
+                COALESCE(c.user_keys_count, 0) AS user_keys_count,
+                COALESCE(c.notifications_count, 0) AS notifications_count,
+                ug.group_name, ug.group_description
+                """,
+                """
+                FROM users u
+                LEFT JOIN user_counters c ON c.user_id = u.telegram_id
+                LEFT JOIN user_groups ug ON ug.group_id = u.group_id
+                """,
+                conditions, params,
+                sort_expr=USER_SORT_FIELDS[sort], id_expr="u.telegram_id", id_field='telegram_id',
+                descending=order != 'asc', limit=limit, page_cursor=cursor, direction=direction
+            )
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get users page: {e}")
+        return page
 
-            
+    for row in rows:
+        if row.get('registration_date'):
+            row['registration_date'] = _parse_db_datetime(row['registration_date'])
+    page['users'] = rows
+    return page
 
-            cursor.execute("SELECT COUNT(*) FROM vpn_keys")
 
-            total = cursor.fetchone()[0]
+def get_keys_for_users(user_ids) -> dict[int, list[dict]]:
+    """Ключи набора пользователей одним запросом IN: {user_id: [ключи по key_id]}."""
+    ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    result: dict[int, list[dict]] = {user_id: [] for user_id in ids}
+    if not ids:
+        return result
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            # Лимит переменных SQLite: разбиваем большой список на пачки
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(
+                    f"SELECT * FROM vpn_keys WHERE user_id IN ({placeholders}) ORDER BY user_id, key_id", chunk
+                )
+                for row in cursor.fetchall():
+                    result[row['user_id']].append(dict(row))
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get keys for {len(ids)} users: {e}")
+    return result
 
 
+def get_users_earned(user_ids) -> dict[int, float]:
+    """Сумма оплаченных транзакций набора пользователей одним запросом: {user_id: сумма}."""
+    ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    result: dict[int, float] = {user_id: 0.0 for user_id in ids}
+    if not ids:
+        return result
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT user_id, COALESCE(SUM(amount_rub), 0) FROM transactions
+                    WHERE user_id IN ({placeholders}) AND status = 'paid'
+                    GROUP BY user_id
+                    """,
+                    chunk
+                )
+                for user_id, earned in cursor.fetchall():
+                    result[user_id] = float(earned or 0)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get earned amounts for {len(ids)} users: {e}")
+    return result
 
-            # Ensure quota column exists
 
-            try:
 
-                cursor.execute("ALTER TABLE vpn_keys ADD COLUMN quota_remaining_bytes INTEGER")
+# Кэш статуса бана для BanMiddleware
+BAN_CACHE_MAX_SIZE = 10000
+BAN_CACHE_TTL = 300
+# Забаненных обычно немного: до этого числа их ID держатся в памяти целиком
+BAN_PRELOAD_LIMIT = 10000
+# Как часто проверяется ban_version (баны, выданные другими процессами)
+BAN_VERSION_CHECK_INTERVAL = 5.0
 
-            except Exception:
 
-                pass
+def _create_ban_version_table(cursor: sqlite3.Cursor):
+    """Создаёт счётчик версии банов и триггеры, увеличивающие его при смене is_banned.
 
+    Процессы сравнивают версию со своей и перезагружают набор забаненных ID,
+    поэтому бан, выданный в панели или другим процессом, применяется без
+    ожидания TTL.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ban_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Случайное начальное значение: у пересозданной БД версия не совпадёт с закэшированной
+    cursor.execute("INSERT OR IGNORE INTO ban_version (id, version) VALUES (1, abs(random() % 1000000000))")
+    for event, condition in (
+        ("INSERT", "NEW.is_banned"),
+        ("UPDATE OF is_banned", "OLD.is_banned IS NOT NEW.is_banned"),
+        ("DELETE", "OLD.is_banned"),
+    ):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_users_ban_version_{event.split()[0].lower()}
+            AFTER {event} ON users WHEN {condition}
+            BEGIN
+                UPDATE ban_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+class BanCache:
+    """Кэш статуса бана пользователей в памяти процесса.
+
+    Пока забаненных не больше preload_limit, их ID загружаются целиком и
+    проверка не обращается к БД. Иначе статус кэшируется по user_id в LRU
+    ограниченного размера с TTL. Версия из ban_version проверяется не чаще
+    check_interval; при её изменении набор перезагружается. ban_user(),
+    unban_user() и правка пользователя в панели сбрасывают кэш явно.
+    """
 
+    def __init__(self, max_size: int = BAN_CACHE_MAX_SIZE, ttl: float = BAN_CACHE_TTL,
+                 preload_limit: int = BAN_PRELOAD_LIMIT, check_interval: float = BAN_VERSION_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.preload_limit = preload_limit
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._banned: set[int] | None = None
+        self._entries: OrderedDict[int, tuple[bool, float]] = OrderedDict()
+        self._version: int | None = None
+        self._db_path: str | None = None
+        self._checked_at: float | None = None
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _read_version(cursor: sqlite3.Cursor) -> int | None:
+        try:
+            cursor.execute("SELECT version FROM ban_version WHERE id = 1")
+            row = cursor.fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
 
-            query = """
+    def _is_fresh(self) -> bool:
+        return (
+            self._checked_at is not None
+            and self._db_path == str(DB_FILE)
+            and time.monotonic() - self._checked_at < self.check_interval
+        )
 
-                SELECT 
+    def _refresh(self):
+        with self._lock:
+            if self._is_fresh():
+                return
+        db_path = str(DB_FILE)
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            version = self._read_version(cursor)
+            with self._lock:
+                if version is not None and version == self._version and db_path == self._db_path:
+                    self._checked_at = time.monotonic()
+                    return
+            cursor.execute("SELECT telegram_id FROM users WHERE is_banned = 1 LIMIT ?", (self.preload_limit + 1,))
+            banned_ids = [row[0] for row in cursor.fetchall()]
+        with self._lock:
+            self._banned = set(banned_ids) if len(banned_ids) <= self.preload_limit else None
+            self._entries.clear()
+            self._version = version
+            self._db_path = db_path
+            self._checked_at = time.monotonic()
+            self._stats["reloads"] += 1
+
+    def peek(self, user_id: int) -> bool | None:
+        """Статус бана из памяти без обращения к БД; None, если нужен запрос."""
+        with self._lock:
+            if not self._is_fresh():
+                return None
+            if self._banned is not None:
+                self._stats["hits"] += 1
+                return user_id in self._banned
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                return None
+            self._entries.move_to_end(user_id)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def is_banned(self, user_id: int) -> bool:
+        self._refresh()
+        cached = self.peek(user_id)
+        if cached is not None:
+            return cached
+        with _get_db_connection() as conn:
+            row = conn.execute("SELECT is_banned FROM users WHERE telegram_id = ?", (user_id,)).fetchone()
+        is_banned = bool(row and row[0])
+        with self._lock:
+            self._stats["misses"] += 1
+            self._entries[user_id] = (is_banned, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return is_banned
+
+    def invalidate(self, user_id: int | None = None):
+        """Сбрасывает кэш: следующая проверка перечитает версию и набор забаненных."""
+        with self._lock:
+            self._checked_at = None
+            self._version = None
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
 
-                    vk.key_id,
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "version": self._version,
+                "preloaded": len(self._banned) if self._banned is not None else None,
+                "entries": len(self._entries),
+            }
 
-                    vk.user_id,
 
-                    u.username,
+_ban_cache = BanCache()
 
-                    vk.key_email,
 
-                    vk.host_name,
+def get_ban_cache() -> BanCache:
+    return _ban_cache
 
-                    vk.plan_name,
 
-                    vk.price,
+def invalidate_ban_cache(user_id: int | None = None):
+    """Сбрасывает кэш банов процесса (после изменения пользователя)."""
+    _ban_cache.invalidate(user_id)
 
-                    vk.connection_string,
 
-                    vk.created_date,
+def ban_user(telegram_id: int):
 
-                    vk.expiry_date,
+    try:
 
-                    vk.remaining_seconds,
+        with _get_db_connection() as conn:
 
-                    vk.quota_remaining_bytes,
+            cursor = conn.cursor()
 
-                    vk.quota_total_gb,
+            cursor.execute("UPDATE users SET is_banned = 1 WHERE telegram_id = ?", (telegram_id,))
 
-                    vk.traffic_down_bytes,
+            conn.commit()
 
-                    vk.is_trial,
+    except sqlite3.Error as e:
 
-                    vk.protocol,
+        logging.error(f"Failed to ban user {telegram_id}: {e}")
 
-                    vk.status,
+    finally:
 
-                    vk.enabled,
+        invalidate_ban_cache(telegram_id)
 
-                    vk.subscription,
 
-                    vk.subscription_link,
 
-                    (SELECT COUNT(*) FROM vpn_keys vk2 WHERE vk2.user_id = vk.user_id) as user_keys_count
+def unban_user(telegram_id: int):
 
-                FROM vpn_keys vk
+    try:
 
-                LEFT JOIN users u ON vk.user_id = u.telegram_id
+        with _get_db_connection() as conn:
 
-                ORDER BY vk.created_date DESC 
+            cursor = conn.cursor()
 
-                LIMIT ? OFFSET ?
+            cursor.execute("UPDATE users SET is_banned = 0 WHERE telegram_id = ?", (telegram_id,))
 
-            """
+            conn.commit()
 
-            cursor.execute(query, (per_page, offset))
+    except sqlite3.Error as e:
 
-            
+        logging.error(f"Failed to unban user {telegram_id}: {e}")
 
-            for row in cursor.fetchall():
+    finally:
 
-                key_dict = dict(row)
+        invalidate_ban_cache(telegram_id)
 
-                
 
-                # Преобразуем даты в datetime объекты
-                if key_dict.get('created_date'):
-                    key_dict['created_date'] = _parse_db_datetime(key_dict['created_date'])
 
-                if key_dict.get('expiry_date'):
-                    parsed_expiry = _parse_db_datetime(key_dict['expiry_date'])
-                    if parsed_expiry is not None:
-                        key_dict['expiry_date'] = parsed_expiry
+def delete_user_keys(user_id: int):
 
-                
+    try:
 
-                keys.append(key_dict)
+        with _get_db_connection() as conn:
 
+            cursor = conn.cursor()
+            
+            # Сначала получаем key_id всех ключей пользователя для удаления токенов
+            cursor.execute("SELECT key_id FROM vpn_keys WHERE user_id = ?", (user_id,))
+            key_ids = [row[0] for row in cursor.fetchall()]
             
+            # Удаляем токены для всех ключей пользователя
+            if key_ids:
+                placeholders = ','.join(['?'] * len(key_ids))
+                cursor.execute(f"DELETE FROM user_tokens WHERE key_id IN ({placeholders})", key_ids)
+                deleted_tokens = cursor.rowcount
+                logging.info(f"Deleted {deleted_tokens} tokens for user {user_id} before deleting keys")
 
-            return keys, total
+            # Удаляем ключи
+            cursor.execute("DELETE FROM vpn_keys WHERE user_id = ?", (user_id,))
+            deleted_keys = cursor.rowcount
 
-            
+            conn.commit()
+            logging.info(f"Deleted {deleted_keys} keys for user {user_id}")
 
     except sqlite3.Error as e:
 
-        logging.error(f"Failed to get paginated keys: {e}")
+        logging.error(f"Failed to delete keys for user {user_id}: {e}")
+
 
+
+_KEYS_PAGE_COLUMNS = """
+        vk.key_id,
+        vk.user_id,
+        u.username,
+        vk.key_email,
+        vk.host_name,
+        vk.plan_name,
+        vk.price,
+        vk.connection_string,
+        vk.created_date,
+        vk.expiry_date,
+        vk.remaining_seconds,
+        vk.quota_remaining_bytes,
+        vk.quota_total_gb,
+        vk.traffic_down_bytes,
+        vk.is_trial,
+        vk.protocol,
+        vk.status,
+        vk.enabled,
+        vk.subscription,
+        vk.subscription_link,
+        COALESCE(c.user_keys_count, 0) AS user_keys_count
+"""
+_KEYS_PAGE_FROM = """
+    FROM vpn_keys vk
+    LEFT JOIN users u ON vk.user_id = u.telegram_id
+    LEFT JOIN user_counters c ON c.user_id = vk.user_id
+"""
+
+
+def _key_from_row(row: sqlite3.Row) -> dict:
+    """Строка списка ключей с датами в виде datetime."""
+    key_dict = dict(row)
+    # Преобразуем даты в datetime объекты
+    if key_dict.get('created_date'):
+        key_dict['created_date'] = _parse_db_datetime(key_dict['created_date'])
+    if key_dict.get('expiry_date'):
+        parsed_expiry = _parse_db_datetime(key_dict['expiry_date'])
+        if parsed_expiry is not None:
+            key_dict['expiry_date'] = parsed_expiry
+    return key_dict
+
+
+def get_paginated_keys(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+    """Получает ключи с пагинацией; общее число берётся из row_counts"""
+    offset = (page - 1) * per_page
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT {_KEYS_PAGE_COLUMNS} {_KEYS_PAGE_FROM} ORDER BY vk.created_date DESC, vk.key_id DESC LIMIT ? OFFSET ?",
+                (per_page, offset)
+            )
+            keys = [_key_from_row(row) for row in cursor.fetchall()]
+        return keys, get_table_row_count('vpn_keys')
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get paginated keys: {e}")
         return [], 0
 
 
+def get_keys_page(limit: int = 15, cursor: str | None = None, direction: str = 'next') -> dict:
+    """Страница ключей с keyset-пагинацией по (created_date, key_id), новые первыми.
+
+    Returns:
+        {'items': [...], 'next_cursor': str | None, 'prev_cursor': str | None, 'total': int}
+    """
+    page = {'items': [], 'next_cursor': None, 'prev_cursor': None, 'total': get_table_row_count('vpn_keys')}
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            rows, page['next_cursor'], page['prev_cursor'] = _fetch_keyset_page(
+                conn.cursor(), _KEYS_PAGE_COLUMNS, _KEYS_PAGE_FROM, [], [],
+                sort_expr="vk.created_date", id_expr="vk.key_id", id_field='key_id',
+                descending=True, limit=limit, page_cursor=cursor, direction=direction
+            )
+            page['items'] = [_key_from_row(row) for row in rows]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get keys page: {e}")
+    return page
+
+
 
 def update_key_remaining_seconds(key_id: int, remaining_seconds: int, expiry_dt: datetime | None = None) -> None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -8962,34 +10057,10 @@ def update_key_quota(key_id: int, quota_total_gb: float | None, traffic_down_byt
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
-            try:
-
-                cursor.execute("ALTER TABLE vpn_keys ADD COLUMN quota_total_gb REAL")
-
-            except Exception:
-
-                pass
-
-            try:
-
-                cursor.execute("ALTER TABLE vpn_keys ADD COLUMN traffic_down_bytes INTEGER")
-
-            except Exception:
-
-                pass
-
-            try:
-
-                cursor.execute("ALTER TABLE vpn_keys ADD COLUMN quota_remaining_bytes INTEGER")
-
-            except Exception:
-
-                pass
-
             cursor.execute(
 
                 "UPDATE vpn_keys SET quota_total_gb = ?, traffic_down_bytes = ?, quota_remaining_bytes = ? WHERE key_id = ?",
@@ -9006,13 +10077,58 @@ def update_key_quota(key_id: int, quota_total_gb: float | None, traffic_down_byt
 
 
 
-def update_key_enabled_status(key_id: int, enabled: bool) -> None:
+# Поля деталей ключа из панели (get_key_details_from_host), которые переносятся
+# в одноимённые колонки vpn_keys, если значение не None
+_PANEL_KEY_DETAIL_COLUMNS = (
+    'remaining_seconds', 'quota_remaining_bytes', 'quota_total_gb', 'traffic_down_bytes',
+    'subscription', 'subscription_link', 'telegram_chat_id', 'comment',
+)
 
-    """Обновляет статус включения/отключения ключа в базе данных"""
 
-    try:
+def update_key_from_panel_details(key_id: int, details: dict) -> bool:
+    """Сохраняет в vpn_keys детали ключа, полученные из панели, одним UPDATE.
 
-        with sqlite3.connect(DB_FILE) as conn:
+    expiry_timestamp_ms и created_at (мс) записываются в expiry_date и
+    start_date, status и protocol — если не пустые, enabled — как 0/1.
+
+    Returns:
+        True, если было что записать и ключ обновлён
+    """
+    assignments: dict[str, object] = {}
+    if details.get('expiry_timestamp_ms'):
+        assignments['expiry_date'] = datetime.fromtimestamp(details['expiry_timestamp_ms'] / 1000)
+    if details.get('created_at'):
+        assignments['start_date'] = datetime.fromtimestamp(details['created_at'] / 1000)
+    for column in ('status', 'protocol'):
+        if details.get(column):
+            assignments[column] = details[column]
+    for column in _PANEL_KEY_DETAIL_COLUMNS:
+        if details.get(column) is not None:
+            assignments[column] = details[column]
+    if details.get('enabled') is not None:
+        assignments['enabled'] = 1 if details['enabled'] else 0
+    if not assignments:
+        return False
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE vpn_keys SET {', '.join(f'{column} = ?' for column in assignments)} WHERE key_id = ?",
+                (*assignments.values(), key_id)
+            )
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logging.error(f"Failed to update key {key_id} from panel details: {e}")
+        return False
+
+
+def update_key_enabled_status(key_id: int, enabled: bool) -> None:
+
+    """Обновляет статус включения/отключения ключа в базе данных"""
+
+    try:
+
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -9074,7 +10190,7 @@ def update_key_status(key_id: int, status: str) -> None:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             cursor = conn.cursor()
 
@@ -9104,7 +10220,7 @@ def update_key_status(key_id: int, status: str) -> None:
 def fix_key_fields(key_id: int) -> bool:
     """Исправляет поля status, remaining_seconds, start_date для существующего ключа"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Получаем данные ключа
@@ -9182,7 +10298,7 @@ def get_key_enabled_status(key_id: int) -> bool:
 
     try:
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
 
             conn.row_factory = sqlite3.Row
 
@@ -9352,7 +10468,7 @@ def get_ton_manifest() -> dict:
 def get_all_plans() -> list[dict]:
     """Получить все планы для выпадающих списков"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -9365,237 +10481,878 @@ def get_all_plans() -> list[dict]:
             return [dict(row) for row in cursor.fetchall()]
             
     except sqlite3.Error as e:
-        logging.error(f"Failed to get all plans: {e}")
+        logging.error(f"Failed to get all plans: {e}")
+        return []
+
+
+def can_user_use_promo_code(user_id: int, promo_code: str, bot: str) -> dict:
+    """Проверить, может ли пользователь использовать промокод"""
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            
+            # Начинаем транзакцию с блокировкой
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            try:
+                # Получаем промокод
+                cursor.execute('''
+                    SELECT * FROM promo_codes 
+                    WHERE code = ? AND is_active = 1
+                ''', (promo_code,))
+                
+                promo = cursor.fetchone()
+                if not promo:
+                    cursor.execute("ROLLBACK")
+                    return {'can_use': False, 'message': 'Промокод не найден или неактивен'}
+                
+                promo_dict = dict(promo)
+                
+                # Проверяем, использовал ли пользователь этот промокод в этом боте
+                cursor.execute('''
+                    SELECT usage_id, status, plan_id, discount_amount, discount_percent, discount_bonus
+                    FROM promo_code_usage 
+                    WHERE promo_id = ? AND user_id = ? AND bot = ?
+                ''', (promo_dict['promo_id'], user_id, bot))
+                
+                usage_result = cursor.fetchone()
+                if usage_result:
+                    # Если есть запись со статусом 'used' - промокод уже использован
+                    if usage_result['status'] == 'used':
+                        cursor.execute("ROLLBACK")
+                        return {'can_use': False, 'message': 'Вы уже использовали этот промокод'}
+                    # Если есть запись со статусом 'applied' - возвращаем данные для обновления
+                    elif usage_result['status'] == 'applied':
+                        cursor.execute("ROLLBACK")
+                        return {
+                            'can_use': True, 
+                            'message': 'Промокод уже применен, обновляем запись',
+                            'existing_usage_id': usage_result['usage_id'],
+                            'promo_data': {
+                                'promo_id': promo_dict['promo_id'],
+                                'discount_amount': usage_result['discount_amount'],
+                                'discount_percent': usage_result['discount_percent'],
+                                'discount_bonus': usage_result['discount_bonus']
+                            }
+                        }
+                
+                # Проверяем общий лимит использований для этого бота
+                cursor.execute('''
+                    SELECT COUNT(*) as total_usage
+                    FROM promo_code_usage 
+                    WHERE promo_id = ? AND bot = ?
+                ''', (promo_dict['promo_id'], bot))
+                
+                total_usage_result = cursor.fetchone()
+                if total_usage_result and total_usage_result['total_usage'] >= promo_dict['usage_limit_per_bot']:
+                    cursor.execute("ROLLBACK")
+                    return {'can_use': False, 'message': 'Лимит использований промокода исчерпан'}
+                
+                # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: Проверяем срок действия промокода (valid_until)
+                # Проверка выполняется ТОЛЬКО если valid_until установлен (не NULL и не пустая строка)
+                valid_until_value = promo_dict.get('valid_until')
+                if valid_until_value and str(valid_until_value).strip():
+                    try:
+                        valid_until = _parse_db_datetime(valid_until_value)
+                        if valid_until and datetime.now(timezone.utc) > valid_until:
+                            cursor.execute("ROLLBACK")
+                            return {'can_use': False, 'message': 'Срок действия промокода истек'}
+                    except (ValueError, TypeError) as e:
+                        # Если не удалось распарсить дату, пропускаем проверку
+                        # Промокод без установленного срока действия работает БЕЗ ОГРАНИЧЕНИЙ
+                        logging.warning(f"Failed to parse valid_until for promo {promo_dict.get('promo_id')}: {e}")
+                        pass
+                
+                # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: Проверяем срок сгорания промокода (burn_after)
+                # Проверка выполняется ТОЛЬКО если burn_after_value и burn_after_unit установлены
+                burn_value_raw = promo_dict.get('burn_after_value')
+                burn_unit_raw = promo_dict.get('burn_after_unit')
+                if burn_value_raw and burn_unit_raw and str(burn_value_raw).strip() and str(burn_unit_raw).strip():
+                    try:
+                        burn_value = int(burn_value_raw)
+                        burn_unit = str(burn_unit_raw).strip()
+                        
+                        # Получаем дату создания промокода
+                        created_at = _parse_db_datetime(promo_dict['created_at'])
+                        if created_at is None:
+                            raise ValueError('invalid created_at')
+                        
+                        # Вычисляем дату сгорания
+                        if burn_unit == 'min':
+                            burn_until = created_at + timedelta(minutes=burn_value)
+                        elif burn_unit == 'hour':
+                            burn_until = created_at + timedelta(hours=burn_value)
+                        elif burn_unit == 'day':
+                            burn_until = created_at + timedelta(days=burn_value)
+                        else:
+                            burn_until = None
+                        
+                        if burn_until and datetime.now(timezone.utc) > burn_until:
+                            cursor.execute("ROLLBACK")
+                            return {'can_use': False, 'message': 'Время использования промокода истекло'}
+                    except (ValueError, TypeError) as e:
+                        # Если не удалось распарсить, пропускаем проверку
+                        # Промокод без установленного срока сгорания работает БЕЗ ОГРАНИЧЕНИЙ
+                        logging.warning(f"Failed to parse burn_after for promo {promo_dict.get('promo_id')}: {e}")
+                        pass
+                
+                # Проверяем группу пользователя
+                if promo_dict.get('target_group_ids'):
+                    try:
+                        target_groups = json.loads(promo_dict['target_group_ids'])
+                        if target_groups:  # Если указаны группы
+                            # Получаем группу пользователя
+                            cursor.execute('''
+                                SELECT group_id FROM users WHERE telegram_id = ?
+                            ''', (user_id,))
+                            user_group_result = cursor.fetchone()
+                            
+                            if not user_group_result or user_group_result[0] not in target_groups:
+                                cursor.execute("ROLLBACK")
+                                return {'can_use': False, 'message': 'Промокод недоступен для вашей группы пользователей'}
+                    except (json.JSONDecodeError, TypeError):
+                        pass  # Если не удалось распарсить группы, пропускаем проверку
+                
+                # Десериализуем данные
+                promo_dict['vpn_plan_id'] = _deserialize_vpn_plan_id(promo_dict.get('vpn_plan_id'))
+                if promo_dict.get('tariff_code'):
+                    try:
+                        promo_dict['tariff_code'] = json.loads(promo_dict['tariff_code'])
+                    except (json.JSONDecodeError, TypeError):
+                        pass
+                
+                # Десериализуем target_group_ids
+                if promo_dict.get('target_group_ids'):
+                    try:
+                        promo_dict['target_group_ids'] = json.loads(promo_dict['target_group_ids'])
+                    except (json.JSONDecodeError, TypeError):
+                        promo_dict['target_group_ids'] = []
+                
+                cursor.execute("COMMIT")
+                return {
+                    'can_use': True, 
+                    'message': 'Промокод можно использовать',
+                    'promo_data': promo_dict
+                }
+                
+            except Exception as e:
+                cursor.execute("ROLLBACK")
+                raise e
+            
+    except sqlite3.Error as e:
+        logging.error(f"Failed to check promo code usage: {e}")
+        return {'can_use': False, 'message': 'Ошибка проверки промокода'}
+
+
+# Время истечения ключа в сравнимом виде 'YYYY-MM-DD HH:MM:SS': даты хранятся
+# ISO-строками с пробелом или 'T', иногда с таймзоной, которая (как и раньше
+# при сравнении в Python) отбрасывается. Выражение совпадает с индексом
+# idx_vpn_keys_status_expiry — менять его нужно в обоих местах сразу.
+_KEY_EXPIRY_SQL = "replace(substr(expiry_date, 1, 19), 'T', ' ')"
+_KEY_EXPIRY_VALID_SQL = "expiry_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+_KEY_ENDED_STATUS_SQL = "CASE WHEN is_trial THEN 'trial-ended' ELSE 'pay-ended' END"
+_KEY_ACTIVE_STATUS_SQL = "CASE WHEN is_trial THEN 'trial-active' ELSE 'pay-active' END"
+
+# Полная сверка статусов выполняется один раз за процесс (первый цикл планировщика)
+_key_status_full_sync_done = False
+
+
+def update_keys_status_by_expiry(full_sync: bool = False) -> int:
+    """
+    Обновляет статус ключей на основе реального времени истечения.
+    Вызывается для синхронизации статуса в БД с реальным временем.
+
+    Переходы pay-active → pay-ended, trial-active → trial-ended (и обратно
+    после продления) выполняются двумя set-based UPDATE по индексу
+    (status, время истечения), поэтому стоимость цикла зависит от числа
+    ключей, сменивших статус, а не от размера таблицы. Полная сверка
+    (статус не соответствует is_trial, нестандартные значения status)
+    выполняется одним UPDATE при первом вызове в процессе или при full_sync=True.
+
+    Returns:
+        Количество ключей, у которых изменился статус
+    """
+    global _key_status_full_sync_done
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # БЕЗОПАСНАЯ ПРОВЕРКА: существует ли колонка status
+            if not _column_exists(cursor, 'vpn_keys', 'status'):
+                logger.warning("Column 'status' does not exist in vpn_keys table. Skipping status update.")
+                return 0
+            
+            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            if full_sync or not _key_status_full_sync_done:
+                cursor.execute(
+                    f"""
+                    UPDATE vpn_keys
+                    SET status = CASE WHEN {_KEY_EXPIRY_SQL} <= :now THEN {_KEY_ENDED_STATUS_SQL} ELSE {_KEY_ACTIVE_STATUS_SQL} END
+                    WHERE status IS NOT NULL AND {_KEY_EXPIRY_VALID_SQL}
+                      AND status != CASE WHEN {_KEY_EXPIRY_SQL} <= :now THEN {_KEY_ENDED_STATUS_SQL} ELSE {_KEY_ACTIVE_STATUS_SQL} END
+                    """,
+                    {"now": now_str}
+                )
+                transitions = {'full_sync': cursor.rowcount}
+            else:
+                cursor.execute(
+                    f"""
+                    UPDATE vpn_keys SET status = {_KEY_ENDED_STATUS_SQL}
+                    WHERE status IN ('pay-active', 'trial-active') AND {_KEY_EXPIRY_SQL} <= ? AND {_KEY_EXPIRY_VALID_SQL}
+                    """,
+                    (now_str,)
+                )
+                expired_count = cursor.rowcount
+                # Ключи, продлённые без обновления статуса, снова становятся активными
+                cursor.execute(
+                    f"""
+                    UPDATE vpn_keys SET status = {_KEY_ACTIVE_STATUS_SQL}
+                    WHERE status IN ('pay-ended', 'trial-ended') AND {_KEY_EXPIRY_SQL} > ? AND {_KEY_EXPIRY_VALID_SQL}
+                    """,
+                    (now_str,)
+                )
+                transitions = {'ended': expired_count, 'reactivated': cursor.rowcount}
+            
+            conn.commit()
+            _key_status_full_sync_done = True
+            updated_count = sum(transitions.values())
+            if updated_count > 0:
+                logging.info(f"Updated status for {updated_count} keys based on expiry time: {transitions}")
+            
+            return updated_count
+            
+    except sqlite3.Error as e:
+        logging.error(f"Database error while updating keys status: {e}")
+        return 0
+
+
+# ============================================
+# Очередь автопродления
+# ============================================
+
+# Статусы записей renewal_queue:
+#   pending  — ключ истёк и ждёт продления (списание ещё не выполнено); если
+#              баланса не хватает или тариф недоступен, запись откладывается
+#              до next_attempt_at (UTC), чтобы не занимать пачку каждый цикл
+#   charged  — баланс списан и транзакция записана, ключ ещё не продлён
+#   done     — ключ продлён
+#   skipped  — автопродление выключено (запись снова станет pending после включения)
+#   obsolete — ключ удалён или продлён в обход очереди до списания
+#   failed   — продление после списания не удалось за RENEWAL_MAX_ATTEMPTS попыток
+RENEWAL_ACTIVE_STATUSES = ('pending', 'charged')
+RENEWAL_MAX_ATTEMPTS = 5
+
+
+def _create_renewal_queue_table(cursor: sqlite3.Cursor):
+    """Создаёт очередь автопродления.
+
+    Одна запись на пару (ключ, время истечения): idempotency_key
+    'renew:<key_id>:<expiry>' уникален, поэтому повторная постановка в
+    очередь и повторная обработка того же истечения не приводят к
+    повторному списанию.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS renewal_queue (
+            queue_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            key_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            host_name TEXT,
+            expiry_date TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            payment_id TEXT,
+            amount REAL,
+            metadata TEXT,
+            last_error TEXT,
+            postpone_count INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Очередь, созданная до появления отложенных попыток
+    if not _column_exists(cursor, 'renewal_queue', 'next_attempt_at'):
+        cursor.execute("ALTER TABLE renewal_queue ADD COLUMN postpone_count INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("ALTER TABLE renewal_queue ADD COLUMN next_attempt_at TIMESTAMP")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_renewal_queue_status_expiry ON renewal_queue(status, expiry_date)"
+    )
+
+
+def key_expiry_marker(expiry_date) -> str:
+    """Время истечения ключа в виде 'YYYY-MM-DD HH:MM:SS' (как _KEY_EXPIRY_SQL)."""
+    if isinstance(expiry_date, datetime):
+        expiry_date = expiry_date.isoformat(sep=' ')
+    return str(expiry_date or '')[:19].replace('T', ' ')
+
+
+def enqueue_due_renewals(now: datetime) -> int:
+    """Ставит в очередь автопродления ключи, истёкшие к моменту now.
+
+    now — наивное время UTC. В очередь попадают ключи пользователей с
+    положительным балансом и включённым автопродлением (глобально и для
+    ключа). Выборка идёт диапазоном по индексу idx_vpn_keys_expiry_date;
+    уже поставленные истечения пропускаются по idempotency_key, записи
+    'skipped' снова становятся 'pending'.
+
+    Returns:
+        Количество новых или возвращённых в работу записей
+    """
+    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+    # Верхняя граница по дате с запасом: индекс строится по исходной строке
+    upper = (now + timedelta(days=1)).strftime("%Y-%m-%d")
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            user_flag = "u.auto_renewal_enabled" if _column_exists(cursor, 'users', 'auto_renewal_enabled') else "NULL"
+            key_flag = "k.auto_renewal_enabled" if _column_exists(cursor, 'vpn_keys', 'auto_renewal_enabled') else "NULL"
+            cursor.execute(
+                f"""
+                INSERT INTO renewal_queue (idempotency_key, key_id, user_id, host_name, expiry_date)
+                SELECT 'renew:' || k.key_id || ':' || {_KEY_EXPIRY_SQL}, k.key_id, k.user_id, k.host_name, {_KEY_EXPIRY_SQL}
+                FROM vpn_keys k
+                JOIN users u ON u.telegram_id = k.user_id
+                WHERE k.expiry_date < :upper AND {_KEY_EXPIRY_VALID_SQL} AND {_KEY_EXPIRY_SQL} <= :now
+                  AND COALESCE({user_flag}, 1) = 1 AND COALESCE({key_flag}, 1) = 1
+                  AND COALESCE(u.balance, 0) > 0
+                ORDER BY {_KEY_EXPIRY_SQL}
+                ON CONFLICT(idempotency_key) DO UPDATE SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+                WHERE renewal_queue.status = 'skipped'
+                """,
+                {"upper": upper, "now": now_str}
+            )
+            return max(cursor.rowcount, 0)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to enqueue due renewals: {e}")
+        return 0
+
+
+def get_due_renewals(limit: int = 500) -> list[dict]:
+    """Возвращает активные записи очереди (pending/charged) в порядке истечения.
+
+    Отложенные записи (next_attempt_at в будущем) пропускаются, поэтому
+    ключи без денег на балансе не вытесняют из пачки новые истечения.
+    """
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT * FROM renewal_queue
+                WHERE status IN (?, ?) AND (next_attempt_at IS NULL OR next_attempt_at <= datetime('now'))
+                ORDER BY expiry_date, queue_id
+                LIMIT ?
+                """,
+                (*RENEWAL_ACTIVE_STATUSES, limit)
+            )
+            items = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get due renewals: {e}")
+        return []
+    for item in items:
+        try:
+            item['metadata'] = json.loads(item['metadata']) if item.get('metadata') else None
+        except (TypeError, ValueError):
+            item['metadata'] = None
+    return items
+
+
+def charge_renewal(queue_id: int, user_id: int, amount: float, metadata: dict) -> str:
+    """Списывает оплату автопродления с баланса в одной транзакции БД.
+
+    Списание баланса, запись транзакции (payment_id из metadata) и перевод
+    записи очереди в 'charged' фиксируются вместе. Списание выполняется
+    только для записи в статусе 'pending' и только при достаточном балансе,
+    поэтому повторный вызов для той же записи не списывает деньги повторно.
+
+    Returns:
+        'charged' — деньги списаны; 'insufficient_funds' — баланса не хватает;
+        'not_pending' — запись уже обработана; 'error' — ошибка БД
+    """
+    amount = float(amount)
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT status FROM renewal_queue WHERE queue_id = ?", (queue_id,))
+            row = cursor.fetchone()
+            if not row or row[0] != 'pending':
+                conn.rollback()
+                return 'not_pending'
+
+            cursor.execute(
+                "UPDATE users SET balance = COALESCE(balance, 0) - ? WHERE telegram_id = ? AND COALESCE(balance, 0) >= ?",
+                (amount, user_id, amount)
+            )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return 'insufficient_funds'
+
+            cursor.execute("SELECT username FROM users WHERE telegram_id = ?", (user_id,))
+            user_row = cursor.fetchone()
+            username = (user_row[0] if user_row else None) or 'N/A'
+            local_now = datetime.now(timezone(timedelta(hours=3)))  # UTC+3, как в log_transaction
+            cursor.execute(
+                """INSERT INTO transactions
+                   (username, payment_id, user_id, status, amount_rub, amount_currency, currency_name, payment_method, metadata, created_date)
+                   VALUES (?, ?, ?, 'paid', ?, NULL, NULL, 'Auto-Renewal', ?, ?)""",
+                (username, metadata['payment_id'], user_id, amount, json.dumps(metadata), local_now)
+            )
+            cursor.execute(
+                """
+                UPDATE renewal_queue
+                SET status = 'charged', payment_id = ?, amount = ?, metadata = ?, last_error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE queue_id = ?
+                """,
+                (metadata['payment_id'], amount, json.dumps(metadata), queue_id)
+            )
+            conn.commit()
+            return 'charged'
+    except sqlite3.Error as e:
+        logging.error(f"Failed to charge renewal {queue_id} for user {user_id}: {e}")
+        return 'error'
+
+
+def update_renewal_status(queue_id: int, status: str, error: str | None = None, count_attempt: bool = False) -> bool:
+    """Меняет статус записи очереди автопродления.
+
+    count_attempt=True увеличивает счётчик неудачных попыток продления.
+    """
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE renewal_queue
+                SET status = ?, last_error = ?, attempts = attempts + ?, updated_at = CURRENT_TIMESTAMP
+                WHERE queue_id = ?
+                """,
+                (status, error, 1 if count_attempt else 0, queue_id)
+            )
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logging.error(f"Failed to update renewal {queue_id} status to {status}: {e}")
+        return False
+
+
+def postpone_renewal(queue_id: int, retry_in: int, reason: str) -> bool:
+    """Откладывает запись 'pending' на retry_in секунд и увеличивает postpone_count."""
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE renewal_queue
+                SET postpone_count = postpone_count + 1, last_error = ?,
+                    next_attempt_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                WHERE queue_id = ? AND status = 'pending'
+                """,
+                (reason, f"+{int(retry_in)} seconds", queue_id)
+            )
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logging.error(f"Failed to postpone renewal {queue_id}: {e}")
+        return False
+
+
+def purge_renewal_queue(days: int = 30) -> int:
+    """Удаляет завершённые записи очереди автопродления старше days дней."""
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                DELETE FROM renewal_queue
+                WHERE status IN ('done', 'obsolete', 'failed') AND updated_at < datetime('now', ?)
+                """,
+                (f"-{int(days)} days",)
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Failed to purge renewal queue: {e}")
+        return 0
+
+
+# ============================================
+# Рассылки
+# ============================================
+
+# Статусы рассылок: running — выполняется или прервана перезапуском (будет
+# возобновлена), completed — завершена, cancelled — остановлена администратором,
+# failed — прервана ошибкой (не возобновляется автоматически)
+BROADCAST_RECIPIENTS_BATCH = 500
+
+
+def _create_broadcasts_table(cursor: sqlite3.Cursor):
+    """Создаёт таблицу рассылок с сохраняемым прогрессом.
+
+    last_user_id — курсор: все получатели с telegram_id <= last_user_id уже
+    обработаны, возобновлённая рассылка продолжает с первого следующего.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            reply_markup TEXT,
+            progress_message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            skipped_banned INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)")
+
+
+def create_broadcast(admin_chat_id: int, from_chat_id: int, message_id: int, reply_markup: str | None = None,
+                     progress_message_id: int | None = None) -> int | None:
+    """Создаёт рассылку и фиксирует число получателей и пропущенных (забаненных)."""
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(CASE WHEN is_banned THEN 1 ELSE 0 END), 0) FROM users"
+            )
+            users_count, banned_count = cursor.fetchone()
+            cursor.execute(
+                """
+                INSERT INTO broadcasts
+                    (admin_chat_id, from_chat_id, message_id, reply_markup, progress_message_id, total, skipped_banned)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (admin_chat_id, from_chat_id, message_id, reply_markup, progress_message_id,
+                 users_count - banned_count, banned_count)
+            )
+            return cursor.lastrowid
+    except sqlite3.Error as e:
+        logging.error(f"Failed to create broadcast: {e}")
+        return None
+
+
+def get_broadcast(broadcast_id: int) -> dict | None:
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get broadcast {broadcast_id}: {e}")
+        return None
+
+
+def get_unfinished_broadcasts() -> list[dict]:
+    """Рассылки в статусе running (прерванные остановкой бота)."""
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY broadcast_id")
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get unfinished broadcasts: {e}")
+        return []
+
+
+def update_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked: int,
+                              status: str | None = None, progress_message_id: int | None = None) -> bool:
+    """Сохраняет курсор и счётчики рассылки; со status != running отмечает время завершения."""
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE broadcasts
+                SET last_user_id = ?, sent = ?, failed = ?, blocked = ?,
+                    status = COALESCE(?, status),
+                    progress_message_id = COALESCE(?, progress_message_id),
+                    finished_at = CASE WHEN COALESCE(?, status) != 'running' THEN CURRENT_TIMESTAMP ELSE finished_at END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE broadcast_id = ?
+                """,
+                (last_user_id, sent, failed, blocked, status, progress_message_id, status, broadcast_id)
+            )
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logging.error(f"Failed to update broadcast {broadcast_id} progress: {e}")
+        return False
+
+
+def get_broadcast_recipients(after_user_id: int = 0, limit: int = BROADCAST_RECIPIENTS_BATCH) -> list[int]:
+    """Следующая пачка telegram_id незабаненных пользователей по возрастанию.
+
+    Пользователи читаются по первичному ключу после after_user_id
+    (keyset-пагинация), из таблицы берётся одна колонка, поэтому рассылка
+    перебирает получателей пачками, не удерживая соединение между ними.
+    """
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT telegram_id FROM users
+                WHERE telegram_id > ? AND COALESCE(is_banned, 0) = 0
+                ORDER BY telegram_id
+                LIMIT ?
+                """,
+                (after_user_id, limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to read broadcast recipients after {after_user_id}: {e}")
+        return []
+
+
+# ============================================
+# Очередь исходящих уведомлений (outbox)
+# ============================================
+
+# Статусы записей outbox: pending — ждёт отправки (next_attempt_at — не раньше
+# какого момента UTC), sent — доставлено, failed — не доставлено за
+# NOTIFICATION_OUTBOX_MAX_ATTEMPTS попыток или пользователь заблокировал бота,
+# skipped — не отправлено, потому что прошёл deadline (UTC, обычно время
+# истечения ключа): «ключ истекает через час» после истечения бессмысленно
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5
+
+
+def _create_notification_outbox_table(cursor: sqlite3.Cursor):
+    """Создаёт очередь исходящих уведомлений.
+
+    Каждая запись связана со строкой notifications (notification_id) и
+    хранит готовое сообщение: текст, клавиатуру (JSON) и parse_mode.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            notification_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            deadline TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    ''')
+    # Outbox, созданный до появления срока актуальности уведомлений
+    if not _column_exists(cursor, 'notification_outbox', 'deadline'):
+        cursor.execute("ALTER TABLE notification_outbox ADD COLUMN deadline TIMESTAMP")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notification_outbox_status_next ON notification_outbox(status, next_attempt_at)"
+    )
+
+
+def enqueue_notifications(entries: list[dict]) -> int:
+    """Записывает уведомления и их сообщения в outbox одной транзакцией.
+
+    Каждый элемент entries: user_id, notif_type, title, message, meta,
+    key_id, marker_hours, reply_markup (JSON или None), parse_mode и
+    необязательный deadline ('YYYY-MM-DD HH:MM:SS' UTC), после которого
+    уведомление не отправляется.
+    Строка notifications создаётся со статусом 'pending' и служит маркером
+    против повторной постановки; уведомление, маркер которого уже записан,
+    пропускается.
+
+    Returns:
+        Количество поставленных в очередь уведомлений
+    """
+    if not entries:
+        return 0
+    created_date = datetime.now(timezone(timedelta(hours=3)))  # UTC+3, как в log_notification
+    enqueued = 0
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            for entry in entries:
+                cursor.execute(
+                    """
+                    INSERT INTO notifications (user_id, username, type, title, message, status, meta, key_id, marker_hours, created_date)
+                    SELECT ?, (SELECT username FROM users WHERE telegram_id = ?), ?, ?, ?, 'pending', ?, ?, ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM notifications
+                        WHERE user_id = ? AND key_id = ? AND marker_hours = ? AND type = ?
+                    )
+                    """,
+                    (
+                        entry['user_id'], entry['user_id'], entry['notif_type'], entry['title'], entry['message'],
+                        json.dumps(entry.get('meta') or {}), entry.get('key_id'), entry.get('marker_hours'), created_date,
+                        entry['user_id'], entry.get('key_id'), entry.get('marker_hours'), entry['notif_type']
+                    )
+                )
+                if cursor.rowcount == 0:
+                    continue
+                cursor.execute(
+                    """
+                    INSERT INTO notification_outbox (notification_id, chat_id, text, reply_markup, parse_mode, deadline)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        cursor.lastrowid, entry['user_id'], entry['message'], entry.get('reply_markup'),
+                        entry.get('parse_mode'), entry.get('deadline')
+                    )
+                )
+                enqueued += 1
+            return enqueued
+    except sqlite3.Error as e:
+        logging.error(f"Failed to enqueue {len(entries)} notifications: {e}")
+        return 0
+
+
+def skip_expired_outbox_notifications() -> int:
+    """Переводит в 'skipped' неотправленные уведомления, deadline которых прошёл.
+
+    Returns:
+        Количество пропущенных уведомлений
+    """
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE notifications SET status = 'skipped'
+                WHERE notification_id IN (
+                    SELECT notification_id FROM notification_outbox
+                    WHERE status = 'pending' AND deadline <= datetime('now')
+                )
+                """
+            )
+            cursor.execute(
+                """
+                UPDATE notification_outbox SET status = 'skipped', last_error = 'deadline passed'
+                WHERE status = 'pending' AND deadline <= datetime('now')
+                """
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Failed to skip expired outbox notifications: {e}")
+        return 0
+
+
+def get_due_outbox_notifications(limit: int = 100) -> list[dict]:
+    """Уведомления outbox, готовые к отправке и не просроченные, в порядке постановки."""
+    try:
+        with _get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT * FROM notification_outbox
+                WHERE status = 'pending' AND next_attempt_at <= datetime('now')
+                  AND (deadline IS NULL OR deadline > datetime('now'))
+                ORDER BY outbox_id
+                LIMIT ?
+                """,
+                (limit,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get due outbox notifications: {e}")
         return []
 
 
-def can_user_use_promo_code(user_id: int, promo_code: str, bot: str) -> dict:
-    """Проверить, может ли пользователь использовать промокод"""
+def record_outbox_results(results: list[dict]) -> bool:
+    """Сохраняет результаты отправки уведомлений outbox одной транзакцией.
+
+    Каждый элемент results: outbox_id, status ('sent', 'retry', 'failed'
+    или 'skipped'), error и для 'retry' — retry_in (секунды до следующей
+    попытки). Итоговый статус переносится в notifications.
+    """
+    if not results:
+        return True
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Устанавливаем режим журналирования
-            cursor.execute("PRAGMA journal_mode=DELETE")
-            
-            # Начинаем транзакцию с блокировкой
-            cursor.execute("BEGIN IMMEDIATE")
-            
-            try:
-                # Получаем промокод
-                cursor.execute('''
-                    SELECT * FROM promo_codes 
-                    WHERE code = ? AND is_active = 1
-                ''', (promo_code,))
-                
-                promo = cursor.fetchone()
-                if not promo:
-                    cursor.execute("ROLLBACK")
-                    return {'can_use': False, 'message': 'Промокод не найден или неактивен'}
-                
-                promo_dict = dict(promo)
-                
-                # Проверяем, использовал ли пользователь этот промокод в этом боте
-                cursor.execute('''
-                    SELECT usage_id, status, plan_id, discount_amount, discount_percent, discount_bonus
-                    FROM promo_code_usage 
-                    WHERE promo_id = ? AND user_id = ? AND bot = ?
-                ''', (promo_dict['promo_id'], user_id, bot))
-                
-                usage_result = cursor.fetchone()
-                if usage_result:
-                    # Если есть запись со статусом 'used' - промокод уже использован
-                    if usage_result['status'] == 'used':
-                        cursor.execute("ROLLBACK")
-                        return {'can_use': False, 'message': 'Вы уже использовали этот промокод'}
-                    # Если есть запись со статусом 'applied' - возвращаем данные для обновления
-                    elif usage_result['status'] == 'applied':
-                        cursor.execute("ROLLBACK")
-                        return {
-                            'can_use': True, 
-                            'message': 'Промокод уже применен, обновляем запись',
-                            'existing_usage_id': usage_result['usage_id'],
-                            'promo_data': {
-                                'promo_id': promo_dict['promo_id'],
-                                'discount_amount': usage_result['discount_amount'],
-                                'discount_percent': usage_result['discount_percent'],
-                                'discount_bonus': usage_result['discount_bonus']
-                            }
-                        }
-                
-                # Проверяем общий лимит использований для этого бота
-                cursor.execute('''
-                    SELECT COUNT(*) as total_usage
-                    FROM promo_code_usage 
-                    WHERE promo_id = ? AND bot = ?
-                ''', (promo_dict['promo_id'], bot))
-                
-                total_usage_result = cursor.fetchone()
-                if total_usage_result and total_usage_result['total_usage'] >= promo_dict['usage_limit_per_bot']:
-                    cursor.execute("ROLLBACK")
-                    return {'can_use': False, 'message': 'Лимит использований промокода исчерпан'}
-                
-                # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: Проверяем срок действия промокода (valid_until)
-                # Проверка выполняется ТОЛЬКО если valid_until установлен (не NULL и не пустая строка)
-                valid_until_value = promo_dict.get('valid_until')
-                if valid_until_value and str(valid_until_value).strip():
-                    try:
-                        valid_until = _parse_db_datetime(valid_until_value)
-                        if valid_until and datetime.now(timezone.utc) > valid_until:
-                            cursor.execute("ROLLBACK")
-                            return {'can_use': False, 'message': 'Срок действия промокода истек'}
-                    except (ValueError, TypeError) as e:
-                        # Если не удалось распарсить дату, пропускаем проверку
-                        # Промокод без установленного срока действия работает БЕЗ ОГРАНИЧЕНИЙ
-                        logging.warning(f"Failed to parse valid_until for promo {promo_dict.get('promo_id')}: {e}")
-                        pass
-                
-                # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: Проверяем срок сгорания промокода (burn_after)
-                # Проверка выполняется ТОЛЬКО если burn_after_value и burn_after_unit установлены
-                burn_value_raw = promo_dict.get('burn_after_value')
-                burn_unit_raw = promo_dict.get('burn_after_unit')
-                if burn_value_raw and burn_unit_raw and str(burn_value_raw).strip() and str(burn_unit_raw).strip():
-                    try:
-                        burn_value = int(burn_value_raw)
-                        burn_unit = str(burn_unit_raw).strip()
-                        
-                        # Получаем дату создания промокода
-                        created_at = _parse_db_datetime(promo_dict['created_at'])
-                        if created_at is None:
-                            raise ValueError('invalid created_at')
-                        
-                        # Вычисляем дату сгорания
-                        if burn_unit == 'min':
-                            burn_until = created_at + timedelta(minutes=burn_value)
-                        elif burn_unit == 'hour':
-                            burn_until = created_at + timedelta(hours=burn_value)
-                        elif burn_unit == 'day':
-                            burn_until = created_at + timedelta(days=burn_value)
-                        else:
-                            burn_until = None
-                        
-                        if burn_until and datetime.now(timezone.utc) > burn_until:
-                            cursor.execute("ROLLBACK")
-                            return {'can_use': False, 'message': 'Время использования промокода истекло'}
-                    except (ValueError, TypeError) as e:
-                        # Если не удалось распарсить, пропускаем проверку
-                        # Промокод без установленного срока сгорания работает БЕЗ ОГРАНИЧЕНИЙ
-                        logging.warning(f"Failed to parse burn_after for promo {promo_dict.get('promo_id')}: {e}")
-                        pass
-                
-                # Проверяем группу пользователя
-                if promo_dict.get('target_group_ids'):
-                    try:
-                        target_groups = json.loads(promo_dict['target_group_ids'])
-                        if target_groups:  # Если указаны группы
-                            # Получаем группу пользователя
-                            cursor.execute('''
-                                SELECT group_id FROM users WHERE telegram_id = ?
-                            ''', (user_id,))
-                            user_group_result = cursor.fetchone()
-                            
-                            if not user_group_result or user_group_result[0] not in target_groups:
-                                cursor.execute("ROLLBACK")
-                                return {'can_use': False, 'message': 'Промокод недоступен для вашей группы пользователей'}
-                    except (json.JSONDecodeError, TypeError):
-                        pass  # Если не удалось распарсить группы, пропускаем проверку
-                
-                # Десериализуем данные
-                promo_dict['vpn_plan_id'] = _deserialize_vpn_plan_id(promo_dict.get('vpn_plan_id'))
-                if promo_dict.get('tariff_code'):
-                    try:
-                        promo_dict['tariff_code'] = json.loads(promo_dict['tariff_code'])
-                    except (json.JSONDecodeError, TypeError):
-                        pass
-                
-                # Десериализуем target_group_ids
-                if promo_dict.get('target_group_ids'):
-                    try:
-                        promo_dict['target_group_ids'] = json.loads(promo_dict['target_group_ids'])
-                    except (json.JSONDecodeError, TypeError):
-                        promo_dict['target_group_ids'] = []
-                
-                cursor.execute("COMMIT")
-                return {
-                    'can_use': True, 
-                    'message': 'Промокод можно использовать',
-                    'promo_data': promo_dict
-                }
-                
-            except Exception as e:
-                cursor.execute("ROLLBACK")
-                raise e
-            
+            for result in results:
+                outbox_id = result['outbox_id']
+                status = result['status']
+                if status == 'retry':
+                    cursor.execute(
+                        """
+                        UPDATE notification_outbox
+                        SET attempts = attempts + 1, last_error = ?, next_attempt_at = datetime('now', ?)
+                        WHERE outbox_id = ?
+                        """,
+                        (result.get('error'), f"+{int(result.get('retry_in') or 0)} seconds", outbox_id)
+                    )
+                    continue
+                cursor.execute(
+                    """
+                    UPDATE notification_outbox
+                    SET status = ?, attempts = attempts + (? != 'skipped'), last_error = ?,
+                        sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP ELSE sent_at END
+                    WHERE outbox_id = ?
+                    """,
+                    (status, status, result.get('error'), status, outbox_id)
+                )
+                cursor.execute(
+                    """
+                    UPDATE notifications SET status = ?
+                    WHERE notification_id = (SELECT notification_id FROM notification_outbox WHERE outbox_id = ?)
+                    """,
+                    (status, outbox_id)
+                )
+            return True
     except sqlite3.Error as e:
-        logging.error(f"Failed to check promo code usage: {e}")
-        return {'can_use': False, 'message': 'Ошибка проверки промокода'}
+        logging.error(f"Failed to record results for {len(results)} outbox notifications: {e}")
+        return False
 
 
-def update_keys_status_by_expiry():
-    """
-    Обновляет статус всех ключей на основе реального времени истечения.
-    Вызывается для синхронизации статуса в БД с реальным временем.
-    """
+def purge_notification_outbox(days: int = 30) -> int:
+    """Удаляет доставленные и окончательно неотправленные записи outbox старше days дней."""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # БЕЗОПАСНАЯ ПРОВЕРКА: существует ли колонка status
-            if not _column_exists(cursor, 'vpn_keys', 'status'):
-                logger.warning("Column 'status' does not exist in vpn_keys table. Skipping status update.")
-                return 0
-            
-            # Получаем все ключи с их временем истечения
-            cursor.execute("""
-                SELECT key_id, expiry_date, is_trial, status 
-                FROM vpn_keys 
-                WHERE status IS NOT NULL
-            """)
-            
-            keys = cursor.fetchall()
-            current_time = datetime.now()
-            updated_count = 0
-            
-            for key_id, expiry_date_str, is_trial, current_status in keys:
-                try:
-                    expiry_date = _parse_db_datetime(expiry_date_str)
-                    # Убираем timezone info для корректного сравнения
-                    if expiry_date.tzinfo is not None:
-                        expiry_date = expiry_date.replace(tzinfo=None)
-                    
-                    # Определяем новый статус на основе времени истечения
-                    is_expired = expiry_date <= current_time
-                    
-                    if is_trial:
-                        new_status = 'trial-ended' if is_expired else 'trial-active'
-                    else:
-                        new_status = 'pay-ended' if is_expired else 'pay-active'
-                    
-                    # Обновляем только если статус изменился
-                    if new_status != current_status:
-                        cursor.execute(
-                            "UPDATE vpn_keys SET status = ? WHERE key_id = ?",
-                            (new_status, key_id)
-                        )
-                        updated_count += 1
-                        logging.debug(f"Updated key {key_id} status from {current_status} to {new_status}")
-                        
-                except Exception as e:
-                    logging.error(f"Error processing key {key_id}: {e}")
-                    continue
-            
-            conn.commit()
-            if updated_count > 0:
-                logging.info(f"Updated status for {updated_count} keys based on expiry time")
-            
-            return updated_count
-            
+            cursor.execute(
+                "DELETE FROM notification_outbox WHERE status IN ('sent', 'failed', 'skipped') AND created_at < datetime('now', ?)",
+                (f"-{int(days)} days",)
+            )
+            return cursor.rowcount
     except sqlite3.Error as e:
-        logging.error(f"Database error while updating keys status: {e}")
+        logging.error(f"Failed to purge notification outbox: {e}")
         return 0
 
 
+def get_queue_depths() -> dict[str, int]:
+    """Глубина фоновых очередей для /metrics: неотправленные уведомления outbox,
+    активные записи автопродления и идущие рассылки (один запрос по индексам status)."""
+    try:
+        with _get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM notification_outbox WHERE status = 'pending'),
+                    (SELECT COUNT(*) FROM renewal_queue WHERE status IN (?, ?)),
+                    (SELECT COUNT(*) FROM broadcasts WHERE status = 'running')
+                """,
+                RENEWAL_ACTIVE_STATUSES
+            )
+            outbox, renewals, broadcasts = cursor.fetchone()
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get queue depths: {e}")
+        return {}
+    return {'notification_outbox': outbox, 'renewal_queue': renewals, 'broadcasts': broadcasts}
+
+
 # ============================================
 # Функции для работы с видеоинструкциями
 # ============================================
@@ -9603,7 +11360,7 @@ def update_keys_status_by_expiry():
 def get_all_video_instructions():
     """Получает список всех видеоинструкций"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute("""
@@ -9622,7 +11379,7 @@ def get_all_video_instructions():
 def get_video_instruction_by_id(video_id: int):
     """Получает видеоинструкцию по ID"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute("""
@@ -9641,7 +11398,7 @@ def get_video_instruction_by_id(video_id: int):
 def create_video_instruction(title: str, filename: str, poster_filename: str = None, file_size_mb: float = None):
     """Создает новую видеоинструкцию"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO video_instructions (title, filename, poster_filename, file_size_mb) 
@@ -9660,7 +11417,7 @@ def update_video_instruction(video_id: int, title: str = None, filename: str = N
                              poster_filename: str = None, file_size_mb: float = None):
     """Обновляет видеоинструкцию"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Строим запрос динамически, обновляя только переданные поля
@@ -9698,7 +11455,7 @@ def update_video_instruction(video_id: int, title: str = None, filename: str = N
 def delete_video_instruction(video_id: int):
     """Удаляет видеоинструкцию"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM video_instructions WHERE video_id = ?", (video_id,))
             conn.commit()
@@ -9712,7 +11469,7 @@ def delete_video_instruction(video_id: int):
 def video_instruction_exists(filename: str):
     """Проверяет, существует ли видеоинструкция с таким filename"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM video_instructions WHERE filename = ?", (filename,))
             count = cursor.fetchone()[0]
@@ -9790,7 +11547,7 @@ def has_any_instructions_enabled() -> bool:
 def get_all_user_groups() -> list[dict]:
     """Получить все группы пользователей с количеством пользователей в каждой группе"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -9823,7 +11580,7 @@ def get_all_user_groups() -> list[dict]:
 def get_user_group(group_id: int) -> dict | None:
     """Получить группу пользователей по ID"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -9842,7 +11599,7 @@ def get_user_group(group_id: int) -> dict | None:
 def create_user_group(group_name: str, group_description: str = None, group_code: str = None) -> int | None:
     """Создать новую группу пользователей"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Если group_code не указан, генерируем его из group_name
@@ -9881,7 +11638,7 @@ def update_user_group(group_id: int, group_name: str, group_description: str = N
     """Обновить группу пользователей"""
     try:
         logging.info(f"DEBUG: update_user_group called: group_id={group_id}, group_name={group_name}, group_code={group_code}")
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Если group_code не указан (None) или пустая строка, генерируем его из group_name
@@ -9937,7 +11694,7 @@ def update_user_group(group_id: int, group_name: str, group_description: str = N
 def delete_user_group(group_id: int) -> tuple[bool, int]:
     """Удалить группу пользователей. Возвращает (успех, количество_пользователей_переназначенных)"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Проверяем, что группа не является группой по умолчанию
@@ -9982,7 +11739,7 @@ def delete_user_group(group_id: int) -> tuple[bool, int]:
 def get_user_group_by_name(group_name: str) -> dict | None:
     """Получить группу пользователей по названию"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -9997,7 +11754,7 @@ def get_user_group_by_name(group_name: str) -> dict | None:
 def get_user_group_by_code(group_code: str) -> dict | None:
     """Получить группу пользователей по коду"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -10012,7 +11769,7 @@ def get_user_group_by_code(group_code: str) -> dict | None:
 def get_default_user_group() -> dict | None:
     """Получить группу пользователей по умолчанию"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -10027,7 +11784,7 @@ def get_default_user_group() -> dict | None:
 def update_user_group_assignment(telegram_id: int, group_id: int) -> bool:
     """Назначить пользователя в группу"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Проверяем, что группа существует
@@ -10055,7 +11812,7 @@ def update_user_group_assignment(telegram_id: int, group_id: int) -> bool:
 def get_user_group_info(telegram_id: int) -> dict | None:
     """Получить информацию о группе пользователя"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -10076,7 +11833,7 @@ def get_user_group_info(telegram_id: int) -> dict | None:
 def get_users_in_group(group_id: int) -> list[dict]:
     """Получить всех пользователей в группе"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -10097,7 +11854,7 @@ def get_users_in_group(group_id: int) -> list[dict]:
 def get_groups_statistics() -> dict:
     """Получить статистику по группам пользователей"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Общее количество групп
@@ -10132,7 +11889,7 @@ def get_groups_statistics() -> dict:
 def assign_user_to_group_by_code(telegram_id: int, group_code: str) -> bool:
     """Назначить пользователя в группу по коду группы"""
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection() as conn:
             cursor = conn.cursor()
             
             # Находим группу по коду
@@ -11,17 +11,41 @@ from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 import uuid
 import json
+import threading
+import time
+from contextlib import asynccontextmanager
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
 
 from shop_bot.bot_controller import BotController
 from shop_bot.data_manager import database
 from shop_bot.modules import xui_api
 from shop_bot.bot import keyboards
 from shop_bot.utils.datetime_utils import ensure_utc_datetime, format_datetime_for_user
+from shop_bot.utils.performance_monitor import get_performance_monitor
 
 CHECK_INTERVAL_SECONDS = 300
+# Сколько панелей синхронизируется одновременно в sync_keys_with_panels
+SYNC_MAX_CONCURRENT_HOSTS = 4
+# Автопродление: сколько ключей продлевается одновременно, из них на одной панели,
+# и сколько записей очереди берётся за цикл
+AUTO_RENEWAL_CONCURRENCY = 10
+AUTO_RENEWAL_PER_HOST_CONCURRENCY = 3
+AUTO_RENEWAL_BATCH_SIZE = 500
+# Экспоненциальная задержка для записей, которые нельзя оплатить сейчас
+# (нет денег на балансе или тариф недоступен)
+AUTO_RENEWAL_RETRY_BASE_SECONDS = 300
+AUTO_RENEWAL_RETRY_MAX_SECONDS = 3600
+# Доставка уведомлений из outbox: параллельность, размер пачки, период опроса
+# и экспоненциальная задержка повтора после временной ошибки
+OUTBOX_CONCURRENCY = 8
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_INTERVAL_SECONDS = 5
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 3600
 NOTIFY_BEFORE_HOURS = {24, 1}
 MANUAL_NOTIFICATION_TEMPLATES: dict[str, dict] = {
     "subscription_expiry": {
@@ -82,11 +106,15 @@ MANUAL_NOTIFICATION_TEMPLATES: dict[str, dict] = {
     },
 }
 notified_users = {}
+# Отчёт последней синхронизации с панелями (тайминги и счётчики по хостам)
+last_sync_report: dict = {}
 
 logger = logging.getLogger(__name__)
 
 # Путь к лог-файлу удалённых orphan клиентов
 ORPHAN_DELETION_LOG = database.PROJECT_ROOT / "logs" / "orphan_deletions.log"
+# Хосты синхронизируются в параллельных потоках — запись в лог сериализуем
+_orphan_log_lock = threading.Lock()
 
 
 def _format_datetime_for_user(user_id: int, dt_utc: datetime) -> str:
@@ -122,7 +150,7 @@ def log_orphan_deletion(host_name: str, client_email: str, client_id: str, expir
         }
         
         # Записываем в файл
-        with open(ORPHAN_DELETION_LOG, 'a', encoding='utf-8') as f:
+        with _orphan_log_lock, open(ORPHAN_DELETION_LOG, 'a', encoding='utf-8') as f:
             f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
             
     except Exception as e:
@@ -205,6 +233,125 @@ def format_time_left(hours: int) -> str:
         else:
             return f"{hours} часов"
 
+def _key_descriptor(user_id: int, key_id: int) -> tuple[int, str]:
+    """Порядковый номер ключа у пользователя и имя его сервера."""
+    try:
+        from shop_bot.data_manager.database import get_user_keys, get_key_by_id
+        key_data = get_key_by_id(key_id) or {}
+        host_name = key_data.get('host_name', 'Неизвестный сервер')
+        # Определяем порядковый номер ключа среди ключей пользователя
+        user_keys = get_user_keys(user_id) or []
+        key_number = next((i + 1 for i, k in enumerate(user_keys) if k.get('key_id') == key_id), 0)
+    except Exception:
+        host_name = 'Неизвестный сервер'
+        key_number = 0
+    return key_number, host_name
+
+
+def _prepare_subscription_notification(user_id: int, key_id: int, time_left_hours: int, expiry_date: datetime) -> dict | None:
+    """Формирует уведомление об окончании подписки (None — уведомление не нужно)."""
+    # Дополнительная проверка: не отправляем уведомления, если время истекло
+    # Используем UTC для сравнения, т.к. expiry_date хранится в UTC
+    current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+    if expiry_date <= current_time_utc:
+        logger.warning(f"Attempted to send expiry notification for already expired key {key_id} (user {user_id}). Skipping.")
+        return None
+
+    # Проверяем, что time_left_hours соответствует реальному времени до истечения
+    actual_time_left = expiry_date - current_time_utc
+    # Исправлено: проверяем секунды, а не часы, чтобы разрешить уведомления для ключей с остатком < 1 часа
+    if time_left_hours <= 0 or actual_time_left.total_seconds() <= 0:
+        logger.warning(f"Invalid time_left_hours ({time_left_hours}) or actual_time_left ({actual_time_left.total_seconds():.0f}s) for key {key_id}. Skipping notification.")
+        return None
+
+    time_text = format_time_left(time_left_hours)
+    expiry_str = _format_datetime_for_user(user_id, expiry_date)
+
+    # Получаем номер ключа для пользователя и имя сервера
+    key_number, host_name = _key_descriptor(user_id, key_id)
+    key_descriptor = f"#{key_number} ({host_name})" if key_number > 0 else f"({host_name})"
+
+    # Баланс пользователя
+    try:
+        from shop_bot.data_manager.database import get_user_balance
+        balance_val = float(get_user_balance(user_id) or 0.0)
+    except Exception:
+        balance_val = 0.0
+    balance_str = f"{balance_val:.2f} RUB"
+
+    if time_left_hours == 1:
+        expiry_line = f"Срок действия вашего ключа {key_descriptor} истекает в течение 1 часа.\n"
+    else:
+        expiry_line = f"Срок действия вашего ключа {key_descriptor} истекает через **{time_text}**.\n"
+
+    message = (
+        f"⚠️ **Внимание!** ⚠️\n\n"
+        f"{expiry_line}"
+        f"📅 Дата окончания: **{expiry_str}**\n"
+        f"💰 Ваш баланс : **{balance_str}**\n\n"
+        f"Пополните счет, чтобы произошло автоматическое списание с баланса или продлите подписку прямо сейчас, чтобы не остаться без доступа к VPN!"
+    )
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Продлить ключ", callback_data=f"extend_key_{key_id}")
+    builder.button(text="💰 Пополнить баланс", callback_data="topup_root")
+    builder.adjust(2)
+
+    return {
+        'user_id': user_id,
+        'key_id': key_id,
+        'marker_hours': time_left_hours,
+        'notif_type': 'subscription_expiry',
+        'title': f'Окончание подписки (через {time_text})',
+        'message': message,
+        'meta': {
+            'key_id': key_id,
+            'expiry_at': expiry_str,
+            'time_left_hours': time_left_hours,
+            'key_number': key_number,
+            'host_name': host_name
+        },
+        'reply_markup': builder.as_markup(),
+        'parse_mode': 'Markdown',
+    }
+
+
+async def _log_and_send_notification(bot: Bot, notification: dict, status: str = 'sent') -> bool:
+    """Записывает уведомление в БД и сразу отправляет его пользователю.
+
+    Запись делается до отправки, чтобы предотвратить дублирование; если записать
+    не удалось, сообщение не отправляется.
+    """
+    user_id = notification['user_id']
+    try:
+        from shop_bot.data_manager.database import log_notification, get_user
+        user = get_user(user_id)
+        notification_id = log_notification(
+            user_id=user_id,
+            username=(user or {}).get('username'),
+            notif_type=notification['notif_type'],
+            title=notification['title'],
+            message=notification['message'],
+            status=status,
+            meta=notification['meta'],
+            key_id=notification['key_id'],
+            marker_hours=notification['marker_hours']
+        )
+        # Проверяем, что логирование прошло успешно (возвращает ID > 0)
+        if notification_id == 0:
+            logger.warning(f"Failed to log {notification['notif_type']} for user {user_id}: log_notification returned 0")
+            return False
+    except Exception as le:
+        logger.warning(f"Failed to log {notification['notif_type']} for user {user_id}: {le}")
+        return False
+
+    send_kwargs = {'chat_id': user_id, 'text': notification['message'], 'reply_markup': notification['reply_markup']}
+    if notification.get('parse_mode'):
+        send_kwargs['parse_mode'] = notification['parse_mode']
+    await bot.send_message(**send_kwargs)
+    return True
+
+
 async def send_subscription_notification(
     bot: Bot,
     user_id: int,
@@ -214,97 +361,9 @@ async def send_subscription_notification(
     status: str = 'sent',
 ):
     try:
-        # Дополнительная проверка: не отправляем уведомления, если время истекло
-        # Используем UTC для сравнения, т.к. expiry_date хранится в UTC
-        current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
-        if expiry_date <= current_time_utc:
-            logger.warning(f"Attempted to send expiry notification for already expired key {key_id} (user {user_id}). Skipping.")
-            return
-        
-        # Проверяем, что time_left_hours соответствует реальному времени до истечения
-        actual_time_left = expiry_date - current_time_utc
-        actual_hours_left = int(actual_time_left.total_seconds() / 3600)
-        # Исправлено: проверяем секунды, а не часы, чтобы разрешить уведомления для ключей с остатком < 1 часа
-        if time_left_hours <= 0 or actual_time_left.total_seconds() <= 0:
-            logger.warning(f"Invalid time_left_hours ({time_left_hours}) or actual_time_left ({actual_time_left.total_seconds():.0f}s) for key {key_id}. Skipping notification.")
-            return
-        
-        time_text = format_time_left(time_left_hours)
-        expiry_str = _format_datetime_for_user(user_id, expiry_date)
-
-        # Получаем номер ключа для пользователя и имя сервера
-        try:
-            from shop_bot.data_manager.database import get_user_keys, get_key_by_id
-            key_data = get_key_by_id(key_id) or {}
-            host_name = key_data.get('host_name', 'Неизвестный сервер')
-            # Определяем порядковый номер ключа среди ключей пользователя
-            user_keys = get_user_keys(user_id) or []
-            key_number = next((i + 1 for i, k in enumerate(user_keys) if k.get('key_id') == key_id), 0)
-        except Exception:
-            host_name = 'Неизвестный сервер'
-            key_number = 0
-
-        key_descriptor = f"#{key_number} ({host_name})" if key_number > 0 else f"({host_name})"
-
-        # Баланс пользователя
-        try:
-            from shop_bot.data_manager.database import get_user_balance
-            balance_val = float(get_user_balance(user_id) or 0.0)
-        except Exception:
-            balance_val = 0.0
-        balance_str = f"{balance_val:.2f} RUB"
-
-        if time_left_hours == 1:
-            expiry_line = f"Срок действия вашего ключа {key_descriptor} истекает в течение 1 часа.\n"
-        else:
-            expiry_line = f"Срок действия вашего ключа {key_descriptor} истекает через **{time_text}**.\n"
-
-        message = (
-            f"⚠️ **Внимание!** ⚠️\n\n"
-            f"{expiry_line}"
-            f"📅 Дата окончания: **{expiry_str}**\n"
-            f"💰 Ваш баланс : **{balance_str}**\n\n"
-            f"Пополните счет, чтобы произошло автоматическое списание с баланса или продлите подписку прямо сейчас, чтобы не остаться без доступа к VPN!"
-        )
-
-        builder = InlineKeyboardBuilder()
-        builder.button(text="🔄 Продлить ключ", callback_data=f"extend_key_{key_id}")
-        builder.button(text="💰 Пополнить баланс", callback_data="topup_root")
-        builder.adjust(2)
-
-        # Сначала логируем уведомление в БД, чтобы предотвратить дублирование
-        try:
-            from shop_bot.data_manager.database import log_notification, get_user
-            user = get_user(user_id)
-            notification_id = log_notification(
-                user_id=user_id,
-                username=(user or {}).get('username'),
-                notif_type='subscription_expiry',
-                title=f'Окончание подписки (через {time_text})',
-                message=message,
-                status=status,
-                meta={
-                    'key_id': key_id,
-                    'expiry_at': expiry_str,
-                    'time_left_hours': time_left_hours,
-                    'key_number': key_number,
-                    'host_name': host_name
-                },
-                key_id=key_id,
-                marker_hours=time_left_hours
-            )
-            # Проверяем, что логирование прошло успешно (возвращает ID > 0)
-            if notification_id == 0:
-                logger.warning(f"Failed to log notification for user {user_id}: log_notification returned 0")
-                return  # Не отправляем сообщение, если не удалось записать в БД
-        except Exception as le:
-            logger.warning(f"Failed to log notification for user {user_id}: {le}")
-            return  # Не отправляем сообщение, если не удалось записать в БД
-
-        # Теперь отправляем сообщение
-        await bot.send_message(chat_id=user_id, text=message, reply_markup=builder.as_markup(), parse_mode='Markdown')
-        logger.info(f"Sent subscription notification to user {user_id} for key {key_id} ({time_left_hours} hours left).")
-        
+        notification = _prepare_subscription_notification(user_id, key_id, time_left_hours, expiry_date)
+        if notification and await _log_and_send_notification(bot, notification, status):
+            logger.info(f"Sent subscription notification to user {user_id} for key {key_id} ({time_left_hours} hours left).")
     except Exception as e:
         logger.error(f"Error sending subscription notification to user {user_id}: {e}")
 
@@ -341,12 +400,6 @@ def _marker_logged(user_id: int, key_id: int, marker_hours: int, notif_type: str
         import sqlite3
         with _get_db_connection() as conn:
             cursor = conn.cursor()
-            # Устанавливаем PRAGMA настройки для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except Exception:
-                pass
             
             # БЕЗОПАСНАЯ ПРОВЕРКА: существует ли колонка key_id
             cursor.execute("PRAGMA table_info(notifications)")
@@ -373,12 +426,6 @@ def cleanup_duplicate_notifications():
         with _get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Устанавливаем PRAGMA настройки для предотвращения блокировок
-            try:
-                cursor.execute("PRAGMA busy_timeout=30000")
-                cursor.execute("PRAGMA journal_mode=DELETE")
-            except Exception:
-                pass
             
             # БЕЗОПАСНАЯ ПРОВЕРКА: существуют ли колонки key_id и marker_hours
             cursor.execute("PRAGMA table_info(notifications)")
@@ -421,6 +468,56 @@ def cleanup_duplicate_notifications():
     except Exception as e:
         logger.error(f"Failed to cleanup duplicate notifications: {e}")
 
+def _prepare_plan_unavailable_notice(user_id: int, key_id: int, time_left_hours: int, expiry_date: datetime) -> dict | None:
+    """Формирует уведомление о недоступности тарифа для автопродления."""
+    # Проверяем, что время не истекло
+    current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+    if expiry_date <= current_time_utc:
+        logger.warning(f"Attempted to send plan unavailable notice for already expired key {key_id} (user {user_id}). Skipping.")
+        return None
+
+    time_text = format_time_left(time_left_hours)
+    expiry_str = _format_datetime_for_user(user_id, expiry_date)
+
+    # Получаем номер ключа и имя сервера
+    key_number, host_name = _key_descriptor(user_id, key_id)
+    key_label = f"#{key_number}" if key_number > 0 else f"ID {key_id}"
+
+    message = (
+        "⚠️ Внимание! ⚠️\n\n"
+        "Ваш тариф больше не доступен для автопродления.\n\n"
+        f"Ключ {key_label} ({host_name}) истекает через {time_text}.\n\n"
+        f"📅 Окончание: {expiry_str}\n\n"
+        "Пожалуйста, выберите новый тариф до истечения срока.\n\n"
+        "Для продления перейдите в меню: 🛒 Купить → 🔄 Продлить ключ и выберите другой тариф"
+    )
+
+    keyboard_builder = InlineKeyboardBuilder()
+    keyboard_builder.button(text="🛒 Купить новый VPN", callback_data="buy_new_vpn")
+    keyboard_builder.button(text="🔄 Продлить VPN", callback_data=f"extend_key_{key_id}")
+    keyboard_builder.button(text="🔑 Перейти к ключу", callback_data=f"show_key_{key_id}")
+    keyboard_builder.button(text="⬅️ Назад в меню", callback_data="back_to_main_menu")
+    keyboard_builder.adjust(2, 1, 1)
+
+    return {
+        'user_id': user_id,
+        'key_id': key_id,
+        'marker_hours': time_left_hours,
+        'notif_type': 'subscription_plan_unavailable',
+        'title': f'Тариф недоступен (через {time_text})',
+        'message': message,
+        'meta': {
+            'key_id': key_id,
+            'expiry_at': expiry_str,
+            'time_left_hours': time_left_hours,
+            'key_number': key_number,
+            'host_name': host_name
+        },
+        'reply_markup': keyboard_builder.as_markup(),
+        'parse_mode': None,
+    }
+
+
 async def send_plan_unavailable_notice(
     bot: Bot,
     user_id: int,
@@ -436,84 +533,102 @@ async def send_plan_unavailable_notice(
         if not force and _marker_logged(user_id, key_id, time_left_hours, 'subscription_plan_unavailable'):
             logger.debug(f"Plan unavailable notice already sent for user {user_id}, key {key_id}, marker {time_left_hours}h. Skipping.")
             return
-        
-        # Проверяем, что время не истекло
-        current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
-        if expiry_date <= current_time_utc:
-            logger.warning(f"Attempted to send plan unavailable notice for already expired key {key_id} (user {user_id}). Skipping.")
-            return
-        
-        time_text = format_time_left(time_left_hours)
-        expiry_str = _format_datetime_for_user(user_id, expiry_date)
 
-        # Получаем номер ключа и имя сервера
-        try:
-            from shop_bot.data_manager.database import get_user_keys, get_key_by_id
-            key_data = get_key_by_id(key_id) or {}
-            host_name = key_data.get('host_name', 'Неизвестный сервер')
-            user_keys = get_user_keys(user_id) or []
-            key_number = next((i + 1 for i, k in enumerate(user_keys) if k.get('key_id') == key_id), 0)
-        except Exception:
-            host_name = 'Неизвестный сервер'
-            key_number = 0
-
-        key_label = f"#{key_number}" if key_number > 0 else f"ID {key_id}"
-
-        message = (
-            "⚠️ Внимание! ⚠️\n\n"
-            "Ваш тариф больше не доступен для автопродления.\n\n"
-            f"Ключ {key_label} ({host_name}) истекает через {time_text}.\n\n"
-            f"📅 Окончание: {expiry_str}\n\n"
-            "Пожалуйста, выберите новый тариф до истечения срока.\n\n"
-            "Для продления перейдите в меню: 🛒 Купить → 🔄 Продлить ключ и выберите другой тариф"
-        )
+        notification = _prepare_plan_unavailable_notice(user_id, key_id, time_left_hours, expiry_date)
+        if notification and await _log_and_send_notification(bot, notification, status if status else 'sent'):
+            logger.info(f"Sent plan unavailable notice to user {user_id} for key {key_id}, time_left={time_left_hours}h")
+    except Exception as e:
+        logger.error(f"Failed to send plan unavailable notice to user {user_id} for key {key_id}: {e}", exc_info=True)
 
-        keyboard_builder = InlineKeyboardBuilder()
-        keyboard_builder.button(text="🛒 Купить новый VPN", callback_data="buy_new_vpn")
-        keyboard_builder.button(text="🔄 Продлить VPN", callback_data=f"extend_key_{key_id}")
-        keyboard_builder.button(text="🔑 Перейти к ключу", callback_data=f"show_key_{key_id}")
-        keyboard_builder.button(text="⬅️ Назад в меню", callback_data="back_to_main_menu")
-        keyboard_builder.adjust(2, 1, 1)
 
-        # Сначала логируем уведомление в БД, чтобы предотвратить дублирование
-        try:
-            from shop_bot.data_manager.database import log_notification, get_user
-            user = get_user(user_id)
-            notification_id = log_notification(
-                user_id=user_id,
-                username=(user or {}).get('username'),
-                notif_type='subscription_plan_unavailable',
-                title=f'Тариф недоступен (через {time_text})',
-                message=message,
-                status=status if status else 'sent',
-                meta={
-                    'key_id': key_id,
-                    'expiry_at': expiry_str,
-                    'time_left_hours': time_left_hours,
-                    'key_number': key_number,
-                    'host_name': host_name
-                },
-                key_id=key_id,
-                marker_hours=time_left_hours
-            )
-            # Проверяем, что логирование прошло успешно (возвращает ID > 0)
-            if notification_id == 0:
-                logger.warning(f"Failed to log plan unavailable notification: log_notification returned 0")
-                return  # Не отправляем сообщение, если не удалось записать в БД
-        except Exception as e:
-            logger.warning(f"Failed to log plan unavailable notification: {e}")
-            return  # Не отправляем сообщение, если не удалось записать в БД
+def _prepare_autorenew_balance_notice(
+    user_id: int,
+    key_id: int,
+    time_left_hours: int,
+    expiry_date: datetime,
+    balance_val: float,
+) -> dict | None:
+    """Формирует уведомление о предстоящем автопродлении с баланса."""
+    from shop_bot.data_manager.database import get_key_auto_renewal_enabled, get_key_by_id
+    # Проверяем, включено ли автопродление для ключа
+    if not get_key_auto_renewal_enabled(key_id):
+        logger.debug(f"Skipping autorenew balance notice for key {key_id}: key auto-renewal is disabled")
+        return None
+    # Дополнительная проверка: не отправляем уведомления, если время истекло
+    # Используем UTC для сравнения, т.к. expiry_date хранится в UTC
+    current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+    if expiry_date <= current_time_utc:
+        logger.warning(f"Attempted to send autorenew notice for already expired key {key_id} (user {user_id}). Skipping.")
+        return None
+
+    # Проверяем, что time_left_hours соответствует реальному времени до истечения
+    actual_time_left = expiry_date - current_time_utc
+    # Исправлено: проверяем секунды, а не часы, чтобы разрешить уведомления для ключей с остатком < 1 часа
+    if time_left_hours <= 0 or actual_time_left.total_seconds() <= 0:
+        logger.warning(f"Invalid time_left_hours ({time_left_hours}) or actual_time_left ({actual_time_left.total_seconds():.0f}s) for autorenew notice key {key_id}. Skipping notification.")
+        return None
+
+    time_text = format_time_left(time_left_hours)
+    expiry_str = _format_datetime_for_user(user_id, expiry_date)
+    expiry_date_only = expiry_str.split(' в ')[0] if ' в ' in expiry_str else expiry_str
+
+    # Получаем номер ключа и имя сервера
+    key_number, host_name = _key_descriptor(user_id, key_id)
+    try:
+        key_data = get_key_by_id(key_id) or {}
+    except Exception:
+        key_data = {}
 
-        # Теперь отправляем сообщение
-        await bot.send_message(
-            chat_id=user_id,
-            text=message,
-            reply_markup=keyboard_builder.as_markup()
-        )
+    balance_str = f"{float(balance_val or 0):.2f} RUB"
 
-        logger.info(f"Sent plan unavailable notice to user {user_id} for key {key_id}, time_left={time_left_hours}h")
-    except Exception as e:
-        logger.error(f"Failed to send plan unavailable notice to user {user_id} for key {key_id}: {e}", exc_info=True)
+    # Определяем сумму тарифа для продления
+    try:
+        _, price_to_renew, _, _, _ = _get_plan_info_for_key(key_data)
+    except Exception:
+        price_to_renew = float(key_data.get('price') or 0.0)
+    price_str = f"{float(price_to_renew or 0):.2f} RUB"
+
+    time_phrase = "в течении" if time_left_hours == 1 else "через"
+    time_text_for_message = "1 часа" if time_left_hours == 1 else time_text
+
+    key_label = f"#{key_number}" if key_number > 0 else f"ID {key_id}"
+
+    message = (
+        "❕ Информация о ключе ❔\n\n"
+        f"Срок действия ключа #{key_number} ({host_name}) истекает {time_phrase} {time_text_for_message}.\n"
+        f"📅 Окончание: {expiry_str}\n"
+        f"💰 Баланс: {balance_str}\n\n"
+        f"🔄 Если \"Автопродление с баланса\" включено, то услуга продлится автоматически, сумма {price_str} будет списана с вашего баланса.\n\n"
+        "❤️ Спасибо, что остаётесь с нами!"
+    )
+
+    keyboard_builder = InlineKeyboardBuilder()
+    keyboard_builder.button(
+        text=f"🔑 Ключ {key_label} ({host_name}) до {expiry_date_only}",
+        callback_data=f"show_key_{key_id}"
+    )
+    keyboard_builder.button(text="⬅️ Назад в меню", callback_data="back_to_main_menu")
+    keyboard_builder.adjust(1)
+
+    return {
+        'user_id': user_id,
+        'key_id': key_id,
+        'marker_hours': time_left_hours,
+        'notif_type': 'subscription_autorenew_notice',
+        'title': f'Автопродление (через {time_text})',
+        'message': message,
+        'meta': {
+            'key_id': key_id,
+            'expiry_at': expiry_str,
+            'time_left_hours': time_left_hours,
+            'key_number': key_number,
+            'host_name': host_name,
+            'balance': balance_str,
+            'price': price_str
+        },
+        'reply_markup': keyboard_builder.as_markup(),
+        'parse_mode': None,
+    }
 
 
 async def send_autorenew_balance_notice(
@@ -526,111 +641,9 @@ async def send_autorenew_balance_notice(
     status: str = 'sent',
 ):
     try:
-        from datetime import timezone, timedelta
-        from shop_bot.data_manager.database import get_key_auto_renewal_enabled
-        # Проверяем, включено ли автопродление для ключа
-        if not get_key_auto_renewal_enabled(key_id):
-            logger.debug(f"Skipping autorenew balance notice for key {key_id}: key auto-renewal is disabled")
-            return
-        # Дополнительная проверка: не отправляем уведомления, если время истекло
-        # Используем UTC для сравнения, т.к. expiry_date хранится в UTC
-        current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
-        if expiry_date <= current_time_utc:
-            logger.warning(f"Attempted to send autorenew notice for already expired key {key_id} (user {user_id}). Skipping.")
-            return
-        
-        # Проверяем, что time_left_hours соответствует реальному времени до истечения
-        actual_time_left = expiry_date - current_time_utc
-        actual_hours_left = int(actual_time_left.total_seconds() / 3600)
-        # Исправлено: проверяем секунды, а не часы, чтобы разрешить уведомления для ключей с остатком < 1 часа
-        if time_left_hours <= 0 or actual_time_left.total_seconds() <= 0:
-            logger.warning(f"Invalid time_left_hours ({time_left_hours}) or actual_time_left ({actual_time_left.total_seconds():.0f}s) for autorenew notice key {key_id}. Skipping notification.")
-            return
-        
-        time_text = format_time_left(time_left_hours)
-        expiry_str = _format_datetime_for_user(user_id, expiry_date)
-        expiry_date_only = expiry_str.split(' в ')[0] if ' в ' in expiry_str else expiry_str
-
-        # Получаем номер ключа и имя сервера
-        try:
-            from shop_bot.data_manager.database import get_user_keys, get_key_by_id
-            key_data = get_key_by_id(key_id) or {}
-            host_name = key_data.get('host_name', 'Неизвестный сервер')
-            user_keys = get_user_keys(user_id) or []
-            key_number = next((i + 1 for i, k in enumerate(user_keys) if k.get('key_id') == key_id), 0)
-        except Exception:
-            host_name = 'Неизвестный сервер'
-            key_number = 0
-
-        balance_str = f"{float(balance_val or 0):.2f} RUB"
-
-        # Определяем сумму тарифа для продления
-        try:
-            _, price_to_renew, _, _, _ = _get_plan_info_for_key(key_data)
-        except Exception:
-            price_to_renew = float(key_data.get('price') or 0.0)
-        price_str = f"{float(price_to_renew or 0):.2f} RUB"
-
-        time_phrase = "в течении" if time_left_hours == 1 else "через"
-        time_text_for_message = "1 часа" if time_left_hours == 1 else time_text
-
-        key_label = f"#{key_number}" if key_number > 0 else f"ID {key_id}"
-
-        message = (
-            "❕ Информация о ключе ❔\n\n"
-            f"Срок действия ключа #{key_number} ({host_name}) истекает {time_phrase} {time_text_for_message}.\n"
-            f"📅 Окончание: {expiry_str}\n"
-            f"💰 Баланс: {balance_str}\n\n"
-            f"🔄 Если \"Автопродление с баланса\" включено, то услуга продлится автоматически, сумма {price_str} будет списана с вашего баланса.\n\n"
-            "❤️ Спасибо, что остаётесь с нами!"
-        )
-
-        keyboard_builder = InlineKeyboardBuilder()
-        keyboard_builder.button(
-            text=f"🔑 Ключ {key_label} ({host_name}) до {expiry_date_only}",
-            callback_data=f"show_key_{key_id}"
-        )
-        keyboard_builder.button(text="⬅️ Назад в меню", callback_data="back_to_main_menu")
-        keyboard_builder.adjust(1)
-
-        # Сначала логируем уведомление в БД, чтобы предотвратить дублирование
-        try:
-            from shop_bot.data_manager.database import log_notification, get_user
-            user = get_user(user_id)
-            notification_id = log_notification(
-                user_id=user_id,
-                username=(user or {}).get('username'),
-                notif_type='subscription_autorenew_notice',
-                title=f'Автопродление (через {time_text})',
-                message=message,
-                status=status,
-                meta={
-                    'key_id': key_id,
-                    'expiry_at': expiry_str,
-                    'time_left_hours': time_left_hours,
-                    'key_number': key_number,
-                    'host_name': host_name,
-                    'balance': balance_str,
-                    'price': price_str
-                },
-                key_id=key_id,
-                marker_hours=time_left_hours
-            )
-            # Проверяем, что логирование прошло успешно (возвращает ID > 0)
-            if notification_id == 0:
-                logger.warning(f"Failed to log autorenew notice for user {user_id}: log_notification returned 0")
-                return  # Не отправляем сообщение, если не удалось записать в БД
-        except Exception as le:
-            logger.warning(f"Failed to log autorenew notice for user {user_id}: {le}")
-            return  # Не отправляем сообщение, если не удалось записать в БД
-
-        # Теперь отправляем сообщение
-        await bot.send_message(
-            chat_id=user_id,
-            text=message,
-            reply_markup=keyboard_builder.as_markup()
-        )
-        logger.info(f"Sent autorenew balance notice to user {user_id} for key {key_id} ({time_left_hours} hours left).")
+        notification = _prepare_autorenew_balance_notice(user_id, key_id, time_left_hours, expiry_date, balance_val)
+        if notification and await _log_and_send_notification(bot, notification, status):
+            logger.info(f"Sent autorenew balance notice to user {user_id} for key {key_id} ({time_left_hours} hours left).")
     except Exception as e:
         logger.error(f"Error sending autorenew notice to user {user_id}: {e}")
 
@@ -667,6 +680,73 @@ async def send_balance_deduction_notice(bot: Bot, user_id: int, key_id: int, amo
     except Exception as e:
         logger.error(f"Failed to send balance deduction notice to user {user_id}: {e}")
 
+def _prepare_autorenew_disabled_notice(
+    user_id: int,
+    key_id: int,
+    time_left_hours: int,
+    expiry_date: datetime,
+    balance_val: float,
+    price_to_renew: float,
+) -> dict | None:
+    """Формирует уведомление о том, что автопродление отключено, но баланс достаточен."""
+    from shop_bot.data_manager.database import get_key_auto_renewal_enabled, get_auto_renewal_enabled
+
+    # Проверяем, что время не истекло
+    current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+    if expiry_date <= current_time_utc:
+        logger.warning(f"Attempted to send autorenew disabled notice for already expired key {key_id} (user {user_id}). Skipping.")
+        return None
+
+    # Проверяем статус автопродления: если оба включены, не отправляем это уведомление
+    if get_auto_renewal_enabled(user_id) and get_key_auto_renewal_enabled(key_id):
+        logger.debug(f"Skipping autorenew disabled notice for key {key_id}: both global and key auto-renewal are enabled")
+        return None
+
+    time_text = format_time_left(time_left_hours)
+    expiry_str = _format_datetime_for_user(user_id, expiry_date)
+
+    # Получаем номер ключа и имя сервера
+    key_number, host_name = _key_descriptor(user_id, key_id)
+
+    balance_str = f"{float(balance_val or 0):.2f} RUB"
+    price_str = f"{float(price_to_renew or 0):.2f} RUB"
+
+    message = (
+        f"⚠️ Автопродление с баланса отключено.\n\n"
+        f"Ключ #{key_number} ({host_name}) истекает через {time_text}.\n"
+        f"📅 Окончание: {expiry_str}\n"
+        f"💰 Ваш баланс: {balance_str}\n"
+        f"💳 Сумма продления: {price_str}\n\n"
+        f"Ваш баланс достаточен для продления, но списание не произойдет автоматически.\n"
+        f"Включите автопродление в профиле, чтобы не остаться без доступа."
+    )
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⚙️ Настройки профиля", callback_data="show_profile")
+    builder.button(text="🔄 Продлить ключ", callback_data=f"extend_key_{key_id}")
+    builder.adjust(1)
+
+    return {
+        'user_id': user_id,
+        'key_id': key_id,
+        'marker_hours': time_left_hours,
+        'notif_type': 'subscription_autorenew_disabled',
+        'title': f'Автопродление отключено (через {time_text})',
+        'message': message,
+        'meta': {
+            'key_id': key_id,
+            'expiry_at': expiry_str,
+            'time_left_hours': time_left_hours,
+            'key_number': key_number,
+            'host_name': host_name,
+            'balance': balance_str,
+            'price': price_str
+        },
+        'reply_markup': builder.as_markup(),
+        'parse_mode': None,
+    }
+
+
 async def send_autorenew_disabled_notice(
     bot: Bot,
     user_id: int,
@@ -679,102 +759,30 @@ async def send_autorenew_disabled_notice(
 ):
     """Отправляет уведомление о том, что автопродление отключено, но баланс достаточен."""
     try:
-        from shop_bot.bot import keyboards
-        from shop_bot.data_manager.database import get_user_keys, get_key_by_id, get_key_auto_renewal_enabled, get_auto_renewal_enabled
-        
-        # Проверяем, что время не истекло
-        current_time_utc = datetime.now(timezone.utc).replace(tzinfo=None)
-        if expiry_date <= current_time_utc:
-            logger.warning(f"Attempted to send autorenew disabled notice for already expired key {key_id} (user {user_id}). Skipping.")
-            return
-        
-        # Проверяем статус автопродления: если оба включены, не отправляем это уведомление
-        if get_auto_renewal_enabled(user_id) and get_key_auto_renewal_enabled(key_id):
-            logger.debug(f"Skipping autorenew disabled notice for key {key_id}: both global and key auto-renewal are enabled")
-            return
-        
-        time_text = format_time_left(time_left_hours)
-        expiry_str = _format_datetime_for_user(user_id, expiry_date)
-
-        # Получаем номер ключа и имя сервера
-        try:
-            key_data = get_key_by_id(key_id) or {}
-            host_name = key_data.get('host_name', 'Неизвестный сервер')
-            user_keys = get_user_keys(user_id) or []
-            key_number = next((i + 1 for i, k in enumerate(user_keys) if k.get('key_id') == key_id), 0)
-        except Exception:
-            host_name = 'Неизвестный сервер'
-            key_number = 0
-
-        balance_str = f"{float(balance_val or 0):.2f} RUB"
-        price_str = f"{float(price_to_renew or 0):.2f} RUB"
-
-        message = (
-            f"⚠️ Автопродление с баланса отключено.\n\n"
-            f"Ключ #{key_number} ({host_name}) истекает через {time_text}.\n"
-            f"📅 Окончание: {expiry_str}\n"
-            f"💰 Ваш баланс: {balance_str}\n"
-            f"💳 Сумма продления: {price_str}\n\n"
-            f"Ваш баланс достаточен для продления, но списание не произойдет автоматически.\n"
-            f"Включите автопродление в профиле, чтобы не остаться без доступа."
+        notification = _prepare_autorenew_disabled_notice(
+            user_id, key_id, time_left_hours, expiry_date, balance_val, price_to_renew
         )
-
-        builder = InlineKeyboardBuilder()
-        builder.button(text="⚙️ Настройки профиля", callback_data="show_profile")
-        builder.button(text="🔄 Продлить ключ", callback_data=f"extend_key_{key_id}")
-        builder.adjust(1)
-
-        # Сначала логируем уведомление, чтобы избежать повторной отправки
-        try:
-            from shop_bot.data_manager.database import log_notification, get_user
-            user = get_user(user_id)
-            notification_id = log_notification(
-                user_id=user_id,
-                username=(user or {}).get('username'),
-                notif_type='subscription_autorenew_disabled',
-                title=f'Автопродление отключено (через {time_text})',
-                message=message,
-                status=status,
-                meta={
-                    'key_id': key_id,
-                    'expiry_at': expiry_str,
-                    'time_left_hours': time_left_hours,
-                    'key_number': key_number,
-                    'host_name': host_name,
-                    'balance': balance_str,
-                    'price': price_str
-                },
-                key_id=key_id,
-                marker_hours=time_left_hours
-            )
-            if notification_id == 0:
-                logger.warning(f"Failed to log autorenew disabled notice for user {user_id}: log_notification returned 0")
-                return
-        except Exception as le:
-            logger.warning(f"Failed to log autorenew disabled notice for user {user_id}: {le}")
-            return
-
-        await bot.send_message(
-            chat_id=user_id,
-            text=message,
-            reply_markup=builder.as_markup()
-        )
-        logger.info(f"Sent autorenew disabled notice to user {user_id} for key {key_id} ({time_left_hours} hours left).")
+        if notification and await _log_and_send_notification(bot, notification, status):
+            logger.info(f"Sent autorenew disabled notice to user {user_id} for key {key_id} ({time_left_hours} hours left).")
     except Exception as e:
         logger.error(f"Failed to send autorenew disabled notice to user {user_id}: {e}")
 
-def _get_plan_info_for_key(key: dict) -> tuple[dict | None, float, int, int | None, bool]:
+def _get_plan_info_for_key(key: dict, plans: list[dict] | None = None) -> tuple[dict | None, float, int, int | None, bool]:
     """Возвращает (plan_dict, price, months, plan_id, is_available) для ключа.
     
     is_available = True, если тариф найден и доступен для автопродления
     is_available = False, если тариф удален или скрыт (hidden_all, hidden_old)
+
+    plans — заранее загруженные тарифы хоста ключа (см. database.get_plans_by_hosts);
+    если не переданы, тарифы читаются из БД.
     """
     try:
         from shop_bot.data_manager.database import get_plans_for_host
         host_name = key.get('host_name')
         plan_name = key.get('plan_name')
         price_fallback = float(key.get('price') or 0.0)
-        plans = get_plans_for_host(host_name) if host_name else []
+        if plans is None:
+            plans = get_plans_for_host(host_name) if host_name else []
         matched = next((p for p in plans if (p.get('plan_name') == plan_name)), None)
         
         if matched:
@@ -790,317 +798,527 @@ def _get_plan_info_for_key(key: dict) -> tuple[dict | None, float, int, int | No
         logger.warning(f"Failed to resolve plan for key {key.get('key_id')}: {e}")
         return None, float(key.get('price') or 0.0), 0, None, False
 
-async def check_expiring_subscriptions(bot: Bot):
-    from datetime import timezone
-    logger.info("Scheduler: Checking for expiring subscriptions...")
-    # Используем UTC для проверки истечения, т.к. все даты в БД хранятся в UTC
-    current_time = datetime.now(timezone.utc).replace(tzinfo=None)
-    all_keys = database.get_all_keys()
-    
-    _cleanup_notified_users(all_keys)
-    
-    for key in all_keys:
+EXPIRY_NOTIFICATION_TYPES = (
+    'subscription_plan_unavailable',
+    'subscription_autorenew_notice',
+    'subscription_autorenew_disabled',
+    'subscription_expiry',
+)
+
+def _build_expiry_notification_plan(
+    keys: list[dict],
+    current_time: datetime,
+    plans_by_host: dict[str, list[dict]],
+    user_states: dict[int, dict],
+    logged_markers: set[tuple[int, int, int, str]],
+) -> list[dict]:
+    """Формирует план уведомлений об истечении за один проход по ключам.
+
+    Все данные (тарифы, балансы, флаги автопродления, уже отправленные маркеры)
+    передаются заранее загруженными, функция не обращается к БД.
+    Для каждого ключа выбирается наименьший подходящий маркер из NOTIFY_BEFORE_HOURS
+    и тип уведомления; ключи, по которым маркер уже записан, в план не попадают.
+    Возвращает список словарей с полями notif_type, key, user_id, key_id,
+    hours_mark, expiry_date, balance, price.
+    """
+    plan: list[dict] = []
+    for key in keys:
         try:
-            expiry_date = datetime.fromisoformat(key['expiry_date'])
-            # Убираем timezone info для совместимости
+            expiry_date = datetime.fromisoformat(str(key['expiry_date']))
             if expiry_date.tzinfo is not None:
-                expiry_date = expiry_date.replace(tzinfo=None)
-            time_left = expiry_date - current_time
+                expiry_date = expiry_date.astimezone(timezone.utc).replace(tzinfo=None)
+            total_seconds_left = int((expiry_date - current_time).total_seconds())
+            # Ключ уже истек - не отправляем уведомления об истечении
+            if total_seconds_left <= 0:
+                continue
 
-            if time_left.total_seconds() < 0:
+            # Ищем наименьший подходящий маркер (по возрастанию: 1, 24, ...)
+            hours_mark = next(
+                (mark for mark in sorted(NOTIFY_BEFORE_HOURS) if total_seconds_left <= mark * 3600),
+                None,
+            )
+            if hours_mark is None:
                 continue
 
-            total_hours_left = int(time_left.total_seconds() / 3600)
-            total_seconds_left = int(time_left.total_seconds())
             user_id = key['user_id']
             key_id = key['key_id']
+            _, price_to_renew, _, _, is_plan_available = _get_plan_info_for_key(
+                key, plans_by_host.get(key.get('host_name'), [])
+            )
+            user_state = user_states.get(user_id) or {}
+            user_balance = float(user_state.get('balance') or 0.0)
 
-            # Цена и длительность для продления, баланс пользователя, доступность тарифа
-            plan_info, price_to_renew, months_to_renew, plan_id, is_plan_available = _get_plan_info_for_key(key)
-            from shop_bot.data_manager.database import get_user_balance
-            user_balance = float(get_user_balance(user_id) or 0.0)
-
-            # Логируем информацию о ключе для отладки (только для ключей с остатком < 2 часов)
             if total_seconds_left < 7200:  # Меньше 2 часов
-                logger.info(f"Key {key_id} (user {user_id}): {total_seconds_left}s left ({total_hours_left}h), balance={user_balance}, price={price_to_renew}, plan_available={is_plan_available}")
-
-            # Catch-up: решаем, что отправлять на каждом маркере
-            # Важно: не отправляем уведомления, если ключ уже истек
-            # Проверяем по секундам, а не по целым часам, чтобы обрабатывать ключи с оставшимся временем < 1 часа
-            if time_left.total_seconds() > 0:
-                # Ищем наименьший подходящий маркер (сортируем по возрастанию: 1, 24, 48, 72)
-                for hours_mark in sorted(NOTIFY_BEFORE_HOURS):
-                    # Проверяем, что осталось времени меньше или равно маркеру (в секундах)
-                    # Для маркера 1 час: осталось <= 3600 секунд (1 час)
-                    # Для маркера 24 часа: осталось <= 86400 секунд (24 часа)
-                    mark_seconds = hours_mark * 3600
-                    if total_seconds_left <= mark_seconds:
-                        # Проверяем доступность тарифа для автопродления
-                        if not is_plan_available:
-                            # Тариф удален или скрыт - отправляем предупреждение
-                            if not _marker_logged(user_id, key_id, hours_mark, 'subscription_plan_unavailable'):
-                                try:
-                                    await send_plan_unavailable_notice(bot, user_id, key_id, hours_mark, expiry_date)
-                                    notified_users.setdefault(user_id, {}).setdefault(key_id, set()).add(hours_mark)
-                                    logger.info(f"Sent plan unavailable notice for user {user_id}, key {key_id}, marker {hours_mark}h")
-                                except Exception as e:
-                                    logger.error(f"Failed to send plan unavailable notice: {e}")
-                            break  # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: выходим из цикла после проверки недоступности тарифа
-                        
-                        balance_covers = price_to_renew > 0 and user_balance >= price_to_renew
-                        if balance_covers:
-                            # Проверяем статус автопродления
-                            from shop_bot.data_manager.database import get_auto_renewal_enabled, get_key_auto_renewal_enabled
-                            auto_renewal_enabled = get_auto_renewal_enabled(user_id)
-                            key_auto_renewal_enabled = get_key_auto_renewal_enabled(key_id)
-                            
-                            # Логируем для отладки
-                            if total_seconds_left < 7200:  # Меньше 2 часов
-                                logger.info(f"Key {key_id}: balance_covers={balance_covers}, auto_renewal_enabled={auto_renewal_enabled}, key_auto_renewal_enabled={key_auto_renewal_enabled}, hours_mark={hours_mark}, marker_logged={_marker_logged(user_id, key_id, hours_mark, 'subscription_autorenew_notice')}")
-                            
-                            # Проверяем, включено ли автопродление для пользователя и ключа
-                            if auto_renewal_enabled and key_auto_renewal_enabled:
-                                # Подавляем стандартные уведомления. На 24ч и 1ч — отправляем новый тип, один раз.
-                                if hours_mark in (24, 1) and not _marker_logged(user_id, key_id, hours_mark, 'subscription_autorenew_notice'):
-                                    try:
-                                        await send_autorenew_balance_notice(bot, user_id, key_id, hours_mark, expiry_date, user_balance)
-                                        notified_users.setdefault(user_id, {}).setdefault(key_id, set()).add(hours_mark)
-                                        logger.info(f"Sent autorenew notice for user {user_id}, key {key_id}, marker {hours_mark}h")
-                                    except Exception as e:
-                                        logger.error(f"Failed to send autorenew notice: {e}")
-                                break  # ВАЖНО: выходим из цикла после проверки автопродления
-                            else:
-                                # Автопродление отключено (глобально или для ключа), но баланс достаточен - отправляем специальное уведомление
-                                if not _marker_logged(user_id, key_id, hours_mark, 'subscription_autorenew_disabled'):
-                                    try:
-                                        await send_autorenew_disabled_notice(bot, user_id, key_id, hours_mark, expiry_date, user_balance, price_to_renew)
-                                        notified_users.setdefault(user_id, {}).setdefault(key_id, set()).add(hours_mark)
-                                        logger.info(f"Sent autorenew disabled notice for user {user_id}, key {key_id}, marker {hours_mark}h")
-                                    except Exception as e:
-                                        logger.error(f"Failed to send autorenew disabled notice: {e}")
-                                break  # ВАЖНО: выходим из цикла после отправки уведомления об отключенном автопродлении
-                        else:
-                            # Обычные уведомления
-                            if not _marker_logged(user_id, key_id, hours_mark, 'subscription_expiry'):
-                                try:
-                                    await send_subscription_notification(bot, user_id, key_id, hours_mark, expiry_date)
-                                    notified_users.setdefault(user_id, {}).setdefault(key_id, set()).add(hours_mark)
-                                    logger.info(f"Sent subscription expiry notice for user {user_id}, key {key_id}, marker {hours_mark}h")
-                                except Exception as e:
-                                    logger.error(f"Failed to send subscription expiry notice: {e}")
-                            break  # ВАЖНО: выходим из цикла после отправки обычного уведомления
+                logger.info(f"Key {key_id} (user {user_id}): {total_seconds_left}s left, balance={user_balance}, price={price_to_renew}, plan_available={is_plan_available}")
+
+            if not is_plan_available:
+                # Тариф удален или скрыт - предупреждение о недоступности
+                notif_type = 'subscription_plan_unavailable'
+            elif price_to_renew > 0 and user_balance >= price_to_renew:
+                auto_renewal_enabled = bool(user_state.get('auto_renewal_enabled', True))
+                key_auto_renewal = key.get('auto_renewal_enabled')
+                key_auto_renewal_enabled = True if key_auto_renewal is None else bool(key_auto_renewal)
+                if auto_renewal_enabled and key_auto_renewal_enabled:
+                    # Подавляем стандартные уведомления. На 24ч и 1ч — отправляем новый тип, один раз.
+                    if hours_mark not in (24, 1):
+                        continue
+                    notif_type = 'subscription_autorenew_notice'
+                else:
+                    # Автопродление отключено, но баланс достаточен
+                    notif_type = 'subscription_autorenew_disabled'
             else:
-                # Ключ уже истек - не отправляем уведомления об истечении
-                logger.debug(f"Key {key_id} for user {user_id} has already expired ({int(time_left.total_seconds())} seconds left). Skipping notifications.")
+                notif_type = 'subscription_expiry'
 
+            if (user_id, key_id, hours_mark, notif_type) in logged_markers:
+                continue
+
+            plan.append({
+                'notif_type': notif_type,
+                'key': key,
+                'user_id': user_id,
+                'key_id': key_id,
+                'hours_mark': hours_mark,
+                'expiry_date': expiry_date,
+                'balance': user_balance,
+                'price': price_to_renew,
+            })
         except KeyError as e:
             logger.error(f"Missing key data for processing expiry: {e}")
         except ValueError as e:
             logger.error(f"Invalid data format for key {key.get('key_id')}: {e}")
         except Exception as e:
             logger.error(f"Unexpected error processing expiry for key {key.get('key_id')}: {e}", exc_info=True)
+    return plan
 
-async def perform_auto_renewals(bot: Bot):
-    """Автопродление по истечении срока при достаточном балансе."""
-    try:
-        all_keys = database.get_all_keys()
-        # Используем UTC для консистентности с данными в БД
-        now = datetime.now(timezone.utc).replace(tzinfo=None)
-        for key in all_keys:
-            try:
-                expiry_date = datetime.fromisoformat(key['expiry_date'])
-                # Убираем timezone info для совместимости
-                if expiry_date.tzinfo is not None:
-                    expiry_date = expiry_date.replace(tzinfo=None)
-            except Exception:
-                continue
+async def check_expiring_subscriptions(bot: Bot):
+    """Находит ключи в окне уведомлений и ставит уведомления в outbox.
 
-            # Продлеваем только если уже истёк
-            if expiry_date > now:
-                continue
+    Сообщения только формируются и записываются пачкой в notification_outbox
+    (database.enqueue_notifications); отправку выполняет отдельный
+    диспетчер notification_outbox_dispatcher, поэтому медленный Telegram API
+    не растягивает цикл планировщика.
+    """
+    logger.info("Scheduler: Checking for expiring subscriptions...")
+    started = time.perf_counter()
+    # Используем UTC для проверки истечения, т.к. все даты в БД хранятся в UTC
+    current_time = datetime.now(timezone.utc).replace(tzinfo=None)
+    window_end = current_time + timedelta(hours=max(NOTIFY_BEFORE_HOURS))
 
-            user_id = key['user_id']
-            key_id = key['key_id']
-            host_name = key.get('host_name')
-            plan_info, price_to_renew, months_to_renew, plan_id, is_plan_available = _get_plan_info_for_key(key)
-
-            # Требуем валидный план, цену и доступность тарифа
-            # Исправлено: проверяем не только месяцы, но и дни/часы для тарифов с months=0
-            plan_has_duration = False
-            if plan_info:
-                months = plan_info.get('months', 0) or 0
-                days = plan_info.get('days', 0) or 0
-                hours = plan_info.get('hours', 0) or 0
-                plan_has_duration = months > 0 or days > 0 or hours > 0
-            
-            if not plan_info or not plan_has_duration or not plan_id or price_to_renew <= 0 or not is_plan_available:
-                if not plan_has_duration:
-                    logger.debug(f"Auto-renewal skipped for key {key_id}: plan has no valid duration (months={plan_info.get('months', 0) if plan_info else 0}, days={plan_info.get('days', 0) if plan_info else 0}, hours={plan_info.get('hours', 0) if plan_info else 0})")
-                continue
+    # Берём только ключи внутри наибольшего окна уведомлений (диапазон по индексу expiry_date)
+    expiring_keys = database.get_keys_expiring_between(current_time, window_end)
+    _cleanup_notified_users(expiring_keys)
+    if not expiring_keys:
+        return
 
-            from shop_bot.data_manager.database import get_user_balance, add_to_user_balance, log_transaction, get_user, get_key_by_id
-            current_balance = float(get_user_balance(user_id) or 0.0)
-            if current_balance < price_to_renew:
+    # Пакетная предзагрузка всего, что нужно для решения по каждому ключу
+    plans_by_host = database.get_plans_by_hosts(key.get('host_name') for key in expiring_keys)
+    user_states = database.get_users_renewal_state(key.get('user_id') for key in expiring_keys)
+    logged_markers = database.get_logged_notification_markers(
+        (key.get('key_id') for key in expiring_keys), EXPIRY_NOTIFICATION_TYPES
+    )
+
+    notification_plan = _build_expiry_notification_plan(
+        expiring_keys, current_time, plans_by_host, user_states, logged_markers
+    )
+    logger.info(f"Scheduler: {len(expiring_keys)} keys in notify window, {len(notification_plan)} notifications planned")
+
+    entries = []
+    for item in notification_plan:
+        user_id = item['user_id']
+        key_id = item['key_id']
+        hours_mark = item['hours_mark']
+        expiry_date = item['expiry_date']
+        notif_type = item['notif_type']
+        try:
+            if notif_type == 'subscription_plan_unavailable':
+                notification = _prepare_plan_unavailable_notice(user_id, key_id, hours_mark, expiry_date)
+            elif notif_type == 'subscription_autorenew_notice':
+                notification = _prepare_autorenew_balance_notice(user_id, key_id, hours_mark, expiry_date, item['balance'])
+            elif notif_type == 'subscription_autorenew_disabled':
+                notification = _prepare_autorenew_disabled_notice(
+                    user_id, key_id, hours_mark, expiry_date, item['balance'], item['price']
+                )
+            else:
+                notification = _prepare_subscription_notification(user_id, key_id, hours_mark, expiry_date)
+            if not notification:
                 continue
+            reply_markup = notification.pop('reply_markup')
+            notification['reply_markup'] = reply_markup.model_dump_json() if reply_markup else None
+            # После истечения ключа предупреждение о скором истечении не отправляется
+            notification['deadline'] = database.key_expiry_marker(expiry_date)
+            entries.append(notification)
+            notified_users.setdefault(user_id, {}).setdefault(key_id, set()).add(hours_mark)
+        except Exception as e:
+            logger.error(f"Failed to prepare {notif_type} for user {user_id}, key {key_id}: {e}")
+
+    enqueued = database.enqueue_notifications(entries)
+    logger.info(f"Scheduler: {enqueued} notifications queued for delivery")
+    monitor = get_performance_monitor()
+    await monitor.record_metric("notification_scan", time.perf_counter() - started)
+    await monitor.record_count("notifications_enqueued", enqueued)
+
+
+async def _deliver_outbox_notification(bot: Bot, item: dict) -> dict:
+    """Отправляет одно уведомление outbox и возвращает результат для record_outbox_results."""
+    result = {'outbox_id': item['outbox_id']}
+    # deadline мог пройти, пока уведомление ждало в пачке (ожидание flood control)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    if item.get('deadline') and item['deadline'] <= database.key_expiry_marker(now):
+        result.update(status='skipped', error='deadline passed')
+        return result
+    try:
+        await bot.send_message(
+            chat_id=item['chat_id'],
+            text=item['text'],
+            reply_markup=InlineKeyboardMarkup.model_validate_json(item['reply_markup']) if item.get('reply_markup') else None,
+            parse_mode=item.get('parse_mode')
+        )
+        result['status'] = 'sent'
+    except TelegramRetryAfter as e:
+        # Flood control: повторяем через указанное Telegram время, попытка не теряется
+        result.update(status='retry', retry_in=e.retry_after, error=str(e))
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Бот заблокирован, чат не найден или сообщение отклонено — повтор не поможет
+        result.update(status='failed', error=str(e))
+    except Exception as e:
+        attempts = (item.get('attempts') or 0) + 1
+        if attempts >= database.NOTIFICATION_OUTBOX_MAX_ATTEMPTS:
+            result.update(status='failed', error=str(e))
+        else:
+            retry_in = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+            result.update(status='retry', retry_in=retry_in, error=str(e))
+    return result
 
-            # Проверяем, включено ли автопродление для пользователя
-            from shop_bot.data_manager.database import get_auto_renewal_enabled, get_key_auto_renewal_enabled
-            if not get_auto_renewal_enabled(user_id):
-                logger.info(f"Auto-renewal skipped for user {user_id}, key {key_id}: global auto-renewal is disabled")
-                continue
 
-            # Проверяем, включено ли автопродление для конкретного ключа
-            if not get_key_auto_renewal_enabled(key_id):
-                logger.info(f"Auto-renewal skipped for user {user_id}, key {key_id}: key auto-renewal is disabled")
-                continue
+async def dispatch_notification_outbox(bot: Bot) -> dict[str, int]:
+    """Отправляет готовые уведомления из outbox, не более OUTBOX_CONCURRENCY одновременно.
 
-            # Сохраняем старое expiry_date для проверки на дублирование
-            old_expiry_date = expiry_date
+    Уведомления с прошедшим deadline помечаются 'skipped' без отправки.
 
-            # Получаем название тарифа для уведомления
-            plan_name = plan_info.get('plan_name', key.get('plan_name', 'Неизвестный тариф'))
+    Returns:
+        Количество уведомлений по итоговым статусам ('sent', 'retry', 'failed', 'skipped')
+    """
+    skipped = database.skip_expired_outbox_notifications()
+    if skipped:
+        logger.info(f"Outbox: skipped {skipped} notifications past their deadline")
+        await get_performance_monitor().record_count("notifications_skipped", skipped)
+    items = database.get_due_outbox_notifications(OUTBOX_BATCH_SIZE)
+    if not items:
+        return {'skipped': skipped} if skipped else {}
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, OUTBOX_CONCURRENCY))
+
+    async def deliver(item: dict) -> dict:
+        async with semaphore:
+            return await _deliver_outbox_notification(bot, item)
+
+    results = await asyncio.gather(*(deliver(item) for item in items))
+    database.record_outbox_results(results)
+
+    outcomes: dict[str, int] = {'skipped': skipped} if skipped else {}
+    for result in results:
+        outcomes[result['status']] = outcomes.get(result['status'], 0) + 1
+        if result['status'] == 'failed':
+            logger.warning(f"Outbox notification {result['outbox_id']} was not delivered: {result.get('error')}")
+    logger.info(f"Outbox: processed {len(items)} notifications: {outcomes}")
+    monitor = get_performance_monitor()
+    await monitor.record_metric("notification_dispatch", time.perf_counter() - started)
+    await monitor.record_count("notifications_delivered", outcomes.get('sent', 0))
+    await monitor.record_count("notifications_failed", outcomes.get('failed', 0))
+    await monitor.record_count("notifications_skipped", outcomes.get('skipped', 0) - skipped)
+    return outcomes
+
+
+async def notification_outbox_dispatcher(bot_controller: BotController):
+    """Фоновый цикл доставки уведомлений из outbox."""
+    logger.info("Notification outbox dispatcher has been started.")
+    while True:
+        outcomes = {}
+        try:
+            if bot_controller.get_status().get("shop_bot_running"):
+                bot = bot_controller.get_bot_instance()
+                if bot:
+                    outcomes = await dispatch_notification_outbox(bot)
+        except Exception as e:
+            logger.error(f"Outbox dispatcher: unhandled error: {e}", exc_info=True)
+        # Полная пачка — в очереди, вероятно, есть ещё готовые уведомления
+        if sum(outcomes.values()) < OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL_SECONDS)
 
-            # Метаданные платежа
-            payment_id = str(uuid.uuid4())
-            # Для тарифов с months=0 используем days и hours из plan_info
-            plan_months = plan_info.get('months', 0) or 0
-            plan_days = plan_info.get('days', 0) or 0
-            plan_hours = plan_info.get('hours', 0) or 0
-            metadata = {
-                'user_id': user_id,
-                'months': int(plan_months),
-                'days': int(plan_days),
-                'hours': int(plan_hours),
-                'price': float(price_to_renew),
-                'action': 'extend',
-                'key_id': key_id,
-                'host_name': host_name,
-                'plan_id': int(plan_id),
-                'customer_email': None,
-                'payment_method': 'Auto-Renewal',
-                'payment_id': payment_id
-            }
+async def perform_auto_renewals(bot: Bot):
+    """Автопродление по истечении срока при достаточном балансе.
+
+    Истёкшие ключи ставятся в персистентную очередь renewal_queue (одна
+    запись на пару ключ + время истечения) и продлеваются пулом задач в
+    порядке истечения: не более AUTO_RENEWAL_CONCURRENCY одновременно и не
+    более AUTO_RENEWAL_PER_HOST_CONCURRENCY на одну панель. Списание
+    баланса и запись транзакции выполняются одной транзакцией БД
+    (database.charge_renewal), поэтому повтор после сбоя продлевает уже
+    оплаченный ключ, не списывая деньги второй раз. Записи, которые нельзя
+    оплатить сейчас, откладываются с экспоненциальной задержкой и не
+    занимают пачку в следующих циклах.
+    """
+    try:
+        # Используем UTC для консистентности с данными в БД
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        database.enqueue_due_renewals(now)
+        items = database.get_due_renewals(AUTO_RENEWAL_BATCH_SIZE)
+        if not items:
+            return
 
-            try:
-                # Списание и логирование
-                add_to_user_balance(user_id, -float(price_to_renew))
-                user = get_user(user_id) or {}
-                username = user.get('username', 'N/A')
-                log_transaction(
-                    username=username,
-                    transaction_id=None,
-                    payment_id=payment_id,
-                    user_id=user_id,
-                    status='paid',
-                    amount_rub=float(price_to_renew),
-                    amount_currency=None,
-                    currency_name=None,
-                    payment_method='Auto-Renewal',
-                    metadata=json.dumps(metadata)
-                )
+        plans_by_host = database.get_plans_by_hosts(item.get('host_name') for item in items)
+        semaphore = asyncio.Semaphore(max(1, AUTO_RENEWAL_CONCURRENCY))
+        host_semaphores: dict[str | None, asyncio.Semaphore] = {}
+        for item in items:
+            host_semaphores.setdefault(
+                item.get('host_name'), asyncio.Semaphore(max(1, AUTO_RENEWAL_PER_HOST_CONCURRENCY))
+            )
 
-                # Обработка, как при обычной оплате
-                from shop_bot.bot.handlers import process_successful_payment
-                await process_successful_payment(bot, metadata)
-                
-                # Проверяем, что ключ действительно был продлен (защита от дублирования)
-                updated_key = get_key_by_id(key_id)
-                if updated_key:
-                    new_expiry_date = datetime.fromisoformat(updated_key['expiry_date'])
-                    if new_expiry_date.tzinfo is not None:
-                        new_expiry_date = new_expiry_date.replace(tzinfo=None)
-                    
-                    # Если expiry_date изменился, значит продление прошло успешно
-                    if new_expiry_date > old_expiry_date:
-                        # Отправляем уведомление о списании
-                        await send_balance_deduction_notice(bot, user_id, key_id, price_to_renew, plan_name, host_name)
-                        logger.info(f"Auto-renewal completed for user {user_id}, key {key_id} on host '{host_name}'. Deduction notice sent.")
-                    else:
-                        logger.warning(f"Auto-renewal: expiry_date did not change for key {key_id}. Possible duplicate renewal attempt.")
-                else:
-                    logger.warning(f"Auto-renewal: could not retrieve updated key {key_id} after renewal.")
-            except ValueError as e:
-                logger.error(f"Invalid data for auto-renewal user {user_id}, key {key_id}: {e}")
-            except KeyError as e:
-                logger.error(f"Missing required data for auto-renewal user {user_id}, key {key_id}: {e}")
-            except Exception as e:
-                logger.error(f"Auto-renewal failed for user {user_id}, key {key_id}: {e}", exc_info=True)
+        async def run_item(item: dict) -> str:
+            # Сначала слот хоста, затем общий: ожидание занятого хоста не держит общий слот
+            async with host_semaphores[item.get('host_name')]:
+                async with semaphore:
+                    return await _process_renewal_item(bot, item, plans_by_host)
+
+        results = await asyncio.gather(*(run_item(item) for item in items), return_exceptions=True)
+        outcomes: dict[str, int] = {}
+        for item, result in zip(items, results):
+            if isinstance(result, Exception):
+                logger.error(f"Auto-renewal failed for key {item.get('key_id')}: {result}", exc_info=result)
+                result = 'error'
+            outcomes[result] = outcomes.get(result, 0) + 1
+        logger.info(f"Auto-renewal: processed {len(items)} queued keys: {outcomes}")
+        await get_performance_monitor().record_count("auto_renewals_completed", outcomes.get('done', 0))
     except Exception as e:
         logger.error(f"perform_auto_renewals: fatal error: {e}")
 
-async def sync_keys_with_panels():
-    logger.info("Scheduler: Starting sync with XUI panels...")
-    total_affected_records = 0
-    
-    all_hosts = database.get_all_hosts()
-    if not all_hosts:
-        logger.info("Scheduler: No hosts configured in the database. Sync skipped.")
-        return
 
-    orphan_summary: list[tuple[str, int]] = []
-    orphan_summary_with_errors: list[tuple[str, int]] = []
-    auto_delete = (database.get_setting("auto_delete_orphans") == "true")
+async def _process_renewal_item(bot: Bot, item: dict, plans_by_host: dict[str, list[dict]]) -> str:
+    """Обрабатывает одну запись очереди автопродления и возвращает её итоговый статус."""
+    from shop_bot.data_manager.database import get_auto_renewal_enabled, get_key_auto_renewal_enabled, get_key_by_id
+
+    queue_id = item['queue_id']
+    user_id = item['user_id']
+    key_id = item['key_id']
+    host_name = item.get('host_name')
+    queued_expiry = item['expiry_date']
+
+    key = get_key_by_id(key_id)
+    current_expiry = database.key_expiry_marker(key.get('expiry_date')) if key else None
+    if item['status'] == 'charged':
+        if not key:
+            logger.error(f"Auto-renewal: key {key_id} was deleted after charging payment {item.get('payment_id')}")
+            database.update_renewal_status(queue_id, 'failed', 'key deleted after charge')
+            return 'failed'
+        if current_expiry > queued_expiry:
+            # Ключ продлён на прошлой попытке, не хватило только отметки в очереди
+            return await _complete_renewal(bot, item, key)
+        return await _extend_charged_key(bot, item, key)
+
+    if not key or current_expiry != queued_expiry:
+        database.update_renewal_status(queue_id, 'obsolete')
+        return 'obsolete'
+
+    if not get_auto_renewal_enabled(user_id):
+        logger.info(f"Auto-renewal skipped for user {user_id}, key {key_id}: global auto-renewal is disabled")
+        database.update_renewal_status(queue_id, 'skipped', 'global auto-renewal disabled')
+        return 'skipped'
+    if not get_key_auto_renewal_enabled(key_id):
+        logger.info(f"Auto-renewal skipped for user {user_id}, key {key_id}: key auto-renewal is disabled")
+        database.update_renewal_status(queue_id, 'skipped', 'key auto-renewal disabled')
+        return 'skipped'
+
+    plan_info, price_to_renew, months_to_renew, plan_id, is_plan_available = _get_plan_info_for_key(
+        key, plans_by_host.get(host_name)
+    )
+
+    # Требуем валидный план, цену и доступность тарифа
+    # Исправлено: проверяем не только месяцы, но и дни/часы для тарифов с months=0
+    plan_months = int((plan_info or {}).get('months', 0) or 0)
+    plan_days = int((plan_info or {}).get('days', 0) or 0)
+    plan_hours = int((plan_info or {}).get('hours', 0) or 0)
+    plan_has_duration = plan_months > 0 or plan_days > 0 or plan_hours > 0
+    if not plan_info or not plan_has_duration or not plan_id or price_to_renew <= 0 or not is_plan_available:
+        # Запись остаётся в очереди: тариф могут вернуть в продажу
+        logger.debug(
+            f"Auto-renewal postponed for key {key_id}: plan unavailable or has no valid duration "
+            f"(months={plan_months}, days={plan_days}, hours={plan_hours})"
+        )
+        return _postpone_renewal(item, 'plan unavailable')
+
+    metadata = {
+        'user_id': user_id,
+        'months': plan_months,
+        'days': plan_days,
+        'hours': plan_hours,
+        'price': float(price_to_renew),
+        'action': 'extend',
+        'key_id': key_id,
+        'host_name': host_name,
+        'plan_id': int(plan_id),
+        'plan_name': plan_info.get('plan_name', key.get('plan_name', 'Неизвестный тариф')),
+        'customer_email': None,
+        'payment_method': 'Auto-Renewal',
+        'payment_id': str(uuid.uuid4()),
+    }
+    charge_result = database.charge_renewal(queue_id, user_id, price_to_renew, metadata)
+    if charge_result != 'charged':
+        # Недостаточный баланс: запись ждёт пополнения в следующих циклах
+        logger.debug(f"Auto-renewal for key {key_id} not charged: {charge_result}")
+        return _postpone_renewal(item, 'insufficient funds') if charge_result == 'insufficient_funds' else charge_result
+
+    item = {**item, 'status': 'charged', 'payment_id': metadata['payment_id'], 'amount': float(price_to_renew), 'metadata': metadata}
+    return await _extend_charged_key(bot, item, key)
+
+
+def _postpone_renewal(item: dict, reason: str) -> str:
+    """Откладывает запись 'pending' с экспоненциальной задержкой и возвращает 'pending'."""
+    postponed = item.get('postpone_count') or 0
+    retry_in = min(AUTO_RENEWAL_RETRY_BASE_SECONDS * 2 ** postponed, AUTO_RENEWAL_RETRY_MAX_SECONDS)
+    database.postpone_renewal(item['queue_id'], retry_in, reason)
+    return 'pending'
+
+
+async def _extend_charged_key(bot: Bot, item: dict, key: dict) -> str:
+    """Продлевает оплаченный ключ; при неудаче запись остаётся 'charged' для повтора."""
+    from shop_bot.data_manager.database import get_key_by_id
+
+    queue_id = item['queue_id']
+    key_id = item['key_id']
+    metadata = item.get('metadata')
+    if not metadata:
+        database.update_renewal_status(queue_id, 'failed', 'payment metadata is missing')
+        return 'failed'
+
+    error = None
+    try:
+        # Обработка, как при обычной оплате
+        from shop_bot.bot.handlers import process_successful_payment
+        await process_successful_payment(bot, metadata)
+        updated_key = get_key_by_id(key_id)
+        if updated_key and database.key_expiry_marker(updated_key.get('expiry_date')) > item['expiry_date']:
+            return await _complete_renewal(bot, item, updated_key)
+        error = 'expiry_date did not change after renewal'
+        logger.warning(f"Auto-renewal: expiry_date did not change for key {key_id} (payment {item.get('payment_id')})")
+    except Exception as e:
+        error = str(e)
+        logger.error(f"Auto-renewal failed for user {item['user_id']}, key {key_id}: {e}", exc_info=True)
 
-    for host in all_hosts:
-        host_name = host['host_name']
-        logger.info(f"Scheduler: Processing host: '{host_name}'")
-        
-        try:
-            api, inbound = xui_api.login_to_host(
-                host_url=host['host_url'],
-                username=host['host_username'],
-                password=host['host_pass'],
-                inbound_id=host['host_inbound_id']
-            )
+    if item.get('attempts', 0) + 1 >= database.RENEWAL_MAX_ATTEMPTS:
+        logger.error(
+            f"Auto-renewal: key {key_id} was not extended after {database.RENEWAL_MAX_ATTEMPTS} attempts, "
+            f"payment {item.get('payment_id')} requires manual review"
+        )
+        database.update_renewal_status(queue_id, 'failed', error, count_attempt=True)
+        return 'failed'
+    database.update_renewal_status(queue_id, 'charged', error, count_attempt=True)
+    return 'charged'
+
+
+async def _complete_renewal(bot: Bot, item: dict, key: dict) -> str:
+    """Отмечает продление выполненным и отправляет уведомление о списании."""
+    database.update_renewal_status(item['queue_id'], 'done')
+    metadata = item.get('metadata') or {}
+    plan_name = metadata.get('plan_name') or key.get('plan_name', 'Неизвестный тариф')
+    await send_balance_deduction_notice(
+        bot, item['user_id'], item['key_id'], item.get('amount') or metadata.get('price', 0), plan_name, item.get('host_name')
+    )
+    logger.info(
+        f"Auto-renewal completed for user {item['user_id']}, key {item['key_id']} on host '{item.get('host_name')}'. "
+        f"Deduction notice sent."
+    )
+    return 'done'
+
+
+def _sync_host_blocking(host: dict, auto_delete: bool) -> dict:
+    """Синхронизирует один хост с БД. Выполняется в рабочем потоке.
+
+    Используется закэшированная авторизованная сессия хоста из xui_api: логин
+    выполняется только при её отсутствии или протухании. Inbound загружается
+    один раз, удаления истёкших и orphan-клиентов отправляются одним пакетом
+    (xui_api.panel_client_batch); при ошибке коммита хост помечается как неуспешный,
+    а истёкшие ключи остаются в БД до следующей сверки.
+    Возвращает отчёт: affected, orphans, orphan_errors, ok и тайминги этапов (секунды).
+    """
+    host_name = host['host_name']
+    report = {
+        'host_name': host_name,
+        'ok': False,
+        'affected': 0,
+        'orphans': 0,
+        'orphan_errors': 0,
+        'timings': {},
+    }
+    timings = report['timings']
+    started = time.perf_counter()
+    logger.info(f"Scheduler: Processing host: '{host_name}'")
 
-            if not api or not inbound:
-                logger.warning(f"Scheduler: Could not log in to host '{host_name}'. Skipping this host. This may be a temporary network issue.")
-                continue
-            
-            full_inbound_details = api.inbound.get_by_id(inbound.id)
-            clients_on_server = {client.email: client for client in (full_inbound_details.settings.clients or [])}
+    try:
+        stage_started = time.perf_counter()
+        api, inbound = xui_api.get_panel_api(
+            host['host_url'],
+            host['host_username'],
+            host['host_pass'],
+            host['host_inbound_id'],
+        )
+        timings['login'] = time.perf_counter() - stage_started
+
+        if not api or not inbound:
+            logger.warning(f"Scheduler: Could not log in to host '{host_name}'. Skipping this host. This may be a temporary network issue.")
+            return report
+
+        # Сверка требует актуального состояния панели: пакет загружает inbound в обход кэша.
+        # Удаления истёкших и orphan-клиентов копятся в пакете и отправляются одним коммитом.
+        orphans_to_log = []
+        # Истёкшие ключи удаляются из БД только после успешного коммита пакета:
+        # при ошибке панели они останутся и будут удалены при следующей сверке
+        expired_emails = []
+        stage_started = time.perf_counter()
+        with xui_api.panel_client_batch(host) as batch:
+            clients_on_server = dict(batch.clients)
+            timings['fetch'] = time.perf_counter() - stage_started
             logger.info(f"Scheduler: Found {len(clients_on_server)} clients on the '{host_name}' panel.")
 
+            stage_started = time.perf_counter()
             keys_in_db = database.get_keys_for_host(host_name)
-            
+            # Используем UTC для консистентности с данными в БД
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+
             for db_key in keys_in_db:
                 key_email = db_key['key_email']
                 expiry_date = datetime.fromisoformat(db_key['expiry_date'])
                 # Убираем timezone info для совместимости
                 if expiry_date.tzinfo is not None:
                     expiry_date = expiry_date.replace(tzinfo=None)
-                # Используем UTC для консистентности с данными в БД
-                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                server_client = clients_on_server.pop(key_email, None)
+
                 if expiry_date < now - timedelta(days=5):
                     logger.info(f"Scheduler: Key '{key_email}' expired more than 5 days ago. Deleting from panel and DB.")
-                    try:
-                        await xui_api.delete_client_on_host(host_name, key_email)
-                    except Exception as e:
-                        logger.error(f"Scheduler: Failed to delete client '{key_email}' from panel: {e}")
-                    database.delete_key_by_email(key_email)
-                    total_affected_records += 1
+                    if server_client:
+                        batch.delete(key_email)
+                    expired_emails.append(key_email)
+                    report['affected'] += 1
                     continue
 
-                server_client = clients_on_server.pop(key_email, None)
-
                 if server_client:
                     reset_days = server_client.reset if server_client.reset is not None else 0
                     server_expiry_ms = server_client.expiry_time + reset_days * 24 * 3600 * 1000
-                    local_expiry_dt = expiry_date
-                    local_expiry_ms = int(local_expiry_dt.timestamp() * 1000)
+                    local_expiry_ms = int(expiry_date.timestamp() * 1000)
 
                     if abs(server_expiry_ms - local_expiry_ms) > 1000:
                         database.update_key_status_from_server(key_email, server_client)
-                        total_affected_records += 1
+                        report['affected'] += 1
                         logger.info(f"Scheduler: Synced (updated) key '{key_email}' for host '{host_name}'.")
                 else:
                     logger.warning(f"Scheduler: Key '{key_email}' for host '{host_name}' not found on server. Deleting from local DB.")
                     database.update_key_status_from_server(key_email, None)
-                    total_affected_records += 1
+                    report['affected'] += 1
+            timings['reconcile'] = time.perf_counter() - stage_started
 
             if clients_on_server:
                 count_orphans = len(clients_on_server)
-                orphan_summary.append((host_name, count_orphans))
+                report['orphans'] = count_orphans
 
                 # Логируем информацию о orphan clients
                 orphan_ids = [str(getattr(client, "id", "unknown")) for client in clients_on_server.values()]
@@ -1112,68 +1330,135 @@ async def sync_keys_with_panels():
                     f"Scheduler: Found {count_orphans} orphan client(s) on host '{host_name}'"
                     + (f" (ID(s): {shown_ids})" if shown_ids else "")
                 )
-                
+
                 # Логируем первые 5 orphan clients для диагностики
                 sample_orphans = list(clients_on_server.items())[:5]
                 for orphan_email, orphan_client in sample_orphans:
                     logger.info(f"Scheduler: Orphan client - Email: {orphan_email}, ID: {orphan_client.id}, Expiry: {orphan_client.expiry_time}")
-                
+
                 if count_orphans > 5:
                     logger.info(f"Scheduler: ... and {count_orphans - 5} more orphan client(s)")
-                
+
                 # Опциональное автоудаление осиротевших клиентов с панели
                 if auto_delete:
-                    deleted = 0
-                    failed = 0
                     logger.info(f"Scheduler: Starting auto-deletion of {count_orphans} orphan client(s) on '{host_name}'...")
-                    
-                    for orphan_email in list(clients_on_server.keys()):
-                        try:
-                            result = await xui_api.delete_client_on_host(host_name, orphan_email)
-                            if result:
-                                deleted += 1
-                                logger.info(f"Scheduler: ✅ Successfully deleted orphan client '{orphan_email}' on '{host_name}'.")
-                                # Логируем удаление в файл
-                                orphan_client = clients_on_server[orphan_email]
-                                log_orphan_deletion(
-                                    host_name=host_name,
-                                    client_email=orphan_email,
-                                    client_id=orphan_client.id,
-                                    expiry_time=orphan_client.expiry_time
-                                )
-                            else:
-                                # Клиент не был найден (уже удален или не существует)
-                                deleted += 1
-                                logger.debug(f"Scheduler: ℹ️ Orphan client '{orphan_email}' on '{host_name}' already deleted or not found.")
-                        except Exception as de:
-                            failed += 1
-                            logger.error(f"Scheduler: ❌ Failed to auto-delete orphan '{orphan_email}' on '{host_name}': {de}")
-                    
-                    total_affected_records += deleted
-                    logger.info(f"Scheduler: ✅ Auto-deletion complete on '{host_name}': {deleted} deleted, {failed} failed.")
-                    
-                    # Если были ошибки при удалении, добавляем в список для предупреждения
-                    if failed > 0:
-                        orphan_summary_with_errors.append((host_name, failed))
+                    for orphan_email, orphan_client in clients_on_server.items():
+                        batch.delete(orphan_email)
+                        orphans_to_log.append((orphan_email, orphan_client))
                 else:
-                    # Если автоудаление выключено, добавляем в список для предупреждения
+                    # Если автоудаление выключено, все orphan-клиенты попадают в предупреждение
                     logger.warning(f"Scheduler: ⚠️ Auto-deletion is disabled. {count_orphans} orphan client(s) will NOT be deleted.")
-                    orphan_summary_with_errors.append((host_name, count_orphans))
+                    report['orphan_errors'] = count_orphans
+
+            # Коммит пакета выполняется при выходе из блока
+            stage_started = time.perf_counter()
+        timings['commit'] = time.perf_counter() - stage_started
+
+        for key_email in expired_emails:
+            database.delete_key_by_email(key_email)
+
+        if orphans_to_log:
+            for orphan_email, orphan_client in orphans_to_log:
+                # Логируем удаление в файл
+                log_orphan_deletion(
+                    host_name=host_name,
+                    client_email=orphan_email,
+                    client_id=orphan_client.id,
+                    expiry_time=orphan_client.expiry_time
+                )
+            report['affected'] += len(orphans_to_log)
+            logger.info(f"Scheduler: ✅ Auto-deletion complete on '{host_name}': {len(orphans_to_log)} orphan client(s) deleted.")
+        logger.info(f"Scheduler: Panel batch for '{host_name}': {batch.result}")
+
+        report['ok'] = True
+
+    except ConnectionError as e:
+        logger.warning(f"Scheduler: Connection error while processing host '{host_name}': {e}. This may be a temporary network issue.")
+    except TimeoutError as e:
+        logger.warning(f"Scheduler: Timeout error while processing host '{host_name}': {e}. This may be a temporary network issue.")
+    except ValueError as e:
+        logger.error(f"Scheduler: Invalid data while processing host '{host_name}': {e}")
+    except Exception as e:
+        logger.error(f"Scheduler: An unexpected error occurred while processing host '{host_name}': {e}", exc_info=True)
+    finally:
+        timings['total'] = time.perf_counter() - started
+    return report
+
+async def _sync_host(host: dict, auto_delete: bool, semaphore: asyncio.Semaphore) -> dict:
+    """Воркер синхронизации одного хоста: блокирующая работа уходит в поток, время пишется в монитор."""
+    async with semaphore:
+        report = await asyncio.to_thread(_sync_host_blocking, host, auto_delete)
+    try:
+        await get_performance_monitor().record_metric(
+            operation=f"panel_sync:{report['host_name']}",
+            duration=report['timings'].get('total', 0.0),
+            success=report['ok'],
+        )
+    except Exception as e:
+        logger.debug(f"Scheduler: Failed to record sync metric for '{report['host_name']}': {e}")
+    return report
+
+async def sync_keys_with_panels():
+    logger.info("Scheduler: Starting sync with XUI panels...")
+    started = time.perf_counter()
+
+    all_hosts = database.get_all_hosts()
+    if not all_hosts:
+        logger.info("Scheduler: No hosts configured in the database. Sync skipped.")
+        return
+
+    auto_delete = (database.get_setting("auto_delete_orphans") == "true")
+
+    # Хосты обрабатываются параллельно, не больше SYNC_MAX_CONCURRENT_HOSTS одновременно:
+    # общее время синхронизации ~ время самого медленного хоста, а не сумма всех.
+    semaphore = asyncio.Semaphore(max(1, SYNC_MAX_CONCURRENT_HOSTS))
+    reports = await asyncio.gather(*(_sync_host(host, auto_delete, semaphore) for host in all_hosts))
+
+    total_affected_records = sum(report['affected'] for report in reports)
+    orphan_summary_with_errors = [(report['host_name'], report['orphan_errors']) for report in reports if report['orphan_errors'] > 0]
+
+    last_sync_report.clear()
+    last_sync_report.update({
+        'finished_at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+        'duration': time.perf_counter() - started,
+        'total_affected': total_affected_records,
+        'hosts': {report['host_name']: report for report in reports},
+    })
+
+    timings_str = ", ".join(
+        f"{report['host_name']}={report['timings'].get('total', 0.0):.2f}s{'' if report['ok'] else ' (failed)'}"
+        for report in sorted(reports, key=lambda r: r['timings'].get('total', 0.0), reverse=True)
+    )
+    logger.info(f"Scheduler: Per-host sync timings -> {timings_str}")
 
-        except ConnectionError as e:
-            logger.warning(f"Scheduler: Connection error while processing host '{host_name}': {e}. This may be a temporary network issue.")
-        except TimeoutError as e:
-            logger.warning(f"Scheduler: Timeout error while processing host '{host_name}': {e}. This may be a temporary network issue.")
-        except ValueError as e:
-            logger.error(f"Scheduler: Invalid data while processing host '{host_name}': {e}")
-        except Exception as e:
-            logger.error(f"Scheduler: An unexpected error occurred while processing host '{host_name}': {e}", exc_info=True)
-            
     # Выводим предупреждение только если автоудаление выключено или были ошибки
     if orphan_summary_with_errors:
         summary_str = ", ".join([f"{hn}:{cnt}" for hn, cnt in orphan_summary_with_errors])
         logger.warning(f"Scheduler: Orphan summary -> {summary_str}")
-    logger.info(f"Scheduler: Sync with XUI panels finished. Total records affected: {total_affected_records}.")
+    logger.info(f"Scheduler: Sync with XUI panels finished in {last_sync_report['duration']:.2f}s. Total records affected: {total_affected_records}.")
+
+async def _update_keys_status_cycle() -> int:
+    """Переводит статусы истёкших/продлённых ключей и пишет число переходов в монитор."""
+    from shop_bot.data_manager.database import update_keys_status_by_expiry
+    started = time.perf_counter()
+    transitions = update_keys_status_by_expiry()
+    monitor = get_performance_monitor()
+    await monitor.record_metric("update_keys_status_by_expiry", time.perf_counter() - started)
+    await monitor.record_count("key_status_transitions", transitions)
+    return transitions
+
+
+@asynccontextmanager
+async def _scheduler_phase(operation: str):
+    """Замеряет цикл планировщика или его этап и пишет длительность в монитор."""
+    started = time.perf_counter()
+    success = False
+    try:
+        yield
+        success = True
+    finally:
+        await get_performance_monitor().record_metric(operation, time.perf_counter() - started, success=success)
+
 
 async def periodic_subscription_check(bot_controller: BotController):
     logger.info("Scheduler has been started.")
@@ -1189,45 +1474,58 @@ async def periodic_subscription_check(bot_controller: BotController):
 
     while True:
         try:
-            # Очищаем дублирующиеся уведомления (раз в цикл)
-            cleanup_duplicate_notifications()
-            
-            # Обновляем статус ключей на основе реального времени истечения
-            from shop_bot.data_manager.database import update_keys_status_by_expiry
-            update_keys_status_by_expiry()
-            
-            await sync_keys_with_panels()
-            
-            # Периодическая очистка старых webhook'ов (раз в день)
-            webhook_cleanup_counter += 1
-            if webhook_cleanup_counter >= WEBHOOK_CLEANUP_INTERVAL:
-                try:
-                    from shop_bot.data_manager.database import cleanup_old_webhooks
-                    deleted_count = cleanup_old_webhooks(days_to_keep=90)
-                    if deleted_count > 0:
-                        logger.info(f"Scheduler: Cleaned up {deleted_count} old webhook records")
-                    webhook_cleanup_counter = 0
-                except Exception as cleanup_error:
-                    logger.error(f"Scheduler: Failed to cleanup old webhooks: {cleanup_error}", exc_info=True)
-            
-            # Периодическая очистка токенов истекших подписок (раз в день)
-            token_cleanup_counter += 1
-            if token_cleanup_counter >= TOKEN_CLEANUP_INTERVAL:
-                logger.debug("Scheduler: Token cleanup skipped (persistent cabinet links enabled)")
-                token_cleanup_counter = 0
-
-            if bot_controller.get_status().get("shop_bot_running"):
-                bot = bot_controller.get_bot_instance()
-                if bot:
-                    await check_expiring_subscriptions(bot)
-                    await perform_auto_renewals(bot)
+            # Длительность цикла и каждого этапа — в монитор (scheduler_cycle, scheduler_phase:<этап>)
+            async with _scheduler_phase("scheduler_cycle"):
+                # Очищаем дублирующиеся уведомления (раз в цикл)
+                async with _scheduler_phase("scheduler_phase:cleanup_duplicates"):
+                    cleanup_duplicate_notifications()
+                
+                # Обновляем статус ключей на основе реального времени истечения
+                async with _scheduler_phase("scheduler_phase:key_status"):
+                    await _update_keys_status_cycle()
+                
+                async with _scheduler_phase("scheduler_phase:panel_sync"):
+                    await sync_keys_with_panels()
+                
+                # Периодическая очистка старых webhook'ов (раз в день)
+                webhook_cleanup_counter += 1
+                if webhook_cleanup_counter >= WEBHOOK_CLEANUP_INTERVAL:
+                    try:
+                        async with _scheduler_phase("scheduler_phase:daily_cleanup"):
+                            from shop_bot.data_manager.database import cleanup_old_webhooks
+                            deleted_count = cleanup_old_webhooks(days_to_keep=90)
+                            if deleted_count > 0:
+                                logger.info(f"Scheduler: Cleaned up {deleted_count} old webhook records")
+                            purged_renewals = database.purge_renewal_queue(days=30)
+                            if purged_renewals > 0:
+                                logger.info(f"Scheduler: Purged {purged_renewals} finished auto-renewal queue records")
+                            purged_outbox = database.purge_notification_outbox(days=30)
+                            if purged_outbox > 0:
+                                logger.info(f"Scheduler: Purged {purged_outbox} processed notification outbox records")
+                        webhook_cleanup_counter = 0
+                    except Exception as cleanup_error:
+                        logger.error(f"Scheduler: Failed to cleanup old webhooks: {cleanup_error}", exc_info=True)
+                
+                # Периодическая очистка токенов истекших подписок (раз в день)
+                token_cleanup_counter += 1
+                if token_cleanup_counter >= TOKEN_CLEANUP_INTERVAL:
+                    logger.debug("Scheduler: Token cleanup skipped (persistent cabinet links enabled)")
+                    token_cleanup_counter = 0
+
+                if bot_controller.get_status().get("shop_bot_running"):
+                    bot = bot_controller.get_bot_instance()
+                    if bot:
+                        async with _scheduler_phase("scheduler_phase:expiry_notifications"):
+                            await check_expiring_subscriptions(bot)
+                        async with _scheduler_phase("scheduler_phase:auto_renewals"):
+                            await perform_auto_renewals(bot)
+                    else:
+                        logger.warning("Scheduler: Bot is marked as running, but instance is not available.")
                 else:
-                    logger.warning("Scheduler: Bot is marked as running, but instance is not available.")
-            else:
-                logger.info("Scheduler: Bot is stopped, skipping user notifications.")
+                    logger.info("Scheduler: Bot is stopped, skipping user notifications.")
 
         except Exception as e:
             logger.error(f"Scheduler: An unhandled error occurred in the main loop: {e}", exc_info=True)
             
         logger.info(f"Scheduler: Cycle finished. Next check in {CHECK_INTERVAL_SECONDS} seconds.")
-        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
\ No newline at end of file
+        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
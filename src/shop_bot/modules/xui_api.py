@@ -14,15 +14,22 @@ import json
 import requests
 import sqlite3
 import asyncio
+import threading
+import time
+import ssl
+from contextlib import contextmanager
 
+import aiohttp
 from py3xui import Api, Client, Inbound
 
-from shop_bot.data_manager.database import get_host, get_host_by_code, get_key_by_email, DB_FILE, get_global_domain
+from shop_bot.data_manager.database import get_host, get_host_by_code, get_key_by_email, DB_FILE, get_global_domain, _get_db_connection
+from shop_bot.utils.performance_monitor import get_performance_monitor
 
 logger = logging.getLogger(__name__)
 
 _TLS_VERIFY_ENV = "XUI_TLS_VERIFY"
 _TLS_CA_BUNDLE_ENV = "XUI_CA_BUNDLE_PATH"
+_ASYNC_CLIENT_ENV = "XUI_ASYNC_CLIENT"
 
 
 def _resolve_tls_verify_option(host_url: str) -> bool | str:
@@ -70,7 +77,12 @@ def _create_verified_panel_session(host_url: str) -> requests.Session:
     """
     session = requests.Session()
     session.verify = _resolve_tls_verify_option(host_url)
-    
+    session.headers.update(_panel_default_headers())
+    return session
+
+
+def _panel_default_headers() -> dict[str, str]:
+    """Заголовки запросов к панели (User-Agent с доменом бота) для requests и aiohttp."""
     # Получаем домен из настроек для User-Agent
     global_domain = get_global_domain()
     if global_domain:
@@ -93,13 +105,10 @@ def _create_verified_panel_session(host_url: str) -> requests.Session:
     else:
         user_agent = "DarkMaximus-XUI/1.0"
     
-    session.headers.update(
-        {
-            "User-Agent": user_agent,
-            "Accept": "application/json, text/plain, */*",
-        }
-    )
-    return session
+    return {
+        "User-Agent": user_agent,
+        "Accept": "application/json, text/plain, */*",
+    }
 
 # Карантин для проблемных хостов: при повторных сбоях временно пропускаем хост,
 # чтобы не засорять логи и не тратить время на заведомо недоступные панели.
@@ -117,18 +126,11 @@ def get_sub_uri_from_panel(host_url: str, username: str, password: str) -> str |
     if cache_key in _sub_uri_cache:
         return _sub_uri_cache[cache_key]
     
+    base = host_url.rstrip('/')
     try:
-        session = _create_verified_panel_session(host_url)
-        base = host_url.rstrip('/')
-        
-        # Логин
-        login_response = session.post(f"{base}/login", json={"username": username, "password": password}, timeout=10)
-        if login_response.status_code != 200:
-            logger.warning(f"Failed to login to {base} for getting subURI")
-            return None
-        
-        # Получаем настройки подписки
-        settings_response = session.post(f"{base}/panel/setting/all", timeout=10)
+        # Авторизованная keep-alive сессия хоста (логин только при первом запросе или 401)
+        session = _get_panel_session(host_url, username, password)
+        settings_response = session.http_request("POST", "panel/setting/all")
         if settings_response.status_code != 200:
             logger.warning(f"Failed to get settings from {base}")
             return None
@@ -139,49 +141,45 @@ def get_sub_uri_from_panel(host_url: str, username: str, password: str) -> str |
             return None
         
         # Получаем настройки из obj (это словарь, а не массив)
-        obj = settings_data.get('obj', {})
-        
-        # Проверяем, есть ли готовый subURI
-        sub_uri = obj.get('subURI')
+        sub_uri = _sub_uri_from_settings(host_url, settings_data.get('obj', {}))
         if sub_uri:
             # Кэшируем результат
             _sub_uri_cache[cache_key] = sub_uri
-            logger.info(f"Got subURI from 3x-ui settings: {sub_uri}")
-            return sub_uri
-        
-        # Если subURI пустой, формируем его из других полей
-        sub_port = obj.get('subPort')
-        sub_path = obj.get('subPath', '/sub/')
-        sub_domain = obj.get('subDomain')
-        
-        if not sub_port:
-            logger.warning(f"subPort not found in settings for {base}")
-            return None
-        
-        # Определяем домен
-        if sub_domain:
-            domain = sub_domain
-        else:
-            # Используем домен из host_url
-            parsed_url = urlparse(host_url)
-            domain = parsed_url.hostname
-        
-        # Формируем subURI
-        sub_uri = f"http://{domain}:{sub_port}{sub_path}"
-        
-        # Кэшируем результат
-        _sub_uri_cache[cache_key] = sub_uri
-        logger.info(f"Generated subURI from settings: {sub_uri}")
         return sub_uri
         
     except Exception as e:
         logger.error(f"Error getting subURI from {base}: {e}")
         return None
-    finally:
-        try:
-            session.close()
-        except Exception:
-            pass
+
+def _sub_uri_from_settings(host_url: str, obj: dict) -> str | None:
+    """Извлекает subURI из ответа /panel/setting/all (или формирует из subPort/subPath)."""
+    # Проверяем, есть ли готовый subURI
+    sub_uri = obj.get('subURI')
+    if sub_uri:
+        logger.info(f"Got subURI from 3x-ui settings: {sub_uri}")
+        return sub_uri
+    
+    # Если subURI пустой, формируем его из других полей
+    sub_port = obj.get('subPort')
+    sub_path = obj.get('subPath', '/sub/')
+    sub_domain = obj.get('subDomain')
+    
+    if not sub_port:
+        logger.warning(f"subPort not found in settings for {host_url.rstrip('/')}")
+        return None
+    
+    # Определяем домен
+    if sub_domain:
+        domain = sub_domain
+    else:
+        # Используем домен из host_url
+        parsed_url = urlparse(host_url)
+        domain = parsed_url.hostname
+    
+    # Формируем subURI
+    sub_uri = f"http://{domain}:{sub_port}{sub_path}"
+    logger.info(f"Generated subURI from settings: {sub_uri}")
+    return sub_uri
 
 def _normalize_host_url(host_url: str) -> str:
     """
@@ -327,6 +325,714 @@ def login_to_host(host_url: str, username: str, password: str, inbound_id: int,
                 
     return None, None
 
+# ============================================================================
+# Кэш авторизованных сессий 3x-ui
+# ============================================================================
+
+# Максимальный возраст py3xui-сессии: по истечении логинимся заново даже без 401
+PANEL_SESSION_MAX_AGE_SECONDS = 30 * 60
+# TTL кэша inbound.get_list()/get_by_id: короткий, т.к. панель могут править вручную
+PANEL_INBOUND_CACHE_TTL_SECONDS = 10
+
+
+class PanelLoginError(ConnectionError):
+    """Не удалось авторизоваться на панели или найти inbound."""
+
+
+def _is_panel_auth_error(error: Exception) -> bool:
+    """True, если ошибка означает протухшую сессию панели.
+
+    С заголовком X-Requested-With 3x-ui отвечает 401 на запросы без сессии;
+    старые сборки вместо этого отдают HTML-страницу логина, и py3xui падает
+    на разборе JSON.
+    """
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 401:
+        return True
+    return isinstance(error, requests.exceptions.JSONDecodeError)
+
+
+class _PanelSession:
+    """Авторизованная сессия одной панели 3x-ui.
+
+    Хранит py3xui Api с найденными inbound'ами, общий requests.Session с keep-alive
+    (через него ходят и py3xui, и нативные эндпоинты панели) и короткоживущий кэш
+    inbound.get_list()/get_by_id. Повторный логин выполняется только при 401
+    или по истечении PANEL_SESSION_MAX_AGE_SECONDS.
+    """
+
+    def __init__(self, host_url: str, username: str, password: str):
+        self.host_url = _normalize_host_url(host_url)
+        self.username = username
+        self.password = password
+        self.lock = threading.RLock()
+        # Сериализует изменения клиентов хоста: inbound.update перезаписывает весь список
+        # клиентов, и параллельная запись по старому снимку потеряла бы чужие изменения
+        self.mutation_lock = threading.RLock()
+        self.http: requests.Session | None = None
+        self.http_logged_in = False
+        self.api: Api | None = None
+        self.api_logged_in_at = 0.0
+        self.inbounds: dict[int, Inbound] = {}
+        self._cache: dict[tuple, tuple[float, object]] = {}
+        self._load_locks: dict[tuple, threading.Lock] = {}
+        # Увеличивается при сбросе кэша: загрузка, начатая до изменения, не попадёт в кэш
+        self._cache_generation = 0
+
+    def _get_http(self) -> requests.Session:
+        with self.lock:
+            if self.http is None:
+                http = _create_verified_panel_session(self.host_url)
+                # С этим заголовком панель отвечает 401 (а не редиректом на логин) при протухшей сессии
+                http.headers["X-Requested-With"] = "XMLHttpRequest"
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=16)
+                http.mount("https://", adapter)
+                http.mount("http://", adapter)
+                self.http = http
+            return self.http
+
+    def _bind_keepalive(self, api: Api) -> None:
+        """Направляет HTTP-запросы py3xui через общий requests.Session вместо requests.get/post."""
+        http = self._get_http()
+        for name in ("client", "inbound", "database", "server"):
+            sub_api = getattr(api, name, None)
+            if sub_api is None or not hasattr(type(sub_api), "_request_with_retry"):
+                continue
+            if "_request_with_retry" in vars(sub_api):
+                continue
+            original = sub_api._request_with_retry
+
+            def pooled_request(method, url, headers, _original=original, **kwargs):
+                return _original(getattr(http, method.__name__, method), url, headers, **kwargs)
+
+            sub_api._request_with_retry = pooled_request
+
+    def get_api(self, inbound_id: int) -> tuple[Api | None, Inbound | None]:
+        """Возвращает авторизованный Api и inbound, логинясь только при необходимости."""
+        with self.lock:
+            is_fresh = self.api is not None and time.monotonic() - self.api_logged_in_at < PANEL_SESSION_MAX_AGE_SECONDS
+            if is_fresh and inbound_id in self.inbounds:
+                _panel_session_stats['reused'] += 1
+                return self.api, self.inbounds[inbound_id]
+
+            api, inbound = login_to_host(self.host_url, self.username, self.password, inbound_id)
+            if not api or not inbound:
+                return api, inbound
+
+            self._bind_keepalive(api)
+            if api is not self.api:
+                self.inbounds = {}
+            self.api = api
+            self.api_logged_in_at = time.monotonic()
+            self.inbounds[inbound_id] = inbound
+            self._cache.clear()
+            _panel_session_stats['logins'] += 1
+            return api, inbound
+
+    def expire_login(self) -> None:
+        """Сбрасывает авторизацию: следующий вызов выполнит логин заново."""
+        with self.lock:
+            self.api = None
+            self.inbounds = {}
+            self.http_logged_in = False
+            self._cache.clear()
+
+    def invalidate_cache(self) -> None:
+        with self.lock:
+            self._cache.clear()
+            self._cache_generation += 1
+
+    def _cached(self, cache_key: tuple, loader, force: bool):
+        if force:
+            # Свежий объект под изменение: в кэш не кладём, чтобы его не увидели читатели
+            return loader()
+        with self.lock:
+            entry = self._cache.get(cache_key)
+            load_lock = self._load_locks.setdefault(cache_key, threading.Lock())
+        if entry and time.monotonic() - entry[0] < PANEL_INBOUND_CACHE_TTL_SECONDS:
+            _panel_session_stats['cache_hits'] += 1
+            return entry[1]
+        # Одновременные промахи (пакетное обновление ключей) ждут одну загрузку
+        with load_lock:
+            with self.lock:
+                entry = self._cache.get(cache_key)
+            if entry and time.monotonic() - entry[0] < PANEL_INBOUND_CACHE_TTL_SECONDS:
+                _panel_session_stats['cache_hits'] += 1
+                return entry[1]
+            _panel_session_stats['cache_misses'] += 1
+            with self.lock:
+                generation = self._cache_generation
+            now = time.monotonic()
+            value = loader()
+            with self.lock:
+                if generation == self._cache_generation:
+                    self._cache[cache_key] = (now, value)
+            return value
+
+    def get_inbound(self, api: Api, inbound_id: int, force: bool = False) -> Inbound:
+        """api.inbound.get_by_id() с коротким TTL-кэшем.
+
+        Для изменения клиентов используйте force=True: объект из кэша общий,
+        его нельзя модифицировать; force=True загружает inbound в обход кэша.
+        """
+        return self._cached(("inbound", inbound_id), lambda: api.inbound.get_by_id(inbound_id), force)
+
+    def get_inbound_list(self, api: Api, force: bool = False) -> list[Inbound]:
+        """api.inbound.get_list() с коротким TTL-кэшем."""
+        return self._cached(("inbound_list",), api.inbound.get_list, force)
+
+    def http_request(self, method: str, path: str, timeout: float = 10, **kwargs) -> requests.Response:
+        """Запрос к нативному эндпоинту панели через авторизованную keep-alive сессию.
+
+        Логин выполняется при первом запросе и повторяется один раз при ответе 401.
+        Если логин не удался, возвращается ответ на /login.
+        """
+        http = self._get_http()
+        url = f"{self.host_url}/{path.lstrip('/')}"
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self._http_request(http, method, url, timeout, **kwargs)
+            return response
+        finally:
+            _record_panel_call(self.host_url, started, response is not None and response.status_code < 400)
+
+    def _http_request(self, http: requests.Session, method: str, url: str, timeout: float, **kwargs) -> requests.Response:
+        for attempt in range(2):
+            if not self.http_logged_in:
+                login_response = http.post(
+                    f"{self.host_url}/login",
+                    json={"username": self.username, "password": self.password},
+                    timeout=timeout,
+                )
+                if login_response.status_code != 200:
+                    return login_response
+                self.http_logged_in = True
+                _panel_session_stats['logins'] += 1
+            else:
+                _panel_session_stats['reused'] += 1
+            response = http.request(method, url, timeout=timeout, **kwargs)
+            if response.status_code == 401 and attempt == 0:
+                logger.info(f"Panel session for '{self.host_url}' expired (HTTP 401), logging in again")
+                self.http_logged_in = False
+                _panel_session_stats['relogins'] += 1
+                continue
+            return response
+        return response
+
+    def close(self) -> None:
+        with self.lock:
+            if self.http is not None:
+                try:
+                    self.http.close()
+                except Exception:
+                    pass
+            self.http = None
+            self.api = None
+            self.inbounds = {}
+            self.http_logged_in = False
+            self._cache.clear()
+
+
+_panel_sessions: dict[tuple[str, str], _PanelSession] = {}
+_panel_sessions_lock = threading.Lock()
+_panel_session_stats = {'logins': 0, 'reused': 0, 'relogins': 0, 'cache_hits': 0, 'cache_misses': 0}
+
+
+def _record_panel_call(host_url: str, started: float, success: bool) -> None:
+    """Пишет длительность обращения к панели в монитор как операцию panel_api:<хост>."""
+    host = urlparse(host_url).netloc or host_url
+    get_performance_monitor().record_metric_sync(f"panel_api:{host}", time.perf_counter() - started, success=success)
+
+
+def _get_panel_session(host_url: str, username: str, password: str) -> _PanelSession:
+    """Возвращает (создавая при необходимости) сессию панели для пары (URL, логин).
+
+    Смена пароля хоста в админке приводит к созданию новой сессии.
+    """
+    key = (_normalize_host_url(host_url), username)
+    with _panel_sessions_lock:
+        session = _panel_sessions.get(key)
+        if session is None or session.password != password:
+            if session is not None:
+                session.close()
+            session = _PanelSession(host_url, username, password)
+            _panel_sessions[key] = session
+        return session
+
+
+def get_panel_api(host_url: str, username: str, password: str, inbound_id: int) -> tuple[Api | None, Inbound | None]:
+    """Аналог login_to_host(), переиспользующий авторизованную сессию хоста."""
+    return _get_panel_session(host_url, username, password).get_api(inbound_id)
+
+
+def run_panel_operation(host_data: dict, operation, mutates: bool = False):
+    """Выполняет operation(api, inbound, session) на авторизованной сессии хоста.
+
+    При протухшей сессии (401) выполняет повторный логин и один повтор операции.
+    mutates=True сбрасывает кэш inbound'ов хоста после операции.
+    Блокирующая функция — из async-кода вызывайте через asyncio.to_thread.
+
+    Raises:
+        PanelLoginError: если не удалось авторизоваться или найти inbound
+    """
+    session = _get_panel_session(host_data['host_url'], host_data['host_username'], host_data['host_pass'])
+    if mutates:
+        session.mutation_lock.acquire()
+    started = time.perf_counter()
+    success = False
+    try:
+        for attempt in range(2):
+            api, inbound = session.get_api(host_data['host_inbound_id'])
+            if not api or not inbound:
+                raise PanelLoginError(f"Could not log in or find inbound {host_data['host_inbound_id']} on '{session.host_url}'")
+            try:
+                result = operation(api, inbound, session)
+                success = True
+                return result
+            except Exception as e:
+                if attempt == 0 and _is_panel_auth_error(e):
+                    logger.info(f"Panel session for '{session.host_url}' expired, logging in again")
+                    session.expire_login()
+                    _panel_session_stats['relogins'] += 1
+                    continue
+                raise
+    finally:
+        _record_panel_call(session.host_url, started, success)
+        if mutates:
+            invalidate_panel_cache(host_data['host_url'])
+            session.mutation_lock.release()
+
+
+def invalidate_panel_cache(host_url: str | None = None) -> None:
+    """Сбрасывает кэш inbound'ов для хоста (или для всех хостов, если host_url не задан).
+
+    Затрагивает и py3xui-сессии, и нативные aiohttp-клиенты.
+    """
+    normalized = _normalize_host_url(host_url) if host_url else None
+    with _panel_sessions_lock:
+        sessions = [s for (url, _), s in _panel_sessions.items() if normalized is None or url == normalized]
+        sessions += [c for (url, _), c in _async_panel_clients.items() if normalized is None or url == normalized]
+    for session in sessions:
+        session.invalidate_cache()
+
+
+def reset_panel_sessions() -> None:
+    """Закрывает все сессии панелей (смена настроек хостов, тесты)."""
+    with _panel_sessions_lock:
+        sessions = list(_panel_sessions.values())
+        _panel_sessions.clear()
+        async_clients = list(_async_panel_clients.values())
+        _async_panel_clients.clear()
+    for session in sessions:
+        session.close()
+    for client in async_clients:
+        client.close_sessions()
+
+
+def get_panel_session_stats() -> dict:
+    """Счётчики кэша сессий: логины, переиспользования, повторные логины, попадания в кэш inbound'ов."""
+    with _panel_sessions_lock:
+        active = len(_panel_sessions)
+    return {**_panel_session_stats, 'sessions': active}
+
+class PanelClientBatch:
+    """Пакет изменений клиентов одного inbound 3x-ui.
+
+    Inbound загружается один раз, добавления/изменения/удаления копятся в памяти
+    и фиксируются commit() за минимум запросов к панели: один inbound.update
+    для изменений и удалений и один client.add для всех новых клиентов.
+    Перед inbound.update inbound перечитывается, и изменения пакета
+    накладываются на свежий список клиентов, поэтому клиенты и счётчики
+    трафика, изменённые в панели после загрузки снимка, не перезаписываются.
+    """
+
+    def __init__(self, inbound: Inbound):
+        self.inbound = inbound
+        self.clients: dict[str, Client] = {
+            client.email: client for client in (inbound.settings.clients or [])
+        }
+        self._added: dict[str, Client] = {}
+        self._updated: dict[str, dict] = {}
+        self._deleted: dict[str, Client] = {}
+        self.result: dict | None = None
+
+    def get(self, email: str) -> Client | None:
+        """Клиент из снимка inbound (с учётом изменений пакета)."""
+        return self._added.get(email) or self.clients.get(email)
+
+    def add(self, client: Client) -> None:
+        if self.get(client.email) is not None:
+            raise ValueError(f"Client '{client.email}' already exists in inbound {self.inbound.id}")
+        self._deleted.pop(client.email, None)
+        self._added[client.email] = client
+
+    def update(self, email: str, **fields) -> bool:
+        """Меняет поля клиента (enable=False, expiry_time=... и т.п.). False, если клиента нет."""
+        client = self.get(email)
+        if client is None:
+            return False
+        for name, value in fields.items():
+            setattr(client, name, value)
+        if email in self.clients:
+            self._updated.setdefault(email, {}).update(fields)
+        return True
+
+    def delete(self, email: str) -> bool:
+        """Помечает клиента на удаление. False, если клиента нет."""
+        if self._added.pop(email, None) is not None:
+            return True
+        client = self.clients.pop(email, None)
+        if client is None:
+            return False
+        self._updated.pop(email, None)
+        self._deleted[email] = client
+        return True
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self._added or self._updated or self._deleted)
+
+    def commit(self, api: Api) -> dict:
+        """Отправляет накопленные изменения в панель.
+
+        Сначала inbound.update со свежим списком клиентов, из которого убраны
+        удалённые и в котором изменены поля обновлённых клиентов, затем
+        client.add: в обратном порядке список без новых клиентов удалил бы их.
+        """
+        requests_made = 0
+        if self._updated or self._deleted:
+            inbound = api.inbound.get_by_id(self.inbound.id)
+            requests_made += 1
+            clients = []
+            for client in inbound.settings.clients or []:
+                if client.email in self._deleted:
+                    continue
+                for name, value in self._updated.get(client.email, {}).items():
+                    setattr(client, name, value)
+                clients.append(client)
+            inbound.settings.clients = clients
+            api.inbound.update(inbound.id, inbound)
+            requests_made += 1
+            self.inbound = inbound
+            self.clients = {client.email: client for client in clients}
+        if self._added:
+            api.client.add(self.inbound.id, list(self._added.values()))
+            requests_made += 1
+            self.clients.update(self._added)
+        self.result = {
+            'added': len(self._added),
+            'updated': len(self._updated),
+            'deleted': len(self._deleted),
+            'requests': requests_made,
+        }
+        logger.info(
+            f"Committed client batch on inbound {self.inbound.id}: "
+            f"{self.result['added']} added, {self.result['updated']} updated, "
+            f"{self.result['deleted']} deleted in {requests_made} request(s)"
+        )
+        self._added, self._updated, self._deleted = {}, {}, {}
+        return self.result
+
+
+@contextmanager
+def panel_client_batch(host_data: dict):
+    """Пакетное изменение клиентов хоста: свежая загрузка inbound и commit при выходе.
+
+    На время блока удерживается блокировка изменений хоста, поэтому одиночные
+    операции с клиентами в этом процессе не перезапишут снимок пакета.
+    При исключении внутри блока изменения в панель не отправляются.
+    Блокирующая функция — из async-кода вызывайте через asyncio.to_thread.
+
+    Пример:
+        with panel_client_batch(host) as batch:
+            for email in expired_emails:
+                batch.delete(email)
+        print(batch.result)
+
+    Raises:
+        PanelLoginError: если не удалось авторизоваться или найти inbound
+    """
+    session = _get_panel_session(host_data['host_url'], host_data['host_username'], host_data['host_pass'])
+    with session.mutation_lock:
+        batch = run_panel_operation(
+            host_data,
+            lambda api, inbound, session: PanelClientBatch(session.get_inbound(api, inbound.id, force=True)),
+        )
+        yield batch
+        if batch.has_changes:
+            run_panel_operation(host_data, lambda api, inbound, session: batch.commit(api), mutates=True)
+        else:
+            batch.result = {'added': 0, 'updated': 0, 'deleted': 0, 'requests': 0}
+
+
+# Нативный aiohttp-клиент панели: общий таймаут и таймаут соединения на вызов (секунды)
+PANEL_HTTP_TIMEOUT_SECONDS = 15
+PANEL_HTTP_CONNECT_TIMEOUT_SECONDS = 5
+# Максимум одновременных соединений с одной панелью
+PANEL_HTTP_CONNECTIONS_PER_HOST = 8
+
+
+def is_async_panel_client_enabled() -> bool:
+    """Включён ли нативный aiohttp-клиент панели (переменная окружения XUI_ASYNC_CLIENT).
+
+    Без неё операции с ключами идут через py3xui в рабочих потоках.
+    """
+    value = os.getenv(_ASYNC_CLIENT_ENV)
+    return bool(value) and value.strip().lower() in {"1", "true", "on", "yes"}
+
+
+class _AsyncLoopState:
+    """ClientSession и состояние логина для одного event loop."""
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self.login_lock = asyncio.Lock()
+        self.logged_in = False
+
+
+class AsyncPanelClient:
+    """Нативный aiohttp-клиент панели 3x-ui.
+
+    На хост (и event loop) держится один ClientSession с пулом keep-alive
+    соединений; каждый вызов ограничен таймаутом, логин выполняется при первом
+    запросе и повторяется один раз при 401. Ответы разбираются в модели py3xui,
+    поэтому get_connection_string() и разбор клиентов работают как в py3xui-пути.
+    """
+
+    def __init__(self, host_url: str, username: str, password: str):
+        self.raw_host_url = host_url
+        self.host_url = _normalize_host_url(host_url)
+        self.username = username
+        self.password = password
+        self._states: dict[asyncio.AbstractEventLoop, _AsyncLoopState] = {}
+        self._cache: dict[tuple, tuple[float, object]] = {}
+        self._cache_generation = 0
+
+    def _new_session(self) -> aiohttp.ClientSession:
+        verify = _resolve_tls_verify_option(self.host_url)
+        if verify is False:
+            ssl_option = False
+        elif isinstance(verify, str):
+            ssl_option = ssl.create_default_context(cafile=verify)
+        else:
+            ssl_option = True
+        connector = aiohttp.TCPConnector(limit_per_host=PANEL_HTTP_CONNECTIONS_PER_HOST, ssl=ssl_option)
+        return aiohttp.ClientSession(
+            connector=connector,
+            # Панели часто доступны по IP — cookie сессии нужно принимать и для них
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            # С этим заголовком панель отвечает 401 (а не редиректом на логин) при протухшей сессии
+            headers={**_panel_default_headers(), "X-Requested-With": "XMLHttpRequest"},
+            timeout=aiohttp.ClientTimeout(total=PANEL_HTTP_TIMEOUT_SECONDS, connect=PANEL_HTTP_CONNECT_TIMEOUT_SECONDS),
+        )
+
+    def _state(self) -> _AsyncLoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None or state.session.closed:
+            # Сессии закрытых loop'ов (asyncio.run во Flask-маршрутах) больше не понадобятся
+            for stale_loop in [l for l in self._states if l.is_closed()]:
+                self._states.pop(stale_loop, None)
+            state = _AsyncLoopState(self._new_session())
+            self._states[loop] = state
+        return state
+
+    async def _login(self, state: _AsyncLoopState) -> None:
+        async with state.session.post(
+            f"{self.host_url}/login",
+            json={"username": self.username, "password": self.password},
+        ) as response:
+            status = response.status
+            data = await response.json(content_type=None) if status == 200 else None
+        if status != 200 or not isinstance(data, dict) or not data.get('success'):
+            raise PanelLoginError(f"Login to '{self.host_url}' failed (HTTP {status})")
+        state.logged_in = True
+        _panel_session_stats['logins'] += 1
+
+    async def request(self, method: str, path: str, json_body: dict | None = None, timeout: float | None = None) -> dict:
+        """Запрос к API панели; возвращает разобранный JSON с success=true.
+
+        Длительность и исход вызова пишутся в монитор как panel_api:<хост>.
+
+        Raises:
+            PanelLoginError: если не удалось авторизоваться
+            ValueError: если панель ответила ошибкой (success=false или HTTP != 200)
+            asyncio.TimeoutError, aiohttp.ClientError: сетевые ошибки
+        """
+        state = self._state()
+        url = f"{self.host_url}/{path.lstrip('/')}"
+        kwargs = {}
+        if json_body is not None:
+            kwargs['json'] = json_body
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+
+        started = time.perf_counter()
+        success = False
+        try:
+            data = await self._request(state, method, url, path, kwargs)
+            success = True
+            return data
+        finally:
+            _record_panel_call(self.host_url, started, success)
+
+    async def _request(self, state: _AsyncLoopState, method: str, url: str, path: str, kwargs: dict) -> dict:
+        for attempt in range(2):
+            if not state.logged_in:
+                async with state.login_lock:
+                    if not state.logged_in:
+                        await self._login(state)
+            else:
+                _panel_session_stats['reused'] += 1
+            async with state.session.request(method, url, **kwargs) as response:
+                status = response.status
+                text = await response.text()
+            # Протухшая сессия: 401 или HTML-страница логина вместо JSON (старые сборки)
+            if status == 401 or (status == 200 and text.lstrip().startswith('<')):
+                if attempt == 0:
+                    logger.info(f"Panel session for '{self.host_url}' expired (HTTP {status}), logging in again")
+                    state.logged_in = False
+                    _panel_session_stats['relogins'] += 1
+                    continue
+                raise PanelLoginError(f"Panel '{self.host_url}' rejected the session after re-login")
+            if status != 200:
+                raise ValueError(f"Panel '{self.host_url}' returned HTTP {status} for {path}")
+            data = json.loads(text) if text.strip() else {}
+            if not data.get('success'):
+                raise ValueError(f"Response status is not successful, message: {data.get('msg')}")
+            return data
+
+    async def _cached(self, cache_key: tuple, loader, force: bool):
+        if force:
+            # Свежий объект под изменение: в кэш не кладём, чтобы его не увидели читатели
+            return await loader()
+        now = time.monotonic()
+        entry = self._cache.get(cache_key)
+        if entry and now - entry[0] < PANEL_INBOUND_CACHE_TTL_SECONDS:
+            _panel_session_stats['cache_hits'] += 1
+            return entry[1]
+        _panel_session_stats['cache_misses'] += 1
+        generation = self._cache_generation
+        value = await loader()
+        # Мутация во время загрузки сбросила кэш — прочитанный inbound уже устарел
+        if generation == self._cache_generation:
+            self._cache[cache_key] = (now, value)
+        return value
+
+    def invalidate_cache(self) -> None:
+        self._cache.clear()
+        self._cache_generation += 1
+
+    async def get_inbound(self, inbound_id: int, force: bool = False) -> Inbound:
+        """Inbound по ID с коротким TTL-кэшем; для изменения используйте force=True."""
+        async def load():
+            data = await self.request("GET", f"panel/api/inbounds/get/{inbound_id}")
+            return Inbound.model_validate(data.get('obj'))
+        return await self._cached(("inbound", inbound_id), load, force)
+
+    async def get_inbound_list(self, force: bool = False) -> list[Inbound]:
+        async def load():
+            data = await self.request("GET", "panel/api/inbounds/list")
+            return [Inbound.model_validate(item) for item in (data.get('obj') or [])]
+        return await self._cached(("inbound_list",), load, force)
+
+    async def get_inbound_with_stats(self, inbound_id: int, force: bool = False) -> Inbound:
+        """Inbound с clientStats (на некоторых сборках get/{id} их не возвращает)."""
+        inbound = await self.get_inbound(inbound_id, force=force)
+        if inbound.client_stats:
+            return inbound
+        for item in await self.get_inbound_list(force=force):
+            if item.id == inbound_id:
+                return item
+        return inbound
+
+    async def add_clients(self, inbound_id: int, clients: list[Client]) -> None:
+        settings = {"clients": [client.model_dump(by_alias=True, exclude_defaults=True) for client in clients]}
+        try:
+            await self.request("POST", "panel/api/inbounds/addClient", {"id": inbound_id, "settings": json.dumps(settings)})
+        finally:
+            invalidate_panel_cache(self.host_url)
+
+    async def update_client(self, inbound_id: int, client: Client) -> None:
+        settings = {"clients": [client.model_dump(by_alias=True, exclude_defaults=True)]}
+        try:
+            await self.request("POST", f"panel/api/inbounds/updateClient/{client.id}", {"id": inbound_id, "settings": json.dumps(settings)})
+        finally:
+            invalidate_panel_cache(self.host_url)
+
+    async def delete_client(self, inbound_id: int, client_uuid: str) -> None:
+        try:
+            await self.request("POST", f"panel/api/inbounds/{inbound_id}/delClient/{client_uuid}", {})
+        finally:
+            invalidate_panel_cache(self.host_url)
+
+    async def get_sub_uri(self) -> str | None:
+        """subURI из настроек панели (общий кэш с get_sub_uri_from_panel)."""
+        cache_key = f"{self.raw_host_url}:{self.username}"
+        if cache_key in _sub_uri_cache:
+            return _sub_uri_cache[cache_key]
+        try:
+            data = await self.request("POST", "panel/setting/all")
+        except (PanelLoginError, ValueError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Failed to get settings from {self.host_url}: {e}")
+            return None
+        sub_uri = _sub_uri_from_settings(self.host_url, data.get('obj') or {})
+        if sub_uri:
+            _sub_uri_cache[cache_key] = sub_uri
+        return sub_uri
+
+    async def close(self) -> None:
+        """Закрывает ClientSession текущего event loop."""
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is not None and not state.session.closed:
+            await state.session.close()
+
+    def close_sessions(self) -> None:
+        """Закрывает ClientSession всех event loop'ов из синхронного кода.
+
+        Простаивающий loop выполняет закрытие сразу; в работающем loop (или
+        если текущий поток сам выполняет loop) закрытие планируется в loop
+        сессии. Сессии закрытых loop'ов закрыть уже нельзя.
+        """
+        try:
+            asyncio.get_running_loop()
+            inside_loop = True
+        except RuntimeError:
+            inside_loop = False
+        states, self._states = self._states, {}
+        self.invalidate_cache()
+        for loop, state in states.items():
+            if state.session.closed or loop.is_closed():
+                continue
+            if loop.is_running() or inside_loop:
+                asyncio.run_coroutine_threadsafe(state.session.close(), loop)
+            else:
+                loop.run_until_complete(state.session.close())
+
+
+_async_panel_clients: dict[tuple[str, str], AsyncPanelClient] = {}
+
+
+def get_async_panel_client(host_data: dict) -> AsyncPanelClient:
+    """Возвращает (создавая при необходимости) нативный клиент панели хоста."""
+    key = (_normalize_host_url(host_data['host_url']), host_data['host_username'])
+    with _panel_sessions_lock:
+        client = _async_panel_clients.get(key)
+        if client is None or client.password != host_data['host_pass']:
+            client = AsyncPanelClient(host_data['host_url'], host_data['host_username'], host_data['host_pass'])
+            _async_panel_clients[key] = client
+        return client
+
+
+async def close_async_panel_clients() -> None:
+    """Закрывает сессии нативных клиентов панели в текущем event loop (при остановке бота)."""
+    with _panel_sessions_lock:
+        clients = list(_async_panel_clients.values())
+    for client in clients:
+        await client.close()
+
+
 def get_connection_string(inbound: Inbound, user_uuid: str, host_url: str, remark: str) -> str | None:
     if not inbound: 
         return None
@@ -431,26 +1137,23 @@ def update_client_quota_on_host(host_name: str, email: str, traffic_bytes: int)
         # Если API панели не сработал, пробуем через py3xui как fallback
         logger.warning(f"Panel API failed for '{email}', trying py3xui fallback")
         
-        api, inbound = login_to_host(
-            host_data['host_url'],
-            host_data['host_username'], 
-            host_data['host_pass'],
-            host_data['host_inbound_id']
-        )
-        
-        if not api or not inbound:
+        try:
+            # Используем старый метод через py3xui на закэшированной сессии хоста
+            client_uuid, new_expiry_ms = run_panel_operation(
+                host_data,
+                lambda api, inbound, session: update_or_create_client_on_panel(
+                    api,
+                    inbound.id,
+                    email,
+                    days_to_add=0,  # Не изменяем срок действия
+                    comment=str(key_data['user_id']),
+                    traffic_gb=traffic_bytes / (1024 * 1024 * 1024)  # Конвертируем в гигабайты
+                ),
+                mutates=True,
+            )
+        except PanelLoginError:
             logger.error(f"Failed to connect to host '{host_name}' via py3xui")
             return False
-            
-        # Используем старый метод через py3xui
-        client_uuid, new_expiry_ms = update_or_create_client_on_panel(
-            api, 
-            inbound.id, 
-            email, 
-            days_to_add=0,  # Не изменяем срок действия
-            comment=str(key_data['user_id']),
-            traffic_gb=traffic_bytes / (1024 * 1024 * 1024)  # Конвертируем в гигабайты
-        )
         
         if client_uuid:
             logger.info(f"Successfully updated quota for '{email}' on host '{host_name}' to {traffic_bytes} bytes via py3xui fallback")
@@ -463,198 +1166,220 @@ def update_client_quota_on_host(host_name: str, email: str, traffic_bytes: int)
         logger.error(f"Error updating quota for '{email}' on host '{host_name}': {e}", exc_info=True)
         return False
 
-def update_or_create_client_on_panel(api: Api, inbound_id: int, email: str, days_to_add: float, comment: str | None = None, traffic_gb: float | None = None, sub_id: str | None = None, telegram_chat_id: int | None = None) -> tuple[str | None, int | None]:
-    try:
-        # Нормализуем days_to_add, т.к. настройки могут вернуть строку
-        try:
-            days_to_add = float(days_to_add)
-        except Exception:
-            days_to_add = 0.0
-        inbound_to_modify = api.inbound.get_by_id(inbound_id)
-        if not inbound_to_modify:
-            raise ValueError(f"Could not find inbound with ID {inbound_id}")
+def _apply_client_upsert(inbound_to_modify: Inbound, email: str, days_to_add: float, comment: str | None = None, traffic_gb: float | None = None, sub_id: str | None = None, telegram_chat_id: int | None = None) -> tuple[str, int, Client | None]:
+    """Создаёт или продлевает клиента в объекте inbound (без запросов к панели).
 
-        if inbound_to_modify.settings.clients is None:
-            inbound_to_modify.settings.clients = []
-            
-        client_index = -1
-        for i, client in enumerate(inbound_to_modify.settings.clients):
-            if client.email == email:
-                client_index = i
-                break
-        
-        # Используем UTC для совместимости с 3x-ui
-        from datetime import timezone, timedelta
-        utc_tz = timezone.utc
-        utc_now = datetime.now(utc_tz)
+    Возвращает (client_uuid, new_expiry_ms, updated_client), где updated_client —
+    отдельный объект клиента для дополнительного client.update (или None).
+    Используется и py3xui-путём, и нативным aiohttp-клиентом.
+    """
+    # Нормализуем days_to_add, т.к. настройки могут вернуть строку
+    try:
+        days_to_add = float(days_to_add)
+    except Exception:
+        days_to_add = 0.0
+    if inbound_to_modify.settings.clients is None:
+        inbound_to_modify.settings.clients = []
         
-        if client_index != -1:
-            existing_client = inbound_to_modify.settings.clients[client_index]
-            if existing_client.expiry_time > int(utc_now.timestamp() * 1000):
-                current_expiry_dt = datetime.fromtimestamp(existing_client.expiry_time / 1000, tz=utc_tz)
-                new_expiry_dt = current_expiry_dt + timedelta(days=days_to_add)
-            else:
-                new_expiry_dt = utc_now + timedelta(days=days_to_add)
+    client_index = -1
+    for i, client in enumerate(inbound_to_modify.settings.clients):
+        if client.email == email:
+            client_index = i
+            break
+    
+    # Используем UTC для совместимости с 3x-ui
+    from datetime import timezone, timedelta
+    utc_tz = timezone.utc
+    utc_now = datetime.now(utc_tz)
+    
+    if client_index != -1:
+        existing_client = inbound_to_modify.settings.clients[client_index]
+        if existing_client.expiry_time > int(utc_now.timestamp() * 1000):
+            current_expiry_dt = datetime.fromtimestamp(existing_client.expiry_time / 1000, tz=utc_tz)
+            new_expiry_dt = current_expiry_dt + timedelta(days=days_to_add)
         else:
             new_expiry_dt = utc_now + timedelta(days=days_to_add)
+    else:
+        new_expiry_dt = utc_now + timedelta(days=days_to_add)
 
-        new_expiry_ms = int(new_expiry_dt.timestamp() * 1000)
+    new_expiry_ms = int(new_expiry_dt.timestamp() * 1000)
 
-        # Подготовим лимит трафика
-        traffic_bytes = None
-        if traffic_gb is not None:
+    # Подготовим лимит трафика
+    traffic_bytes = None
+    if traffic_gb is not None:
+        try:
+            traffic_gb_val = float(traffic_gb)
+            traffic_bytes = int(traffic_gb_val * 1024 * 1024 * 1024)
+            if traffic_bytes < 0:
+                traffic_bytes = 0
+        except Exception:
+            traffic_bytes = None
+            traffic_gb_val = None
+
+    if client_index != -1:
+        c = inbound_to_modify.settings.clients[client_index]
+        c.expiry_time = new_expiry_ms
+        c.enable = True
+        try:
+            if comment is not None:
+                setattr(c, 'comment', comment)
+            else:
+                setattr(c, 'comment', "")
+        except Exception:
+            pass
+        # Обновляем subscription для существующих клиентов
+        if sub_id:
+            try:
+                setattr(c, 'subId', sub_id)
+                setattr(c, 'subscription', sub_id)
+            except Exception:
+                pass
+        before_total = getattr(c, 'total', None)
+        before_totalGB = getattr(c, 'totalGB', None)
+        if traffic_bytes is not None:
+            try:
+                setattr(c, 'total', int(traffic_bytes))  # bytes
+            except Exception:
+                pass
+            try:
+                # totalGB должен быть в байтах, как и total
+                setattr(c, 'totalGB', int(traffic_bytes))
+            except Exception:
+                pass
+        after_total = getattr(c, 'total', None)
+        after_totalGB = getattr(c, 'totalGB', None)
+        try:
+            from shop_bot.webhook_server.app import logger as app_logger
+            app_logger.info(f"XUI set traffic for {email}: before total={before_total}, totalGB={before_totalGB} -> after total={after_total}, totalGB={after_totalGB}")
+        except Exception:
+            pass
+        client_uuid = c.id
+    else:
+        client_uuid = str(uuid.uuid4())
+        new_client = Client(
+            id=client_uuid,
+            email=email,
+            enable=True,
+            flow="xtls-rprx-vision"
+        )
+        # Устанавливаем expiry_time через setattr
+        setattr(new_client, 'expiry_time', new_expiry_ms)
+        try:
+            if comment is not None:
+                setattr(new_client, 'comment', comment)
+            else:
+                setattr(new_client, 'comment', "")
+        except Exception:
+            pass
+        # Устанавливаем subId для поддержки subscription (пробуем разные варианты)
+        if sub_id:
+            try:
+                setattr(new_client, 'sub_id', sub_id)
+                setattr(new_client, 'subId', sub_id)
+                setattr(new_client, 'subscription', sub_id)
+            except Exception:
+                pass
+        # Устанавливаем telegram_chat_id
+        if telegram_chat_id:
+            try:
+                setattr(new_client, 'tg_id', telegram_chat_id)
+                setattr(new_client, 'tgId', telegram_chat_id)
+            except Exception:
+                pass
+        elif email and 'user' in email:
+            # Fallback: извлекаем user_id из email (user6044240344-key1@host.bot)
             try:
-                traffic_gb_val = float(traffic_gb)
-                traffic_bytes = int(traffic_gb_val * 1024 * 1024 * 1024)
-                if traffic_bytes < 0:
-                    traffic_bytes = 0
+                parts = email.split('@')[0].split('-')
+                if parts and parts[0].startswith('user'):
+                    user_id = parts[0][4:]  # убираем 'user'
+                    setattr(new_client, 'tg_id', int(user_id))
+                    setattr(new_client, 'tgId', int(user_id))
             except Exception:
-                traffic_bytes = None
-                traffic_gb_val = None
+                pass
+        if traffic_bytes is not None:
+            try:
+                setattr(new_client, 'total', int(traffic_bytes))  # bytes
+            except Exception:
+                pass
+            try:
+                # totalGB должен быть в байтах, как и total
+                setattr(new_client, 'totalGB', int(traffic_bytes))
+            except Exception:
+                pass
+        inbound_to_modify.settings.clients.append(new_client)
 
-        if client_index != -1:
-            c = inbound_to_modify.settings.clients[client_index]
-            c.expiry_time = new_expiry_ms
-            c.enable = True
+    # Объект для дополнительного client.update
+    updated_client = None
+    try:
+        updated_client = Client(
+            id=client_uuid,
+            email=email,
+            enable=True,
+            flow="xtls-rprx-vision"
+        )
+        # Устанавливаем expiry_time через setattr
+        setattr(updated_client, 'expiry_time', new_expiry_ms)
+        # Устанавливаем subId для поддержки subscription (пробуем разные варианты)
+        if sub_id:
             try:
-                if comment is not None:
-                    setattr(c, 'comment', comment)
-                else:
-                    setattr(c, 'comment', "")
+                setattr(updated_client, 'sub_id', sub_id)
+                setattr(updated_client, 'subId', sub_id)
+                setattr(updated_client, 'subscription', sub_id)
             except Exception:
                 pass
-            # Обновляем subscription для существующих клиентов
-            if sub_id:
-                try:
-                    setattr(c, 'subId', sub_id)
-                    setattr(c, 'subscription', sub_id)
-                except Exception:
-                    pass
-            before_total = getattr(c, 'total', None)
-            before_totalGB = getattr(c, 'totalGB', None)
-            if traffic_bytes is not None:
-                try:
-                    setattr(c, 'total', int(traffic_bytes))  # bytes
-                except Exception:
-                    pass
-                try:
-                    # totalGB должен быть в байтах, как и total
-                    setattr(c, 'totalGB', int(traffic_bytes))
-                except Exception:
-                    pass
-            after_total = getattr(c, 'total', None)
-            after_totalGB = getattr(c, 'totalGB', None)
+        # Устанавливаем telegram_chat_id
+        if telegram_chat_id:
             try:
-                from shop_bot.webhook_server.app import logger as app_logger
-                app_logger.info(f"XUI set traffic for {email}: before total={before_total}, totalGB={before_totalGB} -> after total={after_total}, totalGB={after_totalGB}")
+                setattr(updated_client, 'tg_id', telegram_chat_id)
+                setattr(updated_client, 'tgId', telegram_chat_id)
             except Exception:
                 pass
-            client_uuid = c.id
-        else:
-            client_uuid = str(uuid.uuid4())
-            new_client = Client(
-                id=client_uuid,
-                email=email,
-                enable=True,
-                flow="xtls-rprx-vision"
-            )
-            # Устанавливаем expiry_time через setattr
-            setattr(new_client, 'expiry_time', new_expiry_ms)
+        elif email and 'user' in email:
+            # Fallback: извлекаем user_id из email (user6044240344-key1@host.bot)
             try:
-                if comment is not None:
-                    setattr(new_client, 'comment', comment)
-                else:
-                    setattr(new_client, 'comment', "")
+                parts = email.split('@')[0].split('-')
+                if parts and parts[0].startswith('user'):
+                    user_id = parts[0][4:]  # убираем 'user'
+                    setattr(updated_client, 'tg_id', int(user_id))
+                    setattr(updated_client, 'tgId', int(user_id))
             except Exception:
                 pass
-            # Устанавливаем subId для поддержки subscription (пробуем разные варианты)
-            if sub_id:
-                try:
-                    setattr(new_client, 'sub_id', sub_id)
-                    setattr(new_client, 'subId', sub_id)
-                    setattr(new_client, 'subscription', sub_id)
-                except Exception:
-                    pass
-            # Устанавливаем telegram_chat_id
-            if telegram_chat_id:
-                try:
-                    setattr(new_client, 'tg_id', telegram_chat_id)
-                    setattr(new_client, 'tgId', telegram_chat_id)
-                except Exception:
-                    pass
-            elif email and 'user' in email:
-                # Fallback: извлекаем user_id из email (user6044240344-key1@host.bot)
-                try:
-                    parts = email.split('@')[0].split('-')
-                    if parts and parts[0].startswith('user'):
-                        user_id = parts[0][4:]  # убираем 'user'
-                        setattr(new_client, 'tg_id', int(user_id))
-                        setattr(new_client, 'tgId', int(user_id))
-                except Exception:
-                    pass
-            if traffic_bytes is not None:
-                try:
-                    setattr(new_client, 'total', int(traffic_bytes))  # bytes
-                except Exception:
-                    pass
-                try:
-                    # totalGB должен быть в байтах, как и total
-                    setattr(new_client, 'totalGB', int(traffic_bytes))
-                except Exception:
-                    pass
-            inbound_to_modify.settings.clients.append(new_client)
+        if traffic_bytes is not None:
+            try:
+                setattr(updated_client, 'total', int(traffic_bytes))  # bytes
+            except Exception:
+                pass
+            try:
+                # totalGB должен быть в байтах, как и total
+                setattr(updated_client, 'totalGB', int(traffic_bytes))
+            except Exception:
+                pass
+    except Exception:
+        updated_client = None
+
+    return client_uuid, new_expiry_ms, updated_client
+
+
+def update_or_create_client_on_panel(api: Api, inbound_id: int, email: str, days_to_add: float, comment: str | None = None, traffic_gb: float | None = None, sub_id: str | None = None, telegram_chat_id: int | None = None) -> tuple[str | None, int | None]:
+    try:
+        inbound_to_modify = api.inbound.get_by_id(inbound_id)
+        if not inbound_to_modify:
+            raise ValueError(f"Could not find inbound with ID {inbound_id}")
+
+        client_uuid, new_expiry_ms, updated_client = _apply_client_upsert(
+            inbound_to_modify, email, days_to_add, comment, traffic_gb, sub_id, telegram_chat_id
+        )
 
         api.inbound.update(inbound_id, inbound_to_modify)
 
         # Дополнительно client.update
         try:
-            updated_client = Client(
-                id=client_uuid,
-                email=email,
-                enable=True,
-                flow="xtls-rprx-vision"
-            )
-            # Устанавливаем expiry_time через setattr
-            setattr(updated_client, 'expiry_time', new_expiry_ms)
-            # Устанавливаем subId для поддержки subscription (пробуем разные варианты)
-            if sub_id:
-                try:
-                    setattr(updated_client, 'sub_id', sub_id)
-                    setattr(updated_client, 'subId', sub_id)
-                    setattr(updated_client, 'subscription', sub_id)
-                except Exception:
-                    pass
-            # Устанавливаем telegram_chat_id
-            if telegram_chat_id:
-                try:
-                    setattr(updated_client, 'tg_id', telegram_chat_id)
-                    setattr(updated_client, 'tgId', telegram_chat_id)
-                except Exception:
-                    pass
-            elif email and 'user' in email:
-                # Fallback: извлекаем user_id из email (user6044240344-key1@host.bot)
-                try:
-                    parts = email.split('@')[0].split('-')
-                    if parts and parts[0].startswith('user'):
-                        user_id = parts[0][4:]  # убираем 'user'
-                        setattr(updated_client, 'tg_id', int(user_id))
-                        setattr(updated_client, 'tgId', int(user_id))
-                except Exception:
-                    pass
-            if traffic_bytes is not None:
-                try:
-                    setattr(updated_client, 'total', int(traffic_bytes))  # bytes
-                except Exception:
-                    pass
-                try:
-                    # totalGB должен быть в байтах, как и total
-                    setattr(updated_client, 'totalGB', int(traffic_bytes))
-                except Exception:
-                    pass
+            if updated_client is None:
+                raise ValueError("client object for client.update was not built")
             api.client.update(str(inbound_id), updated_client)
             try:
                 from shop_bot.webhook_server.app import logger as app_logger
-                app_logger.info(f"XUI client.update pushed for {email}: total(bytes)={traffic_bytes}")
+                app_logger.info(f"XUI client.update pushed for {email}: total(bytes)={getattr(updated_client, 'total', None)}")
             except Exception:
                 pass
         except Exception:
@@ -676,6 +1401,9 @@ def update_or_create_client_on_panel(api: Api, inbound_id: int, email: str, days
         return str(client_uuid) if client_uuid else None, new_expiry_ms
 
     except Exception as e:
+        if _is_panel_auth_error(e):
+            # Протухшая сессия: пробрасываем, run_panel_operation залогинится заново
+            raise
         logger.error(f"Error in update_or_create_client_on_panel: {e}", exc_info=True)
         return None, None
 
@@ -698,15 +1426,19 @@ async def create_or_update_key_on_host(host_name: str, email: str, days_to_add:
         logger.error(f"Workflow failed: Host not found (name: '{host_name}', code: '{host_code}').")
         return None
 
+    if is_async_panel_client_enabled():
+        return await _create_or_update_key_native(host_data, host_name, email, days_to_add, comment, traffic_gb, sub_id, telegram_chat_id)
+
     logger.info(f"Attempting to connect to host '{host_name}' at {host_data['host_url']}")
-    # ВАЖНО: login_to_host выполняет сетевые операции и использует time.sleep,
+    # ВАЖНО: логин выполняет сетевые операции и использует time.sleep,
     # поэтому выносим его в отдельный поток, чтобы не блокировать event loop.
+    # Авторизованная сессия хоста переиспользуется между вызовами.
     api, inbound = await asyncio.to_thread(
-        login_to_host,
-        host_url=host_data['host_url'],
-        username=host_data['host_username'],
-        password=host_data['host_pass'],
-        inbound_id=host_data['host_inbound_id']
+        get_panel_api,
+        host_data['host_url'],
+        host_data['host_username'],
+        host_data['host_pass'],
+        host_data['host_inbound_id'],
     )
     if not api or not inbound:
         logger.error(f"Workflow failed: Could not log in or find inbound on host '{host_name}'.")
@@ -715,17 +1447,17 @@ async def create_or_update_key_on_host(host_name: str, email: str, days_to_add:
     logger.info(f"Successfully connected to host '{host_name}', attempting to create/update client '{email}'")
     # update_or_create_client_on_panel использует py3xui (синхронные HTTP-вызовы),
     # поэтому также выполняем его в отдельном потоке.
-    client_uuid, new_expiry_ms = await asyncio.to_thread(
-        update_or_create_client_on_panel,
-        api,
-        inbound.id,
-        email,
-        days_to_add,
-        comment,
-        traffic_gb,
-        sub_id,
-        telegram_chat_id,
-    )
+    try:
+        client_uuid, new_expiry_ms = await asyncio.to_thread(
+            run_panel_operation,
+            host_data,
+            lambda api, inbound, session: update_or_create_client_on_panel(
+                api, inbound.id, email, days_to_add, comment, traffic_gb, sub_id, telegram_chat_id
+            ),
+            True,
+        )
+    except PanelLoginError:
+        client_uuid, new_expiry_ms = None, None
     if not client_uuid:
         logger.error(f"Workflow failed: Could not create/update client '{email}' on host '{host_name}'.")
         return None
@@ -784,6 +1516,186 @@ async def create_or_update_key_on_host(host_name: str, email: str, days_to_add:
     else:
         return None
 
+def _load_inbound_with_stats(api: Api, inbound_id: int, session: "_PanelSession", force: bool = False) -> Inbound:
+    """Загружает inbound (через кэш сессии) так, чтобы в нём был clientStats."""
+    target = session.get_inbound(api, inbound_id, force=force)
+    # На некоторых сборках get_by_id не возвращает clientStats.
+    # В таком случае подменим inbound объектом из списка, где clientStats присутствует.
+    try:
+        has_stats = getattr(target, 'clientStats', None) is not None or getattr(target, 'client_stats', None) is not None
+        if not has_stats:
+            for ib in session.get_inbound_list(api, force=force):
+                if getattr(ib, 'id', None) == inbound_id:
+                    return ib
+    except Exception as e:
+        if _is_panel_auth_error(e):
+            raise
+    return target
+
+
+def _client_details_from_inbound(key_data: dict, target_inbound: Inbound) -> tuple[dict, str | None]:
+    """Вычисляет поля ключа по снимку inbound без запросов к панели.
+
+    Возвращает (details, email найденного клиента или None). subscription_link
+    не заполняется: для него нужен subURI из настроек панели.
+    """
+    exp_ms = None
+    status = None
+    protocol = None
+    created_at = None
+    remaining_seconds = None
+    quota_remaining_bytes = None
+    quota_total_gb = None
+    traffic_down_bytes = None
+    enabled_status = None
+    if target_inbound and target_inbound.settings and target_inbound.settings.clients:
+        protocol = getattr(target_inbound, 'protocol', None)
+        # Собираем карту статистики по email из clientStats, если доступно
+        stats_map = {}
+        try:
+            client_stats = getattr(target_inbound, 'clientStats', None)
+            if client_stats is None:
+                client_stats = getattr(target_inbound, 'client_stats', None)
+            if client_stats:
+                for s in client_stats:
+                    s_email = str(getattr(s, 'email', '') or '')
+                    if not s_email:
+                        continue
+                    try:
+                        s_total = int(getattr(s, 'total', 0) or 0)
+                        s_up = int(getattr(s, 'up', 0) or 0)
+                        s_down = int(getattr(s, 'down', 0) or 0)
+                    except Exception:
+                        s_total, s_up, s_down = 0, 0, 0
+                    stats_map[s_email] = (s_total, s_up, s_down)
+        except Exception:
+            pass
+
+        for c in target_inbound.settings.clients:
+            cid = str(getattr(c, 'id', '') or '')
+            cemail = str(getattr(c, 'email', '') or '')
+            if cid == str(key_data.get('xui_client_uuid')) or (key_data.get('key_email') and cemail == str(key_data.get('key_email'))):
+                exp_ms = getattr(c, 'expiry_time', None)
+                # created_at / usage start
+                created_at = getattr(c, 'created_at', None) or getattr(c, 'enableDate', None)
+                # Получаем статус включения
+                enabled_status = getattr(c, 'enable', None)
+                # traffic quota remaining: сначала пробуем clientStats, затем fallback на settings.clients
+                try:
+                    total_limit_bytes = None
+                    up_bytes = 0
+                    down_bytes = 0
+
+                    if cemail in stats_map:
+                        s_total, s_up, s_down = stats_map[cemail]
+                        total_limit_bytes = s_total
+                        up_bytes = s_up
+                        down_bytes = s_down
+                        traffic_down_bytes = down_bytes
+                        quota_total_gb = round(total_limit_bytes / (1024*1024*1024), 2) if total_limit_bytes else None
+                        try:
+                            from shop_bot.webhook_server.app import logger as app_logger  # lazy import
+                        except Exception:
+                            app_logger = None
+                        if app_logger:
+                            app_logger.info(f"XUI traffic debug (clientStats) for {key_data.get('key_email')}: total={total_limit_bytes}, up={up_bytes}, down={down_bytes}")
+                    else:
+                        # traffic fields across x-ui forks
+                        if hasattr(c, 'total') and getattr(c, 'total') not in [None, '', 'null']:
+                            total_limit_bytes = int(getattr(c, 'total'))
+                            quota_total_gb = round(total_limit_bytes / (1024*1024*1024), 2)
+                        elif hasattr(c, 'totalGB') and getattr(c, 'totalGB') not in [None, '', 'null']:
+                            quota_total_gb = float(getattr(c, 'totalGB'))
+                            total_limit_bytes = int(quota_total_gb * 1024 * 1024 * 1024)
+                        elif hasattr(c, 'total_gb') and getattr(c, 'total_gb') not in [None, '', 'null']:
+                            quota_total_gb = float(getattr(c, 'total_gb'))
+                            total_limit_bytes = int(quota_total_gb * 1024 * 1024 * 1024)
+
+                        def _to_int(val):
+                            try:
+                                if val in [None, '', 'null']:
+                                    return 0
+                                return int(float(val))
+                            except Exception:
+                                return 0
+                        up_bytes = _to_int(getattr(c, 'up', getattr(c, 'upload', 0)))
+                        down_bytes = _to_int(getattr(c, 'down', getattr(c, 'download', 0)))
+                        traffic_down_bytes = down_bytes
+
+                        try:
+                            from shop_bot.webhook_server.app import logger as app_logger  # lazy import
+                        except Exception:
+                            app_logger = None
+                        if app_logger:
+                            app_logger.info(f"XUI traffic debug (clients) for {key_data.get('key_email')}: total={total_limit_bytes}, up={up_bytes}, down={down_bytes}")
+
+                    if total_limit_bytes is None or total_limit_bytes == 0 or total_limit_bytes == -1:
+                        quota_remaining_bytes = None  # бесконечно/не задано
+                    else:
+                        quota_remaining_bytes = max(0, int(total_limit_bytes) - (up_bytes + down_bytes))
+                except Exception:
+                    quota_remaining_bytes = None
+                # вычисление статуса
+                from datetime import timezone, datetime
+                now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+                is_trial = int(key_data.get('is_trial') or 0) == 1
+                active = exp_ms is not None and exp_ms > now_ms
+                if exp_ms is not None:
+                    remaining_seconds = max(0, int((exp_ms - now_ms) / 1000))
+                
+                # Проверяем, не отозван ли триал (квота = 1 МБ)
+                is_revoked_trial = False
+                if quota_total_gb is not None and quota_total_gb <= 0.001:  # 1 МБ = 0.001 ГБ
+                    is_revoked_trial = True
+                
+                if is_trial and active and not is_revoked_trial:
+                    status = 'trial-active'
+                elif is_trial and not active:
+                    status = 'trial-ended'
+                elif is_trial and is_revoked_trial:
+                    status = 'deactivate'  # Отозванный триал
+                elif not is_trial and active:
+                    status = 'pay-active'
+                else:
+                    status = 'pay-ended'
+                break
+    # Получаем дополнительные поля из клиента (используем правильные поля 3x-ui)
+    subscription = None
+    telegram_chat_id = None
+    comment = None
+    matched_email = None
+
+    if target_inbound and target_inbound.settings and target_inbound.settings.clients:
+        for c in target_inbound.settings.clients:
+            cid = str(getattr(c, 'id', '') or '')
+            cemail = str(getattr(c, 'email', '') or '')
+            if cid == str(key_data.get('xui_client_uuid')) or (key_data.get('key_email') and cemail == str(key_data.get('key_email'))):
+                matched_email = cemail
+                # Используем правильные поля 3x-ui
+                subscription = getattr(c, 'sub_id', None) or getattr(c, 'subId', None)
+                telegram_chat_id = getattr(c, 'tg_id', None) or getattr(c, 'tgId', None)
+                # Пробуем извлечь comment из разных полей
+                comment = getattr(c, 'comment', None) or getattr(c, 'comments', None) or getattr(c, 'description', None)
+                break
+
+    details = {
+        "expiry_timestamp_ms": exp_ms,
+        "status": status,
+        "protocol": protocol,
+        "created_at": created_at,
+        "remaining_seconds": remaining_seconds,
+        "quota_remaining_bytes": quota_remaining_bytes,
+        "quota_total_gb": quota_total_gb,
+        "traffic_down_bytes": traffic_down_bytes,
+        "enabled": enabled_status,
+        "subscription": subscription,
+        "subscription_link": None,
+        "telegram_chat_id": telegram_chat_id,
+        "comment": comment
+    }
+    return details, matched_email
+
+
 async def get_key_details_from_host(key_data: dict) -> dict | None:
     host_name = key_data.get('host_name')
     if not host_name:
@@ -795,13 +1707,17 @@ async def get_key_details_from_host(key_data: dict) -> dict | None:
         logger.error(f"Could not get key details: Host '{host_name}' not found in the database.")
         return None
 
+    if is_async_panel_client_enabled():
+        return await _get_key_details_native(key_data, host_db_data)
+
     # Логин к панели выполняет сетевые вызовы — переносим в отдельный поток.
+    # Авторизованная сессия хоста переиспользуется между вызовами.
     api, inbound = await asyncio.to_thread(
-        login_to_host,
-        host_url=host_db_data['host_url'],
-        username=host_db_data['host_username'],
-        password=host_db_data['host_pass'],
-        inbound_id=host_db_data['host_inbound_id'],
+        get_panel_api,
+        host_db_data['host_url'],
+        host_db_data['host_username'],
+        host_db_data['host_pass'],
+        host_db_data['host_inbound_id'],
     )
     if not api or not inbound: return None
 
@@ -810,174 +1726,33 @@ async def get_key_details_from_host(key_data: dict) -> dict | None:
     connection_string = get_connection_string(inbound, key_data['xui_client_uuid'], host_db_data['host_url'], remark=host_code)
     # Получаем свежий expiry_time клиента из панели
     try:
-        target_inbound = api.inbound.get_by_id(host_db_data['host_inbound_id'])
-        # На некоторых сборках get_by_id не возвращает clientStats.
-        # В таком случае подменим inbound объектом из списка, где clientStats присутствует.
-        try:
-            has_stats = getattr(target_inbound, 'clientStats', None) is not None or getattr(target_inbound, 'client_stats', None) is not None
-            if not has_stats:
-                inbounds_list = api.inbound.get_list()
-                for ib in inbounds_list:
-                    if getattr(ib, 'id', None) == host_db_data['host_inbound_id']:
-                        target_inbound = ib
-                        break
-        except Exception:
-            pass
-        exp_ms = None
-        status = None
-        protocol = None
-        created_at = None
-        remaining_seconds = None
-        quota_remaining_bytes = None
-        quota_total_gb = None
-        traffic_down_bytes = None
-        enabled_status = None
-        if target_inbound and target_inbound.settings and target_inbound.settings.clients:
-            protocol = getattr(target_inbound, 'protocol', None)
-            # Собираем карту статистики по email из clientStats, если доступно
-            stats_map = {}
-            try:
-                client_stats = getattr(target_inbound, 'clientStats', None)
-                if client_stats is None:
-                    client_stats = getattr(target_inbound, 'client_stats', None)
-                if client_stats:
-                    for s in client_stats:
-                        s_email = str(getattr(s, 'email', '') or '')
-                        if not s_email:
-                            continue
-                        try:
-                            s_total = int(getattr(s, 'total', 0) or 0)
-                            s_up = int(getattr(s, 'up', 0) or 0)
-                            s_down = int(getattr(s, 'down', 0) or 0)
-                        except Exception:
-                            s_total, s_up, s_down = 0, 0, 0
-                        stats_map[s_email] = (s_total, s_up, s_down)
-            except Exception:
-                pass
-
-            for c in target_inbound.settings.clients:
-                cid = str(getattr(c, 'id', '') or '')
-                cemail = str(getattr(c, 'email', '') or '')
-                if cid == str(key_data.get('xui_client_uuid')) or (key_data.get('key_email') and cemail == str(key_data.get('key_email'))):
-                    exp_ms = getattr(c, 'expiry_time', None)
-                    # created_at / usage start
-                    created_at = getattr(c, 'created_at', None) or getattr(c, 'enableDate', None)
-                    # Получаем статус включения
-                    enabled_status = getattr(c, 'enable', None)
-                    # traffic quota remaining: сначала пробуем clientStats, затем fallback на settings.clients
-                    try:
-                        total_limit_bytes = None
-                        up_bytes = 0
-                        down_bytes = 0
-
-                        if cemail in stats_map:
-                            s_total, s_up, s_down = stats_map[cemail]
-                            total_limit_bytes = s_total
-                            up_bytes = s_up
-                            down_bytes = s_down
-                            traffic_down_bytes = down_bytes
-                            quota_total_gb = round(total_limit_bytes / (1024*1024*1024), 2) if total_limit_bytes else None
-                            try:
-                                from shop_bot.webhook_server.app import logger as app_logger  # lazy import
-                            except Exception:
-                                app_logger = None
-                            if app_logger:
-                                app_logger.info(f"XUI traffic debug (clientStats) for {key_data.get('key_email')}: total={total_limit_bytes}, up={up_bytes}, down={down_bytes}")
-                        else:
-                            # traffic fields across x-ui forks
-                            if hasattr(c, 'total') and getattr(c, 'total') not in [None, '', 'null']:
-                                total_limit_bytes = int(getattr(c, 'total'))
-                                quota_total_gb = round(total_limit_bytes / (1024*1024*1024), 2)
-                            elif hasattr(c, 'totalGB') and getattr(c, 'totalGB') not in [None, '', 'null']:
-                                quota_total_gb = float(getattr(c, 'totalGB'))
-                                total_limit_bytes = int(quota_total_gb * 1024 * 1024 * 1024)
-                            elif hasattr(c, 'total_gb') and getattr(c, 'total_gb') not in [None, '', 'null']:
-                                quota_total_gb = float(getattr(c, 'total_gb'))
-                                total_limit_bytes = int(quota_total_gb * 1024 * 1024 * 1024)
-
-                            def _to_int(val):
-                                try:
-                                    if val in [None, '', 'null']:
-                                        return 0
-                                    return int(float(val))
-                                except Exception:
-                                    return 0
-                            up_bytes = _to_int(getattr(c, 'up', getattr(c, 'upload', 0)))
-                            down_bytes = _to_int(getattr(c, 'down', getattr(c, 'download', 0)))
-                            traffic_down_bytes = down_bytes
-
-                            try:
-                                from shop_bot.webhook_server.app import logger as app_logger  # lazy import
-                            except Exception:
-                                app_logger = None
-                            if app_logger:
-                                app_logger.info(f"XUI traffic debug (clients) for {key_data.get('key_email')}: total={total_limit_bytes}, up={up_bytes}, down={down_bytes}")
-
-                        if total_limit_bytes is None or total_limit_bytes == 0 or total_limit_bytes == -1:
-                            quota_remaining_bytes = None  # бесконечно/не задано
-                        else:
-                            quota_remaining_bytes = max(0, int(total_limit_bytes) - (up_bytes + down_bytes))
-                    except Exception:
-                        quota_remaining_bytes = None
-                    # вычисление статуса
-                    from datetime import timezone, datetime
-                    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
-                    is_trial = int(key_data.get('is_trial') or 0) == 1
-                    active = exp_ms is not None and exp_ms > now_ms
-                    if exp_ms is not None:
-                        remaining_seconds = max(0, int((exp_ms - now_ms) / 1000))
-                    
-                    # Проверяем, не отозван ли триал (квота = 1 МБ)
-                    is_revoked_trial = False
-                    if quota_total_gb is not None and quota_total_gb <= 0.001:  # 1 МБ = 0.001 ГБ
-                        is_revoked_trial = True
-                    
-                    if is_trial and active and not is_revoked_trial:
-                        status = 'trial-active'
-                    elif is_trial and not active:
-                        status = 'trial-ended'
-                    elif is_trial and is_revoked_trial:
-                        status = 'deactivate'  # Отозванный триал
-                    elif not is_trial and active:
-                        status = 'pay-active'
-                    else:
-                        status = 'pay-ended'
-                    break
-        # Получаем дополнительные поля из клиента (используем правильные поля 3x-ui)
-        subscription = None
+        # Чтение из короткоживущего кэша inbound'ов (сбрасывается после изменений клиентов)
+        target_inbound = await asyncio.to_thread(
+            run_panel_operation,
+            host_db_data,
+            lambda api, inbound, session: _load_inbound_with_stats(api, host_db_data['host_inbound_id'], session),
+        )
+        details, cemail = _client_details_from_inbound(key_data, target_inbound)
+        subscription = details['subscription']
         subscription_link = None
-        telegram_chat_id = None
-        comment = None
-
-        if target_inbound and target_inbound.settings and target_inbound.settings.clients:
-            for c in target_inbound.settings.clients:
-                cid = str(getattr(c, 'id', '') or '')
-                cemail = str(getattr(c, 'email', '') or '')
-                if cid == str(key_data.get('xui_client_uuid')) or (key_data.get('key_email') and cemail == str(key_data.get('key_email'))):
-                    # Используем правильные поля 3x-ui
-                    subscription = getattr(c, 'sub_id', None) or getattr(c, 'subId', None)
-                    telegram_chat_id = getattr(c, 'tg_id', None) or getattr(c, 'tgId', None)
-                    # Пробуем извлечь comment из разных полей
-                    comment = getattr(c, 'comment', None) or getattr(c, 'comments', None) or getattr(c, 'description', None)
-                    
-                    # Получаем subscription link из 3x-ui настроек
-                    if subscription:
-                        # Получение subURI — синхронный HTTP-вызов, выполняем его в отдельном потоке.
-                        sub_uri = await asyncio.to_thread(
-                            get_sub_uri_from_panel,
-                            host_db_data['host_url'],
-                            host_db_data['host_username'],
-                            host_db_data['host_pass'],
-                        )
-                        if sub_uri:
-                            subscription_link = f"{sub_uri}{subscription}"
-                            logger.info(f"Created subscription link for key_id={key_data.get('key_id')}, email={cemail}: {subscription_link}")
-                        else:
-                            logger.warning(f"Could not get subURI from panel for key_id={key_data.get('key_id')}, email={cemail}. Will try fallback method.")
-                    else:
-                        logger.warning(f"No subscription (subId) found for key_id={key_data.get('key_id')}, email={cemail}. Will try fallback method.")
-                    
-                    break
+
+        if cemail is not None:
+            # Получаем subscription link из 3x-ui настроек
+            if subscription:
+                # Получение subURI — синхронный HTTP-вызов, выполняем его в отдельном потоке.
+                sub_uri = await asyncio.to_thread(
+                    get_sub_uri_from_panel,
+                    host_db_data['host_url'],
+                    host_db_data['host_username'],
+                    host_db_data['host_pass'],
+                )
+                if sub_uri:
+                    subscription_link = f"{sub_uri}{subscription}"
+                    logger.info(f"Created subscription link for key_id={key_data.get('key_id')}, email={cemail}: {subscription_link}")
+                else:
+                    logger.warning(f"Could not get subURI from panel for key_id={key_data.get('key_id')}, email={cemail}. Will try fallback method.")
+            else:
+                logger.warning(f"No subscription (subId) found for key_id={key_data.get('key_id')}, email={cemail}. Will try fallback method.")
         
         # Fallback: пытаемся получить subscription_link через get_client_subscription_link
         if not subscription_link and key_data.get('key_email'):
@@ -991,25 +1766,193 @@ async def get_key_details_from_host(key_data: dict) -> dict | None:
             except Exception as e:
                 logger.error(f"Error getting subscription_link via fallback for key_id={key_data.get('key_id')}, email={key_data.get('key_email')}: {e}", exc_info=True)
         
-        return {
-            "connection_string": connection_string, 
-            "expiry_timestamp_ms": exp_ms, 
-            "status": status, 
-            "protocol": protocol, 
-            "created_at": created_at, 
-            "remaining_seconds": remaining_seconds, 
-            "quota_remaining_bytes": quota_remaining_bytes, 
-            "quota_total_gb": quota_total_gb, 
-            "traffic_down_bytes": traffic_down_bytes, 
-            "enabled": enabled_status,
-            "subscription": subscription,
-            "subscription_link": subscription_link,
-            "telegram_chat_id": telegram_chat_id,
-            "comment": comment
-        }
+        details['subscription_link'] = subscription_link
+        return {"connection_string": connection_string, **details}
+    except Exception:
+        return {"connection_string": connection_string}
+
+async def get_keys_details_from_host(host_name: str, keys: list[dict]) -> dict[int, dict | None]:
+    """Детали всех переданных ключей одного хоста по одному снимку inbound.
+
+    В отличие от вызова get_key_details_from_host() на каждый ключ, inbound
+    загружается один раз (в обход кэша), а subURI — не более одного раза.
+    Возвращает {key_id: details}; для ключей, не найденных на панели, — None.
+    """
+    host_db_data = get_host(host_name)
+    if not host_db_data:
+        logger.error(f"Could not get keys details: Host '{host_name}' not found in the database.")
+        return {}
+
+    try:
+        inbound, target_inbound = await asyncio.to_thread(
+            run_panel_operation,
+            host_db_data,
+            lambda api, inbound, session: (inbound, _load_inbound_with_stats(api, inbound.id, session, force=True)),
+        )
+    except PanelLoginError:
+        logger.error(f"Could not get keys details: login or inbound lookup failed for host '{host_name}'.")
+        return {}
+
+    host_code = host_db_data.get('host_code') or host_name
+    sub_uri = None
+    sub_uri_loaded = False
+    result: dict[int, dict | None] = {}
+    for key_data in keys:
+        try:
+            details, matched_email = _client_details_from_inbound(key_data, target_inbound)
+        except Exception as e:
+            logger.warning(f"Could not parse details for key_id={key_data.get('key_id')} on host '{host_name}': {e}")
+            result[key_data['key_id']] = None
+            continue
+        if matched_email is None:
+            result[key_data['key_id']] = None
+            continue
+
+        if details['subscription']:
+            if not sub_uri_loaded:
+                # Получение subURI — синхронный HTTP-вызов, выполняем его в отдельном потоке.
+                sub_uri = await asyncio.to_thread(
+                    get_sub_uri_from_panel,
+                    host_db_data['host_url'],
+                    host_db_data['host_username'],
+                    host_db_data['host_pass'],
+                )
+                sub_uri_loaded = True
+            if sub_uri:
+                details['subscription_link'] = f"{sub_uri}{details['subscription']}"
+
+        connection_string = get_connection_string(inbound, key_data['xui_client_uuid'], host_db_data['host_url'], remark=host_code)
+        result[key_data['key_id']] = {"connection_string": connection_string, **details}
+    return result
+
+async def _create_or_update_key_native(host_data: dict, host_name: str, email: str, days_to_add: float, comment: str | None, traffic_gb: float | None, sub_id: str | None, telegram_chat_id: int | None) -> Dict | None:
+    """create_or_update_key_on_host() через нативный aiohttp-клиент панели."""
+    client = get_async_panel_client(host_data)
+    inbound_id = host_data['host_inbound_id']
+    try:
+        inbound = await client.get_inbound(inbound_id, force=True)
+        exists = any(c.email == email for c in (inbound.settings.clients or []))
+        client_uuid, new_expiry_ms, _ = _apply_client_upsert(
+            inbound, email, days_to_add, comment, traffic_gb, sub_id, telegram_chat_id
+        )
+        target = next(c for c in inbound.settings.clients if c.email == email)
+        if traffic_gb is not None:
+            # Панель читает лимит из totalGB (в байтах, как и total)
+            target.total_gb = int(target.total or 0)
+        # Изменяется только этот клиент: addClient/updateClient вместо перезаписи всего inbound
+        if exists:
+            await client.update_client(inbound_id, target)
+        else:
+            await client.add_clients(inbound_id, [target])
+    except PanelLoginError as e:
+        logger.error(f"Workflow failed: Could not log in to host '{host_name}': {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Workflow failed: Could not create/update client '{email}' on host '{host_name}': {e}", exc_info=True)
+        return None
+
+    # Используем host_code вместо host_name для стабильности ключей
+    host_code = host_data.get('host_code') or host_name
+    connection_string = get_connection_string(inbound, client_uuid, host_data['host_url'], remark=host_code)
+
+    subscription_link = None
+    if sub_id:
+        sub_uri = await client.get_sub_uri()
+        if sub_uri:
+            subscription_link = f"{sub_uri}{sub_id}"
+            logger.info(f"Created subscription link: {subscription_link}")
+        else:
+            logger.warning(f"Could not get subURI from panel, subscription link will not be available")
+
+    logger.info(f"Successfully processed key for '{email}' on host '{host_name}'.")
+    return {
+        "client_uuid": client_uuid,
+        "email": email,
+        "expiry_timestamp_ms": new_expiry_ms,
+        "connection_string": connection_string,
+        "subscription_link": subscription_link,
+        "host_name": host_name
+    }
+
+
+async def _get_key_details_native(key_data: dict, host_db_data: dict) -> dict | None:
+    """get_key_details_from_host() через нативный aiohttp-клиент панели."""
+    client = get_async_panel_client(host_db_data)
+    host_name = key_data.get('host_name')
+    try:
+        # Чтение из короткоживущего кэша inbound'ов (сбрасывается после изменений клиентов)
+        target_inbound = await client.get_inbound_with_stats(host_db_data['host_inbound_id'])
+    except Exception as e:
+        logger.error(f"Could not get key details from host '{host_name}': {e}")
+        return None
+
+    host_code = host_db_data.get('host_code') or host_name
+    connection_string = get_connection_string(target_inbound, key_data['xui_client_uuid'], host_db_data['host_url'], remark=host_code)
+    try:
+        details, cemail = _client_details_from_inbound(key_data, target_inbound)
     except Exception:
         return {"connection_string": connection_string}
 
+    if cemail is not None and details['subscription']:
+        sub_uri = await client.get_sub_uri()
+        if sub_uri:
+            details['subscription_link'] = f"{sub_uri}{details['subscription']}"
+    return {"connection_string": connection_string, **details}
+
+
+def _is_client_missing_error(error: Exception) -> bool:
+    """Ошибка панели «клиента уже нет» (удаление считается выполненным)."""
+    error_msg = str(error).lower()
+    return "no client remained" in error_msg or "client not found" in error_msg
+
+
+async def _delete_client_by_email_native(host_data: dict, host_name: str, client_email: str) -> bool:
+    """delete_client_on_host() по email через нативный aiohttp-клиент панели."""
+    client = get_async_panel_client(host_data)
+    inbound_id = host_data['host_inbound_id']
+    try:
+        inbound = await client.get_inbound(inbound_id, force=True)
+        client_on_panel = next((c for c in (inbound.settings.clients or []) if c.email == client_email), None)
+        if not client_on_panel:
+            logger.info(f"Client '{client_email}' not found on host '{host_name}' (already deleted or never existed).")
+            return True
+        await client.delete_client(inbound_id, str(client_on_panel.id))
+        logger.info(f"Successfully deleted client '{client_on_panel.id}' (email: '{client_email}') from host '{host_name}'.")
+        return True
+    except PanelLoginError:
+        logger.error(f"Cannot delete client: Login failed for host '{host_name}'.")
+        return False
+    except Exception as e:
+        if _is_client_missing_error(e):
+            logger.info(f"Client '{client_email}' already deleted from host '{host_name}' (no longer exists on panel).")
+            return True
+        logger.error(f"Failed to delete client '{client_email}' from host '{host_name}': {e}")
+        return False
+
+
+async def _update_client_enabled_status_native(host_data: dict, host_name: str, client_email: str, enabled: bool) -> bool:
+    """update_client_enabled_status_on_host() через нативный aiohttp-клиент панели."""
+    client = get_async_panel_client(host_data)
+    inbound_id = host_data['host_inbound_id']
+    try:
+        inbound = await client.get_inbound(inbound_id, force=True)
+        target = next((c for c in (inbound.settings.clients or []) if c.email == client_email), None)
+        if not target:
+            logger.warning(f"Client with email '{client_email}' not found on host '{host_name}'.")
+            return False
+        target.enable = enabled
+        # При отключении ключа устанавливаем expiry_time на текущее время
+        if not enabled:
+            from datetime import timezone as _tz
+            target.expiry_time = int(datetime.now(_tz.utc).timestamp() * 1000)
+        await client.update_client(inbound_id, target)
+    except Exception as e:
+        logger.error(f"Failed to update enabled status for client '{client_email}' on host '{host_name}': {e}")
+        return False
+    logger.info(f"Successfully updated enabled status for client '{client_email}' on host '{host_name}' to {enabled}.")
+    return True
+
+
 async def delete_client_by_uuid(client_uuid: str, client_email: str | None = None) -> bool:
     """Удаляет клиента напрямую по UUID из всех доступных хостов"""
     if not client_uuid or client_uuid == 'Unknown':
@@ -1018,7 +1961,7 @@ async def delete_client_by_uuid(client_uuid: str, client_email: str | None = Non
     
     # Получаем все хосты из базы данных
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with _get_db_connection(DB_FILE) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM xui_hosts")
@@ -1030,35 +1973,28 @@ async def delete_client_by_uuid(client_uuid: str, client_email: str | None = Non
     # Пытаемся удалить клиента с каждого хоста
     for host_data in hosts:
         try:
-            # Логин к каждому хосту выносим в отдельный поток, чтобы не блокировать event loop.
-            api, inbound = await asyncio.to_thread(
-                login_to_host,
-                host_url=host_data['host_url'],
-                username=host_data['host_username'],
-                password=host_data['host_pass'],
-                inbound_id=host_data['host_inbound_id'],
-            )
-            
-            if not api or not inbound:
-                logger.warning(f"Cannot login to host '{host_data['host_name']}', skipping...")
-                continue
-            
-            try:
-                # Пытаемся удалить по UUID
-                api.client.delete(inbound.id, str(client_uuid))
-                logger.info(f"Successfully deleted client '{client_uuid}' (email: '{client_email or 'Unknown'}') from host '{host_data['host_name']}'")
-                return True
-            except Exception as e:
-                error_msg = str(e)
-                # Проверяем, является ли это ошибкой "клиент уже удален"
-                if "no client remained" in error_msg.lower() or "client not found" in error_msg.lower():
-                    logger.debug(f"Client '{client_uuid}' already deleted from host '{host_data['host_name']}'")
-                    continue
-                else:
-                    logger.debug(f"Client '{client_uuid}' not found on host '{host_data['host_name']}': {e}")
-                    continue
-                
+            if is_async_panel_client_enabled():
+                await get_async_panel_client(host_data).delete_client(host_data['host_inbound_id'], str(client_uuid))
+            else:
+                # Логин и удаление — блокирующие вызовы, выносим в отдельный поток.
+                # Авторизованная сессия хоста переиспользуется между вызовами.
+                await asyncio.to_thread(
+                    run_panel_operation,
+                    host_data,
+                    lambda api, inbound, session: api.client.delete(inbound.id, str(client_uuid)),
+                    True,
+                )
+            logger.info(f"Successfully deleted client '{client_uuid}' (email: '{client_email or 'Unknown'}') from host '{host_data['host_name']}'")
+            return True
+        except PanelLoginError:
+            logger.warning(f"Cannot login to host '{host_data['host_name']}', skipping...")
+            continue
         except Exception as e:
+            # Проверяем, является ли это ошибкой "клиент уже удален"
+            if _is_client_missing_error(e):
+                logger.debug(f"Client '{client_uuid}' already deleted from host '{host_data['host_name']}'")
+                continue
+
             logger.warning(f"Error processing host '{host_data['host_name']}': {e}")
             continue
     
@@ -1079,72 +2015,70 @@ async def update_client_attributes_on_host(host_name: str, email: str, subscript
         if not key_data:
             logger.error(f"Key with email '{email}' not found in database")
             return False
-            
-        # Подключаемся к панели — операция блокирующая, выносим в отдельный поток.
-        api, inbound = await asyncio.to_thread(
-            login_to_host,
-            host_url=host_data['host_url'],
-            username=host_data['host_username'],
-            password=host_data['host_pass'],
-            inbound_id=host_data['host_inbound_id'],
-        )
-        
-        if not api or not inbound:
-            logger.error(f"Cannot login to host '{host_name}'")
-            return False
-            
-        # Получаем данные inbound
-        inbound_to_modify = api.inbound.get_by_id(inbound.id)
-        if not inbound_to_modify or not inbound_to_modify.settings.clients:
-            logger.error(f"No clients found in inbound {inbound.id}")
-            return False
-            
-        # Находим клиента
-        client_found = False
-        for client in inbound_to_modify.settings.clients:
-            if client.email == email:
-                client_found = True
+
+        def apply_attributes(api, inbound, session) -> bool:
+            # Для изменения берём свежий inbound, а не объект из кэша
+            inbound_to_modify = session.get_inbound(api, inbound.id, force=True)
+            if not inbound_to_modify or not inbound_to_modify.settings.clients:
+                logger.error(f"No clients found in inbound {inbound.id}")
+                return False
                 
-                # Обновляем атрибуты (пробуем разные варианты полей для UI)
-                if subscription:
-                    try:
-                        setattr(client, 'sub_id', subscription)
-                        setattr(client, 'subId', subscription)
-                        setattr(client, 'subscription', subscription)
-                    except Exception as e:
-                        logger.warning(f"Failed to set subscription for {email}: {e}")
-                        
-                if telegram_chat_id:
-                    try:
-                        setattr(client, 'tg_id', telegram_chat_id)
-                        setattr(client, 'tgId', telegram_chat_id)
-                        setattr(client, 'telegram_chat_id', telegram_chat_id)
-                        setattr(client, 'telegramChatId', telegram_chat_id)
-                        setattr(client, 'telegram_id', telegram_chat_id)
-                    except Exception as e:
-                        logger.warning(f"Failed to set telegram_chat_id for {email}: {e}")
-                        
-                # Пробуем разные варианты для комментария
-                if comment is not None:
-                    try:
-                        setattr(client, 'comment', comment)
-                        setattr(client, 'comments', comment)
-                        setattr(client, 'description', comment)
-                        setattr(client, 'remark', comment)
-                        setattr(client, 'label', comment)
-                    except Exception as e:
-                        logger.warning(f"Failed to set comment for {email}: {e}")
-                        
-                break
+            # Находим клиента
+            client_found = False
+            for client in inbound_to_modify.settings.clients:
+                if client.email == email:
+                    client_found = True
+                    
+                    # Обновляем атрибуты (пробуем разные варианты полей для UI)
+                    if subscription:
+                        try:
+                            setattr(client, 'sub_id', subscription)
+                            setattr(client, 'subId', subscription)
+                            setattr(client, 'subscription', subscription)
+                        except Exception as e:
+                            logger.warning(f"Failed to set subscription for {email}: {e}")
+                            
+                    if telegram_chat_id:
+                        try:
+                            setattr(client, 'tg_id', telegram_chat_id)
+                            setattr(client, 'tgId', telegram_chat_id)
+                            setattr(client, 'telegram_chat_id', telegram_chat_id)
+                            setattr(client, 'telegramChatId', telegram_chat_id)
+                            setattr(client, 'telegram_id', telegram_chat_id)
+                        except Exception as e:
+                            logger.warning(f"Failed to set telegram_chat_id for {email}: {e}")
+                            
+                    # Пробуем разные варианты для комментария
+                    if comment is not None:
+                        try:
+                            setattr(client, 'comment', comment)
+                            setattr(client, 'comments', comment)
+                            setattr(client, 'description', comment)
+                            setattr(client, 'remark', comment)
+                            setattr(client, 'label', comment)
+                        except Exception as e:
+                            logger.warning(f"Failed to set comment for {email}: {e}")
+                            
+                    break
+                    
+            if not client_found:
+                logger.error(f"Client '{email}' not found on host '{host_name}'")
+                return False
                 
-        if not client_found:
-            logger.error(f"Client '{email}' not found on host '{host_name}'")
+            # Обновляем inbound
+            api.inbound.update(inbound.id, inbound_to_modify)
+            return True
+
+        # Операции с панелью блокирующие — выносим в отдельный поток
+        try:
+            updated = await asyncio.to_thread(run_panel_operation, host_data, apply_attributes, True)
+        except PanelLoginError:
+            logger.error(f"Cannot login to host '{host_name}'")
             return False
-            
-        # Обновляем inbound
-        api.inbound.update(inbound.id, inbound_to_modify)
-        logger.info(f"Successfully updated client attributes for '{email}' on host '{host_name}'")
-        return True
+
+        if updated:
+            logger.info(f"Successfully updated client attributes for '{email}' on host '{host_name}'")
+        return updated
         
     except Exception as e:
         logger.error(f"Failed to update client attributes for '{email}' on host '{host_name}': {e}")
@@ -1161,25 +2095,12 @@ async def delete_client_on_host(host_name: str, client_email: str, client_uuid:
         logger.error(f"Cannot delete client: Host '{host_name}' not found.")
         return False
 
-    # Логин к панели — синхронный сетевой вызов, выполняем его в отдельном потоке.
-    api, inbound = await asyncio.to_thread(
-        login_to_host,
-        host_url=host_data['host_url'],
-        username=host_data['host_username'],
-        password=host_data['host_pass'],
-        inbound_id=host_data['host_inbound_id'],
-    )
+    if is_async_panel_client_enabled():
+        return await _delete_client_by_email_native(host_data, host_name, client_email)
 
-    if not api or not inbound:
-        logger.error(f"Cannot delete client: Login or inbound lookup failed for host '{host_name}'.")
-        return False
-        
-    try:
-        # Ищем в базе данных
-        client_to_delete = get_key_by_email(client_email)
-        
-        # Получаем список всех клиентов на панели
-        inbound_data = api.inbound.get_by_id(inbound.id)
+    def delete_by_email(api, inbound, session) -> bool:
+        # Получаем список всех клиентов на панели (свежий, без кэша)
+        inbound_data = session.get_inbound(api, inbound.id, force=True)
         if not inbound_data or not inbound_data.settings.clients:
             logger.warning(f"No clients found on host '{host_name}'. Client '{client_email}' already deleted or never existed.")
             return True
@@ -1201,6 +2122,8 @@ async def delete_client_on_host(host_name: str, client_email: str, client_uuid:
             logger.info(f"Successfully deleted client '{client_on_panel.id}' (email: '{client_email}') from host '{host_name}'.")
             return True
         except Exception as e:
+            if _is_panel_auth_error(e):
+                raise
             error_msg = str(e)
             # Проверяем, является ли это ошибкой "клиент уже удален"
             if "no client remained" in error_msg.lower() or "client not found" in error_msg.lower():
@@ -1209,7 +2132,17 @@ async def delete_client_on_host(host_name: str, client_email: str, client_uuid:
             else:
                 logger.error(f"Failed to delete client '{client_on_panel.id}' from host '{host_name}': {e}")
                 return False
-            
+
+    try:
+        # Ищем в базе данных
+        client_to_delete = get_key_by_email(client_email)
+
+        # Логин и удаление — синхронные сетевые вызовы, выполняем их в отдельном потоке.
+        # Авторизованная сессия хоста переиспользуется между вызовами.
+        return await asyncio.to_thread(run_panel_operation, host_data, delete_by_email, True)
+    except PanelLoginError:
+        logger.error(f"Cannot delete client: Login or inbound lookup failed for host '{host_name}'.")
+        return False
     except Exception as e:
         logger.error(f"Failed to delete client '{client_email}' from host '{host_name}': {e}", exc_info=True)
         return False
@@ -1217,17 +2150,11 @@ async def delete_client_on_host(host_name: str, client_email: str, client_uuid:
 def _panel_update_client_quota(host_url: str, username: str, password: str, inbound_id: int, client_uuid: str, email: str, traffic_bytes: int, expiry_ms: int, comment: str = "") -> bool:
     """Обновляет квоту трафика клиента через нативный эндпоинт панели"""
     try:
-        base = host_url.rstrip('/')
-        session = _create_verified_panel_session(host_url)
+        # Авторизованная keep-alive сессия хоста (логин только при первом запросе или 401)
+        session = _get_panel_session(host_url, username, password)
 
-        # Логин
-        login_response = session.post(f"{base}/login", json={"username": username, "password": password}, timeout=10)
-        if login_response.status_code != 200:
-            logger.error(f"Failed to login to {base}")
-            return False
-            
         # Получаем текущие данные inbound
-        get_response = session.get(f"{base}/panel/inbound/get/{inbound_id}", timeout=10)
+        get_response = session.http_request("GET", f"panel/inbound/get/{inbound_id}")
         if get_response.status_code != 200:
             logger.error(f"Failed to get inbound data: HTTP {get_response.status_code}")
             logger.error(f"Response content: {get_response.text[:500]}")
@@ -1290,7 +2217,8 @@ def _panel_update_client_quota(host_url: str, username: str, password: str, inbo
         
         # Отправляем обновление
         headers = {"Content-Type": "application/x-www-form-urlencoded; charset=UTF-8", "X-Requested-With": "XMLHttpRequest"}
-        response = session.post(f"{base}/panel/inbound/update/{inbound_id}", data=update_data, headers=headers, timeout=10)
+        response = session.http_request("POST", f"panel/inbound/update/{inbound_id}", data=update_data, headers=headers)
+        session.invalidate_cache()
         
         if response.status_code == 200:
             try:
@@ -1321,26 +2249,15 @@ def _panel_update_client_quota(host_url: str, username: str, password: str, inbo
         except Exception:
             pass
         return False
-    finally:
-        try:
-            session.close()
-        except Exception:
-            pass
 
 def _panel_update_client_enabled_status(host_url: str, username: str, password: str, inbound_id: int, client_uuid: str, email: str, enabled: bool, expiry_ms: int, comment: str = "") -> bool:
     """Обновляет статус включения/отключения клиента через нативный эндпоинт панели"""
     try:
-        base = host_url.rstrip('/')
-        session = _create_verified_panel_session(host_url)
+        # Авторизованная keep-alive сессия хоста (логин только при первом запросе или 401)
+        session = _get_panel_session(host_url, username, password)
 
-        # Логин
-        login_response = session.post(f"{base}/login", json={"username": username, "password": password}, timeout=10)
-        if login_response.status_code != 200:
-            logger.error(f"Failed to login to {base}")
-            return False
-            
         # Получаем текущие данные inbound
-        get_response = session.get(f"{base}/panel/inbound/get/{inbound_id}", timeout=10)
+        get_response = session.http_request("GET", f"panel/inbound/get/{inbound_id}")
         if get_response.status_code != 200:
             logger.error(f"Failed to get inbound data: HTTP {get_response.status_code}")
             return False
@@ -1398,7 +2315,8 @@ def _panel_update_client_enabled_status(host_url: str, username: str, password:
         
         # Отправляем обновление
         headers = {"Content-Type": "application/x-www-form-urlencoded; charset=UTF-8", "X-Requested-With": "XMLHttpRequest"}
-        response = session.post(f"{base}/panel/inbound/update/{inbound_id}", data=update_data, headers=headers, timeout=10)
+        response = session.http_request("POST", f"panel/inbound/update/{inbound_id}", data=update_data, headers=headers)
+        session.invalidate_cache()
         
         if response.status_code == 200:
             try:
@@ -1424,11 +2342,6 @@ def _panel_update_client_enabled_status(host_url: str, username: str, password:
         except Exception:
             logger.error(f"Failed panel updateClient enabled status for {email}: {e}")
         return False
-    finally:
-        try:
-            session.close()
-        except Exception:
-            pass
 
 async def update_client_enabled_status_on_host(host_name: str, client_email: str, enabled: bool) -> bool:
     """Обновляет статус включения/отключения клиента на указанном хосте"""
@@ -1437,48 +2350,51 @@ async def update_client_enabled_status_on_host(host_name: str, client_email: str
         if not host_data:
             logger.error(f"Host '{host_name}' not found in database.")
             return False
+
+        if is_async_panel_client_enabled():
+            return await _update_client_enabled_status_native(host_data, host_name, client_email, enabled)
         
-        # Логин к панели — потенциально долгий сетевой вызов, выносим в поток.
-        api, inbound = await asyncio.to_thread(
-            login_to_host,
-            host_data['host_url'],
-            host_data['host_username'],
-            host_data['host_pass'],
-            host_data['host_inbound_id'],
-        )
-        if not api or not inbound:
+        def apply_enabled_status(api, inbound, session):
+            # Получаем свежие данные inbound с клиентами (изменяемый объект, не из кэша)
+            inbound_data = session.get_inbound(api, inbound.id, force=True)
+            if not inbound_data or not inbound_data.settings.clients:
+                logger.warning(f"No clients found in inbound on host '{host_name}'.")
+                return None
+            
+            # Ищем клиента по email
+            client = None
+            for c in inbound_data.settings.clients:
+                if c.email == client_email:
+                    client = c
+                    break
+            
+            if not client:
+                logger.warning(f"Client with email '{client_email}' not found on host '{host_name}'.")
+                return None
+            
+            # Обновляем статус включения клиента
+            client.enable = enabled
+            
+            # При отключении ключа устанавливаем expiry_time на текущее время
+            if not enabled:
+                from datetime import timezone as _tz
+                now_ms = int(datetime.now(_tz.utc).timestamp() * 1000)
+                client.expiry_time = now_ms
+            
+            # Сохраняем изменения через inbound
+            api.inbound.update(inbound.id, inbound_data)
+            return client
+
+        # Логин и обновление — потенциально долгие сетевые вызовы, выносим в поток.
+        # Авторизованная сессия хоста переиспользуется между вызовами.
+        try:
+            client = await asyncio.to_thread(run_panel_operation, host_data, apply_enabled_status, True)
+        except PanelLoginError:
             logger.error(f"Failed to login to host '{host_name}'.")
             return False
-        
-        # Получаем данные inbound с клиентами
-        inbound_data = api.inbound.get_by_id(inbound.id)
-        if not inbound_data or not inbound_data.settings.clients:
-            logger.warning(f"No clients found in inbound on host '{host_name}'.")
-            return False
-        
-        # Ищем клиента по email
-        client = None
-        for c in inbound_data.settings.clients:
-            if c.email == client_email:
-                client = c
-                break
-        
-        if not client:
-            logger.warning(f"Client with email '{client_email}' not found on host '{host_name}'.")
+        if client is None:
             return False
         
-        # Обновляем статус включения клиента
-        client.enable = enabled
-        
-        # При отключении ключа устанавливаем expiry_time на текущее время
-        if not enabled:
-            from datetime import timezone as _tz
-            now_ms = int(datetime.now(_tz.utc).timestamp() * 1000)
-            client.expiry_time = now_ms
-        
-        # Сохраняем изменения через inbound
-        api.inbound.update(inbound.id, inbound_data)
-        
         # Дополнительно используем нативный эндпоинт панели для максимальной совместимости.
         # Он синхронный, поэтому выполняем в отдельном потоке.
         try:
@@ -1511,17 +2427,12 @@ def get_subscription_settings(host_url: str, username: str, password: str) -> di
     """Получает настройки подписки (subscription) из панели 3x-ui"""
     try:
         base = host_url.rstrip('/')
-        session = _create_verified_panel_session(host_url)
-
-        # Логин
-        login_response = session.post(f"{base}/login", json={"username": username, "password": password}, timeout=10)
-        if login_response.status_code != 200:
-            logger.error(f"Failed to login to {base} to get subscription settings")
-            return None
+        # Авторизованная keep-alive сессия хоста (логин только при первом запросе или 401)
+        session = _get_panel_session(host_url, username, password)
         
         # Получаем настройки панели через API
         # В 3x-ui настройки подписки хранятся в /panel/setting
-        settings_response = session.post(f"{base}/panel/setting/all", timeout=10)
+        settings_response = session.http_request("POST", "panel/setting/all")
         if settings_response.status_code != 200:
             logger.error(f"Failed to get settings from {base}: HTTP {settings_response.status_code}")
             return None
@@ -1547,11 +2458,6 @@ def get_subscription_settings(host_url: str, username: str, password: str) -> di
     except Exception as e:
         logger.error(f"Error getting subscription settings from {host_url}: {e}", exc_info=True)
         return None
-    finally:
-        try:
-            session.close()
-        except Exception:
-            pass
 
 async def get_client_subscription_link(host_name: str, client_email: str) -> str | None:
     """Получает subscription link для клиента по email"""
@@ -1561,21 +2467,19 @@ async def get_client_subscription_link(host_name: str, client_email: str) -> str
             logger.error(f"Host '{host_name}' not found in database")
             return None
         
-        # Логин к панели — выносим в отдельный поток.
-        api, inbound = await asyncio.to_thread(
-            login_to_host,
-            host_data['host_url'],
-            host_data['host_username'],
-            host_data['host_pass'],
-            host_data['host_inbound_id'],
-        )
-        
-        if not api or not inbound:
+        # Логин к панели и чтение inbound — выносим в отдельный поток.
+        # Данные inbound читаются из короткоживущего кэша сессии хоста.
+        try:
+            inbound_data = await asyncio.to_thread(
+                run_panel_operation,
+                host_data,
+                lambda api, inbound, session: session.get_inbound(api, inbound.id),
+            )
+        except PanelLoginError:
             logger.error(f"Failed to login to host '{host_name}'")
             return None
         
         # Получаем данные inbound с клиентами
-        inbound_data = api.inbound.get_by_id(inbound.id)
         if not inbound_data or not inbound_data.settings.clients:
             logger.warning(f"No clients found in inbound on host '{host_name}'")
             return None
@@ -4,9 +4,10 @@
 """
 
 from .error_handler import handle_exceptions, handle_async_exceptions, safe_execute, safe_execute_async, error_handler
-from .logger import app_logger, security_logger, payment_logger, database_logger, get_logger, setup_logging
+from .logger import app_logger, security_logger, payment_logger, database_logger, get_logger, setup_logging, get_log_queue_stats, shutdown_logging
 
 __all__ = [
     'handle_exceptions', 'handle_async_exceptions', 'safe_execute', 'safe_execute_async', 'error_handler',
-    'app_logger', 'security_logger', 'payment_logger', 'database_logger', 'get_logger', 'setup_logging'
+    'app_logger', 'security_logger', 'payment_logger', 'database_logger', 'get_logger', 'setup_logging',
+    'get_log_queue_stats', 'shutdown_logging'
 ]
@@ -1,23 +1,241 @@
 # -*- coding: utf-8 -*-
 """
 Централизованная система логирования для Dark Maximus
+
+По умолчанию логгеры не пишут в файлы и stdout сами: запись кладётся в
+ограниченную очередь (QueueHandler), а форматирование, JSON и ротацию
+выполняет один поток-слушатель. Так logger.info в event loop не делает
+синхронного файлового I/O. Режим настраивается переменными окружения
+LOG_QUEUE_ENABLED, LOG_QUEUE_SIZE, LOG_QUEUE_OVERFLOW (drop, drop_oldest,
+block) и LOG_QUEUE_BLOCK_TIMEOUT.
 """
 
+import atexit
 import logging
 import logging.handlers
 import os
+import queue
 import sys
+import threading
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import json
 
+OVERFLOW_DROP = "drop"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_BLOCK = "block"
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BLOCK_TIMEOUT = 1.0
+
+
+@dataclass
+class LogQueueConfig:
+    """Параметры очереди логов (из переменных окружения LOG_QUEUE_*)."""
+
+    enabled: bool = True
+    max_size: int = DEFAULT_QUEUE_SIZE
+    overflow: str = OVERFLOW_DROP
+    block_timeout: float = DEFAULT_BLOCK_TIMEOUT
+
+    @classmethod
+    def from_env(cls) -> "LogQueueConfig":
+        enabled = (os.getenv("LOG_QUEUE_ENABLED") or "true").strip().lower() in {"1", "true", "on", "yes"}
+        overflow = (os.getenv("LOG_QUEUE_OVERFLOW") or OVERFLOW_DROP).strip().lower()
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            overflow = OVERFLOW_DROP
+        try:
+            max_size = max(1, int(os.getenv("LOG_QUEUE_SIZE") or DEFAULT_QUEUE_SIZE))
+        except ValueError:
+            max_size = DEFAULT_QUEUE_SIZE
+        try:
+            block_timeout = max(0.0, float(os.getenv("LOG_QUEUE_BLOCK_TIMEOUT") or DEFAULT_BLOCK_TIMEOUT))
+        except ValueError:
+            block_timeout = DEFAULT_BLOCK_TIMEOUT
+        return cls(enabled=enabled, max_size=max_size, overflow=overflow, block_timeout=block_timeout)
+
+
+class _PipelineListener(logging.handlers.QueueListener):
+    """Слушатель очереди: элементы — пары (обработчики, запись)."""
+
+    def __init__(self, pipeline: "LogPipeline"):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name="log-listener", daemon=True)
+        self._thread.start()
+
+    def handle(self, item):
+        sink, record = item
+        self.pipeline.report_dropped(sink, record)
+        for handler in sink:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        self.pipeline.processed += 1
+
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена: ждём места, а не теряем sentinel
+        self.queue.put(self._sentinel)
+
+
+class PipelineQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который передаёт запись слушателю без форматирования.
+
+    Очередь живёт в том же процессе, поэтому запись не нужно сериализовать:
+    сообщение, JSON и traceback форматируются уже в потоке слушателя.
+    """
+
+    def __init__(self, pipeline: "LogPipeline", sink: List[logging.Handler]):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.sink = sink
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self.pipeline.put(self.sink, record)
+
+
+class LogPipeline:
+    """Ограниченная очередь логов и один поток, который пишет файлы и stdout."""
+
+    def __init__(self, config: Optional[LogQueueConfig] = None):
+        self.config = config or LogQueueConfig.from_env()
+        self.queue: queue.Queue = queue.Queue(self.config.max_size)
+        self.listener = _PipelineListener(self)
+        self._lock = threading.Lock()
+        self._sinks: Dict[Any, List[logging.Handler]] = {}
+        self.processed = 0
+        self.dropped = 0
+        self._dropped_reported = 0
+        self.max_depth = 0
+
+    def get_sink(self, key: Any, factory) -> List[logging.Handler]:
+        """Общий набор обработчиков для ключа: одни файлы ротирует один владелец"""
+        with self._lock:
+            sink = self._sinks.get(key)
+            if sink is None:
+                sink = self._sinks[key] = factory()
+            return sink
+
+    def start(self):
+        with self._lock:
+            if self.listener._thread is None:
+                self.listener.start()
+
+    def stop(self):
+        """Останавливает слушателя, дописав всё, что уже в очереди"""
+        with self._lock:
+            if self.listener._thread is None:
+                return
+            self.listener.stop()
+
+    def put(self, sink: List[logging.Handler], record: logging.LogRecord):
+        item = (sink, record)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if not self._put_on_overflow(item):
+                with self._lock:
+                    self.dropped += 1
+                return
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _put_on_overflow(self, item) -> bool:
+        overflow = self.config.overflow
+        if overflow == OVERFLOW_BLOCK:
+            try:
+                self.queue.put(item, timeout=self.config.block_timeout)
+                return True
+            except queue.Full:
+                return False
+        if overflow == OVERFLOW_DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+            else:
+                with self._lock:
+                    self.dropped += 1
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                return False
+        return False
+
+    def report_dropped(self, sink: List[logging.Handler], record: logging.LogRecord):
+        """В потоке слушателя: сообщает в тот же набор обработчиков о потерянных записях"""
+        missed = self.dropped - self._dropped_reported
+        if missed <= 0:
+            return
+        self._dropped_reported += missed
+        warning = logging.LogRecord(
+            record.name, logging.WARNING, __file__, 0,
+            f"Log queue overflow ({self.config.overflow}): dropped {missed} records", None, None,
+            func="report_dropped",
+        )
+        for handler in sink:
+            if warning.levelno >= handler.level:
+                handler.handle(warning)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': True,
+            'queue_size': self.queue.qsize(),
+            'capacity': self.config.max_size,
+            'overflow': self.config.overflow,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'max_depth': self.max_depth,
+            'listener_alive': bool(self.listener._thread and self.listener._thread.is_alive()),
+        }
+
+
+_log_pipeline: Optional[LogPipeline] = None
+_log_pipeline_lock = threading.Lock()
+
+
+def get_log_pipeline() -> LogPipeline:
+    """Глобальная очередь логов; поток-слушатель запускается при первом обращении"""
+    global _log_pipeline
+    with _log_pipeline_lock:
+        if _log_pipeline is None:
+            _log_pipeline = LogPipeline()
+            _log_pipeline.start()
+            atexit.register(_log_pipeline.stop)
+        return _log_pipeline
+
+
+def get_log_queue_stats() -> Dict[str, Any]:
+    """Статистика очереди логов (enabled=False, если очередь не используется)"""
+    if _log_pipeline is None:
+        return {'enabled': False}
+    return _log_pipeline.get_stats()
+
+
+def shutdown_logging():
+    """Дописывает очередь логов и останавливает поток-слушатель"""
+    if _log_pipeline is not None:
+        _log_pipeline.stop()
+
 class StructuredLogger:
     """Структурированный логгер с поддержкой JSON и ротации файлов"""
     
-    def __init__(self, name: str, log_dir: str = "logs"):
+    def __init__(self, name: str, log_dir: str = "logs", use_queue: Optional[bool] = None,
+                 pipeline: Optional[LogPipeline] = None):
         self.name = name
         self.log_dir = Path(log_dir)
+        if use_queue is None:
+            use_queue = pipeline is not None or LogQueueConfig.from_env().enabled
+        self.pipeline = (pipeline or get_log_pipeline()) if use_queue else None
         self.log_dir.mkdir(exist_ok=True)
         
         # Создаем логгер
@@ -53,11 +271,22 @@ class StructuredLogger:
     
     def _setup_handlers(self):
         """Настройка обработчиков логов"""
+        if self.pipeline is None:
+            for handler in self._create_handlers():
+                self.logger.addHandler(handler)
+            return
+        # Все логгеры с одним каталогом делят обработчики в потоке слушателя
+        sink = self.pipeline.get_sink(('structured', str(self.log_dir.resolve())), self._create_handlers)
+        self.logger.addHandler(PipelineQueueHandler(self.pipeline, sink))
+
+    def _create_handlers(self) -> List[logging.Handler]:
+        """Консольный, общий, ошибок и JSON-обработчики"""
+        handlers = []
         # Консольный обработчик
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(self.console_formatter)
-        self.logger.addHandler(console_handler)
+        handlers.append(console_handler)
         
         # Файловый обработчик для общих логов
         general_log_file = self.log_dir / "dark_maximus.log"
@@ -68,7 +297,7 @@ class StructuredLogger:
         )
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(self.file_formatter)
-        self.logger.addHandler(file_handler)
+        handlers.append(file_handler)
         
         # Файловый обработчик для ошибок
         error_log_file = self.log_dir / "errors.log"
@@ -79,7 +308,7 @@ class StructuredLogger:
         )
         error_handler.setLevel(logging.ERROR)
         error_handler.setFormatter(self.file_formatter)
-        self.logger.addHandler(error_handler)
+        handlers.append(error_handler)
         
         # Файловый обработчик для структурированных логов
         structured_log_file = self.log_dir / "structured.log"
@@ -90,7 +319,8 @@ class StructuredLogger:
         )
         structured_handler.setLevel(logging.INFO)
         structured_handler.setFormatter(self.json_formatter)
-        self.logger.addHandler(structured_handler)
+        handlers.append(structured_handler)
+        return handlers
     
     def info(self, message: str, **kwargs):
         """Логирование информационного сообщения"""
@@ -193,8 +423,13 @@ def get_logger(name: str) -> StructuredLogger:
     """Получить логгер по имени"""
     return StructuredLogger(name)
 
-def setup_logging(log_level: str = "INFO", log_dir: str = "logs"):
-    """Настройка глобального логирования"""
+def setup_logging(log_level: str = "INFO", log_dir: str = "logs", use_queue: Optional[bool] = None):
+    """Настройка глобального логирования
+
+    Если очередь включена (use_queue или LOG_QUEUE_ENABLED), корневой логгер
+    получает один QueueHandler, а консоль и application.log обслуживает
+    поток-слушатель.
+    """
     # Устанавливаем уровень логирования
     numeric_level = getattr(logging, log_level.upper(), logging.INFO)
     
@@ -210,6 +445,23 @@ def setup_logging(log_level: str = "INFO", log_dir: str = "logs"):
     log_path = Path(log_dir)
     log_path.mkdir(exist_ok=True)
     
+    if use_queue is None:
+        use_queue = LogQueueConfig.from_env().enabled
+    handlers = _create_root_handlers(numeric_level, log_path)
+    if use_queue:
+        root_logger.addHandler(PipelineQueueHandler(get_log_pipeline(), handlers))
+    else:
+        for handler in handlers:
+            root_logger.addHandler(handler)
+    
+    # Отключаем логирование от внешних библиотек
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    logging.getLogger('requests').setLevel(logging.WARNING)
+    logging.getLogger('aiohttp').setLevel(logging.WARNING)
+
+def _create_root_handlers(numeric_level: int, log_path: Path) -> List[logging.Handler]:
+    """Консольный и файловый обработчики корневого логгера"""
     # Настраиваем обработчик для всех логгеров
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(numeric_level)
@@ -217,7 +469,7 @@ def setup_logging(log_level: str = "INFO", log_dir: str = "logs"):
         '%(asctime)s - [%(levelname)s] - %(name)s - %(message)s'
     )
     console_handler.setFormatter(console_formatter)
-    root_logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # Файловый обработчик
     file_handler = logging.handlers.RotatingFileHandler(
@@ -227,10 +479,5 @@ def setup_logging(log_level: str = "INFO", log_dir: str = "logs"):
     )
     file_handler.setLevel(numeric_level)
     file_handler.setFormatter(console_formatter)
-    root_logger.addHandler(file_handler)
-    
-    # Отключаем логирование от внешних библиотек
-    logging.getLogger('werkzeug').setLevel(logging.WARNING)
-    logging.getLogger('urllib3').setLevel(logging.WARNING)
-    logging.getLogger('requests').setLevel(logging.WARNING)
-    logging.getLogger('aiohttp').setLevel(logging.WARNING)
+    handlers.append(file_handler)
+    return handlers
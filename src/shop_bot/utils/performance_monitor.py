@@ -5,16 +5,150 @@
 
 import asyncio
 import logging
+import math
+import threading
 import time
+from bisect import bisect_left
+from itertools import accumulate
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from collections import defaultdict, deque
 import json
-from functools import wraps
+from functools import lru_cache, wraps
 
 logger = logging.getLogger(__name__)
 
+# Гистограммы задержек (HDR-подобные): длительность в микросекундах попадает
+# в логарифмическую корзину, 2**HISTOGRAM_SUB_BUCKET_BITS корзин на каждую
+# степень двойки (погрешность перцентиля не больше 1/16 = 6.25%)
+HISTOGRAM_SUB_BUCKET_BITS = 4
+# Скользящее окно: HISTOGRAM_WINDOWS интервалов по HISTOGRAM_WINDOW_SECONDS (последний час)
+HISTOGRAM_WINDOW_SECONDS = 60
+HISTOGRAM_WINDOWS = 60
+PERCENTILES = (50, 95, 99)
+# Экспорт в OpenMetrics (/metrics): верхние границы корзин гистограмм в секундах
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PREFIX = "shop_bot"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_SUB_BUCKETS = 1 << HISTOGRAM_SUB_BUCKET_BITS
+
+
+def _bucket_index(micros: int) -> int:
+    """Номер корзины для значения в микросекундах (точные корзины до 2 * _SUB_BUCKETS)."""
+    if micros < 2 * _SUB_BUCKETS:
+        return max(micros, 0)
+    shift = micros.bit_length() - 1 - HISTOGRAM_SUB_BUCKET_BITS
+    return shift * _SUB_BUCKETS + (micros >> shift)
+
+
+def _bucket_bounds(index: int) -> tuple[int, int]:
+    """Границы корзины [lower, upper) в микросекундах."""
+    if index < 2 * _SUB_BUCKETS:
+        return index, index + 1
+    shift = index // _SUB_BUCKETS - 1
+    mantissa = index - shift * _SUB_BUCKETS
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+@lru_cache(maxsize=4096)
+def _bucket_upper(index: int) -> int:
+    return _bucket_bounds(index)[1]
+
+
+class LatencyHistogram:
+    """Логарифмическая гистограмма длительностей с подсчётом медленных и ошибочных операций."""
+
+    __slots__ = ('buckets', 'count', 'total', 'max', 'slow', 'errors')
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.errors = 0
+
+    def record(self, duration: float, slow: bool = False, error: bool = False):
+        index = _bucket_index(int(duration * 1_000_000))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.slow += slow
+        self.errors += error
+
+    def copy(self) -> 'LatencyHistogram':
+        clone = LatencyHistogram()
+        clone.buckets = dict(self.buckets)
+        clone.count, clone.total, clone.max = self.count, self.total, self.max
+        clone.slow, clone.errors = self.slow, self.errors
+        return clone
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.slow += other.slow
+        self.errors += other.errors
+
+    def percentile(self, pct: float) -> float:
+        """Значение перцентиля в секундах (середина корзины, не больше максимума)."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                lower, upper = _bucket_bounds(index)
+                return min((lower + upper) / 2 / 1_000_000, self.max)
+        return self.max
+
+    def percentiles(self) -> Dict[str, float]:
+        return {f'p{pct}': self.percentile(pct) for pct in PERCENTILES}
+
+    def cumulative_counts(self, bounds) -> List[int]:
+        """Число значений не больше каждой границы (секунды); корзина учитывается по верхней границе."""
+        limits = [int(bound * 1_000_000) for bound in bounds]
+        counts = [0] * len(limits)
+        for index, count in self.buckets.items():
+            position = bisect_left(limits, _bucket_upper(index))
+            if position < len(limits):
+                counts[position] += count
+        return list(accumulate(counts))
+
+
+class RollingHistogram:
+    """Гистограммы по интервалам времени; сводка объединяет интервалы последнего окна."""
+
+    def __init__(self, window_seconds: int = HISTOGRAM_WINDOW_SECONDS, windows: int = HISTOGRAM_WINDOWS):
+        self.window_seconds = window_seconds
+        self.windows = windows
+        self._buckets: Dict[int, LatencyHistogram] = {}
+
+    def record(self, duration: float, now: float, slow: bool = False, error: bool = False):
+        window_id = int(now // self.window_seconds)
+        histogram = self._buckets.get(window_id)
+        if histogram is None:
+            histogram = self._buckets[window_id] = LatencyHistogram()
+            oldest = window_id - self.windows + 1
+            for stale_id in [wid for wid in self._buckets if wid < oldest]:
+                del self._buckets[stale_id]
+        histogram.record(duration, slow, error)
+
+    def snapshot(self, now: float) -> LatencyHistogram:
+        oldest = int(now // self.window_seconds) - self.windows + 1
+        merged = LatencyHistogram()
+        for window_id, histogram in self._buckets.items():
+            if window_id >= oldest:
+                merged.merge(histogram)
+        return merged
+
+
 @dataclass
 class PerformanceMetric:
     """Метрика производительности"""
@@ -26,7 +160,16 @@ class PerformanceMetric:
     error: Optional[str] = None
 
 class PerformanceMonitor:
-    """Монитор производительности бота"""
+    """Монитор производительности бота.
+
+    Длительности операций накапливаются в скользящих логарифмических
+    гистограммах (по операции и общей), из которых считаются p50/p95/p99;
+    deque последних метрик хранит детали для списков медленных операций и
+    ошибок. Запись защищена threading.Lock и доступна как из event loop
+    (record_metric), так и из потоков (record_metric_sync). Для /metrics
+    дополнительно ведутся накопленные с запуска гистограммы (totals):
+    счётчики OpenMetrics не должны уменьшаться при сдвиге окна.
+    """
     
     def __init__(self, max_metrics: int = 1000, slow_threshold: float = 1.0, enabled: bool = True):
         # Глобальные настройки монитора
@@ -50,13 +193,23 @@ class PerformanceMonitor:
             'avg_time': 0.0,
             'slow_requests': 0
         })
-        self._lock = asyncio.Lock()
+        # Счётчики событий за цикл (например, переходы статусов ключей)
+        self.counters: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+            'last': 0,
+            'total': 0,
+            'samples': 0,
+            'updated_at': None
+        })
+        self.histograms: Dict[str, RollingHistogram] = defaultdict(RollingHistogram)
+        self.overall_histogram = RollingHistogram()
+        self.totals: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._lock = threading.Lock()
     
     async def apply_settings(self, *, max_metrics: Optional[int] = None, slow_threshold: Optional[float] = None, enabled: Optional[bool] = None):
         """Применение новых настроек для монитора на лету.
         Безопасно пересоздает deque при изменении лимита и обновляет порог/флаг включения.
         """
-        async with self._lock:
+        with self._lock:
             if max_metrics is not None and max_metrics != self.max_metrics and max_metrics > 0:
                 # Пересоздаем deque с новым maxlen, сохранив последние элементы
                 new_deque: deque = deque(self.metrics, maxlen=max_metrics)
@@ -68,23 +221,24 @@ class PerformanceMonitor:
                 self.enabled = bool(enabled)
     
     async def set_enabled(self, value: bool):
-        async with self._lock:
+        with self._lock:
             self.enabled = bool(value)
     
-    async def record_metric(
-        self, 
-        operation: str, 
-        duration: float, 
+    def record_metric_sync(
+        self,
+        operation: str,
+        duration: float,
         user_id: Optional[int] = None,
         success: bool = True,
         error: Optional[str] = None
     ):
-        """Запись метрики производительности"""
-        async with self._lock:
+        """Запись метрики производительности из любого потока"""
+        with self._lock:
             if not self.enabled:
                 return
+            now = time.time()
             metric = PerformanceMetric(
-                timestamp=time.time(),
+                timestamp=now,
                 operation=operation,
                 duration=duration,
                 user_id=user_id,
@@ -94,6 +248,11 @@ class PerformanceMonitor:
             
             self.metrics.append(metric)
             
+            is_slow = duration > self.slow_threshold
+            self.histograms[operation].record(duration, now, is_slow, not success)
+            self.overall_histogram.record(duration, now, is_slow, not success)
+            self.totals[operation].record(duration, is_slow, not success)
+            
             # Обновляем статистику операций
             op_stats = self.operation_stats[operation]
             op_stats['count'] += 1
@@ -102,7 +261,7 @@ class PerformanceMonitor:
             op_stats['min_time'] = min(op_stats['min_time'], duration)
             op_stats['max_time'] = max(op_stats['max_time'], duration)
             
-            if duration > self.slow_threshold:
+            if is_slow:
                 op_stats['slow_count'] += 1
             
             if not success:
@@ -115,103 +274,165 @@ class PerformanceMonitor:
                 user_stats['total_time'] += duration
                 user_stats['avg_time'] = user_stats['total_time'] / user_stats['request_count']
                 
-                if duration > self.slow_threshold:
+                if is_slow:
                     user_stats['slow_requests'] += 1
     
+    async def record_metric(
+        self, 
+        operation: str, 
+        duration: float, 
+        user_id: Optional[int] = None,
+        success: bool = True,
+        error: Optional[str] = None
+    ):
+        """Запись метрики производительности"""
+        self.record_metric_sync(operation, duration, user_id, success, error)
+    
+    def record_count_sync(self, name: str, value: int):
+        """Запись значения счётчика из любого потока (последнее значение и накопленная сумма)"""
+        with self._lock:
+            if not self.enabled:
+                return
+            counter = self.counters[name]
+            counter['last'] = value
+            counter['total'] += value
+            counter['samples'] += 1
+            counter['updated_at'] = time.time()
+    
+    async def record_count(self, name: str, value: int):
+        """Запись значения счётчика за цикл (последнее значение и накопленная сумма)"""
+        self.record_count_sync(name, value)
+    
+    async def get_counters(self) -> Dict[str, Dict[str, Any]]:
+        """Получение всех счётчиков"""
+        with self._lock:
+            return {name: counter.copy() for name, counter in self.counters.items()}
+    
     async def get_operation_stats(self, operation: str) -> Dict[str, Any]:
-        """Получение статистики по операции"""
-        async with self._lock:
-            return self.operation_stats.get(operation, {}).copy()
+        """Получение статистики по операции (с перцентилями за скользящее окно)"""
+        with self._lock:
+            stats = self.operation_stats.get(operation, {}).copy()
+            if stats and operation in self.histograms:
+                stats.update(self.histograms[operation].snapshot(time.time()).percentiles())
+            return stats
     
     async def get_user_stats(self, user_id: int) -> Dict[str, Any]:
         """Получение статистики по пользователю"""
-        async with self._lock:
+        with self._lock:
             return self.user_stats.get(user_id, {}).copy()
     
     async def get_slow_operations(self, limit: int = 10) -> List[PerformanceMetric]:
         """Получение медленных операций"""
-        async with self._lock:
+        with self._lock:
             slow_ops = [m for m in self.metrics if m.duration > self.slow_threshold]
             return sorted(slow_ops, key=lambda x: x.duration, reverse=True)[:limit]
     
     async def get_recent_errors(self, limit: int = 10) -> List[PerformanceMetric]:
         """Получение последних ошибок"""
-        async with self._lock:
+        with self._lock:
             errors = [m for m in self.metrics if not m.success]
             return sorted(errors, key=lambda x: x.timestamp, reverse=True)[:limit]
     
     async def get_performance_summary(self) -> Dict[str, Any]:
-        """Получение сводки по производительности"""
-        async with self._lock:
-            if not self.metrics:
-                return {
-                    'total_operations': 0,
-                    'avg_response_time': 0.0,
-                    'slow_operations': 0,
-                    'error_rate': 0.0,
-                    'top_operations': [],
-                    'top_users': []
-                }
-            
-            total_ops = len(self.metrics)
-            total_time = sum(m.duration for m in self.metrics)
-            avg_time = total_time / total_ops if total_ops > 0 else 0.0
-            slow_ops = sum(1 for m in self.metrics if m.duration > self.slow_threshold)
-            error_ops = sum(1 for m in self.metrics if not m.success)
-            error_rate = (error_ops / total_ops) * 100 if total_ops > 0 else 0.0
-            
-            # Топ операций по времени выполнения
-            op_times = defaultdict(list)
-            for metric in self.metrics:
-                op_times[metric.operation].append(metric.duration)
-            
-            top_operations = []
-            for op, times in op_times.items():
-                avg_op_time = sum(times) / len(times)
-                top_operations.append({
-                    'operation': op,
-                    'count': len(times),
-                    'avg_time': avg_op_time,
-                    'total_time': sum(times)
-                })
-            
-            top_operations.sort(key=lambda x: x['total_time'], reverse=True)
-            
-            # Топ пользователей по количеству запросов
+        """Получение сводки по производительности за скользящее окно гистограмм"""
+        with self._lock:
+            now = time.time()
+            overall = self.overall_histogram.snapshot(now)
+            counters = {name: counter.copy() for name, counter in self.counters.items()}
+            operations = {op: histogram.snapshot(now) for op, histogram in self.histograms.items()}
             user_counts = defaultdict(int)
             for metric in self.metrics:
                 if metric.user_id:
                     user_counts[metric.user_id] += 1
-            
-            # Получаем дополнительную информацию о пользователях
-            top_users = []
-            for user_id, count in sorted(user_counts.items(), key=lambda x: x[1], reverse=True):
-                user_info = {'user_id': user_id, 'request_count': count, 'username': 'N/A', 'fullname': 'N/A'}
-                
-                # Получаем данные пользователя из базы данных
-                try:
-                    from shop_bot.data_manager.database import get_user
-                    user_data = get_user(user_id)
-                    if user_data:
-                        user_info['username'] = user_data.get('username') or 'N/A'
-                        user_info['fullname'] = user_data.get('fullname') or 'N/A'
-                except Exception as e:
-                    logger.warning(f"Failed to get user data for {user_id}: {e}")
-                
-                top_users.append(user_info)
-            
+        
+        if not overall.count:
             return {
-                'total_operations': total_ops,
-                'avg_response_time': avg_time,
-                'slow_operations': slow_ops,
-                'error_rate': error_rate,
-                'top_operations': top_operations[:20],
-                'top_users': top_users[:20]
+                'total_operations': 0,
+                'avg_response_time': 0.0,
+                'slow_operations': 0,
+                'error_rate': 0.0,
+                **{f'p{pct}': 0.0 for pct in PERCENTILES},
+                'top_operations': [],
+                'top_users': [],
+                'counters': counters
             }
+        
+        # Топ операций по времени выполнения
+        top_operations = [
+            {
+                'operation': op,
+                'count': histogram.count,
+                'avg_time': histogram.total / histogram.count,
+                'total_time': histogram.total,
+                **histogram.percentiles()
+            }
+            for op, histogram in operations.items() if histogram.count
+        ]
+        top_operations.sort(key=lambda x: x['total_time'], reverse=True)
+        
+        # Получаем дополнительную информацию о пользователях (вне блокировки: запросы к БД)
+        top_users = []
+        for user_id, count in sorted(user_counts.items(), key=lambda x: x[1], reverse=True)[:20]:
+            user_info = {'user_id': user_id, 'request_count': count, 'username': 'N/A', 'fullname': 'N/A'}
+            
+            # Получаем данные пользователя из базы данных
+            try:
+                from shop_bot.data_manager.database import get_user
+                user_data = get_user(user_id)
+                if user_data:
+                    user_info['username'] = user_data.get('username') or 'N/A'
+                    user_info['fullname'] = user_data.get('fullname') or 'N/A'
+            except Exception as e:
+                logger.warning(f"Failed to get user data for {user_id}: {e}")
+            
+            top_users.append(user_info)
+        
+        return {
+            'total_operations': overall.count,
+            'avg_response_time': overall.total / overall.count,
+            'slow_operations': overall.slow,
+            'error_rate': overall.errors / overall.count * 100,
+            **overall.percentiles(),
+            'top_operations': top_operations[:20],
+            'top_users': top_users,
+            'counters': counters
+        }
+    
+    def get_metric_families(self) -> List[tuple]:
+        """Семейства метрик для render_openmetrics: гистограммы операций с запуска и счётчики.
+
+        Операция вида 'panel_api:host' выгружается как operation="panel_api",
+        target="host". Вызов не обращается к БД и занимает время порядка
+        числа операций, поэтому подходит для опроса каждые 15 секунд.
+        """
+        le_labels = [_format_value(bound) for bound in METRICS_BUCKETS] + ['+Inf']
+        durations, errors, slow = [], [], []
+        # Под блокировкой только копии: запись метрик не ждёт построения выгрузки
+        with self._lock:
+            totals = {operation: histogram.copy() for operation, histogram in self.totals.items()}
+            counters = {name: counter.copy() for name, counter in self.counters.items()}
+        for operation, histogram in sorted(totals.items()):
+            labels = _operation_labels(operation)
+            cumulative = histogram.cumulative_counts(METRICS_BUCKETS) + [histogram.count]
+            for le, count in zip(le_labels, cumulative):
+                durations.append(('_bucket', {**labels, 'le': le}, count))
+            durations.append(('_count', labels, histogram.count))
+            durations.append(('_sum', labels, histogram.total))
+            errors.append(('_total', labels, histogram.errors))
+            slow.append(('_total', labels, histogram.slow))
+        events = [('_total', {'name': name}, counter['total']) for name, counter in sorted(counters.items())]
+        last_values = [('', {'name': name}, counter['last']) for name, counter in sorted(counters.items())]
+        return [
+            ('operation_duration_seconds', 'histogram', 'Operation latency since process start', durations),
+            ('operation_errors', 'counter', 'Failed operations', errors),
+            ('operation_slow', 'counter', 'Operations slower than the monitor threshold', slow),
+            ('events', 'counter', 'Per-cycle event counters accumulated since process start', events),
+            ('events_last', 'gauge', 'Event counter value of the last cycle', last_values),
+        ]
     
     async def clear_old_metrics(self, max_age_hours: int = 24):
         """Очистка старых метрик"""
-        async with self._lock:
+        with self._lock:
             cutoff_time = time.time() - (max_age_hours * 3600)
             old_count = len(self.metrics)
             
@@ -225,7 +446,7 @@ class PerformanceMonitor:
     
     async def export_metrics(self, file_path: str):
         """Экспорт метрик в файл"""
-        async with self._lock:
+        with self._lock:
             metrics_data = []
             for metric in self.metrics:
                 metrics_data.append({
@@ -244,7 +465,7 @@ class PerformanceMonitor:
     
     async def export_metrics_json(self) -> list:
         """Экспорт метрик в виде JSON-совместимого списка (для HTTP ответа)."""
-        async with self._lock:
+        with self._lock:
             return [
                 {
                     'timestamp': metric.timestamp,
@@ -259,7 +480,7 @@ class PerformanceMonitor:
     
     async def get_hourly_stats_for_charts(self, hours: int = 24) -> dict:
         """Получение статистики по часам за последние N часов для графиков"""
-        async with self._lock:
+        with self._lock:
             if not self.metrics:
                 return {
                     'hours': [],
@@ -344,6 +565,37 @@ class PerformanceMonitor:
                 'error_count': error_count
             }
 
+def _operation_labels(operation: str) -> Dict[str, str]:
+    name, _, target = operation.partition(':')
+    return {'operation': name, 'target': target} if target else {'operation': name}
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def render_openmetrics(families: List[tuple]) -> str:
+    """Текст в формате OpenMetrics из семейств (name, type, help, [(suffix, labels, value)])."""
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        full_name = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        lines.append(f"# HELP {full_name} {help_text}")
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+            label_text = f"{{{label_text}}}" if label_text else ''
+            lines.append(f"{full_name}{suffix}{label_text} {_format_value(value)}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
 # Глобальный экземпляр монитора
 _performance_monitor: Optional[PerformanceMonitor] = None
 
@@ -411,21 +663,14 @@ def measure_performance_sync(operation_name: str):
                 raise
             finally:
                 duration = time.time() - start_time
-                # Записываем метрику асинхронно через event loop если доступен
                 try:
-                    loop = asyncio.get_event_loop()
-                    if loop.is_running():
-                        monitor = get_performance_monitor()
-                        asyncio.run_coroutine_threadsafe(
-                            monitor.record_metric(
-                                operation=operation_name,
-                                duration=duration,
-                                user_id=None,
-                                success=success,
-                                error=error
-                            ),
-                            loop
-                        )
+                    get_performance_monitor().record_metric_sync(
+                        operation=operation_name,
+                        duration=duration,
+                        user_id=None,
+                        success=success,
+                        error=error
+                    )
                 except Exception:
                     pass  # Игнорируем ошибки мониторинга
         return wrapper
@@ -474,6 +719,7 @@ async def get_performance_report() -> str:
 **Общая статистика:**
 • Всего операций: {summary['total_operations']}
 • Среднее время ответа: {summary['avg_response_time']:.3f}с
+• p50 / p95 / p99: {summary['p50']:.3f}с / {summary['p95']:.3f}с / {summary['p99']:.3f}с
 • Медленных операций: {summary['slow_operations']}
 • Процент ошибок: {summary['error_rate']:.1f}%
 
@@ -481,7 +727,7 @@ async def get_performance_report() -> str:
 """
     
     for i, op in enumerate(summary['top_operations'], 1):
-        report += f"{i}. {op['operation']}: {op['count']} раз, {op['avg_time']:.3f}с среднее\n"
+        report += f"{i}. {op['operation']}: {op['count']} раз, {op['avg_time']:.3f}с среднее, p95 {op['p95']:.3f}с\n"
     
     report += "\n**Топ пользователей по активности:**\n"
     for i, user in enumerate(summary['top_users'], 1):
@@ -1,27 +1,48 @@
 # -*- coding: utf-8 -*-
 """
 Telegram Logger - отправка логов в Telegram бота с умным rate limiting
+
+emit() только ставит запись в ограниченную очередь; форматирование и
+отправка выполняются в отдельном потоке, поэтому поток бота не тратит
+время на доставку логов. Повторы одной и той же ошибки (одна строка кода
+и тип исключения) в пределах окна дедупликации не ставятся в очередь, а
+приходят одной сводкой «×N за последние 60 с».
 """
 
 import asyncio
 import logging
+import threading
+import time
 import traceback
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List, Dict
-from collections import deque
-import aiohttp
+from collections import OrderedDict, deque
+import requests
 
 
 class TelegramLoggerHandler(logging.Handler):
     """
     Обработчик логов для отправки в Telegram бота.
     Включает умный rate limiting и группировку сообщений.
+
+    Политика перегрузки: очередь ограничена QUEUE_MAX_SIZE записями, новые
+    записи сверх неё отбрасываются (счётчик dropped), а число отброшенных
+    добавляется к следующему отправленному сообщению. Отправка ограничена
+    бюджетом MAX_MESSAGES_PER_MINUTE сообщений в минуту; пока бюджет
+    исчерпан, записи копятся в очереди и уходят группами.
     """
     
     # Telegram API ограничения (консервативные значения)
     MAX_MESSAGES_PER_SECOND = 20  # Telegram лимит ~30, используем 20 для безопасности
     MAX_MESSAGES_PER_MINUTE = 50  # Telegram лимит ~60, используем 50
     MAX_MESSAGE_LENGTH = 4000  # Telegram лимит 4096, используем 4000
+    # Очередь записей, ожидающих отправки
+    QUEUE_MAX_SIZE = 500
+    # Дедупликация: повторы записи с тем же отпечатком в течение окна сводятся в одну сводку
+    DEDUP_WINDOW_SECONDS = 60
+    DEDUP_MAX_FINGERPRINTS = 1000
+    # Как часто поток отправки просыпается без новых записей (закрытие окон дедупликации)
+    SENDER_TICK_SECONDS = 1.0
     
     def __init__(
         self,
@@ -45,21 +66,27 @@ class TelegramLoggerHandler(logging.Handler):
         self.log_level = log_level
         self.enabled = enabled
         
-        # Rate limiting
+        # Rate limiting (время отправки по time.monotonic)
         self._message_timestamps = deque()  # Временные метки отправленных сообщений
-        self._message_queue = deque()  # Очередь сообщений для отправки
-        self._grouping_window = 10  # Окно группировки в секундах
+        self._message_queue = deque()  # Очередь сообщений для отправки (не больше QUEUE_MAX_SIZE)
         self._max_logs_per_group = 20  # Максимум логов в одном сообщении
         
+        # Окна дедупликации: отпечаток -> {'started', 'count', 'record'}
+        self._dedup_windows: OrderedDict = OrderedDict()
+        self._queue_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._sender: threading.Thread | None = None
+        self._http: requests.Session | None = None
+        
         # Статистика
         self._total_sent = 0
         self._total_dropped = 0
+        self._total_coalesced = 0
+        self._total_failed = 0
+        self._dropped_unreported = 0
         self._last_send_time = None
         
-        # Флаг для предотвращения множественных отправок
-        self._sending = False
-        self._pending_start = False
-        
         # Настройка уровня логирования
         self._setup_log_level()
         
@@ -75,14 +102,6 @@ class TelegramLoggerHandler(logging.Handler):
             self.setLevel(logging.DEBUG)
         else:
             self.setLevel(logging.ERROR)
-        # Ссылка на event loop, если доступен
-        self._loop: asyncio.AbstractEventLoop | None = None
-
-    def set_loop(self, loop: asyncio.AbstractEventLoop):
-        """Устанавливает event loop для запуска фоновых задач логгера"""
-        self._loop = loop
-        # Если очередь не пуста и цикл уже запущен — сразу инициируем обработку
-        self._ensure_processing(loop)
     
     def _should_filter_error(self, record: logging.LogRecord) -> bool:
         """
@@ -135,9 +154,15 @@ class TelegramLoggerHandler(logging.Handler):
         
         return False
     
+    @staticmethod
+    def _fingerprint(record: logging.LogRecord) -> tuple:
+        """Отпечаток записи: место вызова и тип исключения (текст с переменными частями не учитывается)."""
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        return record.levelno, record.pathname, record.lineno, exc_type
+    
     def emit(self, record: logging.LogRecord):
         """
-        Обработка лог-записи
+        Обработка лог-записи: дедупликация и постановка в очередь без форматирования
         
         Args:
             record: Запись лога
@@ -145,40 +170,62 @@ class TelegramLoggerHandler(logging.Handler):
         if not self.enabled or self.log_level == "none":
             return
         
+        # Логи HTTP-клиента из потока отправки не должны снова попадать в очередь
+        if self._sender is not None and threading.get_ident() == self._sender.ident:
+            return
+        
         # Фильтруем сетевые ошибки Telegram API
         if self._should_filter_error(record):
             return
             
         try:
-            # Форматируем сообщение
-            message = self._format_message(record)
-            
-            # Добавляем в очередь
-            self._message_queue.append({
-                'message': message,
-                'timestamp': datetime.now(timezone.utc),
-                'level': record.levelname
-            })
-            
-            # Запускаем асинхронную отправку если не запущена
-            if not self._sending:
-                target_loop = self._loop
-
-                # Если цикл не задан, пробуем использовать текущий активный
-                try:
-                    running_loop = asyncio.get_running_loop()
-                except RuntimeError:
-                    running_loop = None
-
-                if target_loop is None:
-                    target_loop = running_loop
-
-                self._ensure_processing(target_loop, running_loop)
+            now = time.monotonic()
+            fingerprint = self._fingerprint(record)
+            with self._queue_lock:
+                window = self._dedup_windows.get(fingerprint)
+                if window is not None and now - window['started'] < self.DEDUP_WINDOW_SECONDS:
+                    window['count'] += 1
+                    self._total_coalesced += 1
+                    return
+                if window is None and len(self._dedup_windows) >= self.DEDUP_MAX_FINGERPRINTS:
+                    # Вытесняем самое старое окно; его повторы уйдут сводкой
+                    old_fingerprint, old_window = self._dedup_windows.popitem(last=False)
+                    self._enqueue_summary_locked(old_window)
+                if window is not None:
+                    # Окно истекло, но поток отправки ещё не закрыл его
+                    self._enqueue_summary_locked(self._dedup_windows.pop(fingerprint))
+                self._dedup_windows[fingerprint] = {'started': now, 'count': 0, 'record': record}
+                self._enqueue_locked({
+                    'record': record,
+                    'message': None,
+                    'timestamp': datetime.now(timezone.utc),
+                    'level': record.levelname
+                })
+            self._ensure_sender()
+            self._wakeup.set()
                 
         except Exception as e:
             # Не логируем ошибки обработчика, чтобы избежать рекурсии
             print(f"Error in TelegramLoggerHandler.emit: {e}")
     
+    def _enqueue_locked(self, item: Dict) -> None:
+        if len(self._message_queue) >= self.QUEUE_MAX_SIZE:
+            self._total_dropped += 1
+            self._dropped_unreported += 1
+            return
+        self._message_queue.append(item)
+    
+    def _enqueue_summary_locked(self, window: Dict) -> None:
+        """Ставит в очередь сводку повторов закрытого окна (если повторы были)."""
+        if window['count']:
+            record = window['record']
+            self._enqueue_locked({
+                'record': None,
+                'message': self._format_repeat_summary(record, window['count']),
+                'timestamp': datetime.now(timezone.utc),
+                'level': record.levelname
+            })
+    
     def _format_message(self, record: logging.LogRecord) -> str:
         """
         Форматирование лог-записи в читаемое сообщение
@@ -255,65 +302,6 @@ class TelegramLoggerHandler(logging.Handler):
         
         return full_message
     
-    async def _process_queue(self):
-        """Асинхронная обработка очереди сообщений"""
-        if self._sending:
-            return
-            
-        self._sending = True
-        
-        try:
-            while self._message_queue:
-                # Проверяем rate limits
-                await self._check_rate_limits()
-                
-                # Группируем сообщения
-                grouped_messages = self._group_messages()
-                
-                # Отправляем группу
-                for message in grouped_messages:
-                    await self._send_message(message)
-                    
-                # Небольшая задержка между группами
-                await asyncio.sleep(0.1)
-                
-        finally:
-            self._sending = False
-    
-    def _group_messages(self) -> List[str]:
-        """
-        Группировка сообщений по времени
-        
-        Returns:
-            Список сгруппированных сообщений
-        """
-        if not self._message_queue:
-            return []
-        
-        current_time = datetime.now(timezone.utc)
-        grouped = []
-        current_group = []
-        
-        while self._message_queue:
-            item = self._message_queue.popleft()
-            
-            # Проверяем, входит ли в текущее окно группировки
-            time_diff = (current_time - item['timestamp']).total_seconds()
-            
-            if time_diff <= self._grouping_window and len(current_group) < self._max_logs_per_group:
-                current_group.append(item)
-            else:
-                # Завершаем текущую группу и начинаем новую
-                if current_group:
-                    grouped.append(self._format_grouped_message(current_group))
-                current_group = [item]
-        
-        # Добавляем последнюю группу
-        if current_group:
-            grouped.append(self._format_grouped_message(current_group))
-        
-        return grouped
-    
     def _format_grouped_message(self, logs: List[Dict]) -> str:
         """
         Форматирование группы логов в одно сообщение
@@ -353,102 +341,103 @@ class TelegramLoggerHandler(logging.Handler):
         
         return header + stats + logs_text
     
-    def _ensure_processing(
-        self,
-        loop: Optional[asyncio.AbstractEventLoop] = None,
-        running_loop: Optional[asyncio.AbstractEventLoop] = None
-    ) -> None:
-        """
-        Гарантирует запуск фоновой задачи обработки очереди.
-
-        Args:
-            loop: Целевой цикл событий. Если не передан, используется сохраненный.
-            running_loop: Активный цикл, из которого вызвали метод (если есть).
-        """
-        loop = loop or self._loop
-
-        if loop is None:
-            # Нет доступного цикла — обработаем позже при появлении
-            self._pending_start = True
-            return
-
-        if not loop.is_running():
-            # Цикл еще не стартовал — отметим и вернемся позже
-            self._pending_start = True
+    def _format_repeat_summary(self, record: logging.LogRecord, count: int) -> str:
+        """Сводка повторов записи за окно дедупликации"""
+        moscow_tz = timezone(timedelta(hours=3))
+        time_str = datetime.now(moscow_tz).strftime('%d.%m.%Y %H:%M:%S')
+        message = record.getMessage()
+        return (
+            f"🔁 <b>Повтор {record.levelname}</b> | {time_str}\n"
+            f"📁 <b>Модуль:</b> {record.pathname}\n"
+            f"🔧 <b>Функция:</b> {record.funcName} (строка {record.lineno})\n"
+            f"💬 <b>Сообщение:</b> {message[:500]}\n\n"
+            f"<b>×{count}</b> за последние {self.DEDUP_WINDOW_SECONDS} с"
+        )
+    
+    def _ensure_sender(self) -> None:
+        """Запускает поток отправки при первой записи."""
+        if self._sender is not None and self._sender.is_alive():
             return
-
-        self._pending_start = False
-
-        def runner():
-            if self._sending:
+        with self._queue_lock:
+            if self._sender is not None and self._sender.is_alive():
                 return
-            task = loop.create_task(self._process_queue())
-            task.add_done_callback(self._handle_task_exception)
-
-        try:
-            current_loop = running_loop or asyncio.get_running_loop()
-        except RuntimeError:
-            current_loop = None
-
-        try:
-            if current_loop is loop:
-                loop.call_soon(runner)
-            else:
-                loop.call_soon_threadsafe(runner)
-        except RuntimeError as err:
-            # Возможны ситуации с закрытым циклом — запомним и попробуем позже
-            self._pending_start = True
-            print(f"TelegramLoggerHandler: failed to schedule queue processing: {err}")
-
-    @staticmethod
-    def _handle_task_exception(task: asyncio.Task) -> None:
-        """Выводит исключения фоновой задачи, если они возникли."""
+            self._stop.clear()
+            self._sender = threading.Thread(target=self._sender_loop, name="telegram-logger", daemon=True)
+            self._sender.start()
+    
+    def _sender_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.SENDER_TICK_SECONDS)
+            self._wakeup.clear()
+            try:
+                self._run_once()
+            except Exception as exc:  # noqa: BLE001
+                print(f"TelegramLoggerHandler: queue processing error: {exc}")
+        # Последняя попытка доставить накопленное при остановке
         try:
-            task.result()
+            self._run_once(flush_windows=True)
         except Exception as exc:  # noqa: BLE001
-            print(f"TelegramLoggerHandler: queue processing error: {exc}")
-
-    async def _check_rate_limits(self):
+            print(f"TelegramLoggerHandler: final flush error: {exc}")
+    
+    def _run_once(self, now: float | None = None, flush_windows: bool = False) -> int:
         """
-        Проверка и соблюдение rate limits Telegram API
-        
-        Удаляет старые временные метки и добавляет задержку если необходимо
+        Один шаг потока отправки: закрывает истёкшие окна дедупликации и отправляет
+        очередь группами, пока позволяет бюджет. Возвращает число отправленных сообщений.
         """
-        current_time = datetime.now(timezone.utc)
-        
-        # Удаляем старые метки (старше 1 минуты)
-        while self._message_timestamps and (current_time - self._message_timestamps[0]).total_seconds() > 60:
+        now = time.monotonic() if now is None else now
+        with self._queue_lock:
+            expired = [
+                fingerprint for fingerprint, window in self._dedup_windows.items()
+                if flush_windows or now - window['started'] >= self.DEDUP_WINDOW_SECONDS
+            ]
+            for fingerprint in expired:
+                self._enqueue_summary_locked(self._dedup_windows.pop(fingerprint))
+        
+        sent = 0
+        while self._budget_available(now):
+            with self._queue_lock:
+                batch = [self._message_queue.popleft() for _ in range(min(self._max_logs_per_group, len(self._message_queue)))]
+                dropped, self._dropped_unreported = self._dropped_unreported, 0
+            if not batch:
+                break
+            for item in batch:
+                if item['message'] is None:
+                    item['message'] = self._format_message(item['record'])
+                    item['record'] = None
+            text = self._format_grouped_message(batch)
+            if dropped:
+                text += f"\n\n⚠️ <b>Пропущено записей</b> (очередь переполнена): {dropped}"
+            # Неудачная попытка тоже расходует бюджет: при 429 повтор только усугубит ситуацию
+            self._post_message(text)
+            self._message_timestamps.append(now)
+            sent += 1
+        return sent
+    
+    def _budget_available(self, now: float) -> bool:
+        """Бюджет отправки: не больше MAX_MESSAGES_PER_MINUTE за минуту и MAX_MESSAGES_PER_SECOND за секунду."""
+        while self._message_timestamps and now - self._message_timestamps[0] >= 60:
             self._message_timestamps.popleft()
-        
-        # Проверяем лимит на минуту
         if len(self._message_timestamps) >= self.MAX_MESSAGES_PER_MINUTE:
-            # Ждем пока не освободится место
-            wait_time = 60 - (current_time - self._message_timestamps[0]).total_seconds()
-            if wait_time > 0:
-                await asyncio.sleep(wait_time)
-                # Обновляем время после ожидания
-                current_time = datetime.now(timezone.utc)
-                # Очищаем старые метки
-                while self._message_timestamps and (current_time - self._message_timestamps[0]).total_seconds() > 60:
-                    self._message_timestamps.popleft()
-        
-        # Проверяем лимит на секунду
-        recent_messages = [ts for ts in self._message_timestamps if (current_time - ts).total_seconds() <= 1]
-        if len(recent_messages) >= self.MAX_MESSAGES_PER_SECOND:
-            # Ждем 1 секунду
-            await asyncio.sleep(1)
+            return False
+        recent = sum(1 for ts in self._message_timestamps if now - ts < 1)
+        return recent < self.MAX_MESSAGES_PER_SECOND
     
-    async def _send_message(self, message: str):
+    def _post_message(self, message: str) -> bool:
         """
-        Отправка сообщения в Telegram
+        Отправка сообщения в Telegram (блокирующая, из потока отправки)
         
         Args:
             message: Текст сообщения
+            
+        Returns:
+            True, если Telegram принял сообщение
         """
         if not self.bot_token or not self.admin_chat_id:
-            return
+            return False
         
         try:
+            if self._http is None:
+                self._http = requests.Session()
             url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
             payload = {
                 'chat_id': self.admin_chat_id,
@@ -456,23 +445,20 @@ class TelegramLoggerHandler(logging.Handler):
                 'parse_mode': 'HTML',
                 'disable_web_page_preview': True
             }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status == 200:
-                        self._message_timestamps.append(datetime.now(timezone.utc))
-                        self._total_sent += 1
-                        self._last_send_time = datetime.now(timezone.utc)
-                    else:
-                        self._total_dropped += 1
-                        print(f"Failed to send message to Telegram: {response.status}")
-                        
-        except asyncio.TimeoutError:
-            self._total_dropped += 1
+            response = self._http.post(url, json=payload, timeout=10)
+            if response.status_code == 200:
+                self._total_sent += 1
+                self._last_send_time = datetime.now(timezone.utc)
+                return True
+            self._total_failed += 1
+            print(f"Failed to send message to Telegram: {response.status_code}")
+        except requests.Timeout:
+            self._total_failed += 1
             print("Timeout while sending message to Telegram")
         except Exception as e:
-            self._total_dropped += 1
+            self._total_failed += 1
             print(f"Error sending message to Telegram: {e}")
+        return False
     
     async def send_test_message(self, message: str = "🧪 Тестовое сообщение от бота логирования"):
         """
@@ -484,25 +470,46 @@ class TelegramLoggerHandler(logging.Handler):
         if not self.enabled:
             return {"success": False, "message": "Бот логирования отключен"}
         
-        try:
-            await self._send_message(message)
+        if await asyncio.to_thread(self._post_message, message):
             return {"success": True, "message": "Тестовое сообщение отправлено"}
-        except Exception as e:
-            return {"success": False, "message": f"Ошибка отправки: {str(e)}"}
+        return {"success": False, "message": "Ошибка отправки: Telegram не принял сообщение"}
+    
+    def close(self):
+        """Останавливает поток отправки, дав ему доставить накопленные записи."""
+        self._stop.set()
+        self._wakeup.set()
+        sender = self._sender
+        if sender is not None and sender.is_alive() and sender is not threading.current_thread():
+            sender.join(timeout=5)
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+        super().close()
     
     def get_stats(self) -> Dict:
         """
         Получение статистики обработчика
         
         Returns:
-            Словарь со статистикой
+            Словарь со статистикой: отправлено, отброшено при переполнении очереди,
+            свёрнуто дедупликацией, ошибок отправки, размер очереди и остаток бюджета
         """
+        with self._queue_lock:
+            queue_size = len(self._message_queue)
+            dedup_windows = len(self._dedup_windows)
+        now = time.monotonic()
+        sent_last_minute = sum(1 for ts in list(self._message_timestamps) if now - ts < 60)
         return {
             'enabled': self.enabled,
             'log_level': self.log_level,
             'total_sent': self._total_sent,
             'total_dropped': self._total_dropped,
-            'queue_size': len(self._message_queue),
+            'total_coalesced': self._total_coalesced,
+            'total_failed': self._total_failed,
+            'queue_size': queue_size,
+            'queue_capacity': self.QUEUE_MAX_SIZE,
+            'dedup_windows': dedup_windows,
+            'budget_remaining': max(0, self.MAX_MESSAGES_PER_MINUTE - sent_last_minute),
             'last_send_time': self._last_send_time.isoformat() if self._last_send_time else None
         }
 
@@ -16,7 +16,7 @@ from datetime import timezone
 from functools import wraps
 from math import ceil
 from typing import Optional, Tuple
-from flask import Flask, request, render_template, redirect, url_for, flash, session, current_app, jsonify, g, make_response
+from flask import Flask, request, render_template, redirect, url_for, flash, session, current_app, jsonify, g, make_response, Response
 # CSRF отключен
 from pathlib import Path
 from yookassa import Payment, Configuration
@@ -41,14 +41,17 @@ from shop_bot.modules import xui_api
 from shop_bot.bot import handlers 
 from shop_bot.security import rate_limit, get_client_ip
 from shop_bot.security.validators import InputValidator, ValidationError
-from shop_bot.utils import handle_exceptions
+from shop_bot.utils import handle_exceptions, get_log_queue_stats
 from shop_bot.config import get_user_cabinet_domain
 from shop_bot.data_manager import database
 from shop_bot.data_manager.database import (
     get_all_settings, update_setting, get_all_hosts, get_plans_for_host,
     create_host, delete_host, create_plan, delete_plan, get_user_count,
     get_total_keys_count, get_total_earned_sum, get_total_notifications_count, get_daily_stats_for_charts,
+    get_dashboard_stats,
     get_recent_transactions, get_paginated_transactions, get_all_users, get_user_keys,
+    get_users_page, get_keys_for_users, get_users_earned,
+    get_transactions_page, get_notifications_page, get_keys_page,
     ban_user, unban_user, delete_user_keys, get_setting, get_global_domain, find_and_complete_ton_transaction,
     get_paginated_keys, get_plan_by_id, update_plan, get_host, get_host_by_code, update_host, revoke_user_consent,
     search_users as db_search_users, add_to_user_balance, log_transaction, get_user, get_notification_by_id,
@@ -72,7 +75,10 @@ from shop_bot.data_manager.scheduler import (
     _marker_logged,
 )
 from shop_bot.ton_monitor import start_ton_monitoring
-from shop_bot.utils.performance_monitor import get_performance_monitor, get_performance_report, measure_performance, measure_performance_sync
+from shop_bot.utils.performance_monitor import (
+    OPENMETRICS_CONTENT_TYPE, get_performance_monitor, get_performance_report, measure_performance,
+    measure_performance_sync, render_openmetrics,
+)
 from shop_bot.utils.datetime_utils import (
     ensure_isoformat_for_timezone,
     format_datetime_for_timezone,
@@ -82,6 +88,7 @@ from shop_bot.utils.datetime_utils import (
 )
 from shop_bot.data.timezones import TIMEZONES, DEFAULT_TIMEZONE, validate_timezone
 from shop_bot.webhook_server.auth_utils import init_flask_auth, login_required
+from shop_bot.webhook_server.async_runner import run_async, gather_limited
 
 _bot_controller = None
 get_common_template_data = None  # Экспорт для тестирования
@@ -97,7 +104,7 @@ ALL_SETTINGS_KEYS = [
     "referral_discount", "ton_wallet_address", "tonapi_key", "force_subscription", "trial_enabled", "trial_duration_days", "enable_referrals", "minimum_withdrawal",
     "support_group_id", "support_bot_token", "ton_monitoring_enabled", "hidden_mode", "support_enabled",
     # Настройки мониторинга производительности
-    "monitoring_enabled", "monitoring_max_metrics", "monitoring_slow_threshold", "monitoring_cleanup_hours"
+    "monitoring_enabled", "monitoring_max_metrics", "monitoring_slow_threshold", "monitoring_cleanup_hours", "metrics_token"
 ]
 
 
@@ -246,6 +253,62 @@ def to_panel_iso(value):
 
     return ensure_isoformat_for_timezone(dt_value, tz_name)
 
+KEY_REFRESH_CONCURRENCY = 10
+# Размеры страницы списка пользователей
+USERS_PER_PAGE_OPTIONS = (25, 50, 100, 200)
+USERS_PER_PAGE_DEFAULT = 50
+CURSOR_PAGE_MAX = 200
+
+
+def fetch_keys_details(keys: list[dict], details_fn) -> dict:
+    """Запрашивает детали ключей из панелей одним конкурентным пакетом.
+
+    details_fn — корутина вида get_key_details_from_host(key). Запросы идут
+    параллельно (не более KEY_REFRESH_CONCURRENCY одновременно) в общем фоновом
+    loop, поэтому обновление пакета ключей занимает примерно столько же, сколько
+    самый медленный хост. Возвращает {key_id: детали | None | Exception}.
+    """
+    if not keys:
+        return {}
+
+    async def fetch_all():
+        return await gather_limited((details_fn(key) for key in keys), limit=KEY_REFRESH_CONCURRENCY)
+
+    results = run_async(fetch_all())
+    return {key['key_id']: result for key, result in zip(keys, results)}
+
+
+def collect_subsystem_metric_families() -> list[tuple]:
+    """Семейства метрик подсистем для /metrics (формат render_openmetrics).
+
+    Пул SQLite (выдачи соединений, SQL-операторы, время занятости), сессии
+    панелей 3x-ui, глубина фоновых очередей и очереди логов. Всё, кроме
+    очередей в БД, берётся из счётчиков в памяти; очереди в БД — одним
+    запросом по индексам.
+    """
+    pool = database.get_connection_pool_stats()
+    panel = xui_api.get_panel_session_stats()
+    queues = database.get_queue_depths()
+    log_queue = get_log_queue_stats()
+    if log_queue['enabled']:
+        queues['logs'] = log_queue['queue_size']
+    panel_events = ('logins', 'reused', 'relogins', 'cache_hits', 'cache_misses')
+    return [
+        ('sqlite_checkouts', 'counter', 'Pooled SQLite connection checkouts', [('_total', {}, pool['checkouts'])]),
+        ('sqlite_statements', 'counter', 'SQL statements executed on pooled connections', [('_total', {}, pool['statements'])]),
+        ('sqlite_connection_seconds', 'counter', 'Time pooled SQLite connections were held', [('_total', {}, pool['connection_seconds'])]),
+        ('sqlite_connections_opened', 'counter', 'SQLite connections opened by the pool', [('_total', {}, pool['opened'])]),
+        ('sqlite_idle_connections', 'gauge', 'Idle pooled SQLite connections', [('', {}, pool['idle'])]),
+        ('panel_session_events', 'counter', '3x-ui panel session events',
+         [('_total', {'event': event}, panel.get(event, 0)) for event in panel_events]),
+        ('panel_sessions', 'gauge', 'Open 3x-ui panel sessions', [('', {}, panel.get('sessions', 0))]),
+        ('queue_depth', 'gauge', 'Pending items in background queues',
+         [('', {'queue': name}, depth) for name, depth in queues.items()]),
+        ('log_records_dropped', 'counter', 'Log records dropped on log queue overflow',
+         [('_total', {}, log_queue.get('dropped', 0))]),
+    ]
+
+
 def create_webhook_app(bot_controller_instance):
     global _bot_controller
     _bot_controller = bot_controller_instance
@@ -455,12 +518,13 @@ def create_webhook_app(bot_controller_instance):
             project_version = ""
         
         # Формируем динамические URL-ы для Wiki и базы знаний
+        is_dev = is_development_server()
         global_domain = settings.get('global_domain', '')
         docs_domain = settings.get('docs_domain', '')
         codex_docs_domain = settings.get('codex_docs_domain', '')
         
         # URL для Вики (docs)
-        if is_development_server():
+        if is_dev:
             # В development режиме используем localhost
             wiki_url = 'http://localhost:50001'
         elif docs_domain:
@@ -476,7 +540,7 @@ def create_webhook_app(bot_controller_instance):
             wiki_url = 'http://localhost:50001'
         
         # URL для базы знаний (codex-docs)
-        if is_development_server():
+        if is_dev:
             # В development режиме используем localhost
             knowledge_base_url = 'http://localhost:50002'
         elif codex_docs_domain:
@@ -499,7 +563,7 @@ def create_webhook_app(bot_controller_instance):
         
         # URL для Allure (тестирование)
         allure_domain = settings.get('allure_domain', '')
-        if is_development_server():
+        if is_dev:
             # В development режиме используем localhost
             allure_url = 'http://localhost:50005'
         elif allure_domain:
@@ -556,7 +620,7 @@ def create_webhook_app(bot_controller_instance):
                     return None
             
             # Находим последний ключ (по максимальному key_id)
-            with sqlite3.connect(DB_FILE, timeout=30) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -615,24 +679,11 @@ def create_webhook_app(bot_controller_instance):
     @flask_app.route('/dashboard')
     @login_required
     def dashboard_page():
-        hosts = get_all_hosts()
-        stats = {
-            "user_count": get_user_count(),
-            "total_keys": get_total_keys_count(),
-            "total_spent": get_total_earned_sum(),
-            "host_count": len(hosts),
-            "total_notifications": get_total_notifications_count()
-        }
+        # Итоги и графики берутся одним запросом из дневной статистики daily_stats
+        dashboard = get_dashboard_stats(days=30)
+        stats = dashboard['stats']
         logging.info(f"Dashboard stats: {stats}")
-        
-        page = request.args.get('page', 1, type=int)
-        tab = request.args.get('tab', 'analytics')
-        per_page = 8
-        
-        transactions, total_transactions = get_paginated_transactions(page=page, per_page=per_page)
-        total_pages = ceil(total_transactions / per_page)
-        
-        chart_data = get_daily_stats_for_charts(days=30)
+        chart_data = dashboard['chart_data']
         common_data = get_common_template_data()
         
         # Получаем последнюю ссылку на кабинет
@@ -682,7 +733,7 @@ def create_webhook_app(bot_controller_instance):
                 return performance_summary, slow_operations, recent_errors, operation_stats, settings
             
             # Запускаем асинхронную функцию
-            performance_summary, slow_operations, recent_errors, operation_stats, settings = asyncio.run(get_performance_data())
+            performance_summary, slow_operations, recent_errors, operation_stats, settings = run_async(get_performance_data())
             
             common_data = get_common_template_data()
             
@@ -709,7 +760,7 @@ def create_webhook_app(bot_controller_instance):
             update_setting('monitoring_enabled', value)
             # Применяем немедленно
             monitor = get_performance_monitor()
-            asyncio.run(monitor.set_enabled(value == 'true'))
+            run_async(monitor.set_enabled(value == 'true'))
             return {'success': True, 'enabled': (value == 'true')}
         except Exception as e:
             logger.error(f"Failed to toggle monitoring: {e}")
@@ -720,7 +771,7 @@ def create_webhook_app(bot_controller_instance):
     def api_export_monitoring():
         try:
             monitor = get_performance_monitor()
-            data = asyncio.run(monitor.export_metrics_json())
+            data = run_async(monitor.export_metrics_json())
             return json.dumps(data, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
         except Exception as e:
             logger.error(f"Failed to export metrics: {e}")
@@ -736,12 +787,34 @@ def create_webhook_app(bot_controller_instance):
                 hours = 24
             
             monitor = get_performance_monitor()
-            data = asyncio.run(monitor.get_hourly_stats_for_charts(hours))
+            data = run_async(monitor.get_hourly_stats_for_charts(hours))
             return json.dumps(data, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
         except Exception as e:
             logger.error(f"Failed to get hourly stats: {e}")
             return {'success': False, 'message': str(e)}, 500
 
+    @flask_app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Метрики в формате OpenMetrics для Prometheus.
+
+        Доступ — по заголовку Authorization: Bearer <metrics_token> (настройка
+        панели) или из авторизованной сессии панели.
+        """
+        token = (get_setting('metrics_token') or '').strip()
+        auth_header = request.headers.get('Authorization', '')
+        # Сравниваем байты: compare_digest не принимает str с не-ASCII символами
+        authorized = bool(token) and auth_header.startswith('Bearer ') and compare_digest(
+            auth_header[7:].strip().encode('utf-8'), token.encode('utf-8')
+        )
+        if not authorized and 'logged_in' not in session:
+            return 'Unauthorized\n', 401, {'WWW-Authenticate': 'Bearer', 'Content-Type': 'text/plain; charset=utf-8'}
+        try:
+            families = get_performance_monitor().get_metric_families() + collect_subsystem_metric_families()
+            return render_openmetrics(families), 200, {'Content-Type': OPENMETRICS_CONTENT_TYPE}
+        except Exception as e:
+            logger.error(f"Failed to render metrics: {e}", exc_info=True)
+            return 'Failed to render metrics\n', 500, {'Content-Type': 'text/plain; charset=utf-8'}
+
     @flask_app.route('/transactions')
     @login_required
     def transactions_page():
@@ -772,7 +845,7 @@ def create_webhook_app(bot_controller_instance):
     def get_transaction_details(transaction_id):
         """API endpoint для получения детальной информации о транзакции с улучшенными данными"""
         try:
-            with sqlite3.connect(DB_FILE, timeout=30) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -881,7 +954,7 @@ def create_webhook_app(bot_controller_instance):
             if limit > 500:
                 limit = 500
             
-            with sqlite3.connect(DB_FILE, timeout=30) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -1115,15 +1188,113 @@ def create_webhook_app(bot_controller_instance):
             **common_data
         )
 
+    def _users_list_args() -> dict:
+        """Параметры списка пользователей из query string: фильтры, сортировка и курсор."""
+        per_page = request.args.get('per_page', USERS_PER_PAGE_DEFAULT, type=int)
+        if per_page not in USERS_PER_PAGE_OPTIONS:
+            per_page = USERS_PER_PAGE_DEFAULT
+        sort = request.args.get('sort', 'registration_date')
+        return {
+            'limit': per_page,
+            'cursor': request.args.get('cursor') or None,
+            'direction': 'prev' if request.args.get('direction') == 'prev' else 'next',
+            'sort': sort if sort in database.USER_SORT_FIELDS else 'registration_date',
+            'order': 'asc' if request.args.get('order') == 'asc' else 'desc',
+            'search': (request.args.get('search') or '').strip() or None,
+            'status': request.args.get('status') if request.args.get('status') in ('active', 'banned') else None,
+            'group_id': request.args.get('group_id', type=int),
+        }
+
+    def _load_users_page(args: dict) -> dict:
+        """Страница пользователей с ключами и суммой оплат — по одному запросу на всю страницу."""
+        page = get_users_page(**args)
+        user_ids = [user['telegram_id'] for user in page['users']]
+        keys_by_user = get_keys_for_users(user_ids)
+        earned_by_user = get_users_earned(user_ids)
+        for user in page['users']:
+            user['user_keys'] = keys_by_user.get(user['telegram_id'], [])
+            user['earned'] = earned_by_user.get(user['telegram_id'], 0.0)
+        return page
+
     @flask_app.route('/users')
     @login_required
     def users_page():
-        users = get_all_users()
-        for user in users:
-            user['user_keys'] = get_user_keys(user['telegram_id'])
-        
+        args = _users_list_args()
+        page = _load_users_page(args)
+        try:
+            user_groups = get_all_user_groups()
+        except Exception:
+            user_groups = []
+
         common_data = get_common_template_data()
-        return render_template('users.html', users=users, **common_data)
+        return render_template(
+            'users.html',
+            users=page['users'],
+            total_users=page['total'],
+            next_cursor=page['next_cursor'],
+            prev_cursor=page['prev_cursor'],
+            per_page=args['limit'],
+            per_page_options=USERS_PER_PAGE_OPTIONS,
+            filters={key: args[key] for key in ('sort', 'order', 'search', 'status', 'group_id')},
+            user_groups=user_groups,
+            **common_data
+        )
+
+    @flask_app.route('/api/users', methods=['GET'])
+    @login_required
+    def api_users_list():
+        """API списка пользователей: фильтры, сортировка и keyset-пагинация по курсору"""
+        try:
+            page = _load_users_page(_users_list_args())
+            for user in page['users']:
+                if user.get('registration_date'):
+                    user['registration_date'] = user['registration_date'].isoformat()
+            return jsonify({'success': True, **page})
+        except Exception as e:
+            logger.error(f"Ошибка получения списка пользователей: {e}", exc_info=True)
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    def _cursor_page_response(load_page, date_fields: tuple[str, ...]):
+        """JSON-ответ keyset-страницы: per_page, cursor и direction берутся из запроса"""
+        per_page = request.args.get('per_page', 15, type=int)
+        per_page = min(max(per_page, 1), CURSOR_PAGE_MAX)
+        direction = 'prev' if request.args.get('direction') == 'prev' else 'next'
+        page = load_page(limit=per_page, cursor=request.args.get('cursor') or None, direction=direction)
+        for item in page['items']:
+            for field in date_fields:
+                if isinstance(item.get(field), datetime):
+                    item[field] = item[field].isoformat()
+        return jsonify({'success': True, **page})
+
+    @flask_app.route('/api/transactions', methods=['GET'])
+    @login_required
+    def api_transactions_list():
+        """API списка транзакций с keyset-пагинацией по курсору"""
+        try:
+            return _cursor_page_response(get_transactions_page, ('created_date',))
+        except Exception as e:
+            logger.error(f"Ошибка получения списка транзакций: {e}", exc_info=True)
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @flask_app.route('/api/notifications', methods=['GET'])
+    @login_required
+    def api_notifications_list():
+        """API списка уведомлений с keyset-пагинацией по курсору"""
+        try:
+            return _cursor_page_response(get_notifications_page, ('created_date',))
+        except Exception as e:
+            logger.error(f"Ошибка получения списка уведомлений: {e}", exc_info=True)
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @flask_app.route('/api/keys', methods=['GET'])
+    @login_required
+    def api_keys_list():
+        """API списка ключей с keyset-пагинацией по курсору"""
+        try:
+            return _cursor_page_response(get_keys_page, ('created_date', 'expiry_date'))
+        except Exception as e:
+            logger.error(f"Ошибка получения списка ключей: {e}", exc_info=True)
+            return jsonify({'success': False, 'error': str(e)}), 500
 
     @flask_app.route('/promo-codes')
     @login_required
@@ -1198,7 +1369,7 @@ def create_webhook_app(bot_controller_instance):
     @login_required
     def save_panel_settings():
         """Сохранение настроек панели - v2.1"""
-        panel_keys = ['panel_login', 'global_domain', 'docs_domain', 'codex_docs_domain', 'setup_direct_link', 'user_cabinet_domain', 'allure_domain', 'admin_timezone', 'server_environment', 'monitoring_max_metrics', 'monitoring_slow_threshold', 'monitoring_cleanup_hours']
+        panel_keys = ['panel_login', 'global_domain', 'docs_domain', 'codex_docs_domain', 'setup_direct_link', 'user_cabinet_domain', 'allure_domain', 'admin_timezone', 'server_environment', 'monitoring_max_metrics', 'monitoring_slow_threshold', 'monitoring_cleanup_hours', 'metrics_token']
         
         # Пароль отдельно, если указан
         if 'panel_password' in request.form and request.form.get('panel_password'):
@@ -1346,8 +1517,7 @@ def create_webhook_app(bot_controller_instance):
             )
             
             # Отправляем тестовое сообщение
-            import asyncio
-            result = asyncio.run(handler.send_test_message(
+            result = run_async(handler.send_test_message(
                 "🧪 <b>Тестовое сообщение от бота логирования</b>\n\n"
                 "✅ Если вы видите это сообщение, значит бот для логов настроен правильно!\n\n"
                 "📋 <b>Информация о настройке:</b>\n"
@@ -2385,7 +2555,7 @@ def create_webhook_app(bot_controller_instance):
             
             # Если удаление по UUID не удалось, пробуем через общую функцию
             if not result:
-                result = asyncio.run(xui_api.delete_client_on_host(
+                result = run_async(xui_api.delete_client_on_host(
                     host_name=key['host_name'], 
                     client_email=key['key_email'],
                     client_uuid=key.get('xui_client_uuid') or None
@@ -2941,7 +3111,7 @@ def create_webhook_app(bot_controller_instance):
                                         # Обновляем статус последнего webhook для этого payment_id
                                         import sqlite3
                                         from shop_bot.data_manager.database import DB_FILE
-                                        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                                        with database._get_db_connection(DB_FILE) as conn:
                                             cursor = conn.cursor()
                                             cursor.execute("""
                                                 UPDATE webhooks 
@@ -2968,7 +3138,7 @@ def create_webhook_app(bot_controller_instance):
                                 try:
                                     import sqlite3
                                     from shop_bot.data_manager.database import DB_FILE
-                                    with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                                    with database._get_db_connection(DB_FILE) as conn:
                                         cursor = conn.cursor()
                                         cursor.execute("""
                                             UPDATE webhooks 
@@ -3148,7 +3318,7 @@ def create_webhook_app(bot_controller_instance):
                             try:
                                 import sqlite3
                                 from shop_bot.data_manager.database import DB_FILE
-                                with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                                with database._get_db_connection(DB_FILE) as conn:
                                     cursor = conn.cursor()
                                     cursor.execute("""
                                         UPDATE webhooks 
@@ -3175,7 +3345,7 @@ def create_webhook_app(bot_controller_instance):
                             try:
                                 import sqlite3
                                 from shop_bot.data_manager.database import DB_FILE
-                                with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                                with database._get_db_connection(DB_FILE) as conn:
                                     cursor = conn.cursor()
                                     cursor.execute("""
                                         UPDATE webhooks 
@@ -3543,7 +3713,7 @@ def create_webhook_app(bot_controller_instance):
                 return {'status': 'error', 'message': 'TON API ключ или адрес кошелька не настроены'}, 400
             
             # Получаем все TON транзакции без transaction_hash
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 cursor.execute("""
@@ -3592,7 +3762,7 @@ def create_webhook_app(bot_controller_instance):
                                             tx_hash = event.get('event_id', '').split(':')[0] if ':' in event.get('event_id', '') else event.get('event_id', '')
                                             
                                             # Обновляем статус транзакции
-                                            with sqlite3.connect(DB_FILE) as conn:
+                                            with database._get_db_connection(DB_FILE) as conn:
                                                 cursor = conn.cursor()
                                                 cursor.execute("""
                                                     UPDATE transactions 
@@ -3626,108 +3796,20 @@ def create_webhook_app(bot_controller_instance):
             updated = 0
             errors = []  # Список для сбора ошибок
             
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM vpn_keys ORDER BY created_date DESC LIMIT 50")
-                keys = [dict(row) for row in cursor.fetchall()]
+            keys = database.get_recent_keys(50)
             
             from shop_bot.modules.xui_api import get_key_details_from_host
+            # Детали всех ключей запрашиваются одним конкурентным пакетом
+            details_by_key = fetch_keys_details(keys, get_key_details_from_host)
             for key in keys:
                 try:
-                    details = asyncio.run(get_key_details_from_host(key))
+                    details = details_by_key.get(key['key_id'])
+                    if isinstance(details, Exception):
+                        raise details
                     if details and (details.get('expiry_timestamp_ms') or details.get('status') or details.get('protocol') or details.get('created_at') or details.get('remaining_seconds') is not None or details.get('quota_remaining_bytes') is not None):
-                        with sqlite3.connect(DB_FILE) as conn:
-                            cursor = conn.cursor()
-                            if details.get('expiry_timestamp_ms'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET expiry_date = ? WHERE key_id = ?",
-                                    (datetime.fromtimestamp(details['expiry_timestamp_ms']/1000), key['key_id'])
-                                )
-                            if details.get('created_at'):
-                                try:
-                                    cursor.execute(
-                                        "UPDATE vpn_keys SET start_date = ? WHERE key_id = ?",
-                                        (datetime.fromtimestamp(details['created_at']/1000), key['key_id'])
-                                    )
-                                except Exception:
-                                    pass
-                            if details.get('status'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET status = ? WHERE key_id = ?",
-                                    (details['status'], key['key_id'])
-                                )
-                            if details.get('protocol'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET protocol = ? WHERE key_id = ?",
-                                    (details['protocol'], key['key_id'])
-                                )
-                            if details.get('remaining_seconds') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET remaining_seconds = ? WHERE key_id = ?",
-                                    (details['remaining_seconds'], key['key_id'])
-                                )
-                            if details.get('quota_remaining_bytes') is not None:
-                                try:
-                                    cursor.execute(
-                                        "ALTER TABLE vpn_keys ADD COLUMN quota_remaining_bytes INTEGER"
-                                    )
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET quota_remaining_bytes = ? WHERE key_id = ?",
-                                    (details['quota_remaining_bytes'], key['key_id'])
-                                )
-                            # Кладём также квоту total и down (в байтах) для отображения
-                            if details.get('quota_total_gb') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN quota_total_gb REAL")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET quota_total_gb = ? WHERE key_id = ?",
-                                    (details['quota_total_gb'], key['key_id'])
-                                )
-                            if details.get('traffic_down_bytes') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN traffic_down_bytes INTEGER")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET traffic_down_bytes = ? WHERE key_id = ?",
-                                    (details['traffic_down_bytes'], key['key_id'])
-                                )
-                            if details.get('enabled') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN enabled INTEGER DEFAULT 1")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET enabled = ? WHERE key_id = ?",
-                                    (1 if details['enabled'] else 0, key['key_id'])
-                                )
-                            if details.get('subscription') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET subscription = ? WHERE key_id = ?",
-                                    (details['subscription'], key['key_id'])
-                                )
-                            if details.get('subscription_link') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET subscription_link = ? WHERE key_id = ?",
-                                    (details['subscription_link'], key['key_id'])
-                                )
-                            if details.get('telegram_chat_id') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET telegram_chat_id = ? WHERE key_id = ?",
-                                    (details['telegram_chat_id'], key['key_id'])
-                                )
-                            if details.get('comment') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET comment = ? WHERE key_id = ?",
-                                    (details['comment'], key['key_id'])
-                                )
-                            conn.commit()
-                            updated += 1
+                        if not database.update_key_from_panel_details(key['key_id'], details):
+                            raise RuntimeError("Не удалось сохранить детали ключа в БД")
+                        updated += 1
                     else:
                         # Ключ не найден в 3x-ui панели
                         created_date = key.get('created_date', 'Неизвестно')
@@ -3793,101 +3875,18 @@ def create_webhook_app(bot_controller_instance):
             errors = []
             
             from shop_bot.modules.xui_api import get_key_details_from_host
+            # Детали всех ключей пользователя запрашиваются одним конкурентным пакетом
+            details_by_key = fetch_keys_details(user_keys, get_key_details_from_host)
             
             for key in user_keys:
                 try:
-                    details = asyncio.run(get_key_details_from_host(key))
+                    details = details_by_key.get(key['key_id'])
+                    if isinstance(details, Exception):
+                        raise details
                     if details and (details.get('expiry_timestamp_ms') or details.get('status') or details.get('protocol') or details.get('created_at') or details.get('remaining_seconds') is not None or details.get('quota_remaining_bytes') is not None):
-                        with sqlite3.connect(DB_FILE) as conn:
-                            cursor = conn.cursor()
-                            if details.get('expiry_timestamp_ms'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET expiry_date = ? WHERE key_id = ?",
-                                    (datetime.fromtimestamp(details['expiry_timestamp_ms']/1000), key['key_id'])
-                                )
-                            if details.get('created_at'):
-                                try:
-                                    cursor.execute(
-                                        "UPDATE vpn_keys SET start_date = ? WHERE key_id = ?",
-                                        (datetime.fromtimestamp(details['created_at']/1000), key['key_id'])
-                                    )
-                                except Exception:
-                                    pass
-                            if details.get('status'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET status = ? WHERE key_id = ?",
-                                    (details['status'], key['key_id'])
-                                )
-                            if details.get('protocol'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET protocol = ? WHERE key_id = ?",
-                                    (details['protocol'], key['key_id'])
-                                )
-                            if details.get('remaining_seconds') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET remaining_seconds = ? WHERE key_id = ?",
-                                    (details['remaining_seconds'], key['key_id'])
-                                )
-                            if details.get('quota_remaining_bytes') is not None:
-                                try:
-                                    cursor.execute(
-                                        "ALTER TABLE vpn_keys ADD COLUMN quota_remaining_bytes INTEGER"
-                                    )
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET quota_remaining_bytes = ? WHERE key_id = ?",
-                                    (details['quota_remaining_bytes'], key['key_id'])
-                                )
-                            if details.get('quota_total_gb') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN quota_total_gb REAL")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET quota_total_gb = ? WHERE key_id = ?",
-                                    (details['quota_total_gb'], key['key_id'])
-                                )
-                            if details.get('traffic_down_bytes') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN traffic_down_bytes INTEGER")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET traffic_down_bytes = ? WHERE key_id = ?",
-                                    (details['traffic_down_bytes'], key['key_id'])
-                                )
-                            if details.get('enabled') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN enabled INTEGER DEFAULT 1")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET enabled = ? WHERE key_id = ?",
-                                    (1 if details['enabled'] else 0, key['key_id'])
-                                )
-                            if details.get('subscription') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET subscription = ? WHERE key_id = ?",
-                                    (details['subscription'], key['key_id'])
-                                )
-                            if details.get('subscription_link') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET subscription_link = ? WHERE key_id = ?",
-                                    (details['subscription_link'], key['key_id'])
-                                )
-                            if details.get('telegram_chat_id') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET telegram_chat_id = ? WHERE key_id = ?",
-                                    (details['telegram_chat_id'], key['key_id'])
-                                )
-                            if details.get('comment') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET comment = ? WHERE key_id = ?",
-                                    (details['comment'], key['key_id'])
-                                )
-                            conn.commit()
-                            updated_count += 1
+                        if not database.update_key_from_panel_details(key['key_id'], details):
+                            raise RuntimeError("Не удалось сохранить детали ключа в БД")
+                        updated_count += 1
                     else:
                         # Ключ не найден в 3x-ui панели
                         email = key.get('key_email', 'N/A')
@@ -3944,7 +3943,7 @@ def create_webhook_app(bot_controller_instance):
                         continue
                     
                     # Удаляем ключ из 3x-ui панели напрямую по UUID
-                    success = asyncio.run(delete_client_by_uuid(xui_client_uuid, email))
+                    success = run_async(delete_client_by_uuid(xui_client_uuid, email))
                     
                     if success:
                         deleted_count += 1
@@ -3986,7 +3985,7 @@ def create_webhook_app(bot_controller_instance):
     def api_user_payments(user_id):
         """API для получения платежей пользователя"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -4048,7 +4047,7 @@ def create_webhook_app(bot_controller_instance):
     def api_user_keys(user_id):
         """API для получения ключей пользователя"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -4087,7 +4086,7 @@ def create_webhook_app(bot_controller_instance):
     def api_get_key(key_id):
         """API для получения данных конкретного ключа"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -4146,15 +4145,7 @@ def create_webhook_app(bot_controller_instance):
                             )
                             
                             # Получаем subscription_link через API 3X-UI
-                            try:
-                                # Пытаемся получить существующий event loop
-                                loop = asyncio.get_event_loop()
-                            except RuntimeError:
-                                # Если event loop не существует, создаем новый
-                                loop = asyncio.new_event_loop()
-                                asyncio.set_event_loop(loop)
-                            
-                            subscription_link = loop.run_until_complete(
+                            subscription_link = run_async(
                                 get_client_subscription_link(host_name, key_email)
                             )
                             
@@ -4291,7 +4282,7 @@ def create_webhook_app(bot_controller_instance):
     def api_user_balance(user_id):
         """API для получения баланса пользователя"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 cursor.execute("SELECT balance FROM users WHERE telegram_id = ?", (user_id,))
@@ -4309,7 +4300,7 @@ def create_webhook_app(bot_controller_instance):
     def api_user_earned(user_id):
         """API для получения суммы заработанных денег пользователя"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -4335,7 +4326,7 @@ def create_webhook_app(bot_controller_instance):
     def api_user_notifications(user_id):
         """API для получения уведомлений пользователя"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -4373,7 +4364,7 @@ def create_webhook_app(bot_controller_instance):
     def api_user_details(user_id):
         """API для получения полных данных пользователя"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -4464,7 +4455,7 @@ def create_webhook_app(bot_controller_instance):
             if not update_fields and not reset_trial_requested:
                 return {'error': 'Нет разрешенных полей для обновления'}, 400
             
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 cursor = conn.cursor()
                 
                 # Проверяем существование пользователя
@@ -4497,6 +4488,8 @@ def create_webhook_app(bot_controller_instance):
                     cursor.execute(query, values)
                 
                 conn.commit()
+                # Сбрасываем закэшированный статус пользователя в BanMiddleware
+                database.invalidate_ban_cache(user_id)
                 
                 logger.info(f"Updated user {user_id} fields: {list(update_fields.keys()) + (['balance'] if 'balance' in data else [])}")
                 return {'message': 'Данные пользователя обновлены успешно'}
@@ -4878,11 +4871,7 @@ def create_webhook_app(bot_controller_instance):
                 }), 404
             
             # Получаем все ключи для данного хоста
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM vpn_keys WHERE host_name = ? ORDER BY created_date DESC", (host_name,))
-                keys = [dict(row) for row in cursor.fetchall()]
+            keys = database.get_keys_for_host(host_name)
             
             if not keys:
                 return jsonify({
@@ -4894,101 +4883,16 @@ def create_webhook_app(bot_controller_instance):
             updated = 0
             errors = []
             
-            from shop_bot.modules.xui_api import get_key_details_from_host
+            # Один снимок inbound на весь хост вместо загрузки панели на каждый ключ
+            from shop_bot.modules.xui_api import get_keys_details_from_host
+            details_by_key = run_async(get_keys_details_from_host(host_name, keys))
             for key in keys:
                 try:
-                    details = asyncio.run(get_key_details_from_host(key))
+                    details = details_by_key.get(key['key_id'])
                     if details and (details.get('expiry_timestamp_ms') or details.get('status') or details.get('protocol') or details.get('created_at') or details.get('remaining_seconds') is not None or details.get('quota_remaining_bytes') is not None):
-                        with sqlite3.connect(DB_FILE) as conn:
-                            cursor = conn.cursor()
-                            if details.get('expiry_timestamp_ms'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET expiry_date = ? WHERE key_id = ?",
-                                    (datetime.fromtimestamp(details['expiry_timestamp_ms']/1000), key['key_id'])
-                                )
-                            if details.get('created_at'):
-                                try:
-                                    cursor.execute(
-                                        "UPDATE vpn_keys SET start_date = ? WHERE key_id = ?",
-                                        (datetime.fromtimestamp(details['created_at']/1000), key['key_id'])
-                                    )
-                                except Exception:
-                                    pass
-                            if details.get('status'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET status = ? WHERE key_id = ?",
-                                    (details['status'], key['key_id'])
-                                )
-                            if details.get('protocol'):
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET protocol = ? WHERE key_id = ?",
-                                    (details['protocol'], key['key_id'])
-                                )
-                            if details.get('remaining_seconds') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET remaining_seconds = ? WHERE key_id = ?",
-                                    (details['remaining_seconds'], key['key_id'])
-                                )
-                            if details.get('quota_remaining_bytes') is not None:
-                                try:
-                                    cursor.execute(
-                                        "ALTER TABLE vpn_keys ADD COLUMN quota_remaining_bytes INTEGER"
-                                    )
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET quota_remaining_bytes = ? WHERE key_id = ?",
-                                    (details['quota_remaining_bytes'], key['key_id'])
-                                )
-                            if details.get('quota_total_gb') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN quota_total_gb REAL")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET quota_total_gb = ? WHERE key_id = ?",
-                                    (details['quota_total_gb'], key['key_id'])
-                                )
-                            if details.get('traffic_down_bytes') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN traffic_down_bytes INTEGER")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET traffic_down_bytes = ? WHERE key_id = ?",
-                                    (details['traffic_down_bytes'], key['key_id'])
-                                )
-                            if details.get('enabled') is not None:
-                                try:
-                                    cursor.execute("ALTER TABLE vpn_keys ADD COLUMN enabled INTEGER DEFAULT 1")
-                                except Exception:
-                                    pass
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET enabled = ? WHERE key_id = ?",
-                                    (1 if details['enabled'] else 0, key['key_id'])
-                                )
-                            if details.get('subscription') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET subscription = ? WHERE key_id = ?",
-                                    (details['subscription'], key['key_id'])
-                                )
-                            if details.get('subscription_link') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET subscription_link = ? WHERE key_id = ?",
-                                    (details['subscription_link'], key['key_id'])
-                                )
-                            if details.get('telegram_chat_id') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET telegram_chat_id = ? WHERE key_id = ?",
-                                    (details['telegram_chat_id'], key['key_id'])
-                                )
-                            if details.get('comment') is not None:
-                                cursor.execute(
-                                    "UPDATE vpn_keys SET comment = ? WHERE key_id = ?",
-                                    (details['comment'], key['key_id'])
-                                )
-                            conn.commit()
-                            updated += 1
+                        if not database.update_key_from_panel_details(key['key_id'], details):
+                            raise RuntimeError("Не удалось сохранить детали ключа в БД")
+                        updated += 1
                     else:
                         # Ключ не найден в 3x-ui панели
                         created_date = key.get('created_date', 'Неизвестно')
@@ -5112,7 +5016,7 @@ def create_webhook_app(bot_controller_instance):
                 return jsonify({'success': False, 'error': 'Не указан key_id или enabled'}), 400
             
             # Получаем информацию о ключе
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM vpn_keys WHERE key_id = ?", (key_id,))
@@ -5642,7 +5546,7 @@ def create_webhook_app(bot_controller_instance):
     def get_database_stats():
         """Получение статистики таблиц базы данных"""
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -5714,7 +5618,7 @@ def create_webhook_app(bot_controller_instance):
                     'message': 'Таблица не найдена или удаление запрещено'
                 }), 404
             
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 cursor = conn.cursor()
                 
                 # Получаем количество записей до удаления
@@ -5728,7 +5632,7 @@ def create_webhook_app(bot_controller_instance):
                 conn.commit()
             
             # Выполняем VACUUM вне транзакции для очистки WAL
-            with sqlite3.connect(DB_FILE) as conn:
+            with database._get_db_connection(DB_FILE) as conn:
                 cursor = conn.cursor()
                 cursor.execute("VACUUM")
                 
@@ -5756,29 +5660,26 @@ def create_webhook_app(bot_controller_instance):
     @flask_app.route('/api/database/download')
     @login_required
     def download_database():
-        """Скачивание резервной копии базы данных"""
+        """Скачивание согласованного снимка базы данных (gzip-поток)"""
         try:
-            from flask import send_file
-            import tempfile
-            import shutil
+            from shop_bot.data_manager.backup import backup_manager
             from datetime import datetime
             
-            # Создаем временную копию базы данных
+            # Снимок через backup API снимается до ответа, сжатие идёт по мере отправки
+            stream = backup_manager.stream_snapshot()
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_filename = f"database_backup_{timestamp}.db"
-            temp_path = tempfile.mktemp(suffix=f"_{temp_filename}")
-            
-            # Копируем базу данных во временный файл
-            shutil.copy2(DB_FILE, temp_path)
-            
-            logger.info(f"Создана резервная копия базы данных: {temp_filename}")
-            
-            # Отправляем файл для скачивания
-            return send_file(
-                temp_path,
-                as_attachment=True,
-                download_name=temp_filename,
-                mimetype='application/octet-stream'
+            download_name = f"database_backup_{timestamp}.db.gz"
+            
+            logger.info(f"Отдаётся снимок базы данных: {download_name}")
+            
+            return Response(
+                stream,
+                mimetype='application/gzip',
+                headers={
+                    'Content-Disposition': f'attachment; filename="{download_name}"',
+                    'Cache-Control': 'no-store',
+                    'X-Accel-Buffering': 'no',
+                }
             )
             
         except Exception as e:
@@ -5890,7 +5791,11 @@ def create_webhook_app(bot_controller_instance):
                 'failed_backups': stats.get('failed_backups', 0),
                 'retention_days': backup_manager.retention_days,
                 'compression_enabled': backup_manager.compression_enabled,
-                'verify_backups': backup_manager.verify_backups
+                'verify_backups': backup_manager.verify_backups,
+                'quick_check': backup_manager.quick_check,
+                'last_backup_metrics': stats.get('last_backup_metrics'),
+                'incremental_enabled': backup_manager.incremental_enabled,
+                'incremental': stats.get('incremental')
             })
         except Exception as e:
             logger.error(f"Ошибка получения статуса бекапов: {e}")
@@ -5940,8 +5845,9 @@ def create_webhook_app(bot_controller_instance):
             # Сохраняем настройки
             for key, value in data.items():
                 if key in ['backup_enabled', 'backup_interval_hours', 'backup_retention_days', 
-                          'backup_compression', 'backup_verify']:
-                    normalized = to_str(value) if key in ['backup_enabled', 'backup_compression', 'backup_verify'] else str(value)
+                          'backup_compression', 'backup_verify', 'backup_quick_check',
+                          'backup_incremental', 'backup_full_every']:
+                    normalized = to_str(value) if key in ['backup_enabled', 'backup_compression', 'backup_verify', 'backup_quick_check', 'backup_incremental'] else str(value)
                     update_backup_setting(key, normalized)
             
             # Обновляем настройки менеджера бекапов
@@ -5953,6 +5859,12 @@ def create_webhook_app(bot_controller_instance):
             
             compression_enabled = str(data.get('backup_compression', True)).lower() in ('true','1','yes','on')
             verify_backups = str(data.get('backup_verify', True)).lower() in ('true','1','yes','on')
+            quick_check = str(data.get('backup_quick_check', False)).lower() in ('true','1','yes','on')
+            incremental_enabled = str(data.get('backup_incremental', False)).lower() in ('true','1','yes','on')
+            try:
+                full_backup_every = int(data.get('backup_full_every', 7))
+            except (TypeError, ValueError):
+                full_backup_every = 7
             
             # Управляем системой бекапов
             enabled_flag = str(data.get('backup_enabled', True)).lower() in ('true','1','yes','on')
@@ -5975,7 +5887,10 @@ def create_webhook_app(bot_controller_instance):
                         interval_hours=interval_hours,
                         retention_days=retention_days,
                         compression_enabled=compression_enabled,
-                        verify_backups=verify_backups
+                        verify_backups=verify_backups,
+                        quick_check=quick_check,
+                        incremental_enabled=incremental_enabled,
+                        full_backup_every=full_backup_every
                     )
             else:
                 # Бекапы должны быть отключены
@@ -5990,7 +5905,10 @@ def create_webhook_app(bot_controller_instance):
                     interval_hours=interval_hours,
                     retention_days=retention_days,
                     compression_enabled=compression_enabled,
-                    verify_backups=verify_backups
+                    verify_backups=verify_backups,
+                    quick_check=quick_check,
+                    incremental_enabled=incremental_enabled,
+                    full_backup_every=full_backup_every
                 )
             
             return jsonify({'status': 'success', 'message': 'Настройки бекапов сохранены'})
@@ -6022,7 +5940,16 @@ def create_webhook_app(bot_controller_instance):
                 errors.append('backup_retention_days must be a valid integer')
         
         # Валидация boolean полей
-        for field in ['backup_enabled', 'backup_compression', 'backup_verify']:
+        # Валидация периода полных снимков инкрементальной цепочки
+        if 'backup_full_every' in data:
+            try:
+                full_every = int(data['backup_full_every'])
+                if full_every not in [1, 3, 7, 14, 30]:
+                    errors.append('backup_full_every must be one of: 1, 3, 7, 14, 30')
+            except (ValueError, TypeError):
+                errors.append('backup_full_every must be a valid integer')
+        
+        for field in ['backup_enabled', 'backup_compression', 'backup_verify', 'backup_quick_check', 'backup_incremental']:
             if field in data and not isinstance(data[field], bool):
                 errors.append(f'{field} must be a boolean value')
         
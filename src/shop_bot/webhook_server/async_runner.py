@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Общий фоновый event loop веб-сервера
+
+Синхронные Flask-маршруты выполняют корутины через run_async() в одном
+долгоживущем loop, работающем в отдельном потоке, вместо asyncio.run() на
+каждый запрос или ключ. Сессии и кэши, привязанные к loop (например,
+aiohttp-клиенты панелей 3x-ui), переживают запрос, а пакетные операции
+выполняются конкурентно через gather_limited().
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Coroutine, Iterable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 120
+DEFAULT_CONCURRENCY = 10
+
+
+class BackgroundLoop:
+    """Event loop в daemon-потоке, запускаемый при первом обращении."""
+
+    def __init__(self, name: str = "web-async-loop"):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed() or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run_loop():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run_loop, name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+                logger.info(f"Background event loop '{self.name}' started")
+            return self._loop
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._ensure_started()
+
+    def run(self, coro: Coroutine, timeout: float | None = DEFAULT_TIMEOUT_SECONDS) -> Any:
+        """Выполняет корутину в фоновом loop и возвращает её результат (блокирующе)."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run_async() нельзя вызывать из потока фонового loop: используйте await")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Отменяет незавершённые задачи и останавливает loop."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or loop.is_closed():
+            return
+
+        async def cancel_pending():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_pending(), loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"Error while cancelling background tasks: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+
+_background_loop = BackgroundLoop()
+
+
+def run_async(coro: Coroutine, timeout: float | None = DEFAULT_TIMEOUT_SECONDS) -> Any:
+    """Выполняет корутину из синхронного кода (Flask-маршрута) в общем фоновом loop.
+
+    Args:
+        coro: корутина
+        timeout: максимальное время ожидания результата (None — без ограничения)
+
+    Raises:
+        TimeoutError: если корутина не завершилась за timeout (она отменяется)
+    """
+    return _background_loop.run(coro, timeout)
+
+
+async def gather_limited(aws: Iterable[Awaitable], limit: int = DEFAULT_CONCURRENCY, return_exceptions: bool = True) -> list:
+    """asyncio.gather с ограничением числа одновременно выполняемых корутин.
+
+    Результаты возвращаются в порядке aws; при return_exceptions=True
+    исключения возвращаются на месте результатов, как в asyncio.gather.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run_one(aw: Awaitable):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run_one(aw) for aw in aws), return_exceptions=return_exceptions)
+
+
+def stop_background_loop(timeout: float = 5.0) -> None:
+    """Останавливает общий фоновый loop (при завершении приложения)."""
+    _background_loop.stop(timeout)
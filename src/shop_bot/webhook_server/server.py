@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Запуск веб-сервера админ-панели и платёжных вебхуков
+
+По умолчанию приложение обслуживает production WSGI-сервер waitress с пулом
+рабочих потоков. Сервер работает в том же процессе, что и боты, поэтому
+вебхуки по-прежнему передают обработку платежей в event loop ботов через
+asyncio.run_coroutine_threadsafe (flask_app.config['EVENT_LOOP']).
+Режим WEB_SERVER=werkzeug оставлен для локальной отладки.
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+try:
+    from waitress import wasyncore
+    from waitress.server import create_server as _create_waitress_server
+except ImportError:  # pragma: no cover - waitress не установлен
+    wasyncore = None
+    _create_waitress_server = None
+
+SERVER_WAITRESS = "waitress"
+SERVER_WERKZEUG = "werkzeug"
+
+DEFAULT_THREADS = 8
+DEFAULT_CONNECTION_LIMIT = 200
+DEFAULT_CHANNEL_TIMEOUT = 120
+
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    raw = os.getenv(name)
+    if raw is None or raw.strip() == "":
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}={raw!r}, используется {default}")
+        return default
+    return max(minimum, value)
+
+
+@dataclass
+class WebServerConfig:
+    """Параметры веб-сервера (из переменных окружения WEB_SERVER_*)."""
+
+    kind: str = SERVER_WAITRESS
+    threads: int = DEFAULT_THREADS
+    connection_limit: int = DEFAULT_CONNECTION_LIMIT
+    channel_timeout: int = DEFAULT_CHANNEL_TIMEOUT
+
+    @classmethod
+    def from_env(cls) -> "WebServerConfig":
+        kind = (os.getenv("WEB_SERVER") or SERVER_WAITRESS).strip().lower()
+        if kind not in (SERVER_WAITRESS, SERVER_WERKZEUG):
+            logger.warning(f"Неизвестный WEB_SERVER={kind!r}, используется {SERVER_WAITRESS}")
+            kind = SERVER_WAITRESS
+        if kind == SERVER_WAITRESS and _create_waitress_server is None:
+            logger.warning("Пакет waitress не установлен, используется встроенный сервер Werkzeug")
+            kind = SERVER_WERKZEUG
+
+        workers = _env_int("WEB_SERVER_WORKERS", 1)
+        if workers > 1:
+            # Отдельные процессы не видят event loop ботов, а вебхукам он нужен
+            logger.warning(
+                f"WEB_SERVER_WORKERS={workers} не поддерживается: вебхуки передают платежи в event loop "
+                f"ботов этого процесса. Используется 1 процесс, масштабируйте WEB_SERVER_THREADS"
+            )
+
+        return cls(
+            kind=kind,
+            threads=_env_int("WEB_SERVER_THREADS", DEFAULT_THREADS),
+            connection_limit=_env_int("WEB_SERVER_CONNECTION_LIMIT", DEFAULT_CONNECTION_LIMIT),
+            channel_timeout=_env_int("WEB_SERVER_CHANNEL_TIMEOUT", DEFAULT_CHANNEL_TIMEOUT),
+        )
+
+
+class WebServer:
+    """WSGI-сервер приложения в фоновом потоке с корректной остановкой."""
+
+    def __init__(self, app, host: str = "0.0.0.0", port: int = 50000, config: WebServerConfig | None = None):
+        self.app = app
+        self.host = host
+        self.config = config or WebServerConfig.from_env()
+        self._server = self._create_server(port)
+        self._thread: threading.Thread | None = None
+
+    def _create_server(self, port: int):
+        if self.config.kind == SERVER_WAITRESS:
+            return _create_waitress_server(
+                self.app,
+                host=self.host,
+                port=port,
+                threads=self.config.threads,
+                connection_limit=self.config.connection_limit,
+                channel_timeout=self.config.channel_timeout,
+                ident="dark-maximus",
+                # Трейсбеки не отдаются клиентам (платёжным системам в том числе)
+                expose_tracebacks=False,
+            )
+        from werkzeug.serving import make_server
+        return make_server(self.host, port, self.app, threaded=True)
+
+    @property
+    def port(self) -> int:
+        """Фактический порт (для port=0 — выбранный системой)."""
+        if self.config.kind == SERVER_WAITRESS:
+            return self._server.effective_port
+        return self._server.port
+
+    def serve_forever(self) -> None:
+        if self.config.kind == SERVER_WAITRESS:
+            self._server.run()
+        else:
+            self._server.serve_forever()
+
+    def start(self) -> threading.Thread:
+        """Запускает сервер в daemon-потоке и возвращает поток."""
+        self._thread = threading.Thread(target=self.serve_forever, name="web-server", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Web server '{self.config.kind}' started on http://{self.host}:{self.port} "
+            f"(threads={self.config.threads if self.config.kind == SERVER_WAITRESS else 'per-request'})"
+        )
+        return self._thread
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Останавливает приём соединений и дожидается потока сервера."""
+        running = self._thread is not None and self._thread.is_alive()
+        try:
+            if self.config.kind != SERVER_WAITRESS:
+                if running:
+                    self._server.shutdown()
+                self._server.server_close()
+            elif running:
+                # Сокеты waitress закрываются в потоке его цикла (через trigger), иначе
+                # select() в цикле упадёт на закрытом дескрипторе; пустая карта завершает цикл
+                server_map = self._server._map
+                self._server.trigger.pull_trigger(lambda: wasyncore.close_all(server_map))
+            else:
+                self._server.close()
+        except Exception as e:
+            logger.warning(f"Error while stopping web server: {e}")
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.config.kind == SERVER_WAITRESS:
+            # Дожидаемся запросов, уже переданных рабочим потокам
+            self._server.task_dispatcher.shutdown(timeout=timeout)
+
+
+def start_web_server(app, host: str = "0.0.0.0", port: int = 50000, config: WebServerConfig | None = None) -> WebServer:
+    """Создаёт и запускает веб-сервер приложения в фоновом потоке."""
+    server = WebServer(app, host=host, port=port, config=config)
+    server.start()
+    return server
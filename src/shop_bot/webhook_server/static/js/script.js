@@ -2725,7 +2725,8 @@ async function loadUserBalance(userId) {
 
 // Загружаем заработанную сумму для всех пользователей на странице пользователей
 async function loadAllUsersEarned() {
-    const earnedElements = document.querySelectorAll('.user-earned');
+    // Суммы, отрисованные сервером, повторно не запрашиваем
+    const earnedElements = document.querySelectorAll('.user-earned:not([data-loaded])');
     
     for (const element of earnedElements) {
         const userId = element.getAttribute('data-user-id');
@@ -2746,7 +2747,7 @@ async function loadAllUsersEarned() {
 }
 
 async function loadAllUsersBalances() {
-    const balanceElements = document.querySelectorAll('.user-balance');
+    const balanceElements = document.querySelectorAll('.user-balance:not([data-loaded])');
     for (const element of balanceElements) {
         const userId = element.getAttribute('data-user-id');
         try {
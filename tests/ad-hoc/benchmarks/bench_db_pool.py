@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк пула соединений SQLite (database._connection_pool)
+
+Сравнивает старую схему «connect + PRAGMA journal_mode=DELETE на каждый вызов»
+с пулом соединений (режим журналирования тот же — DELETE):
+  1. накладные расходы на открытие соединения (чтение одной настройки);
+  2. конкуренцию писателей и читателей из нескольких потоков.
+
+Запуск:
+    python tests/ad-hoc/benchmarks/bench_db_pool.py [--reads 5000] [--threads 8] [--writes 300]
+"""
+
+import argparse
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _prepare_db(path: Path) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS bot_settings (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS bench_events (id INTEGER PRIMARY KEY, payload TEXT)")
+    conn.execute("INSERT OR REPLACE INTO bot_settings VALUES ('server_environment', 'production')")
+    conn.commit()
+    conn.close()
+
+
+# --- Старая схема: новое соединение на каждый вызов -------------------------
+
+def _legacy_read(path: Path) -> None:
+    with sqlite3.connect(path, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.execute("PRAGMA journal_mode=DELETE")
+        cursor.execute("SELECT value FROM bot_settings WHERE key = ?", ("server_environment",))
+        cursor.fetchone()
+    conn.close()
+
+
+def _legacy_write(path: Path, payload: str) -> None:
+    with sqlite3.connect(path, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.execute("PRAGMA journal_mode=DELETE")
+        cursor.execute("INSERT INTO bench_events (payload) VALUES (?)", (payload,))
+    conn.close()
+
+
+# --- Новая схема: пул соединений --------------------------------------------
+
+def _pooled_read(path: Path) -> None:
+    with database._get_db_connection(path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM bot_settings WHERE key = ?", ("server_environment",))
+        cursor.fetchone()
+
+
+def _pooled_write(path: Path, payload: str) -> None:
+    with database._get_db_connection(path) as conn:
+        conn.execute("INSERT INTO bench_events (payload) VALUES (?)", (payload,))
+
+
+def bench_open_overhead(path: Path, reads: int, read_fn) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(reads):
+        t0 = time.perf_counter()
+        read_fn(path)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    total = time.perf_counter() - started
+    return {
+        "ops_per_sec": reads / total,
+        "mean_ms": statistics.fmean(latencies),
+        "p99_ms": _percentile(latencies, 99),
+    }
+
+
+def bench_contention(path: Path, threads: int, writes: int, read_fn, write_fn) -> dict:
+    write_latencies: list[float] = []
+    read_latencies: list[float] = []
+    errors = {"locked": 0}
+    lock = threading.Lock()
+    stop_readers = threading.Event()
+
+    def writer(worker_id: int) -> None:
+        local = []
+        for i in range(writes):
+            t0 = time.perf_counter()
+            try:
+                write_fn(path, f"w{worker_id}-{i}")
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e).lower():
+                    with lock:
+                        errors["locked"] += 1
+                    continue
+                raise
+            local.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            write_latencies.extend(local)
+
+    def reader() -> None:
+        local = []
+        while not stop_readers.is_set():
+            t0 = time.perf_counter()
+            try:
+                read_fn(path)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors["locked"] += 1
+                continue
+            local.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            read_latencies.extend(local)
+
+    writers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+    readers = [threading.Thread(target=reader) for _ in range(max(1, threads // 2))]
+    started = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop_readers.set()
+    for t in readers:
+        t.join()
+
+    return {
+        "writes_per_sec": len(write_latencies) / elapsed,
+        "write_p99_ms": _percentile(write_latencies, 99),
+        "reads": len(read_latencies),
+        "read_p99_ms": _percentile(read_latencies, 99),
+        "lock_errors": errors["locked"],
+    }
+
+
+def _print_row(title: str, result: dict) -> None:
+    cells = ", ".join(
+        f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in result.items()
+    )
+    print(f"  {title:<8} {cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reads", type=int, default=5000, help="число последовательных чтений настройки")
+    parser.add_argument("--threads", type=int, default=8, help="число потоков-писателей")
+    parser.add_argument("--writes", type=int, default=300, help="записей на поток")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = Path(tmp) / "legacy.db"
+        pooled_db = Path(tmp) / "pooled.db"
+        _prepare_db(legacy_db)
+        _prepare_db(pooled_db)
+
+        print("=" * 60)
+        print(f"1. Накладные расходы на соединение ({args.reads} чтений)")
+        print("=" * 60)
+        _print_row("before", bench_open_overhead(legacy_db, args.reads, _legacy_read))
+        _print_row("after", bench_open_overhead(pooled_db, args.reads, _pooled_read))
+
+        print("=" * 60)
+        print(f"2. Конкуренция писателей ({args.threads} потоков x {args.writes} записей + читатели)")
+        print("=" * 60)
+        _print_row("before", bench_contention(legacy_db, args.threads, args.writes, _legacy_read, _legacy_write))
+        _print_row("after", bench_contention(pooled_db, args.threads, args.writes, _pooled_read, _pooled_write))
+        print(f"  pool stats: {database.get_connection_pool_stats()}")
+
+        database.close_db_connections()
+
+
+if __name__ == "__main__":
+    main()
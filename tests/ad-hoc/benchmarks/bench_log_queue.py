@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк логирования в event loop: прямые обработчики vs очередь логов
+
+Запускает в asyncio несколько «обработчиков», которые пачками пишут в
+StructuredLogger (консоль, dark_maximus.log, errors.log и JSON-лог во
+временном каталоге), и задачу-пульс, которая каждые --interval мс
+измеряет, на сколько позже она проснулась. Сравниваются режим без
+очереди (файловый I/O и ротация в event loop) и режим LogPipeline
+(QueueHandler + поток-слушатель). Печатаются p50/p95/p99/max задержки
+пульса и время одного вызова logger.info в мс, а также число потерянных
+записей. Вывод консольного обработчика отправляется в /dev/null.
+
+Запуск:
+    python tests/ad-hoc/benchmarks/bench_log_queue.py [--records 200000] [--burst 50] [--queue-size 10000] [--overflow drop]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.utils.logger import LogPipeline, LogQueueConfig, StructuredLogger
+
+WORKERS = 4
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _heartbeat(interval: float, lags: list[float], done: asyncio.Event) -> None:
+    while not done.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+
+async def _worker(structured: StructuredLogger, worker_id: int, records: int, burst: int, calls: list[float]) -> None:
+    for i in range(records):
+        t0 = time.perf_counter()
+        if i % 100 == 99:
+            structured.error(f"Worker {worker_id}: panel unavailable for key {i}", key_id=i)
+        else:
+            structured.info(f"Worker {worker_id}: key {i} synced", user_id=i, host="panel-1")
+        calls.append((time.perf_counter() - t0) * 1000)
+        if i % burst == burst - 1:
+            await asyncio.sleep(0)
+
+
+async def _run(structured: StructuredLogger, args) -> dict:
+    lags: list[float] = []
+    calls: list[float] = []
+    done = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(args.interval / 1000, lags, done))
+    per_worker = args.records // WORKERS
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker(structured, n, per_worker, args.burst, calls) for n in range(WORKERS)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await heartbeat
+    return {
+        "stall_p50": statistics.median(lags) if lags else 0.0,
+        "stall_p95": _percentile(lags, 95),
+        "stall_p99": _percentile(lags, 99),
+        "stall_max": max(lags, default=0.0),
+        "call_p50": statistics.median(calls),
+        "call_p99": _percentile(calls, 99),
+        "rec_per_s": len(calls) / elapsed,
+    }
+
+
+def bench(use_queue: bool, args) -> tuple[dict, dict]:
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        pipeline = None
+        if use_queue:
+            pipeline = LogPipeline(LogQueueConfig(max_size=args.queue_size, overflow=args.overflow))
+            pipeline.start()
+        structured = StructuredLogger("bench.log_queue", log_dir=tmp, use_queue=use_queue, pipeline=pipeline)
+        structured.logger.propagate = False
+        result = asyncio.run(_run(structured, args))
+        stats = {}
+        if pipeline is not None:
+            drain_started = time.perf_counter()
+            pipeline.stop()
+            stats = pipeline.get_stats()
+            stats["drain_s"] = time.perf_counter() - drain_started
+        for handler in structured.logger.handlers + (list(pipeline._sinks.values())[0] if pipeline else []):
+            handler.close()
+        structured.logger.handlers.clear()
+    return result, stats
+
+
+def _print_row(title: str, result: dict) -> None:
+    cells = "  ".join(f"{key}={value:9.3f}" for key, value in result.items())
+    print(f"  {title:<7} {cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--burst", type=int, default=50, help="записей между await asyncio.sleep(0)")
+    parser.add_argument("--interval", type=float, default=5.0, help="период пульса, мс")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--overflow", choices=["drop", "drop_oldest", "block"], default="drop")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"{args.records} записей, {WORKERS} задачи, пачка {args.burst}, очередь {args.queue_size} ({args.overflow})")
+    print("=" * 60)
+    direct, _ = bench(False, args)
+    _print_row("direct", direct)
+    queued, stats = bench(True, args)
+    _print_row("queue", queued)
+    print(f"  очередь: max_depth={stats['max_depth']}  dropped={stats['dropped']}  "
+          f"дозапись после остановки={stats['drain_s']:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк поиска пользователей: LIKE по users vs триграммный индекс users_search
+
+Создаёт временную БД через database.initialize_db, заполняет её N
+пользователями с ключами (индекс users_search поддерживается триггерами)
+и сравнивает прежний запрос search_users (CAST(telegram_id) LIKE /
+LOWER(username) LIKE) с поиском по FTS5-индексу для запросов по части
+ID, username, имени и email ключа. Печатаются p50/p95/p99 в мс.
+
+Запуск:
+    python tests/ad-hoc/benchmarks/bench_user_search.py [--users 500000] [--repeat 50]
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+QUERIES = {
+    "id":       "4242",
+    "username": "mike_42",
+    "fullname": "Петров 1",
+    "email":    "user99@mail",
+    "miss":     "zzqx",
+}
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _populate(path: Path, users: int) -> None:
+    rng = random.Random(42)
+    names = ["mike", "anna", "ivan", "olga", "alex", "kate", "dima", "lena"]
+    surnames = ["Петров", "Иванова", "Smith", "Kuznetsov", "Lee"]
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (telegram_id, username, fullname, registration_date) VALUES (?, ?, ?, '2024-01-01 00:00:00')",
+            (
+                (100000000 + i, f"{rng.choice(names)}_{i}", f"{rng.choice(surnames)} {i}")
+                for i in range(users)
+            )
+        )
+        conn.executemany(
+            "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email) VALUES (?, 'host', ?, ?)",
+            ((100000000 + i, f"uuid-{i}", f"user{i}@mail.test") for i in range(0, users, 3))
+        )
+    conn.close()
+
+
+def _legacy_search(path: Path, query: str) -> list:
+    with database._get_db_connection(path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT u.telegram_id, u.username FROM users u
+            WHERE CAST(u.telegram_id AS TEXT) LIKE ?
+               OR (u.username IS NOT NULL AND LOWER(u.username) LIKE ?)
+            ORDER BY u.registration_date DESC
+            LIMIT 10
+            """,
+            (f"%{query}%", f"%{query.lower()}%")
+        )
+        return cursor.fetchall()
+
+
+def _indexed_search(path: Path, query: str) -> list:
+    return database.search_users(query, limit=10)
+
+
+def bench(path: Path, search_fn, query: str, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        search_fn(path, query)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+    }
+
+
+def _print_row(title: str, result: dict) -> None:
+    cells = "  ".join(f"{key}={value:8.2f}" for key, value in result.items())
+    print(f"  {title:<8} {cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench_search.db"
+        database.DB_FILE = path
+        database.initialize_db()
+        started = time.perf_counter()
+        _populate(path, args.users)
+        print(f"Заполнено {args.users} пользователей за {time.perf_counter() - started:.1f} с")
+
+        for name, query in QUERIES.items():
+            print("=" * 60)
+            print(f"{name}: '{query}' (найдено {len(_indexed_search(path, query))})")
+            print("=" * 60)
+            _print_row("before", bench(path, _legacy_search, query, args.repeat))
+            _print_row("after", bench(path, _indexed_search, query, args.repeat))
+        database.close_db_connections()
+
+
+if __name__ == "__main__":
+    main()
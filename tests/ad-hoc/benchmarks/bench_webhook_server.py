@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк пропускной способности вебхуков: Werkzeug dev server vs waitress
+
+Поднимает Flask-приложение с вебхуком, устроенным как платёжные вебхуки
+webhook_server.app: разбор JSON, запись в SQLite через пул соединений и
+передача обработки в отдельный event loop через run_coroutine_threadsafe.
+Каждый режим сервера (webhook_server.server.WebServer) нагружается
+N клиентами с keep-alive соединениями; печатаются RPS и p50/p95/p99.
+
+Запуск:
+    python tests/ad-hoc/benchmarks/bench_webhook_server.py [--requests 2000] [--concurrency 32] [--threads 8] [--work-ms 5]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from flask import Flask, current_app, jsonify, request
+
+project_root = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+from shop_bot.webhook_server.server import SERVER_WAITRESS, SERVER_WERKZEUG, WebServer, WebServerConfig
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _create_app(db_path: Path, loop: asyncio.AbstractEventLoop, work_ms: float) -> Flask:
+    app = Flask("bench-webhooks")
+    app.config['EVENT_LOOP'] = loop
+
+    async def process_payment(payment_id: str) -> None:
+        # Имитация обработки платежа в loop ботов (запросы к панели, отправка сообщений)
+        await asyncio.sleep(work_ms / 1000)
+
+    @app.route('/bench-webhook', methods=['POST'])
+    def webhook():
+        payload = request.get_json()
+        with database._get_db_connection(db_path) as conn:
+            conn.execute("INSERT INTO webhooks (payload) VALUES (?)", (json.dumps(payload),))
+        future = asyncio.run_coroutine_threadsafe(process_payment(payload['id']), current_app.config['EVENT_LOOP'])
+        future.result(timeout=30)
+        return jsonify({'status': 'ok'}), 200
+
+    return app
+
+
+def bench_server(kind: str, app: Flask, total_requests: int, concurrency: int, threads: int) -> dict:
+    server = WebServer(app, host="127.0.0.1", port=0, config=WebServerConfig(kind=kind, threads=threads))
+    server.start()
+    latencies: list[float] = []
+    errors = {"count": 0}
+    lock = threading.Lock()
+    per_client = total_requests // concurrency
+
+    def client(client_id: int) -> None:
+        local = []
+        conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=30)
+        for i in range(per_client):
+            body = json.dumps({"id": f"{client_id}-{i}", "event": "payment.succeeded"})
+            t0 = time.perf_counter()
+            try:
+                conn.request("POST", "/bench-webhook", body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}")
+                if response.getheader("Connection", "").lower() == "close":
+                    conn.close()
+            except Exception:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=30)
+                with lock:
+                    errors["count"] += 1
+                continue
+            local.append((time.perf_counter() - t0) * 1000)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    server.stop()
+
+    return {
+        "rps": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "errors": errors["count"],
+    }
+
+
+def _print_row(title: str, result: dict) -> None:
+    cells = ", ".join(
+        f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in result.items()
+    )
+    print(f"  {title:<9} {cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="всего запросов на режим")
+    parser.add_argument("--concurrency", type=int, default=32, help="число одновременных клиентов")
+    parser.add_argument("--threads", type=int, default=8, help="WEB_SERVER_THREADS для waitress")
+    parser.add_argument("--work-ms", type=float, default=5.0, help="длительность обработки платежа в event loop, мс")
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    # При concurrency > threads waitress предупреждает о глубине очереди на каждый запрос
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "webhooks.db"
+        with database._get_db_connection(db_path) as conn:
+            conn.execute("CREATE TABLE webhooks (id INTEGER PRIMARY KEY, payload TEXT)")
+        app = _create_app(db_path, loop, args.work_ms)
+
+        print("=" * 60)
+        print(f"Вебхуки: {args.requests} запросов, {args.concurrency} клиентов, обработка {args.work_ms} мс")
+        print("=" * 60)
+        _print_row(SERVER_WERKZEUG, bench_server(SERVER_WERKZEUG, app, args.requests, args.concurrency, args.threads))
+        _print_row(SERVER_WAITRESS, bench_server(SERVER_WAITRESS, app, args.requests, args.concurrency, args.threads))
+
+        database.close_db_connections()
+
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join(5)
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -316,6 +316,8 @@ def temp_db(test_db_session, monkeypatch):
     # Это гарантирует, что БД создается с правильной структурой
     if TEST_DB_PATH.exists():
         try:
+            # Закрываем соединения пула, иначе они удержат старый файл
+            database.close_db_connections()
             # Закрываем все возможные соединения с БД перед удалением
             import sqlite3
             import time
@@ -334,6 +336,9 @@ def temp_db(test_db_session, monkeypatch):
                         logger.warning(f"⚠️ Не удалось закрыть соединения с БД, продолжаем удаление...")
             
             TEST_DB_PATH.unlink()
+            # Удаляем WAL/SHM старой БД, чтобы их не применило к новому файлу
+            for suffix in ("-wal", "-shm"):
+                Path(f"{TEST_DB_PATH}{suffix}").unlink(missing_ok=True)
             # Небольшая задержка, чтобы система освободила файл
             time.sleep(0.1)
             logger.debug(f"🗑️ Удалена старая тестовая БД: {TEST_DB_PATH}")
@@ -653,6 +658,15 @@ def _create_empty_db_structure(db_path: Path):
     logger.info(f"✅ Пустая БД создана: {db_path}")
 
 
+@pytest.fixture(autouse=True)
+def reset_xui_panel_sessions():
+    """Сбрасывает кэш сессий 3x-ui между тестами, чтобы моки API не переживали тест"""
+    yield
+    xui_api = sys.modules.get("shop_bot.modules.xui_api")
+    if xui_api is not None:
+        xui_api.reset_panel_sessions()
+
+
 @pytest.fixture
 def mock_bot():
     """Мок для aiogram.Bot"""
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для движка рассылок shop_bot.bot.broadcast
+
+Проверяет token bucket, конкурентную отправку с соблюдением
+TelegramRetryAfter, учёт заблокировавших бота пользователей, чтение
+получателей пачками вне event loop, возобновление прерванной рассылки
+с сохранённого курсора и завершение со статусом failed при ошибке.
+"""
+
+import pytest
+import allure
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import CopyMessage
+
+from shop_bot.bot import broadcast
+from shop_bot.data_manager import database
+
+
+class _FakeBot:
+    """Бот, копирующий сообщения с задержкой и заданными ошибками по chat_id."""
+
+    def __init__(self, errors: dict | None = None, delay: float = 0.005):
+        self.errors = errors or {}
+        self.delay = delay
+        self.delivered: list[int] = []
+        self.attempts: dict[int, int] = {}
+        self.active = 0
+        self.peak = 0
+        self.send_message = AsyncMock()
+        self.edit_message_text = AsyncMock()
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, reply_markup=None):
+        self.attempts[chat_id] = self.attempts.get(chat_id, 0) + 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            errors = self.errors.get(chat_id)
+            if errors:
+                raise errors.pop(0)
+            self.delivered.append(chat_id)
+        finally:
+            self.active -= 1
+
+
+def _method(chat_id: int) -> CopyMessage:
+    return CopyMessage(chat_id=chat_id, from_chat_id=1, message_id=10)
+
+
+def _create_users(count: int, banned: set[int] = frozenset()) -> list[int]:
+    user_ids = [100 + i for i in range(count)]
+    for user_id in user_ids:
+        database.register_user_if_not_exists(user_id, f"user{user_id}", referrer_id=None)
+        if user_id in banned:
+            database.ban_user(user_id)
+    return user_ids
+
+
+def _engine(bot, broadcast_id: int, concurrency: int = 4) -> broadcast.BroadcastEngine:
+    return broadcast.BroadcastEngine(
+        bot, database.get_broadcast(broadcast_id), concurrency=concurrency,
+        limiter=broadcast.TelegramRateLimiter(global_rate=1000, per_chat_interval=0.01)
+    )
+
+
+@pytest.mark.unit
+@allure.epic("Бот")
+@allure.feature("Рассылки")
+@allure.label("package", "src.shop_bot.bot")
+class TestTokenBucket:
+    """Тесты для TokenBucket"""
+
+    @allure.title("Token bucket ограничивает скорость и соблюдает паузу retry_after")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("broadcast", "rate_limit", "unit")
+    async def test_rate_and_pause(self):
+        """10 токенов при rate=100 и capacity=1 выдаются не быстрее чем за ~90 мс; пауза задерживает выдачу"""
+        bucket = broadcast.TokenBucket(rate=100, capacity=1)
+        started = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire()
+        assert time.monotonic() - started >= 0.08
+
+        bucket.pause(0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        assert time.monotonic() - started >= 0.09
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("Бот")
+@allure.feature("Рассылки")
+@allure.label("package", "src.shop_bot.bot")
+class TestBroadcastEngine:
+    """Тесты для BroadcastEngine"""
+
+    @allure.title("Рассылка отправляется конкурентно с учётом retry_after и блокировок")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("broadcast", "concurrency", "unit")
+    async def test_broadcast_completes(self, temp_db):
+        """Забаненные пропускаются, flood control повторяется, заблокировавшие бота учитываются отдельно"""
+        user_ids = _create_users(30, banned={103, 104})
+        bot = _FakeBot(errors={
+            105: [TelegramRetryAfter(method=_method(105), message="Flood", retry_after=0)],
+            106: [TelegramForbiddenError(method=_method(106), message="Forbidden: bot was blocked by the user")],
+        })
+        broadcast_id = database.create_broadcast(admin_chat_id=1, from_chat_id=1, message_id=10)
+
+        counts = await _engine(bot, broadcast_id).run()
+
+        assert counts == {'sent': 27, 'failed': 0, 'blocked': 1}
+        assert sorted(bot.delivered) == [u for u in user_ids if u not in (103, 104, 106)]
+        assert bot.attempts[105] == 2
+        assert bot.peak > 1
+        saved = database.get_broadcast(broadcast_id)
+        assert saved['status'] == 'completed'
+        assert (saved['total'], saved['skipped_banned'], saved['sent'], saved['blocked']) == (28, 2, 27, 1)
+        assert saved['last_user_id'] == user_ids[-1]
+        bot.send_message.assert_awaited_once()
+        assert "Рассылка завершена" in bot.send_message.await_args.args[1]
+
+    @allure.title("Прерванная рассылка продолжается с сохранённого курсора")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("broadcast", "resume", "unit")
+    async def test_interrupted_broadcast_resumes(self, temp_db):
+        """После отмены задачи курсор сохранён; возобновление не отправляет повторно получателям до курсора"""
+        user_ids = _create_users(40)
+        broadcast_id = database.create_broadcast(admin_chat_id=1, from_chat_id=1, message_id=10)
+        first_bot = _FakeBot(delay=0.01)
+        engine = _engine(first_bot, broadcast_id, concurrency=2)
+        task = asyncio.create_task(engine.run())
+        while len(first_bot.delivered) < 10:
+            await asyncio.sleep(0.005)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        saved = database.get_broadcast(broadcast_id)
+        assert saved['status'] == 'running'
+        cursor = saved['last_user_id']
+        assert cursor >= user_ids[9]
+        assert saved['sent'] == len([u for u in user_ids if u <= cursor])
+
+        second_bot = _FakeBot()
+        counts = await _engine(second_bot, broadcast_id).run()
+
+        assert min(second_bot.delivered) > cursor
+        assert set(first_bot.delivered) | set(second_bot.delivered) == set(user_ids)
+        assert counts['sent'] == len(user_ids)
+        assert database.get_broadcast(broadcast_id)['status'] == 'completed'
+        assert database.get_unfinished_broadcasts() == []
+
+    @allure.title("Получатели читаются пачками в рабочем потоке, а не в event loop")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("broadcast", "database", "event_loop", "unit")
+    async def test_recipients_fetched_off_event_loop(self, temp_db, monkeypatch):
+        """Каждая пачка get_broadcast_recipients выполняется через asyncio.to_thread"""
+        user_ids = _create_users(20)
+        monkeypatch.setattr(database, "BROADCAST_RECIPIENTS_BATCH", 7)
+        original = database.get_broadcast_recipients
+        pages = []
+
+        def tracking_page(after_user_id, limit):
+            pages.append((after_user_id, threading.current_thread() is threading.main_thread()))
+            return original(after_user_id, limit)
+
+        monkeypatch.setattr(database, "get_broadcast_recipients", tracking_page)
+        broadcast_id = database.create_broadcast(admin_chat_id=1, from_chat_id=1, message_id=10)
+        bot = _FakeBot(delay=0)
+
+        counts = await _engine(bot, broadcast_id).run()
+
+        assert counts['sent'] == len(user_ids)
+        assert pages == [(0, False), (user_ids[6], False), (user_ids[13], False)]
+
+    @allure.title("Ошибка чтения получателей завершает рассылку со статусом failed")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("broadcast", "error", "unit")
+    async def test_recipient_error_marks_failed(self, temp_db, monkeypatch):
+        """Отправители останавливаются, прогресс сохраняется, рассылка не остаётся в running"""
+        user_ids = _create_users(12)
+        monkeypatch.setattr(database, "BROADCAST_RECIPIENTS_BATCH", 5)
+        original = database.get_broadcast_recipients
+
+        def failing_page(after_user_id, limit):
+            if after_user_id:
+                raise RuntimeError("database is locked")
+            return original(after_user_id, limit)
+
+        monkeypatch.setattr(database, "get_broadcast_recipients", failing_page)
+        broadcast_id = database.create_broadcast(admin_chat_id=1, from_chat_id=1, message_id=10)
+        bot = _FakeBot(delay=0)
+
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(_engine(bot, broadcast_id).run(), timeout=5)
+
+        saved = database.get_broadcast(broadcast_id)
+        assert saved['status'] == 'failed'
+        assert saved['finished_at'] is not None
+        assert saved['last_user_id'] <= user_ids[4]
+        assert saved['sent'] == len([u for u in user_ids if u <= saved['last_user_id']])
+        assert database.get_unfinished_broadcasts() == []
+        bot.send_message.assert_awaited_once()
+        assert "прервана ошибкой" in bot.send_message.await_args.args[1]
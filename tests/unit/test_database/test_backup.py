@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для DatabaseBackupManager
+
+Проверяет постраничное копирование снимка без блокировки записи,
+потоковое сжатие без несжатого файла на диске, режим quick_check,
+метрики бэкапа, а также инкрементальные цепочки: дельты изменённых
+страниц, восстановление на момент времени, экономию места и
+согласованность цепочки после сбоя между записью хешей и манифеста.
+"""
+
+import pytest
+import allure
+import gzip
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import backup, database
+from shop_bot.utils import performance_monitor
+from shop_bot.utils.performance_monitor import PerformanceMonitor
+
+
+def _create_users(count: int) -> None:
+    with database._get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (telegram_id, username, fullname) VALUES (?, ?, ?)",
+            ((7000000 + i, f"user_{i}", "Backup Test " * 10) for i in range(count))
+        )
+
+
+def _count_users(path: Path) -> int:
+    with sqlite3.connect(path) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+    return count
+
+
+@pytest.fixture
+def manager(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "DB_FILE", temp_db)
+    monkeypatch.setattr(performance_monitor, "_performance_monitor", PerformanceMonitor())
+    backup_manager = backup.DatabaseBackupManager(backup_dir=str(tmp_path / "backups"))
+    backup_manager.step_pages = 4
+    return backup_manager
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Бэкапы")
+@allure.label("package", "src.shop_bot.data_manager.backup")
+class TestStreamingBackup:
+    """Тесты для create_backup"""
+
+    @allure.title("Снимок копируется шагами, запись в БД между шагами не блокируется")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("backup", "journal_mode", "unit")
+    @pytest.mark.parametrize("write_steps", [2, None])
+    def test_stepwise_snapshot_under_writes(self, manager, temp_db, tmp_path, monkeypatch, write_steps):
+        """Запись без ожидания проходит во время бэкапа; при постоянной записи снимок снимается за один проход"""
+        _create_users(500)
+        writes = []
+
+        def write_between_steps(seconds):
+            if write_steps is None or len(writes) < write_steps:
+                with sqlite3.connect(temp_db, timeout=0) as writer:
+                    writer.execute(
+                        "INSERT INTO users (telegram_id, username) VALUES (?, 'live')", (7100000 + len(writes),)
+                    )
+                writer.close()
+                writes.append(seconds)
+
+        monkeypatch.setattr(backup, "time", SimpleNamespace(sleep=write_between_steps, perf_counter=time.perf_counter))
+        info = manager.create_backup("users_backup_steps.db")
+
+        assert info['success'] is True, info.get('error')
+        assert info['steps'] > 1 and writes
+        assert info['snapshot'] == 'memory'
+        assert sorted(p.name for p in (tmp_path / "backups").iterdir()) == ["users_backup_steps.db.gz"]
+        if write_steps is None:
+            assert len(writes) == backup.BACKUP_MAX_RESTARTS + 1
+
+        restored = tmp_path / "restored.db"
+        with gzip.open(info['backup_path'], 'rb') as f_in:
+            restored.write_bytes(f_in.read())
+        assert _count_users(restored) == _count_users(temp_db) == 500 + len(writes)
+
+    @allure.title("Снимок через временный файл, quick_check и бэкап без сжатия")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("backup", "integrity", "unit")
+    def test_file_snapshot_and_quick_check(self, manager, tmp_path):
+        """Большая БД сжимается из временного снимка, который потом удаляется; quick_check заменяет integrity_check"""
+        _create_users(50)
+        manager.memory_snapshot_limit = 0
+        manager.quick_check = True
+        info = manager.create_backup("users_backup_file.db")
+
+        assert info['success'] is True, info.get('error')
+        assert (info['snapshot'], info['verify_mode']) == ('file', 'quick_check')
+        assert [p.name for p in (tmp_path / "backups").iterdir()] == ["users_backup_file.db.gz"]
+
+        manager.compression_enabled = False
+        plain = manager.create_backup("users_backup_plain.db")
+        assert plain['success'] is True and plain['backup_path'].endswith("users_backup_plain.db")
+        assert _count_users(Path(plain['backup_path'])) == 50
+        assert not list((tmp_path / "backups").glob(".*"))
+
+    @allure.title("Длительность фаз и объём бэкапа попадают в метрики")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("backup", "metrics", "unit")
+    async def test_backup_metrics(self, manager):
+        """backup_create и backup_phase:* записываются в монитор, объёмы — в счётчики и статистику"""
+        _create_users(10)
+        info = manager.create_backup()
+        assert info['success'] is True, info.get('error')
+
+        monitor = performance_monitor.get_performance_monitor()
+        for operation in ("backup_create", "backup_phase:snapshot", "backup_phase:verify", "backup_phase:compress"):
+            assert (await monitor.get_operation_stats(operation))['count'] == 1
+        counters = await monitor.get_counters()
+        assert counters['backup_source_bytes']['last'] == info['source_size'] > 0
+        assert counters['backup_output_bytes']['last'] == info['backup_size']
+        stats = manager.get_backup_statistics()
+        assert stats['last_backup_metrics']['pages'] == info['pages'] > 0
+        assert stats['total_backups'] == 1
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Бэкапы")
+@allure.label("package", "src.shop_bot.data_manager.backup")
+class TestIncrementalBackup:
+    """Тесты для инкрементальных бэкапов"""
+
+    @allure.title("Дельты содержат только изменённые страницы, любую точку можно восстановить")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("backup", "incremental", "restore", "unit")
+    def test_delta_chain_point_in_time_restore(self, manager):
+        """base + дельты; restore_backup по дельте и restore_point_in_time собирают состояние точки"""
+        manager.full_backup_every = 3
+        _create_users(300)
+        base = manager.create_incremental_backup()
+        with database._get_db_connection() as conn:
+            conn.executemany(
+                "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+                [(7200000 + i, f"new_{i}") for i in range(5)]
+            )
+        delta = manager.create_incremental_backup()
+        with database._get_db_connection() as conn:
+            conn.execute("DELETE FROM users WHERE telegram_id >= 7200000")
+        manager.create_incremental_backup()
+        next_chain = manager.create_incremental_backup()
+
+        assert (base['kind'], delta['kind'], next_chain['kind']) == ('base', 'delta', 'base')
+        assert delta['chain'] == base['chain'] != next_chain['chain']
+        assert 0 < delta['changed_pages'] < delta['pages']
+        assert delta['backup_size'] < base['backup_size']
+
+        restored = manager.restore_backup(delta['backup_path'], create_backup_before_restore=False)
+        assert restored['success'] is True, restored.get('error')
+        assert _count_users(backup.DB_FILE) == 305
+
+        restored = manager.restore_point_in_time(
+            datetime.fromisoformat(base['created_at']), create_backup_before_restore=False
+        )
+        assert restored['success'] is True, restored.get('error')
+        assert _count_users(backup.DB_FILE) == 300
+
+    @allure.title("Сбой до записи манифеста не теряет изменения в следующей дельте")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("backup", "incremental", "crash", "unit")
+    def test_crash_before_manifest_keeps_chain_consistent(self, manager, monkeypatch):
+        """Хеши точки, не попавшей в манифест, не используются: следующая дельта восстанавливается полностью"""
+        _create_users(100)
+        manager.create_incremental_backup()
+        with database._get_db_connection() as conn:
+            conn.execute("INSERT INTO users (telegram_id, username) VALUES (7400000, 'lost_point')")
+
+        write_atomic = manager._write_atomic
+
+        def crash_on_manifest(path, data):
+            if path.name == backup.CHAIN_MANIFEST_FILE:
+                raise OSError("No space left on device")
+            write_atomic(path, data)
+
+        monkeypatch.setattr(manager, "_write_atomic", crash_on_manifest)
+        assert manager.create_incremental_backup()['success'] is False
+        monkeypatch.setattr(manager, "_write_atomic", write_atomic)
+
+        delta = manager.create_incremental_backup()
+        assert delta['kind'] == 'delta'
+        chain_dir = Path(delta['backup_path']).parent
+        assert sorted(path.name for path in chain_dir.glob("*.hash")) == ["pages_0001.hash"]
+
+        restored = manager.restore_backup(delta['backup_path'], create_backup_before_restore=False)
+        assert restored['success'] is True, restored.get('error')
+        assert _count_users(backup.DB_FILE) == 101
+
+    @allure.title("Повреждённая дельта не восстанавливается")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("backup", "incremental", "restore", "unit")
+    def test_corrupted_delta_rejected(self, manager):
+        """Контрольная сумма собранной точки не совпадает — восстановление отклоняется, БД не меняется"""
+        _create_users(100)
+        manager.create_incremental_backup()
+        with database._get_db_connection() as conn:
+            conn.execute("INSERT INTO users (telegram_id, username) VALUES (7300000, 'tail')")
+        delta = manager.create_incremental_backup()
+
+        delta_path = Path(delta['backup_path'])
+        with gzip.open(delta_path, 'rb') as f_in:
+            header, body = f_in.read().split(b"\n", 1)
+        with gzip.open(delta_path, 'wb') as f_out:
+            f_out.write(header + b"\n" + body[:-1] + bytes([body[-1] ^ 0xFF]))
+
+        restored = manager.restore_backup(delta['backup_path'], create_backup_before_restore=False)
+        assert restored['success'] is False and "checksum" in restored['error']
+        assert _count_users(backup.DB_FILE) == 101
+
+    @allure.title("Статистика показывает экономию места, старые цепочки удаляются целиком")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("backup", "incremental", "retention", "unit")
+    def test_statistics_and_retention(self, manager):
+        """space_saved считается относительно полных сжатых бэкапов; текущая цепочка не удаляется"""
+        manager.full_backup_every = 4
+        _create_users(300)
+        for i in range(5):
+            with database._get_db_connection() as conn:
+                conn.execute("UPDATE users SET balance = ? WHERE telegram_id = 7000000", (i,))
+            assert manager.create_incremental_backup()['success'] is True
+
+        incremental = manager.get_backup_statistics()['incremental']
+        assert (incremental['chains'], incremental['restore_points']) == (2, 5)
+        assert incremental['space_saved'] > 0 and incremental['space_saved_percent'] > 40
+
+        manager.retention_days = 0
+        assert manager.cleanup_old_backups() == 1
+        assert [point['kind'] for point in manager.list_restore_points()] == ['base']
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для кэша банов (BanCache) и BanMiddleware
+
+Проверяет предзагрузку забаненных ID без запросов к БД на обычном пути,
+явный сброс кэша при ban_user/unban_user, сброс по ban_version при записи
+из другого процесса и ограниченный LRU-режим при большом числе банов.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from aiogram.types import Message
+
+from shop_bot.bot.middlewares import BanMiddleware
+from shop_bot.data_manager import database
+
+
+def _create_users(*user_ids: int) -> None:
+    for user_id in user_ids:
+        database.register_user_if_not_exists(user_id, f"user{user_id}", referrer_id=None)
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Пользователи")
+@allure.label("package", "src.shop_bot.database")
+class TestBanCache:
+    """Тесты для BanCache"""
+
+    @allure.title("Забаненные ID предзагружаются, бан и разбан применяются сразу")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("ban", "cache", "unit")
+    def test_preloaded_and_invalidated(self, temp_db, monkeypatch):
+        """Проверка незабаненного не обращается к БД; ban_user/unban_user сбрасывают кэш процесса"""
+        _create_users(6001, 6002)
+        database.ban_user(6001)
+        cache = database.BanCache(check_interval=60)
+        monkeypatch.setattr(database, "_ban_cache", cache)
+
+        assert cache.is_banned(6001) is True
+        assert cache.is_banned(6002) is False
+        assert cache.get_stats()["preloaded"] == 1
+
+        def fail_connection(*args, **kwargs):
+            raise AssertionError("BanCache не должен обращаться к БД")
+
+        with monkeypatch.context() as patched:
+            patched.setattr(database, "_get_db_connection", fail_connection)
+            assert cache.peek(6002) is False
+            assert cache.is_banned(123456) is False
+
+        database.ban_user(6002)
+        assert cache.is_banned(6002) is True
+        database.unban_user(6001)
+        assert cache.is_banned(6001) is False
+
+    @allure.title("Бан из другого процесса замечается по ban_version")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("ban", "cache", "unit")
+    def test_version_row_invalidation(self, temp_db):
+        """Прямая запись is_banned увеличивает ban_version; кэш перечитывает набор после check_interval"""
+        _create_users(6101)
+        cache = database.BanCache(check_interval=0)
+        assert cache.is_banned(6101) is False
+
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("UPDATE users SET is_banned = 1 WHERE telegram_id = 6101")
+        conn.close()
+
+        assert cache.is_banned(6101) is True
+        assert cache.get_stats()["reloads"] == 2
+
+    @allure.title("При большом числе банов кэш ограничен по размеру")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("ban", "cache", "lru", "unit")
+    def test_bounded_lru_fallback(self, temp_db):
+        """Если забаненных больше preload_limit, статусы хранятся в LRU не больше max_size записей"""
+        _create_users(6201, 6202, 6203, 6204)
+        database.ban_user(6201)
+        database.ban_user(6202)
+        cache = database.BanCache(max_size=2, preload_limit=1, check_interval=60)
+
+        assert [cache.is_banned(user_id) for user_id in (6201, 6202, 6203, 6204)] == [True, True, False, False]
+        stats = cache.get_stats()
+        assert stats["preloaded"] is None
+        assert stats["entries"] == 2 and stats["evictions"] == 2
+        assert cache.peek(6204) is False and cache.peek(6201) is None
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("Бот")
+@allure.feature("Middleware")
+@allure.label("package", "src.shop_bot.bot")
+class TestBanMiddleware:
+    """Тесты для BanMiddleware"""
+
+    @allure.title("Забаненный пользователь не доходит до обработчика")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("ban", "middleware", "unit")
+    async def test_banned_user_blocked(self, temp_db, monkeypatch):
+        """Обработчик вызывается для обычного пользователя и не вызывается после ban_user"""
+        _create_users(6301)
+        monkeypatch.setattr(database, "_ban_cache", database.BanCache())
+        middleware = BanMiddleware()
+        handler = AsyncMock(return_value="handled")
+        event = MagicMock(spec=Message)
+        event.answer = AsyncMock()
+        data = {"event_from_user": MagicMock(id=6301)}
+
+        assert await middleware(handler, event, data) == "handled"
+        database.ban_user(6301)
+        assert await middleware(handler, event, data) is None
+
+        handler.assert_awaited_once()
+        event.answer.assert_awaited_once()
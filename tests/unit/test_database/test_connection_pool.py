@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для пула синхронных соединений SQLite
+
+Проверяет переиспользование соединений, режим DELETE, сброс состояния
+соединения при возврате в пул и обработку пересозданного файла БД.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """Изолированный пул и отдельный файл БД"""
+    db_path = tmp_path / "pool.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.commit()
+    conn.close()
+    test_pool = database.SQLiteConnectionPool(max_idle=2)
+    yield test_pool, db_path
+    test_pool.close_all()
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Пул соединений")
+@allure.label("package", "src.shop_bot.database")
+class TestConnectionPool:
+    """Тесты для SQLiteConnectionPool"""
+
+    @allure.title("Соединение переиспользуется и работает в режиме DELETE")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("pool", "journal_mode", "database", "unit")
+    def test_connection_reused_in_delete_mode(self, pool):
+        """Повторный acquire возвращает то же соединение с PRAGMA journal_mode=DELETE"""
+        test_pool, db_path = pool
+
+        conn = test_pool.acquire(db_path)
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        test_pool.release(conn)
+
+        assert mode.upper() == "DELETE"
+        assert test_pool.acquire(db_path) is conn
+        stats = test_pool.get_stats()
+        assert stats["opened"] == 1
+        assert stats["reused"] == 1
+
+    @allure.title("Состояние соединения сбрасывается при возврате в пул")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("pool", "row_factory", "transaction", "database", "unit")
+    def test_release_resets_state(self, pool):
+        """row_factory сбрасывается, незавершённая транзакция откатывается"""
+        test_pool, db_path = pool
+
+        conn = test_pool.acquire(db_path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("INSERT INTO items (name) VALUES ('uncommitted')")
+        test_pool.release(conn)
+
+        conn = test_pool.acquire(db_path)
+        assert conn.row_factory is None
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+        test_pool.release(conn)
+
+    @allure.title("Закрытое вызывающим кодом соединение не возвращается в пул")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("pool", "close", "database", "unit")
+    def test_closed_connection_discarded(self, pool):
+        """release() закрытого соединения не ломает пул"""
+        test_pool, db_path = pool
+
+        conn = test_pool.acquire(db_path)
+        conn.close()
+        test_pool.release(conn)
+
+        fresh = test_pool.acquire(db_path)
+        assert fresh is not conn
+        assert fresh.execute("SELECT 1").fetchone() == (1,)
+        test_pool.release(fresh)
+
+    @allure.title("Пересозданный файл БД сбрасывает свободные соединения")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("pool", "stale", "database", "unit")
+    def test_recreated_file_drops_idle_connections(self, pool):
+        """После замены файла БД пул открывает новое соединение"""
+        test_pool, db_path = pool
+
+        conn = test_pool.acquire(db_path)
+        test_pool.release(conn)
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+        new_conn = sqlite3.connect(db_path)
+        new_conn.execute("CREATE TABLE other (id INTEGER PRIMARY KEY)")
+        new_conn.commit()
+        new_conn.close()
+
+        conn = test_pool.acquire(db_path)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        test_pool.release(conn)
+        assert tables == {"other"}
+        assert test_pool.get_stats()["discarded"] == 1
+
+    @allure.title("_get_db_connection фиксирует и откатывает транзакции как sqlite3.connect")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("pool", "commit", "rollback", "database", "unit")
+    def test_context_manager_commit_and_rollback(self, temp_db):
+        """Коммит при успешном выходе, откат при исключении"""
+        with database._get_db_connection() as conn:
+            conn.execute("INSERT INTO bot_settings (key, value) VALUES ('pool_test_ok', '1')")
+
+        with pytest.raises(RuntimeError):
+            with database._get_db_connection() as conn:
+                conn.execute("INSERT INTO bot_settings (key, value) VALUES ('pool_test_fail', '1')")
+                raise RuntimeError("boom")
+
+        with sqlite3.connect(str(temp_db)) as check_conn:
+            keys = {row[0] for row in check_conn.execute(
+                "SELECT key FROM bot_settings WHERE key LIKE 'pool_test_%'"
+            )}
+        assert keys == {"pool_test_ok"}
+
+    @allure.title("Пул считает выдачи соединений, SQL-операторы и время занятости")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("pool", "metrics", "database", "unit")
+    def test_statement_and_checkout_stats(self, pool):
+        """Операторы считаются trace-callback'ом соединения и сбрасываются при возврате в пул"""
+        test_pool, db_path = pool
+
+        conn = test_pool.acquire(db_path)
+        conn.execute("SELECT COUNT(*) FROM items").fetchone()
+        conn.execute("SELECT name FROM items WHERE id = 1").fetchone()
+        test_pool.release(conn, held_seconds=0.25)
+        conn = test_pool.acquire(db_path)
+        conn.execute("SELECT 1").fetchone()
+        test_pool.release(conn, held_seconds=0.5)
+
+        stats = test_pool.get_stats()
+        assert stats["checkouts"] == 2
+        assert stats["statements"] == 3
+        assert stats["connection_seconds"] == 0.75
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для дневной статистики дашборда (daily_stats)
+
+Проверяет обновление daily_stats триггерами при записи пользователей,
+ключей, транзакций и уведомлений, пересчёт истории rebuild_daily_stats
+и выдачу итогов и графиков дашборда get_dashboard_stats.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+
+def _daily_stats(temp_db) -> dict:
+    with sqlite3.connect(str(temp_db)) as conn:
+        rows = conn.execute(
+            "SELECT day, new_users, new_keys, earned_paid, earned_completed, new_notifications FROM daily_stats WHERE day != '' ORDER BY day"
+        ).fetchall()
+    conn.close()
+    return {row[0]: row[1:] for row in rows}
+
+
+def _insert_transaction(conn, payment_id: str, status: str, amount: float, created_date: str) -> int:
+    cursor = conn.execute(
+        "INSERT INTO transactions (payment_id, user_id, status, amount_rub, payment_method, created_date) VALUES (?, 9001, ?, ?, 'Balance', ?)",
+        (payment_id, status, amount, created_date)
+    )
+    return cursor.lastrowid
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Статистика")
+@allure.label("package", "src.shop_bot.database")
+class TestDailyStats:
+    """Тесты для daily_stats и get_dashboard_stats"""
+
+    @allure.title("Дневная статистика обновляется триггерами и совпадает с пересчётом")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("dashboard", "daily_stats", "unit")
+    def test_triggers_match_rebuild(self, temp_db):
+        """Вставка, удаление и смена статуса/даты меняют daily_stats так же, как полный пересчёт"""
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("INSERT INTO users (telegram_id, username, registration_date) VALUES (9001, 'u1', '2024-05-01 10:00:00')")
+            conn.execute("INSERT INTO users (telegram_id, username, registration_date) VALUES (9002, 'u2', '2024-05-02 10:00:00')")
+            conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, created_date) VALUES (9001, 'h', 'uuid-1', 'k1', '2024-05-01 11:00:00')"
+            )
+            pending = _insert_transaction(conn, "p1", "pending", 150.0, "2024-05-01 12:00:00")
+            _insert_transaction(conn, "p2", "paid", 50.0, "2024-05-02 12:00:00")
+            removed = _insert_transaction(conn, "p3", "paid", 70.0, "2024-05-02 13:00:00")
+            conn.execute("UPDATE transactions SET status = 'paid' WHERE transaction_id = ?", (pending,))
+            conn.execute("UPDATE transactions SET created_date = '2024-05-02 09:00:00' WHERE transaction_id = ?", (pending,))
+            conn.execute("DELETE FROM transactions WHERE transaction_id = ?", (removed,))
+            conn.execute(
+                "INSERT INTO notifications (user_id, type, title, message, created_date) VALUES (9002, 'test', 'T', 'M', '2024-05-02 14:00:00')"
+            )
+            conn.execute("DELETE FROM users WHERE telegram_id = 9002")
+        conn.close()
+
+        incremental = _daily_stats(temp_db)
+        assert incremental == {
+            '2024-05-01': (1, 1, 0.0, 0.0, 0),
+            '2024-05-02': (0, 0, 200.0, 0.0, 1),
+        }
+        database.rebuild_daily_stats()
+        assert _daily_stats(temp_db) == incremental
+
+    @allure.title("Дашборд читает итоги и графики одним запросом")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("dashboard", "daily_stats", "unit")
+    def test_dashboard_stats(self, temp_db):
+        """Итоги считаются по всей истории, графики — за последние дни; пустые дни заполняются нулями"""
+        now = datetime.now(timezone.utc)
+        today = now.strftime('%Y-%m-%d %H:%M:%S')
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("INSERT INTO users (telegram_id, username, registration_date) VALUES (9001, 'u1', '2020-01-01 00:00:00')")
+            conn.execute("INSERT INTO users (telegram_id, username, registration_date) VALUES (9002, 'u2', ?)", (today,))
+            _insert_transaction(conn, "p1", "paid", 99.5, today)
+            _insert_transaction(conn, "p2", "completed", 40.0, "2020-01-01 00:00:00")
+        conn.close()
+
+        dashboard = database.get_dashboard_stats(days=7)
+
+        assert dashboard['stats'] == {
+            'user_count': 2, 'total_keys': 0, 'total_spent': 40.0, 'host_count': 0, 'total_notifications': 0
+        }
+        chart = dashboard['chart_data']
+        assert len(chart['dates']) == 7
+        assert sum(chart['new_users']) == 1 and sum(chart['earned_sum']) == 99.5
+        assert chart == database.get_daily_stats_for_charts(days=7)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для пакетного прохода уведомлений об истечении подписки
+
+Проверяет выборку ключей по окну expiry_date, пакетную предзагрузку
+тарифов/балансов/маркеров и построение плана уведомлений за один проход.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+from shop_bot.data_manager import scheduler
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _insert_key(cursor, user_id: int, host_name: str, email: str, expiry_date: datetime,
+                plan_name: str = "Месяц", auto_renewal_enabled: int = 1) -> int:
+    cursor.execute(
+        """INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, status, plan_name, price, auto_renewal_enabled)
+           VALUES (?, ?, ?, ?, ?, 'active', ?, 100.0, ?)""",
+        (user_id, host_name, f"uuid-{email}", email, expiry_date, plan_name, auto_renewal_enabled)
+    )
+    return cursor.lastrowid
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Уведомления")
+@allure.label("package", "src.shop_bot.scheduler")
+class TestExpiryNotificationPlan:
+    """Тесты для check_expiring_subscriptions и пакетных выборок"""
+
+    @allure.title("Выборка ключей только внутри окна уведомлений")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("scheduler", "expiry", "database", "unit")
+    def test_keys_expiring_between_window(self, temp_db):
+        """get_keys_expiring_between() возвращает ключи в окне независимо от формата даты"""
+        now = _now()
+        with sqlite3.connect(str(temp_db)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO users (telegram_id, username, balance) VALUES (1001, 'u1', 0)")
+            inside = _insert_key(cursor, 1001, "host-a", "inside@test", now + timedelta(hours=5))
+            inside_iso = _insert_key(cursor, 1001, "host-a", "iso@test", (now + timedelta(hours=20)).isoformat())
+            _insert_key(cursor, 1001, "host-a", "later@test", now + timedelta(days=3))
+            _insert_key(cursor, 1001, "host-a", "expired@test", now - timedelta(hours=2))
+        conn.close()
+
+        keys = database.get_keys_expiring_between(now, now + timedelta(hours=24))
+
+        assert {key['key_id'] for key in keys} == {inside, inside_iso}
+
+    @allure.title("Пакетная загрузка тарифов, балансов и маркеров")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("scheduler", "batch", "database", "unit")
+    def test_bulk_preloads(self, temp_db):
+        """get_plans_by_hosts, get_users_renewal_state и get_logged_notification_markers"""
+        database.create_plan("host-a", "Месяц", 1, 100.0)
+        database.create_plan("host-b", "Год", 12, 900.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("INSERT INTO users (telegram_id, username, balance, auto_renewal_enabled) VALUES (1001, 'u1', 150, 0)")
+            conn.execute("INSERT INTO users (telegram_id, username, balance) VALUES (1002, 'u2', 10)")
+        conn.close()
+        database.log_notification(1001, "u1", "subscription_expiry", "t", "m", key_id=7, marker_hours=24)
+        database.log_notification(1001, "u1", "other_type", "t", "m", key_id=7, marker_hours=1)
+
+        plans = database.get_plans_by_hosts(["host-a", "host-b", "host-c", None])
+        states = database.get_users_renewal_state([1001, 1002, 9999])
+        markers = database.get_logged_notification_markers([7, 8], scheduler.EXPIRY_NOTIFICATION_TYPES)
+
+        assert [p['plan_name'] for p in plans['host-a']] == ["Месяц"]
+        assert [p['plan_name'] for p in plans['host-b']] == ["Год"]
+        assert plans['host-c'] == []
+        assert states[1001] == {'balance': 150.0, 'auto_renewal_enabled': False}
+        assert states[1002]['auto_renewal_enabled'] is True
+        assert 9999 not in states
+        assert markers == {(1001, 7, 24, 'subscription_expiry')}
+
+    @allure.title("План уведомлений строится за один проход без обращений к БД")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("scheduler", "expiry", "plan", "unit")
+    def test_build_plan_selects_notification_types(self, monkeypatch):
+        """Выбор типа уведомления и маркера для каждого ключа, пропуск уже отправленных"""
+        monkeypatch.setattr(database, "get_plans_for_host", lambda host: pytest.fail("plans must be preloaded"))
+        now = _now()
+        plans_by_host = {
+            "host-a": [{'plan_id': 1, 'plan_name': "Месяц", 'price': 100.0, 'months': 1, 'display_mode': 'all'}],
+            "host-b": [{'plan_id': 2, 'plan_name': "Месяц", 'price': 100.0, 'months': 1, 'display_mode': 'hidden_all'}],
+        }
+        user_states = {
+            1: {'balance': 0.0, 'auto_renewal_enabled': True},
+            2: {'balance': 500.0, 'auto_renewal_enabled': True},
+            3: {'balance': 500.0, 'auto_renewal_enabled': False},
+        }
+        keys = [
+            {'key_id': 10, 'user_id': 1, 'host_name': "host-a", 'plan_name': "Месяц", 'expiry_date': str(now + timedelta(hours=12))},
+            {'key_id': 11, 'user_id': 1, 'host_name': "host-b", 'plan_name': "Месяц", 'expiry_date': str(now + timedelta(minutes=30))},
+            {'key_id': 12, 'user_id': 2, 'host_name': "host-a", 'plan_name': "Месяц", 'expiry_date': str(now + timedelta(hours=20)), 'auto_renewal_enabled': 1},
+            {'key_id': 13, 'user_id': 3, 'host_name': "host-a", 'plan_name': "Месяц", 'expiry_date': str(now + timedelta(minutes=40))},
+            {'key_id': 14, 'user_id': 1, 'host_name': "host-a", 'plan_name': "Месяц", 'expiry_date': str(now + timedelta(hours=3))},
+            {'key_id': 15, 'user_id': 1, 'host_name': "host-a", 'plan_name': "Месяц", 'expiry_date': str(now - timedelta(hours=1))},
+        ]
+        logged = {(1, 14, 24, 'subscription_expiry')}
+
+        plan = scheduler._build_expiry_notification_plan(keys, now, plans_by_host, user_states, logged)
+
+        assert [(item['key_id'], item['notif_type'], item['hours_mark']) for item in plan] == [
+            (10, 'subscription_expiry', 24),
+            (11, 'subscription_plan_unavailable', 1),
+            (12, 'subscription_autorenew_notice', 24),
+            (13, 'subscription_autorenew_disabled', 1),
+        ]
+
+    @allure.title("check_expiring_subscriptions ставит уведомления по плану в outbox")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("scheduler", "expiry", "unit")
+    @pytest.mark.asyncio
+    async def test_check_expiring_enqueues_plan(self, temp_db):
+        """Ключ в окне ставится в outbox один раз, ключ вне окна не рассматривается"""
+        now = _now()
+        database.create_plan("host-a", "Месяц", 1, 100.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO users (telegram_id, username, balance) VALUES (2001, 'u', 0)")
+            soon = _insert_key(cursor, 2001, "host-a", "soon@test", now + timedelta(hours=10))
+            _insert_key(cursor, 2001, "host-a", "far@test", now + timedelta(days=10))
+        conn.close()
+
+        await scheduler.check_expiring_subscriptions(bot=None)
+        await scheduler.check_expiring_subscriptions(bot=None)
+
+        with sqlite3.connect(str(temp_db)) as conn:
+            queued = conn.execute(
+                """SELECT n.user_id, n.key_id, n.marker_hours, n.type, n.status, o.status
+                   FROM notification_outbox o JOIN notifications n ON n.notification_id = o.notification_id"""
+            ).fetchall()
+        conn.close()
+        assert queued == [(2001, soon, 24, 'subscription_expiry', 'pending', 'pending')]
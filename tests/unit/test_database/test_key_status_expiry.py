@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для update_keys_status_by_expiry
+
+Проверяет set-based переходы статусов ключей по времени истечения,
+полную сверку при первом вызове, использование индекса
+idx_vpn_keys_status_expiry и передачу числа переходов в монитор.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+from shop_bot.data_manager import scheduler
+from shop_bot.utils.performance_monitor import PerformanceMonitor
+
+
+def _insert_key(conn, email: str, expiry, status: str, is_trial: int = 0) -> None:
+    conn.execute(
+        "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, status, is_trial) VALUES (1, 'host', ?, ?, ?, ?, ?)",
+        (f"uuid-{email}", email, expiry, status, is_trial)
+    )
+
+
+def _statuses(temp_db) -> dict:
+    with sqlite3.connect(str(temp_db)) as conn:
+        return dict(conn.execute("SELECT key_email, status FROM vpn_keys").fetchall())
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Статусы ключей")
+@allure.label("package", "src.shop_bot.database")
+class TestKeyStatusByExpiry:
+    """Тесты для update_keys_status_by_expiry"""
+
+    @allure.title("Переходы статусов выполняются set-based обновлениями")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("keys", "status", "expiry", "unit")
+    def test_incremental_transitions(self, temp_db):
+        """Истёкшие ключи завершаются, продлённые снова активны, остальные не меняются"""
+        now = datetime.now()
+        with sqlite3.connect(str(temp_db)) as conn:
+            _insert_key(conn, "paid-expired", now - timedelta(hours=1), "pay-active")
+            _insert_key(conn, "trial-expired", (now - timedelta(minutes=5)).isoformat(), "trial-active", is_trial=1)
+            _insert_key(conn, "paid-renewed", now + timedelta(days=30), "pay-ended")
+            _insert_key(conn, "tz-suffix", (now + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S+00:00"), "pay-active")
+            _insert_key(conn, "still-ended", now - timedelta(days=3), "trial-ended", is_trial=1)
+            _insert_key(conn, "broken-date", "not a date", "pay-active")
+        conn.close()
+
+        # Первый вызов в процессе — полная сверка; дальше — инкрементальные переходы
+        database.update_keys_status_by_expiry(full_sync=True)
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("UPDATE vpn_keys SET status = 'pay-active' WHERE key_email = 'paid-renewed'")
+            conn.execute("UPDATE vpn_keys SET expiry_date = ? WHERE key_email = 'paid-renewed'", (now - timedelta(seconds=5),))
+            conn.execute("UPDATE vpn_keys SET expiry_date = ? WHERE key_email = 'still-ended'", (now + timedelta(days=7),))
+        conn.close()
+
+        assert database.update_keys_status_by_expiry() == 2
+        assert database.update_keys_status_by_expiry() == 0
+
+        statuses = _statuses(temp_db)
+        assert statuses["paid-expired"] == "pay-ended"
+        assert statuses["trial-expired"] == "trial-ended"
+        assert statuses["paid-renewed"] == "pay-ended"
+        assert statuses["still-ended"] == "trial-active"
+        assert statuses["tz-suffix"] == "pay-active"
+        assert statuses["broken-date"] == "pay-active"
+
+    @allure.title("Полная сверка исправляет статусы, не соответствующие is_trial")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("keys", "status", "expiry", "unit")
+    def test_full_sync_normalizes_statuses(self, temp_db):
+        """full_sync приводит нестандартные и несогласованные статусы к расчётным"""
+        now = datetime.now()
+        with sqlite3.connect(str(temp_db)) as conn:
+            _insert_key(conn, "trial-as-paid", now + timedelta(days=1), "pay-active", is_trial=1)
+            _insert_key(conn, "legacy-active", now - timedelta(days=1), "active")
+            _insert_key(conn, "ok", now + timedelta(days=1), "pay-active")
+        conn.close()
+
+        assert database.update_keys_status_by_expiry(full_sync=True) == 2
+
+        statuses = _statuses(temp_db)
+        assert statuses == {"trial-as-paid": "trial-active", "legacy-active": "pay-ended", "ok": "pay-active"}
+
+    @allure.title("Инкрементальные переходы идут по индексу статуса и времени истечения")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("keys", "status", "index", "unit")
+    def test_transition_queries_use_index(self, temp_db):
+        """Запросы переходов используют idx_vpn_keys_status_expiry, а не полный скан"""
+        with sqlite3.connect(str(temp_db)) as conn:
+            plan = conn.execute(
+                f"EXPLAIN QUERY PLAN UPDATE vpn_keys SET status = 'pay-ended' "
+                f"WHERE status IN ('pay-active', 'trial-active') AND {database._KEY_EXPIRY_SQL} <= ?",
+                ("2030-01-01 00:00:00",)
+            ).fetchall()
+        conn.close()
+        assert any("idx_vpn_keys_status_expiry" in row[-1] for row in plan), plan
+
+    @allure.title("Число переходов за цикл передаётся в монитор производительности")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("keys", "status", "monitoring", "unit")
+    async def test_transitions_recorded_in_monitor(self, temp_db, monkeypatch):
+        """Цикл планировщика пишет счётчик key_status_transitions и длительность операции"""
+        monitor = PerformanceMonitor()
+        monkeypatch.setattr(scheduler, "get_performance_monitor", lambda: monitor)
+        monkeypatch.setattr(database, "update_keys_status_by_expiry", lambda: 3)
+
+        assert await scheduler._update_keys_status_cycle() == 3
+
+        counters = await monitor.get_counters()
+        assert counters["key_status_transitions"]["last"] == 3
+        assert counters["key_status_transitions"]["total"] == 3
+        assert (await monitor.get_operation_stats("update_keys_status_by_expiry"))["count"] == 1
+        assert (await monitor.get_performance_summary())["counters"]["key_status_transitions"]["samples"] == 1
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для keyset-пагинации списков веб-панели
+
+Проверяет счётчики row_counts, поддерживаемые триггерами, и постраничный
+обход транзакций, уведомлений и ключей по курсору при одинаковых
+created_date, включая переход назад.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+
+def _insert_transaction(conn, user_id: int, payment_id: str, created_date: str) -> int:
+    cursor = conn.execute(
+        "INSERT INTO transactions (payment_id, user_id, status, amount_rub, payment_method, created_date) VALUES (?, ?, 'paid', 100, 'Balance', ?)",
+        (payment_id, user_id, created_date)
+    )
+    return cursor.lastrowid
+
+
+def _insert_key(conn, user_id: int, email: str, created_date: str) -> int:
+    cursor = conn.execute(
+        "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, created_date) VALUES (?, 'host-a', ?, ?, '2030-01-01 00:00:00', ?)",
+        (user_id, f"uuid-{email}", email, created_date)
+    )
+    return cursor.lastrowid
+
+
+def _row_counts(temp_db) -> dict:
+    with sqlite3.connect(str(temp_db)) as conn:
+        rows = conn.execute("SELECT table_name, row_count FROM row_counts").fetchall()
+    conn.close()
+    return dict(rows)
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Пагинация")
+@allure.label("package", "src.shop_bot.database")
+class TestKeysetPagination:
+    """Тесты для row_counts и get_transactions_page / get_notifications_page / get_keys_page"""
+
+    @allure.title("Счётчики строк обновляются триггерами и пересоздаются при инициализации")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("pagination", "counters", "unit")
+    def test_row_counts_follow_changes(self, temp_db):
+        """Вставка и удаление меняют row_counts; потерянный счётчик пересчитывается при initialize_db"""
+        database.register_user_if_not_exists(8001, "user8001", referrer_id=None)
+        with sqlite3.connect(str(temp_db)) as conn:
+            first = _insert_transaction(conn, 8001, "p1", "2024-01-01 10:00:00")
+            _insert_transaction(conn, 8001, "p2", "2024-01-01 10:00:00")
+            _insert_key(conn, 8001, "k1", "2024-01-01 10:00:00")
+            conn.execute("DELETE FROM transactions WHERE transaction_id = ?", (first,))
+        conn.close()
+        database.log_notification(8001, "user8001", "test", "Тест", "Сообщение")
+
+        assert _row_counts(temp_db) == {'transactions': 1, 'notifications': 1, 'vpn_keys': 1, 'users': 1}
+        assert database.get_table_row_count('transactions') == 1
+
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("DELETE FROM row_counts WHERE table_name = 'vpn_keys'")
+        conn.close()
+        database.initialize_db()
+        assert _row_counts(temp_db)['vpn_keys'] == 1
+
+    @allure.title("Курсор проходит транзакции с одинаковой датой без пропусков и повторов")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("pagination", "transactions", "unit")
+    def test_transactions_cursor_traversal(self, temp_db):
+        """Страницы по next_cursor покрывают все транзакции по убыванию (created_date, id); prev_cursor возвращает предыдущую страницу"""
+        database.register_user_if_not_exists(8101, "user8101", referrer_id=None)
+        with sqlite3.connect(str(temp_db)) as conn:
+            ids = [
+                _insert_transaction(conn, 8101, f"t{i}", "2024-02-01 12:00:00" if i < 5 else "2024-02-02 12:00:00")
+                for i in range(7)
+            ]
+        conn.close()
+        expected = sorted(ids[5:], reverse=True) + sorted(ids[:5], reverse=True)
+
+        pages = []
+        cursor = None
+        while True:
+            page = database.get_transactions_page(limit=3, cursor=cursor)
+            pages.append([item['transaction_id'] for item in page['items']])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        assert pages == [expected[0:3], expected[3:6], expected[6:7]]
+        assert page['total'] == 7
+        assert page['items'][0]['username'] == "user8101"
+
+        second = database.get_transactions_page(limit=3, cursor=database.get_transactions_page(limit=3)['next_cursor'])
+        back = database.get_transactions_page(limit=3, cursor=second['prev_cursor'], direction='prev')
+        assert [item['transaction_id'] for item in back['items']] == expected[0:3]
+        assert back['prev_cursor'] is None and back['next_cursor'] is not None
+
+    @allure.title("Страницы уведомлений и ключей читаются по курсору")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("pagination", "notifications", "keys", "unit")
+    def test_notifications_and_keys_pages(self, temp_db):
+        """get_notifications_page и get_keys_page отдают все записи; user_keys_count берётся из user_counters"""
+        database.register_user_if_not_exists(8201, "user8201", referrer_id=None)
+        for i in range(4):
+            database.log_notification(8201, "user8201", "test", f"Тест {i}", "Сообщение")
+        with sqlite3.connect(str(temp_db)) as conn:
+            key_ids = [_insert_key(conn, 8201, f"key{i}", "2024-03-01 00:00:00") for i in range(3)]
+        conn.close()
+
+        first = database.get_notifications_page(limit=3)
+        rest = database.get_notifications_page(limit=3, cursor=first['next_cursor'])
+        notification_ids = [item['notification_id'] for item in first['items'] + rest['items']]
+        assert len(set(notification_ids)) == 4 and rest['next_cursor'] is None
+
+        keys = database.get_keys_page(limit=2)
+        more = database.get_keys_page(limit=2, cursor=keys['next_cursor'])
+        assert [item['key_id'] for item in keys['items'] + more['items']] == sorted(key_ids, reverse=True)
+        assert all(item['user_keys_count'] == 3 for item in keys['items'])
+
+        paginated, total = database.get_paginated_keys(page=2, per_page=2)
+        assert total == 3 and [item['key_id'] for item in paginated] == [min(key_ids)]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для очереди исходящих уведомлений (notification_outbox)
+
+Проверяет постановку уведомлений в outbox без дублей и диспетчер
+dispatch_notification_outbox: доставку с обновлением статуса, повтор
+с задержкой после временной ошибки, отказ при блокировке бота и пропуск
+уведомлений, срок актуальности которых (истечение ключа) уже прошёл.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from shop_bot.data_manager import database
+from shop_bot.data_manager import scheduler
+
+
+def _entry(user_id: int, key_id: int, marker_hours: int = 24) -> dict:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Продлить ключ", callback_data=f"extend_key_{key_id}")
+    return {
+        'user_id': user_id,
+        'key_id': key_id,
+        'marker_hours': marker_hours,
+        'notif_type': 'subscription_expiry',
+        'title': 'Окончание подписки',
+        'message': f"Ключ {key_id} скоро истекает",
+        'meta': {'key_id': key_id},
+        'reply_markup': builder.as_markup().model_dump_json(),
+        'parse_mode': 'Markdown',
+    }
+
+
+def _statuses(temp_db) -> list[tuple]:
+    with sqlite3.connect(str(temp_db)) as conn:
+        rows = conn.execute(
+            """
+            SELECT o.chat_id, o.status, o.attempts, n.status, o.next_attempt_at > datetime('now')
+            FROM notification_outbox o JOIN notifications n ON n.notification_id = o.notification_id
+            ORDER BY o.outbox_id
+            """
+        ).fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Уведомления")
+@allure.label("package", "src.shop_bot.data_manager.scheduler")
+class TestNotificationOutbox:
+    """Тесты для notification_outbox и dispatch_notification_outbox"""
+
+    @allure.title("Уведомление ставится в outbox один раз")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("notifications", "outbox", "unit")
+    def test_enqueue_skips_logged_markers(self, temp_db):
+        """Повторная постановка того же маркера не создаёт новых строк notifications и outbox"""
+        database.register_user_if_not_exists(5001, "outbox_user", referrer_id=None)
+
+        assert database.enqueue_notifications([_entry(5001, 1), _entry(5001, 2)]) == 2
+        assert database.enqueue_notifications([_entry(5001, 1), _entry(5001, 1, marker_hours=1)]) == 1
+
+        items = database.get_due_outbox_notifications()
+        assert [item['chat_id'] for item in items] == [5001, 5001, 5001]
+        notifications, _ = database.get_paginated_notifications(page=1, per_page=10)
+        assert {n['username'] for n in notifications} == {"outbox_user"}
+
+    @allure.title("Диспетчер доставляет, повторяет с задержкой и отмечает недоставленные")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("notifications", "outbox", "retry", "unit")
+    async def test_dispatch_updates_delivery_status(self, temp_db, monkeypatch):
+        """Успешная отправка — sent, временная ошибка — повтор позже, блокировка бота — failed"""
+        monkeypatch.setattr(scheduler, "OUTBOX_CONCURRENCY", 2)
+        database.enqueue_notifications([_entry(6001, 1), _entry(6002, 2), _entry(6003, 3)])
+        attempts: dict[int, int] = {}
+
+        async def send_message(chat_id, text, reply_markup=None, parse_mode=None):
+            attempts[chat_id] = attempts.get(chat_id, 0) + 1
+            assert reply_markup.inline_keyboard[0][0].text == "🔄 Продлить ключ"
+            assert parse_mode == 'Markdown'
+            if chat_id == 6002 and attempts[chat_id] == 1:
+                raise ConnectionError("Telegram API timeout")
+            if chat_id == 6003:
+                raise TelegramForbiddenError(
+                    method=SendMessage(chat_id=chat_id, text=text), message="Forbidden: bot was blocked by the user"
+                )
+
+        bot = AsyncMock()
+        bot.send_message.side_effect = send_message
+
+        outcomes = await scheduler.dispatch_notification_outbox(bot)
+
+        assert outcomes == {'sent': 1, 'retry': 1, 'failed': 1}
+        assert _statuses(temp_db) == [
+            (6001, 'sent', 1, 'sent', 0),
+            (6002, 'pending', 1, 'pending', 1),
+            (6003, 'failed', 1, 'failed', 0),
+        ]
+        # Повтор ещё не наступил — диспетчеру нечего отправлять
+        assert await scheduler.dispatch_notification_outbox(bot) == {}
+
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("UPDATE notification_outbox SET next_attempt_at = datetime('now', '-1 seconds')")
+        conn.close()
+        assert await scheduler.dispatch_notification_outbox(bot) == {'sent': 1}
+        assert _statuses(temp_db)[1] == (6002, 'sent', 2, 'sent', 0)
+        assert attempts == {6001: 1, 6002: 2, 6003: 1}
+
+    @allure.title("Уведомление с прошедшим deadline не отправляется")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("notifications", "outbox", "deadline", "unit")
+    async def test_dispatch_skips_expired_notifications(self, temp_db):
+        """Уведомление о ключе, который уже истёк, помечается skipped и не уходит в Telegram"""
+        expired = _entry(7001, 1)
+        expired['deadline'] = "2000-01-01 00:00:00"
+        actual = _entry(7002, 2)
+        actual['deadline'] = "2999-01-01 00:00:00"
+        database.enqueue_notifications([expired, actual, _entry(7003, 3)])
+
+        bot = AsyncMock()
+        outcomes = await scheduler.dispatch_notification_outbox(bot)
+
+        assert outcomes == {'skipped': 1, 'sent': 2}
+        assert sorted(call.kwargs['chat_id'] for call in bot.send_message.await_args_list) == [7002, 7003]
+        assert _statuses(temp_db) == [
+            (7001, 'skipped', 0, 'skipped', 0),
+            (7002, 'sent', 1, 'sent', 0),
+            (7003, 'sent', 1, 'sent', 0),
+        ]
+
+        # deadline прошёл, пока уведомление ждало отправки в пачке
+        item = {'outbox_id': 1, 'chat_id': 7001, 'text': 'x', 'deadline': "2000-01-01 00:00:00"}
+        assert (await scheduler._deliver_outbox_notification(bot, item))['status'] == 'skipped'
+        assert bot.send_message.await_count == 2
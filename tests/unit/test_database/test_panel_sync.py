@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для параллельной синхронизации ключей с панелями 3x-ui
+
+Проверяет параллельную обработку хостов, однократный логин на хост,
+удаление истёкших и orphan-клиентов одним пакетным коммитом (из БД — только
+после успешного коммита), отчёт с таймингами и сохранение деталей ключа,
+полученных из панели, через update_key_from_panel_details.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+from shop_bot.data_manager import scheduler
+
+
+def _panel_client(email: str, client_id: str, expiry_ms: int):
+    return SimpleNamespace(email=email, id=client_id, expiry_time=expiry_ms, reset=0)
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Синхронизация с панелями")
+@allure.label("package", "src.shop_bot.scheduler")
+class TestPanelSync:
+    """Тесты для sync_keys_with_panels"""
+
+    @allure.title("Хосты синхронизируются параллельно с одним логином на хост")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("scheduler", "sync", "concurrency", "unit")
+    async def test_hosts_synced_concurrently(self, temp_db, monkeypatch):
+        """Медленный логин на двух хостах не суммируется, удаления уходят одним обновлением inbound"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        active_expiry = now + timedelta(days=10)
+        active_ms = int(active_expiry.timestamp() * 1000)
+
+        database.create_host("host-a", "https://a.example", "admin", "pass", 1)
+        database.create_host("host-b", "https://b.example", "admin", "pass", 1)
+        database.update_setting("auto_delete_orphans", "true")
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, status) VALUES (1, 'host-a', 'u1', 'active@a', ?, 'active')",
+                (active_expiry,)
+            )
+            conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, status) VALUES (1, 'host-a', 'u2', 'old@a', ?, 'expired')",
+                (now - timedelta(days=10),)
+            )
+        conn.close()
+
+        panel_clients = {
+            "https://a.example": [
+                _panel_client("active@a", "u1", active_ms),
+                _panel_client("old@a", "u2", 0),
+                _panel_client("orphan@a", "u3", 0),
+            ],
+            "https://b.example": [],
+        }
+        apis = {}
+        login_calls = []
+
+        def fake_login(host_url, username, password, inbound_id, max_retries=3):
+            login_calls.append(host_url)
+            time.sleep(0.3)
+            api = MagicMock()
+            api.inbound.get_by_id.return_value = SimpleNamespace(
+                id=inbound_id, settings=SimpleNamespace(clients=list(panel_clients[host_url]))
+            )
+            apis[host_url] = api
+            return api, SimpleNamespace(id=inbound_id)
+
+        monkeypatch.setattr(scheduler.xui_api, "login_to_host", fake_login)
+        monkeypatch.setattr(scheduler, "log_orphan_deletion", lambda **kwargs: None)
+
+        started = time.perf_counter()
+        await scheduler.sync_keys_with_panels()
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 0.55, f"хосты обрабатывались последовательно ({elapsed:.2f}s)"
+        assert sorted(login_calls) == ["https://a.example", "https://b.example"]
+        api_a = apis["https://a.example"]
+        api_a.client.delete.assert_not_called()
+        api_a.inbound.update.assert_called_once()
+        remaining = api_a.inbound.update.call_args.args[1].settings.clients
+        assert [client.id for client in remaining] == ["u1"]
+        apis["https://b.example"].inbound.update.assert_not_called()
+        assert database.get_key_by_email("old@a") is None
+        assert database.get_key_by_email("active@a") is not None
+
+        report = scheduler.last_sync_report
+        assert set(report['hosts']) == {"host-a", "host-b"}
+        assert report['hosts']["host-a"]['orphans'] == 1
+        assert report['hosts']["host-a"]['orphan_errors'] == 0
+        assert report['hosts']["host-a"]['timings']['login'] >= 0.3
+        assert all(host_report['ok'] for host_report in report['hosts'].values())
+
+    @allure.title("Недоступный хост не прерывает синхронизацию остальных")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("scheduler", "sync", "errors", "unit")
+    async def test_failed_host_isolated(self, temp_db, monkeypatch):
+        """Ошибка логина на одном хосте отражается в отчёте, второй хост обрабатывается"""
+        database.create_host("host-down", "https://down.example", "admin", "pass", 1)
+        database.create_host("host-up", "https://up.example", "admin", "pass", 1)
+
+        def fake_login(host_url, username, password, inbound_id, max_retries=3):
+            if "down" in host_url:
+                raise ConnectionError("panel unreachable")
+            api = MagicMock()
+            api.inbound.get_by_id.return_value = SimpleNamespace(id=inbound_id, settings=SimpleNamespace(clients=[]))
+            return api, SimpleNamespace(id=inbound_id)
+
+        monkeypatch.setattr(scheduler.xui_api, "login_to_host", fake_login)
+
+        await scheduler.sync_keys_with_panels()
+
+        hosts = scheduler.last_sync_report['hosts']
+        assert hosts["host-down"]['ok'] is False
+        assert hosts["host-up"]['ok'] is True
+
+    @allure.title("Истёкший ключ остаётся в БД, если коммит в панель не удался")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("scheduler", "sync", "errors", "unit")
+    async def test_expired_key_kept_when_commit_fails(self, temp_db, monkeypatch):
+        """Ошибка inbound.update помечает хост неуспешным, удаление ключа из БД откладывается до следующей сверки"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        database.create_host("host-a", "https://a.example", "admin", "pass", 1)
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, status) VALUES (1, 'host-a', 'u2', 'old@a', ?, 'expired')",
+                (now - timedelta(days=10),)
+            )
+        conn.close()
+
+        def fake_login(host_url, username, password, inbound_id, max_retries=3):
+            api = MagicMock()
+            api.inbound.get_by_id.return_value = SimpleNamespace(
+                id=inbound_id, settings=SimpleNamespace(clients=[_panel_client("old@a", "u2", 0)])
+            )
+            api.inbound.update.side_effect = ConnectionError("panel unreachable")
+            return api, SimpleNamespace(id=inbound_id)
+
+        monkeypatch.setattr(scheduler.xui_api, "login_to_host", fake_login)
+
+        await scheduler.sync_keys_with_panels()
+
+        assert scheduler.last_sync_report['hosts']["host-a"]['ok'] is False
+        assert database.get_key_by_email("old@a") is not None
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Синхронизация с панелями")
+@allure.label("package", "src.shop_bot.database")
+class TestPanelKeyDetails:
+    """Тесты для update_key_from_panel_details"""
+
+    @allure.title("Детали ключа из панели сохраняются одним обновлением")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("keys", "sync", "database", "unit")
+    def test_details_saved(self, temp_db):
+        """Заполненные поля переносятся в vpn_keys, None и пустые значения не затирают данные"""
+        expiry_ms = int((datetime.now(timezone.utc) + timedelta(days=5)).timestamp() * 1000)
+        with sqlite3.connect(str(temp_db)) as conn:
+            key_id = conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, status, protocol, comment) "
+                "VALUES (1, 'host-a', 'u1', 'details@a', 'pay-active', 'vless', 'keep')"
+            ).lastrowid
+        conn.close()
+
+        assert database.update_key_from_panel_details(key_id, {
+            'expiry_timestamp_ms': expiry_ms, 'status': '', 'protocol': 'trojan', 'remaining_seconds': 3600,
+            'quota_total_gb': 50.0, 'enabled': False, 'subscription_link': 'https://sub.example/s', 'comment': None,
+        })
+        assert database.update_key_from_panel_details(key_id, {'status': None}) is False
+        assert database.update_key_from_panel_details(999999, {'protocol': 'vless'}) is False
+
+        key = database.get_key_by_id(key_id)
+        assert (key['status'], key['protocol'], key['comment']) == ('pay-active', 'trojan', 'keep')
+        assert (key['remaining_seconds'], key['quota_total_gb'], key['enabled']) == (3600, 50.0, 0)
+        assert key['subscription_link'] == 'https://sub.example/s'
+        assert str(key['expiry_date']).startswith(datetime.fromtimestamp(expiry_ms / 1000).strftime('%Y-%m-%d %H:%M'))
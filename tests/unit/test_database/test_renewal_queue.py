@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для очереди автопродления (renewal_queue)
+
+Проверяет постановку истёкших ключей в очередь, атомарное и идемпотентное
+списание (charge_renewal) и пул продлений perform_auto_renewals с
+ограничением параллельности на хост и повтором без повторного списания.
+"""
+
+import pytest
+import allure
+import asyncio
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+from shop_bot.data_manager import scheduler
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _insert_key(conn, user_id: int, host_name: str, email: str, expiry: datetime, plan_name: str = "Month") -> int:
+    cursor = conn.execute(
+        "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date, plan_name) VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, host_name, f"uuid-{email}", email, expiry.strftime("%Y-%m-%d %H:%M:%S"), plan_name)
+    )
+    return cursor.lastrowid
+
+
+def _add_user(user_id: int, balance: float) -> None:
+    database.register_user_if_not_exists(user_id, f"user{user_id}", referrer_id=None)
+    database.add_to_user_balance(user_id, balance)
+
+
+def _queue(temp_db) -> list[tuple]:
+    with sqlite3.connect(str(temp_db)) as conn:
+        return conn.execute("SELECT key_id, status, attempts FROM renewal_queue ORDER BY queue_id").fetchall()
+
+
+def _renewal_transactions(temp_db, user_id: int) -> int:
+    with sqlite3.connect(str(temp_db)) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM transactions WHERE user_id = ? AND payment_method = 'Auto-Renewal'", (user_id,)
+        ).fetchone()[0]
+
+
+def _metadata(key_id: int, user_id: int, payment_id: str) -> dict:
+    return {'user_id': user_id, 'key_id': key_id, 'price': 100.0, 'action': 'extend', 'payment_id': payment_id}
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Автопродление")
+@allure.label("package", "src.shop_bot.database")
+class TestRenewalQueue:
+    """Тесты для renewal_queue и charge_renewal"""
+
+    @allure.title("Истёкшие ключи ставятся в очередь один раз в порядке истечения")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("auto_renewal", "queue", "unit")
+    def test_enqueue_due_renewals(self, temp_db):
+        """В очередь попадают только истёкшие ключи пользователей с балансом и включённым автопродлением"""
+        now = _utc_now()
+        _add_user(1001, 500.0)
+        _add_user(1002, 0.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            later = _insert_key(conn, 1001, "host-a", "later", now - timedelta(minutes=5))
+            earlier = _insert_key(conn, 1001, "host-a", "earlier", now - timedelta(hours=2))
+            _insert_key(conn, 1001, "host-a", "active", now + timedelta(days=3))
+            _insert_key(conn, 1002, "host-a", "no-balance", now - timedelta(hours=1))
+            disabled = _insert_key(conn, 1001, "host-a", "disabled", now - timedelta(hours=1))
+            conn.execute("UPDATE vpn_keys SET auto_renewal_enabled = 0 WHERE key_id = ?", (disabled,))
+        conn.close()
+
+        assert database.enqueue_due_renewals(now) == 2
+        assert database.enqueue_due_renewals(now) == 0
+
+        items = database.get_due_renewals()
+        assert [item['key_id'] for item in items] == [earlier, later]
+        assert items[0]['idempotency_key'] == f"renew:{earlier}:{database.key_expiry_marker(now - timedelta(hours=2))}"
+        assert all(item['status'] == 'pending' for item in items)
+
+    @allure.title("Списание атомарно и не повторяется для той же записи")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("auto_renewal", "balance", "idempotency", "unit")
+    def test_charge_renewal_idempotent(self, temp_db):
+        """Повторное списание по записи не меняет баланс; при нехватке средств ничего не пишется"""
+        now = _utc_now()
+        _add_user(2001, 150.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            first = _insert_key(conn, 2001, "host-a", "first", now - timedelta(hours=2))
+            second = _insert_key(conn, 2001, "host-a", "second", now - timedelta(hours=1))
+        conn.close()
+        database.enqueue_due_renewals(now)
+        items = {item['key_id']: item for item in database.get_due_renewals()}
+
+        result = database.charge_renewal(items[first]['queue_id'], 2001, 100.0, _metadata(first, 2001, "pay-1"))
+        assert result == 'charged'
+        retry = database.charge_renewal(items[first]['queue_id'], 2001, 100.0, _metadata(first, 2001, "pay-2"))
+        assert retry == 'not_pending'
+        short = database.charge_renewal(items[second]['queue_id'], 2001, 100.0, _metadata(second, 2001, "pay-3"))
+        assert short == 'insufficient_funds'
+
+        assert database.get_user_balance(2001) == 50.0
+        assert _renewal_transactions(temp_db, 2001) == 1
+        assert _queue(temp_db) == [(first, 'charged', 0), (second, 'pending', 0)]
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Автопродление")
+@allure.label("package", "src.shop_bot.data_manager.scheduler")
+class TestPerformAutoRenewals:
+    """Тесты для пула продлений perform_auto_renewals"""
+
+    @pytest.fixture
+    def renewal_env(self, temp_db, monkeypatch):
+        """Два хоста с тарифом, уведомления о списании подменены"""
+        for host_name in ("host-a", "host-b"):
+            database.create_host(host_name, f"http://{host_name}.test", "user", "pass", 1, host_name.replace("-", ""))
+            database.create_plan(host_name, "Month", 1, 100.0, 0, 0.0, 0)
+        notice = AsyncMock()
+        monkeypatch.setattr(scheduler, "send_balance_deduction_notice", notice)
+        return notice
+
+    @staticmethod
+    def _extend_key(key_id: int) -> None:
+        with database._get_db_connection() as conn:
+            conn.execute(
+                "UPDATE vpn_keys SET expiry_date = ? WHERE key_id = ?",
+                ((_utc_now() + timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S"), key_id)
+            )
+
+    @allure.title("Ключи продлеваются конкурентно с лимитом на хост")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("auto_renewal", "concurrency", "unit")
+    async def test_concurrent_renewals_respect_host_limit(self, temp_db, renewal_env, monkeypatch):
+        """Продления идут параллельно, но не больше AUTO_RENEWAL_PER_HOST_CONCURRENCY на хост"""
+        monkeypatch.setattr(scheduler, "AUTO_RENEWAL_CONCURRENCY", 3)
+        monkeypatch.setattr(scheduler, "AUTO_RENEWAL_PER_HOST_CONCURRENCY", 2)
+        now = _utc_now()
+        _add_user(3001, 1000.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            for i in range(4):
+                _insert_key(conn, 3001, "host-a", f"a{i}", now - timedelta(minutes=10 + i))
+                _insert_key(conn, 3001, "host-b", f"b{i}", now - timedelta(minutes=10 + i))
+        conn.close()
+
+        active = {"host-a": 0, "host-b": 0, "total": 0}
+        peak = {"host-a": 0, "host-b": 0, "total": 0}
+
+        async def fake_payment(bot, metadata):
+            host_name = metadata['host_name']
+            active[host_name] += 1
+            active["total"] += 1
+            peak[host_name] = max(peak[host_name], active[host_name])
+            peak["total"] = max(peak["total"], active["total"])
+            await asyncio.sleep(0.02)
+            self._extend_key(metadata['key_id'])
+            active[host_name] -= 1
+            active["total"] -= 1
+
+        with patch("shop_bot.bot.handlers.process_successful_payment", fake_payment):
+            await scheduler.perform_auto_renewals(MagicMock())
+
+        assert peak["host-a"] == 2 and peak["host-b"] <= 2
+        assert peak["total"] == 3
+        assert [status for _, status, _ in _queue(temp_db)] == ['done'] * 8
+        assert database.get_user_balance(3001) == 200.0
+        assert _renewal_transactions(temp_db, 3001) == 8
+        assert renewal_env.await_count == 8
+
+    @allure.title("Повтор после сбоя продления не списывает деньги повторно")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("auto_renewal", "idempotency", "unit")
+    async def test_retry_after_failure_does_not_double_charge(self, temp_db, renewal_env):
+        """Сбой панели оставляет запись 'charged'; следующий цикл продлевает ключ без списания"""
+        now = _utc_now()
+        _add_user(4001, 300.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            key_id = _insert_key(conn, 4001, "host-a", "retry", now - timedelta(minutes=30))
+        conn.close()
+        payment_ids = []
+
+        async def failing_payment(bot, metadata):
+            payment_ids.append(metadata['payment_id'])
+            raise ConnectionError("panel is unavailable")
+
+        async def working_payment(bot, metadata):
+            payment_ids.append(metadata['payment_id'])
+            self._extend_key(metadata['key_id'])
+
+        with patch("shop_bot.bot.handlers.process_successful_payment", failing_payment):
+            await scheduler.perform_auto_renewals(MagicMock())
+        assert _queue(temp_db) == [(key_id, 'charged', 1)]
+        assert database.get_user_balance(4001) == 200.0
+        renewal_env.assert_not_awaited()
+
+        with patch("shop_bot.bot.handlers.process_successful_payment", working_payment):
+            await scheduler.perform_auto_renewals(MagicMock())
+            await scheduler.perform_auto_renewals(MagicMock())
+
+        assert _queue(temp_db) == [(key_id, 'done', 1)]
+        assert database.get_user_balance(4001) == 200.0
+        assert _renewal_transactions(temp_db, 4001) == 1
+        assert len(payment_ids) == 2 and payment_ids[0] == payment_ids[1]
+        renewal_env.assert_awaited_once()
+
+    @allure.title("Записи без денег откладываются и не вытесняют оплачиваемые продления")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("auto_renewal", "queue", "backoff", "unit")
+    async def test_unfunded_renewals_do_not_starve_queue(self, temp_db, renewal_env, monkeypatch):
+        """Больше AUTO_RENEWAL_BATCH_SIZE ключей без денег и один оплачиваемый: он продлевается во втором цикле"""
+        monkeypatch.setattr(scheduler, "AUTO_RENEWAL_BATCH_SIZE", 3)
+        now = _utc_now()
+        _add_user(5001, 10.0)
+        _add_user(5002, 500.0)
+        with sqlite3.connect(str(temp_db)) as conn:
+            unfunded = [_insert_key(conn, 5001, "host-a", f"poor{i}", now - timedelta(hours=5 - i)) for i in range(4)]
+            funded = _insert_key(conn, 5002, "host-a", "funded", now - timedelta(minutes=5))
+        conn.close()
+
+        async def working_payment(bot, metadata):
+            self._extend_key(metadata['key_id'])
+
+        with patch("shop_bot.bot.handlers.process_successful_payment", working_payment):
+            await scheduler.perform_auto_renewals(MagicMock())
+            await scheduler.perform_auto_renewals(MagicMock())
+
+        statuses = {key_id: status for key_id, status, _ in _queue(temp_db)}
+        assert statuses[funded] == 'done'
+        assert all(statuses[key_id] == 'pending' for key_id in unfunded)
+        assert database.get_due_renewals() == []
+        with sqlite3.connect(str(temp_db)) as conn:
+            postponed = conn.execute(
+                "SELECT postpone_count, next_attempt_at > datetime('now'), last_error FROM renewal_queue WHERE key_id != ?",
+                (funded,)
+            ).fetchall()
+        conn.close()
+        assert postponed == [(1, 1, 'insufficient funds')] * 4
+        assert database.get_user_balance(5001) == 10.0
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для кэша настроек bot_settings / backup_settings
+
+Проверяет чтение настроек из памяти без обращения к БД, сброс кэша при
+записи, обнаружение изменений, сделанных в обход update_setting(), не
+позже check_interval, и отказ сохранять загрузку, начатую до сброса кэша.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+from shop_bot.data_manager.database import (
+    get_setting,
+    update_setting,
+    get_backup_setting,
+    update_backup_setting,
+    get_settings_cache,
+    get_settings_version,
+)
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Кэш настроек")
+@allure.label("package", "src.shop_bot.database")
+class TestSettingsCache:
+    """Тесты для SettingsCache"""
+
+    @allure.title("Повторное чтение настроек не перечитывает таблицу")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("settings", "cache", "database", "unit")
+    def test_repeated_reads_served_from_cache(self, temp_db):
+        """После первой загрузки get_setting() отдаёт значения из памяти"""
+        update_setting("global_domain", "https://cached.example.com")
+        get_setting("global_domain")
+        loads_before = get_settings_cache().get_stats()["loads"]
+
+        for _ in range(10):
+            assert get_setting("global_domain") == "https://cached.example.com"
+
+        assert get_settings_cache().get_stats()["loads"] == loads_before
+
+    @allure.title("В пределах check_interval чтение настроек не обращается к БД")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("settings", "cache", "database", "unit")
+    def test_reads_within_interval_skip_database(self, temp_db, monkeypatch):
+        """Пока версия проверялась недавно, get_setting() не берёт соединение из пула"""
+        update_setting("global_domain", "https://cached.example.com")
+        get_setting("global_domain")
+
+        def no_connection(*args, **kwargs):
+            raise AssertionError("settings cache hit must not open a connection")
+
+        with monkeypatch.context() as m:
+            m.setattr(database, "_get_db_connection", no_connection)
+            for _ in range(10):
+                assert get_setting("global_domain") == "https://cached.example.com"
+
+    @allure.title("update_setting() сбрасывает кэш")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("settings", "cache", "invalidation", "database", "unit")
+    def test_update_setting_invalidates(self, temp_db):
+        """Новое значение доступно сразу после update_setting()"""
+        update_setting("support_enabled", "true")
+        assert get_setting("support_enabled") == "true"
+
+        update_setting("support_enabled", "false")
+        assert get_setting("support_enabled") == "false"
+
+    @allure.title("Прямая запись в bot_settings меняет версию настроек")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("settings", "cache", "version", "database", "unit")
+    def test_direct_write_detected_by_version(self, temp_db, monkeypatch):
+        """Запись другим соединением (другим процессом) видна без явного сброса кэша после check_interval"""
+        update_setting("hidden_mode", "0")
+        assert get_setting("hidden_mode") == "0"
+        version_before = get_settings_version()
+
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("UPDATE bot_settings SET value = '1' WHERE key = 'hidden_mode'")
+        conn.close()
+
+        assert get_settings_version() != version_before
+        assert get_setting("hidden_mode") == "0"
+        monkeypatch.setattr(get_settings_cache(), "check_interval", 0)
+        assert get_setting("hidden_mode") == "1"
+
+    @allure.title("Загрузка, начатая до сброса кэша, не сохраняется")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("settings", "cache", "race", "database", "unit")
+    def test_load_racing_invalidate_not_stored(self, temp_db, monkeypatch):
+        """invalidate() во время чтения из БД: прочитанные значения отдаются, но не кэшируются"""
+        update_setting("hidden_mode", "0")
+        cache = get_settings_cache()
+        cache.invalidate()
+        read_version = cache._read_version
+
+        def read_version_then_invalidate(cursor):
+            version = read_version(cursor)
+            # Параллельная запись настройки сбрасывает кэш посреди загрузки
+            cache.invalidate()
+            return version
+
+        monkeypatch.setattr(cache, "_read_version", read_version_then_invalidate)
+        assert get_setting("hidden_mode") == "0"
+        assert cache.version is None
+
+        monkeypatch.setattr(cache, "_read_version", read_version)
+        assert get_setting("hidden_mode") == "0"
+        assert cache.version == get_settings_version()
+
+    @allure.title("update_backup_setting() сбрасывает кэш настроек бэкапа")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("settings", "cache", "backup", "database", "unit")
+    def test_backup_settings_invalidated(self, temp_db):
+        """Настройки бэкапа кэшируются и обновляются так же, как bot_settings"""
+        update_backup_setting("backup_interval_hours", "12")
+        assert get_backup_setting("backup_interval_hours") == "12"
+
+        update_backup_setting("backup_interval_hours", "6")
+        assert get_backup_setting("backup_interval_hours") == "6"
+
+    @allure.title("Типизированные геттеры кэша")
+    @allure.severity(allure.severity_level.MINOR)
+    @allure.tag("settings", "cache", "typed", "database", "unit")
+    def test_typed_getters(self, temp_db):
+        """get_bool/get_int/get_float приводят значения и возвращают default"""
+        update_setting("auto_delete_orphans", "true")
+        update_setting("minimum_topup", "150")
+        update_setting("referral_percentage", "not-a-number")
+        cache = get_settings_cache()
+
+        assert cache.get_bool("auto_delete_orphans") is True
+        assert cache.get_int("minimum_topup") == 150
+        assert cache.get_float("referral_percentage", 5.0) == 5.0
+        assert cache.get_bool("missing_setting_key", default=True) is True
+        assert database.get_all_settings()["minimum_topup"] == "150"
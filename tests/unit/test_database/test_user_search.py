@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для поиска пользователей (users_search)
+
+Проверяет синхронизацию триграммного индекса users_search триггерами
+users и vpn_keys, ранжирование search_users и поиск коротких запросов
+без индекса.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+
+def _found(query: str) -> list[int]:
+    return [user['telegram_id'] for user in database.search_users(query, limit=50)]
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Пользователи")
+@allure.label("package", "src.shop_bot.database")
+class TestUserSearch:
+    """Тесты для search_users и users_search"""
+
+    @allure.title("Индекс поиска следует за изменениями пользователей и ключей")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("users", "search", "unit")
+    def test_index_follows_changes(self, temp_db):
+        """Поиск находит пользователя по ID, username, имени и email ключа после вставки, изменения и удаления"""
+        database.register_user_if_not_exists(5550123, "AliceWonder", referrer_id=None, fullname="Алиса Иванова")
+        database.register_user_if_not_exists(5550456, "bob_builder", referrer_id=None)
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email) VALUES (5550456, 'h', 'uuid-1', 'promo-europe@mail.test')"
+            )
+        conn.close()
+
+        assert _found("5550123") == [5550123]
+        assert _found("alicewon") == [5550123]
+        assert _found("Иванова") == [5550123]
+        assert _found("europe") == [5550456]
+        assert set(_found("555")) == {5550123, 5550456}
+
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("UPDATE users SET username = 'robert' WHERE telegram_id = 5550456")
+            conn.execute("UPDATE vpn_keys SET user_id = 5550123 WHERE key_email = 'promo-europe@mail.test'")
+            conn.execute("DELETE FROM users WHERE telegram_id = 5550456")
+        conn.close()
+
+        assert _found("bob_builder") == []
+        assert _found("europe") == [5550123]
+        assert database.rebuild_users_search() == 1
+        assert _found("europe") == [5550123]
+
+    @allure.title("Точное совпадение Telegram ID выше частичных, короткие запросы ищутся через LIKE")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("users", "search", "ranking", "unit")
+    def test_ranking_and_short_queries(self, temp_db):
+        """Пользователь с ID, равным запросу, первый; запросы короче триграммы находят совпадения по username"""
+        for user_id, username in ((1234, "first"), (91234, "second"), (81234, "user1234")):
+            database.register_user_if_not_exists(user_id, username, referrer_id=None)
+
+        found = _found("1234")
+        assert found[0] == 1234 and set(found) == {1234, 91234, 81234}
+        assert set(_found("se")) == {81234, 91234}
+        assert database.search_users("   ") == []
+
+    @allure.title("Лучшее совпадение не отсекается лимитом кандидатов")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("users", "search", "ranking", "unit")
+    def test_best_match_beyond_candidate_limit(self, temp_db):
+        """Больше USER_SEARCH_CANDIDATES частичных совпадений: пользователь с username, равным запросу, первый"""
+        with database._get_db_connection() as conn:
+            conn.executemany(
+                "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+                ((6000000 + i, f"xivanx{i}") for i in range(database.USER_SEARCH_CANDIDATES * 5))
+            )
+            conn.execute("INSERT INTO users (telegram_id, username) VALUES (6999999, 'ivan')")
+
+        found = [user['telegram_id'] for user in database.search_users("ivan", limit=10)]
+        assert found[0] == 6999999 and len(found) == 10
+        assert database.search_users("@ivan", limit=1)[0]['telegram_id'] == 6999999
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для постраничного списка пользователей
+
+Проверяет счётчики user_counters, поддерживаемые триггерами, и
+keyset-пагинацию get_users_page с сортировкой, фильтрами и переходом
+назад, а также пачечную загрузку ключей get_keys_for_users.
+"""
+
+import pytest
+import allure
+import sqlite3
+import sys
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.data_manager import database
+
+
+def _insert_key(conn, user_id: int, email: str) -> int:
+    cursor = conn.execute(
+        "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email, expiry_date) VALUES (?, 'host-a', ?, ?, '2030-01-01 00:00:00')",
+        (user_id, f"uuid-{email}", email)
+    )
+    return cursor.lastrowid
+
+
+def _collect_pages(limit: int, **kwargs) -> list[list[int]]:
+    pages = []
+    cursor = None
+    while True:
+        page = database.get_users_page(limit=limit, cursor=cursor, **kwargs)
+        pages.append([user['telegram_id'] for user in page['users']])
+        cursor = page['next_cursor']
+        if not cursor:
+            return pages
+
+
+@pytest.mark.unit
+@pytest.mark.database
+@allure.epic("База данных")
+@allure.feature("Пользователи")
+@allure.label("package", "src.shop_bot.database")
+class TestUsersPage:
+    """Тесты для get_users_page и user_counters"""
+
+    @allure.title("Счётчики ключей и уведомлений обновляются триггерами")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("users", "counters", "unit")
+    def test_user_counters_follow_changes(self, temp_db):
+        """Вставка, удаление и перенос ключей и уведомлений меняют счётчики; rebuild даёт тот же результат"""
+        for user_id in (7001, 7002):
+            database.register_user_if_not_exists(user_id, f"user{user_id}", referrer_id=None)
+        with sqlite3.connect(str(temp_db)) as conn:
+            first = _insert_key(conn, 7001, "k1")
+            _insert_key(conn, 7001, "k2")
+            _insert_key(conn, 7002, "k3")
+            conn.execute("DELETE FROM vpn_keys WHERE key_id = ?", (first,))
+            conn.execute("UPDATE vpn_keys SET user_id = 7002 WHERE key_email = 'k2'")
+        conn.close()
+        database.log_notification(7001, "user7001", "test", "Тест", "Сообщение")
+
+        def counters():
+            with sqlite3.connect(str(temp_db)) as conn:
+                rows = conn.execute("SELECT user_id, user_keys_count, notifications_count FROM user_counters ORDER BY user_id").fetchall()
+            conn.close()
+            return rows
+
+        assert counters() == [(7001, 0, 1), (7002, 2, 0)]
+        assert database.rebuild_user_counters() == 2
+        assert counters() == [(7001, 0, 1), (7002, 2, 0)]
+
+    @allure.title("Keyset-пагинация проходит всех пользователей без пропусков и повторов")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("users", "pagination", "unit")
+    def test_keyset_pagination(self, temp_db):
+        """Страницы вперёд по балансу с одинаковыми значениями, назад по курсору и фильтр по статусу"""
+        user_ids = list(range(8001, 8012))
+        for user_id in user_ids:
+            database.register_user_if_not_exists(user_id, f"user{user_id}", referrer_id=None)
+            database.add_to_user_balance(user_id, float(user_id % 3) * 100)
+        database.ban_user(8005)
+        with sqlite3.connect(str(temp_db)) as conn:
+            for i in range(3):
+                _insert_key(conn, 8003, f"page-{i}")
+        conn.close()
+
+        pages = _collect_pages(4, sort='balance', order='desc')
+        ordered = [uid for page in pages for uid in page]
+        expected = sorted(user_ids, key=lambda uid: (uid % 3, uid), reverse=True)
+        assert [len(page) for page in pages] == [4, 4, 3]
+        assert ordered == expected
+
+        first = database.get_users_page(limit=4, sort='balance', order='desc')
+        second = database.get_users_page(limit=4, cursor=first['next_cursor'], sort='balance', order='desc')
+        back = database.get_users_page(limit=4, cursor=second['prev_cursor'], direction='prev', sort='balance', order='desc')
+        assert [u['telegram_id'] for u in back['users']] == [u['telegram_id'] for u in first['users']]
+        assert back['prev_cursor'] is None and back['next_cursor'] is not None
+        assert first['total'] == 11
+
+        by_keys = database.get_users_page(limit=1, sort='keys', order='desc')
+        assert by_keys['users'][0]['telegram_id'] == 8003
+        assert by_keys['users'][0]['user_keys_count'] == 3
+
+        banned = database.get_users_page(limit=10, status='banned')
+        assert [u['telegram_id'] for u in banned['users']] == [8005]
+        assert banned['total'] == 1 and banned['next_cursor'] is None
+
+        # Общее число без фильтров берётся из row_counts, который ведут триггеры
+        with sqlite3.connect(str(temp_db)) as conn:
+            conn.execute("DELETE FROM users WHERE telegram_id = 8010")
+            assert conn.execute("SELECT row_count FROM row_counts WHERE table_name = 'users'").fetchone()[0] == 10
+        conn.close()
+        assert database.get_users_page(limit=4)['total'] == 10
+
+        keys = database.get_keys_for_users([8003, 8004])
+        assert [key['key_email'] for key in keys[8003]] == ["page-0", "page-1", "page-2"]
+        assert keys[8004] == []
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для нативного aiohttp-клиента панели 3X-UI в модуле xui_api
+
+Поднимает локальную фейковую панель (aiohttp.web) и проверяет логин
+с переиспользованием cookie, повторный логин при 401, создание/продление,
+получение деталей, отключение и удаление клиента через XUI_ASYNC_CLIENT,
+а также кэш inbound'ов и закрытие сессий при reset_panel_sessions().
+"""
+
+import asyncio
+import json
+import pytest
+import allure
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.modules import xui_api
+
+
+class _FakePanel:
+    """Минимальная панель 3x-ui: авторизация по cookie и API inbound'ов/клиентов"""
+
+    def __init__(self):
+        self.clients = [{"id": "uuid-a", "email": "a@test", "enable": True, "expiryTime": 0, "flow": "", "subId": "sub-a"}]
+        self.logins = 0
+        self.requests = []
+        self.delay = 0.0
+        self.app = web.Application()
+        self.app.router.add_post("/login", self.login)
+        self.app.router.add_get("/panel/api/inbounds/get/{inbound_id}", self.get_inbound)
+        self.app.router.add_get("/panel/api/inbounds/list", self.list_inbounds)
+        self.app.router.add_post("/panel/api/inbounds/addClient", self.add_client)
+        self.app.router.add_post("/panel/api/inbounds/updateClient/{uuid}", self.update_client)
+        self.app.router.add_post("/panel/api/inbounds/{inbound_id}/delClient/{uuid}", self.del_client)
+        self.app.router.add_post("/panel/setting/all", self.settings)
+
+    def _authorized(self, request) -> bool:
+        return request.cookies.get("3x-ui") == f"session-{self.logins}"
+
+    async def login(self, request):
+        body = await request.json()
+        if body.get("password") != "secret":
+            return web.json_response({"success": False, "msg": "wrong password"})
+        self.logins += 1
+        response = web.json_response({"success": True})
+        response.set_cookie("3x-ui", f"session-{self.logins}")
+        return response
+
+    def _inbound(self) -> dict:
+        return {
+            "id": 1, "up": 0, "down": 0, "total": 0, "remark": "test", "enable": True,
+            "expiryTime": 0, "listen": "", "port": 443, "protocol": "vless", "tag": "inbound-443",
+            "settings": json.dumps({"clients": self.clients, "decryption": "none", "fallbacks": []}),
+            "streamSettings": json.dumps({
+                "network": "tcp", "security": "reality",
+                "realitySettings": {
+                    "serverNames": ["example.com"], "shortIds": ["abcd"],
+                    "settings": {"publicKey": "pbk", "fingerprint": "chrome", "spiderX": "/"},
+                },
+            }),
+            "sniffing": json.dumps({"enabled": False, "destOverride": []}),
+            "clientStats": [
+                {"id": 1, "inboundId": 1, "enable": c["enable"], "email": c["email"], "up": 10, "down": 20,
+                 "expiryTime": c["expiryTime"], "total": 0, "reset": 0}
+                for c in self.clients
+            ],
+        }
+
+    async def _guard(self, request):
+        self.requests.append((request.method, request.path))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if not self._authorized(request):
+            raise web.HTTPUnauthorized()
+
+    async def get_inbound(self, request):
+        await self._guard(request)
+        return web.json_response({"success": True, "obj": self._inbound()})
+
+    async def list_inbounds(self, request):
+        await self._guard(request)
+        return web.json_response({"success": True, "obj": [self._inbound()]})
+
+    async def add_client(self, request):
+        await self._guard(request)
+        body = await request.json()
+        self.clients.extend(json.loads(body["settings"])["clients"])
+        return web.json_response({"success": True})
+
+    async def update_client(self, request):
+        await self._guard(request)
+        body = await request.json()
+        updated = json.loads(body["settings"])["clients"][0]
+        for index, client in enumerate(self.clients):
+            if client["id"] == request.match_info["uuid"]:
+                self.clients[index] = {**client, **updated}
+                return web.json_response({"success": True})
+        return web.json_response({"success": False, "msg": "Client Not Found"})
+
+    async def del_client(self, request):
+        await self._guard(request)
+        uuid = request.match_info["uuid"]
+        if not any(c["id"] == uuid for c in self.clients):
+            return web.json_response({"success": False, "msg": f"Client Not Found In Inbound For ID: {uuid}"})
+        self.clients = [c for c in self.clients if c["id"] != uuid]
+        return web.json_response({"success": True})
+
+    async def settings(self, request):
+        await self._guard(request)
+        return web.json_response({"success": True, "obj": {"subURI": "https://sub.example/sub/"}})
+
+
+@asynccontextmanager
+async def _running_panel():
+    panel = _FakePanel()
+    server = TestServer(panel.app)
+    await server.start_server()
+    try:
+        panel.url = str(server.make_url("")).rstrip("/")
+        yield panel
+    finally:
+        await xui_api.close_async_panel_clients()
+        await server.close()
+
+
+def _host(panel) -> dict:
+    return {
+        'host_name': 'host-a',
+        'host_url': panel.url,
+        'host_username': 'admin',
+        'host_pass': 'secret',
+        'host_inbound_id': 1,
+        'host_code': 'hosta',
+    }
+
+
+@pytest.mark.unit
+@allure.epic("Модули")
+@allure.feature("3X-UI API")
+@allure.label("package", "src.shop_bot.modules")
+class TestAsyncPanelClient:
+    """Тесты для AsyncPanelClient и нативного пути операций с ключами"""
+
+    @allure.title("Сессия переиспользуется, при 401 выполняется повторный логин")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "aiohttp", "session", "unit")
+    async def test_login_reused_and_relogin_on_401(self):
+        """Несколько запросов — один логин; сброс сессии на панели — один повторный логин"""
+        async with _running_panel() as panel:
+            client = xui_api.get_async_panel_client(_host(panel))
+            assert xui_api.get_async_panel_client(_host(panel)) is client
+
+            inbound = await client.get_inbound(1, force=True)
+            await client.get_inbound(1, force=True)
+            assert inbound.protocol == "vless"
+            assert [c.email for c in inbound.settings.clients] == ["a@test"]
+            assert panel.logins == 1
+
+            # Панель «забыла» сессию: cookie клиента больше не действует
+            panel.logins += 1
+            await client.get_inbound(1, force=True)
+            assert panel.logins == 3
+
+            cached = await client.get_inbound(1)
+            assert await client.get_inbound(1) is cached
+
+    @allure.title("Загрузка, начатая до сброса кэша, не попадает в кэш")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "aiohttp", "cache", "unit")
+    async def test_cache_load_racing_invalidate_not_stored(self):
+        """invalidate_cache() во время чтения inbound'а: следующий вызов снова идёт в панель"""
+        async with _running_panel() as panel:
+            client = xui_api.get_async_panel_client(_host(panel))
+            panel.delay = 0.1
+            loading = asyncio.create_task(client.get_inbound(1))
+            await asyncio.sleep(0.05)
+            client.invalidate_cache()
+            await loading
+            panel.delay = 0
+
+            await client.get_inbound(1)
+            assert panel.requests.count(("GET", "/panel/api/inbounds/get/1")) == 2
+            await client.get_inbound(1)
+            assert panel.requests.count(("GET", "/panel/api/inbounds/get/1")) == 2
+
+    @allure.title("reset_panel_sessions() закрывает ClientSession нативных клиентов")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "aiohttp", "session", "unit")
+    async def test_reset_closes_client_sessions(self):
+        """Сессии работающего и простаивающего event loop закрываются, клиенты создаются заново"""
+        async with _running_panel() as panel:
+            client = xui_api.get_async_panel_client(_host(panel))
+            await client.get_inbound(1, force=True)
+            session = client._states[asyncio.get_running_loop()].session
+
+            idle_loop = asyncio.new_event_loop()
+            try:
+                idle_session = await asyncio.to_thread(
+                    lambda: idle_loop.run_until_complete(self._open_session(client))
+                )
+                await asyncio.to_thread(xui_api.reset_panel_sessions)
+                assert idle_session.closed
+            finally:
+                idle_loop.close()
+
+            await asyncio.sleep(0.01)
+            assert session.closed
+            assert client._states == {}
+            assert xui_api.get_async_panel_client(_host(panel)) is not client
+
+    @staticmethod
+    async def _open_session(client):
+        await client.get_inbound(1, force=True)
+        return client._states[asyncio.get_running_loop()].session
+
+    @allure.title("Неверный пароль и таймаут запроса")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "aiohttp", "errors", "unit")
+    async def test_login_error_and_timeout(self):
+        """Ошибка логина — PanelLoginError, медленная панель — asyncio.TimeoutError"""
+        async with _running_panel() as panel:
+            bad = xui_api.AsyncPanelClient(panel.url, "admin", "wrong")
+            with pytest.raises(xui_api.PanelLoginError):
+                await bad.get_inbound(1)
+            await bad.close()
+
+            client = xui_api.get_async_panel_client(_host(panel))
+            panel.delay = 0.5
+            with pytest.raises(asyncio.TimeoutError):
+                await client.request("GET", "panel/api/inbounds/get/1", timeout=0.1)
+
+    @allure.title("Нативный путь: создание, продление, детали, отключение и удаление ключа")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "aiohttp", "keys", "unit")
+    async def test_key_lifecycle_via_native_client(self, monkeypatch):
+        """С XUI_ASYNC_CLIENT=1 публичные функции xui_api работают через addClient/updateClient/delClient"""
+        async with _running_panel() as panel:
+            host = _host(panel)
+            monkeypatch.setenv("XUI_ASYNC_CLIENT", "1")
+            monkeypatch.setattr(xui_api, "get_host", lambda name: host)
+
+            def forbidden(*args, **kwargs):
+                raise AssertionError("py3xui-путь не должен использоваться")
+            monkeypatch.setattr(xui_api, "login_to_host", forbidden)
+
+            created = await xui_api.create_or_update_key_on_host("host-a", "new@test", days_to_add=30, sub_id="sub-new")
+            assert created['email'] == "new@test"
+            assert created['connection_string'].startswith(f"vless://{created['client_uuid']}@")
+            assert created['subscription_link'] == "https://sub.example/sub/sub-new"
+            assert ("POST", "/panel/api/inbounds/addClient") in panel.requests
+            assert [c["email"] for c in panel.clients] == ["a@test", "new@test"]
+
+            extended = await xui_api.create_or_update_key_on_host("host-a", "new@test", days_to_add=10)
+            assert extended['client_uuid'] == created['client_uuid']
+            assert extended['expiry_timestamp_ms'] > created['expiry_timestamp_ms']
+            assert ("POST", f"/panel/api/inbounds/updateClient/{created['client_uuid']}") in panel.requests
+            assert len(panel.clients) == 2
+
+            details = await xui_api.get_key_details_from_host({
+                'host_name': "host-a", 'xui_client_uuid': created['client_uuid'], 'key_email': "new@test",
+            })
+            assert details['connection_string'].startswith("vless://")
+            assert details['subscription_link'] == "https://sub.example/sub/sub-new"
+            assert details['protocol'] == "vless"
+
+            assert await xui_api.update_client_enabled_status_on_host("host-a", "new@test", False)
+            assert panel.clients[1]["enable"] is False
+
+            assert await xui_api.delete_client_on_host("host-a", "new@test")
+            assert [c["email"] for c in panel.clients] == ["a@test"]
+            assert await xui_api.delete_client_on_host("host-a", "new@test")
+            assert panel.logins == 1
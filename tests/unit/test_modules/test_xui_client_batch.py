@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для пакетного изменения клиентов 3X-UI в модуле xui_api
+
+Проверяет, что пакет накапливает добавления, изменения и удаления,
+фиксирует их минимальным числом запросов к панели и накладывает их на
+перечитанный перед записью inbound, не затирая изменения из панели.
+"""
+
+import pytest
+import allure
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from py3xui import Client
+
+from shop_bot.modules import xui_api
+
+
+HOST = {
+    'host_name': 'host-a',
+    'host_url': 'https://panel.example:2053',
+    'host_username': 'admin',
+    'host_pass': 'secret',
+    'host_inbound_id': 7,
+    'host_code': 'hosta',
+}
+
+
+def _client(email: str, client_id: str, **fields) -> Client:
+    return Client(id=client_id, email=email, enable=True, **fields)
+
+
+@pytest.mark.unit
+@allure.epic("Модули")
+@allure.feature("3X-UI API")
+@allure.label("package", "src.shop_bot.modules")
+class TestPanelClientBatch:
+    """Тесты для PanelClientBatch и panel_client_batch"""
+
+    @pytest.fixture
+    def panel(self, monkeypatch):
+        """Подменяет login_to_host: панель с тремя клиентами в inbound 7"""
+        state = {}
+
+        def login(host_url, username, password, inbound_id, max_retries=3):
+            api = MagicMock()
+            api.inbound.get_by_id.side_effect = lambda inbound_id: SimpleNamespace(
+                id=inbound_id,
+                protocol="vless",
+                settings=SimpleNamespace(clients=[
+                    _client("a@test", "uuid-a", sub_id="sub-a"),
+                    _client("b@test", "uuid-b"),
+                    _client("c@test", "uuid-c"),
+                ]),
+                clientStats=[],
+            )
+            state['api'] = api
+            return api, SimpleNamespace(id=inbound_id)
+
+        monkeypatch.setattr(xui_api, "login_to_host", login)
+        return state
+
+    @allure.title("Изменения пакета фиксируются тремя запросами")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "batch", "unit")
+    def test_commit_applies_all_changes(self, panel):
+        """Загрузка и перечитывание inbound, один inbound.update для изменений/удалений и один client.add"""
+        with xui_api.panel_client_batch(HOST) as batch:
+            assert batch.update("a@test", enable=False)
+            assert batch.delete("b@test")
+            assert not batch.delete("missing@test")
+            batch.add(_client("new1@test", "uuid-n1"))
+            batch.add(_client("new2@test", "uuid-n2"))
+            with pytest.raises(ValueError):
+                batch.add(_client("c@test", "uuid-dup"))
+
+        api = panel['api']
+        assert api.inbound.get_by_id.call_count == 2
+        api.client.delete.assert_not_called()
+        api.client.update.assert_not_called()
+
+        inbound_id, inbound = api.inbound.update.call_args.args
+        assert inbound_id == 7
+        assert [(c.email, c.enable) for c in inbound.settings.clients] == [("a@test", False), ("c@test", True)]
+        api.client.add.assert_called_once()
+        assert [c.email for c in api.client.add.call_args.args[1]] == ["new1@test", "new2@test"]
+        assert batch.result == {'added': 2, 'updated': 1, 'deleted': 1, 'requests': 3}
+
+    @allure.title("Коммит не затирает клиентов и трафик, изменённые в панели после загрузки")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "batch", "concurrency", "unit")
+    def test_commit_merges_into_fresh_inbound(self, panel):
+        """Изменения пакета накладываются на перечитанный inbound: чужие клиенты и счётчики сохраняются"""
+        with xui_api.panel_client_batch(HOST) as batch:
+            batch.update("a@test", enable=False)
+            batch.delete("b@test")
+            fresh = SimpleNamespace(
+                id=7,
+                up=500,
+                down=900,
+                settings=SimpleNamespace(clients=[
+                    _client("a@test", "uuid-a", sub_id="sub-a", limit_ip=3),
+                    _client("b@test", "uuid-b"),
+                    _client("c@test", "uuid-c", up=1024, down=4096),
+                    _client("d@test", "uuid-d"),
+                ]),
+            )
+            panel['api'].inbound.get_by_id.side_effect = lambda inbound_id: fresh
+
+        inbound_id, inbound = panel['api'].inbound.update.call_args.args
+        assert inbound is fresh and (inbound.up, inbound.down) == (500, 900)
+        assert [(c.email, c.enable) for c in inbound.settings.clients] == [
+            ("a@test", False), ("c@test", True), ("d@test", True),
+        ]
+        assert inbound.settings.clients[0].limit_ip == 3
+        assert (inbound.settings.clients[1].up, inbound.settings.clients[1].down) == (1024, 4096)
+        assert set(batch.clients) == {"a@test", "c@test", "d@test"}
+
+    @allure.title("Пакет без изменений и пакет с ошибкой не отправляют запросов")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "batch", "unit")
+    def test_no_commit_without_changes_or_on_error(self, panel):
+        """Пустой пакет ничего не пишет; исключение в блоке отменяет изменения"""
+        with xui_api.panel_client_batch(HOST) as batch:
+            assert batch.get("a@test").id == "uuid-a"
+        assert batch.result['requests'] == 0
+
+        with pytest.raises(RuntimeError):
+            with xui_api.panel_client_batch(HOST) as batch:
+                batch.delete("a@test")
+                raise RuntimeError("reconcile failed")
+
+        api = panel['api']
+        api.inbound.update.assert_not_called()
+        api.client.add.assert_not_called()
+
+    @allure.title("Детали ключей хоста по одному снимку inbound")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "batch", "refresh", "unit")
+    async def test_keys_details_single_snapshot(self, panel, monkeypatch):
+        """get_keys_details_from_host загружает inbound и subURI один раз на хост"""
+        sub_uri_calls = []
+
+        def fake_sub_uri(host_url, username, password):
+            sub_uri_calls.append(host_url)
+            return "https://sub.example/sub/"
+
+        monkeypatch.setattr(xui_api, "get_host", lambda name: HOST)
+        monkeypatch.setattr(xui_api, "get_sub_uri_from_panel", fake_sub_uri)
+        monkeypatch.setattr(xui_api, "get_connection_string", lambda inbound, uuid, url, remark: f"vless://{uuid}@{remark}")
+        keys = [
+            {'key_id': 1, 'xui_client_uuid': "uuid-a", 'key_email': "a@test"},
+            {'key_id': 2, 'xui_client_uuid': "uuid-b", 'key_email': "b@test"},
+            {'key_id': 3, 'xui_client_uuid': "uuid-x", 'key_email': "x@test"},
+        ]
+
+        details = await xui_api.get_keys_details_from_host("host-a", keys)
+
+        assert panel['api'].inbound.get_by_id.call_count == 1
+        assert len(sub_uri_calls) == 1
+        assert details[1]['subscription_link'] == "https://sub.example/sub/sub-a"
+        assert details[1]['connection_string'] == "vless://uuid-a@hosta"
+        assert details[1]['protocol'] == "vless"
+        assert details[2]['subscription_link'] is None
+        assert details[3] is None
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для кэша сессий 3X-UI в модуле xui_api
+
+Проверяет переиспользование авторизованной сессии хоста, повторный логин
+при 401, TTL-кэш inbound'ов и его сброс после изменений клиентов.
+"""
+
+import pytest
+import allure
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import requests
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.modules import xui_api
+
+
+HOST = {
+    'host_name': 'host-a',
+    'host_url': 'https://panel.example:2053',
+    'host_username': 'admin',
+    'host_pass': 'secret',
+    'host_inbound_id': 1,
+}
+
+
+def _http_error(status_code: int) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code} error", response=response)
+
+
+class _FakeHttpSession:
+    """Подмена requests.Session: считает логины и отвечает 401 на первый запрос после истечения сессии"""
+
+    def __init__(self):
+        self.headers = {}
+        self.logins = 0
+        self.expired = False
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, json=None, timeout=None):
+        self.logins += 1
+        self.expired = False
+        return SimpleNamespace(status_code=200)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        if self.expired:
+            return SimpleNamespace(status_code=401)
+        return SimpleNamespace(status_code=200, url=url)
+
+    def close(self):
+        pass
+
+
+@pytest.mark.unit
+@allure.epic("Модули")
+@allure.feature("3X-UI API")
+@allure.label("package", "src.shop_bot.modules")
+class TestPanelSessionCache:
+    """Тесты для кэша авторизованных сессий панелей"""
+
+    @pytest.fixture
+    def fake_login(self, monkeypatch):
+        """Подменяет login_to_host и считает логины"""
+        calls = []
+
+        def login(host_url, username, password, inbound_id, max_retries=3):
+            calls.append(host_url)
+            api = MagicMock()
+            api.inbound.get_by_id.side_effect = lambda inbound_id: SimpleNamespace(id=inbound_id, settings=SimpleNamespace(clients=[]))
+            api.inbound.get_list.return_value = []
+            return api, SimpleNamespace(id=inbound_id)
+
+        monkeypatch.setattr(xui_api, "login_to_host", login)
+        return calls
+
+    @allure.title("Авторизованная сессия хоста переиспользуется между вызовами")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "session", "cache", "unit")
+    def test_login_reused_across_operations(self, fake_login):
+        """Несколько операций на одном хосте выполняют один логин"""
+        for _ in range(3):
+            xui_api.run_panel_operation(HOST, lambda api, inbound, session: api.inbound.get_by_id(inbound.id))
+        api, inbound = xui_api.get_panel_api(HOST['host_url'], HOST['host_username'], HOST['host_pass'], 1)
+
+        assert len(fake_login) == 1
+        assert api is not None and inbound.id == 1
+        assert xui_api.get_panel_session_stats()['sessions'] == 1
+
+    @allure.title("Повторный логин при ответе 401")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "session", "auth", "unit")
+    def test_relogin_on_unauthorized(self, fake_login):
+        """Протухшая сессия приводит к одному повторному логину и повтору операции"""
+        attempts = []
+
+        def operation(api, inbound, session):
+            attempts.append(api)
+            if len(attempts) == 1:
+                raise _http_error(401)
+            return "ok"
+
+        xui_api.run_panel_operation(HOST, lambda api, inbound, session: None)
+        result = xui_api.run_panel_operation(HOST, operation)
+
+        assert result == "ok"
+        assert len(fake_login) == 2
+        assert attempts[0] is not attempts[1]
+
+    @allure.title("Прочие ошибки не вызывают повторного логина")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "session", "errors", "unit")
+    def test_other_errors_propagate(self, fake_login, monkeypatch):
+        """Ошибка 500 пробрасывается без повторного логина, неудачный логин — PanelLoginError"""
+        def operation(api, inbound, session):
+            raise _http_error(500)
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            xui_api.run_panel_operation(HOST, operation)
+        assert len(fake_login) == 1
+
+        xui_api.reset_panel_sessions()
+        monkeypatch.setattr(xui_api, "login_to_host", lambda *args, **kwargs: (None, None))
+        with pytest.raises(xui_api.PanelLoginError):
+            xui_api.run_panel_operation(HOST, operation)
+
+    @allure.title("TTL-кэш inbound'ов и сброс после изменений")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("xui", "cache", "unit")
+    def test_inbound_cache_invalidated_after_mutation(self, fake_login):
+        """Повторное чтение берётся из кэша, мутация и force=True идут в панель"""
+        def read(api, inbound, session):
+            return session.get_inbound(api, inbound.id)
+
+        first = xui_api.run_panel_operation(HOST, read)
+        second = xui_api.run_panel_operation(HOST, read)
+        api, _ = xui_api.get_panel_api(HOST['host_url'], HOST['host_username'], HOST['host_pass'], 1)
+        assert first is second
+        assert api.inbound.get_by_id.call_count == 1
+
+        xui_api.run_panel_operation(HOST, lambda api, inbound, session: api.client.delete(inbound.id, "uuid"), mutates=True)
+        third = xui_api.run_panel_operation(HOST, read)
+        assert third is not first
+        assert api.inbound.get_by_id.call_count == 2
+
+        fresh = xui_api.run_panel_operation(HOST, lambda api, inbound, session: session.get_inbound(api, inbound.id, force=True))
+        assert fresh is not third
+
+        xui_api.invalidate_panel_cache(HOST['host_url'] + "/")
+        xui_api.run_panel_operation(HOST, read)
+        assert api.inbound.get_by_id.call_count == 4
+
+    @allure.title("Нативные эндпоинты: keep-alive сессия и повторный логин при 401")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "session", "http", "unit")
+    def test_http_request_relogin_on_401(self, monkeypatch):
+        """http_request логинится один раз, а при 401 — заново с повтором запроса"""
+        fake_http = _FakeHttpSession()
+        monkeypatch.setattr(xui_api, "_create_verified_panel_session", lambda host_url: fake_http)
+        session = xui_api._get_panel_session(HOST['host_url'], HOST['host_username'], HOST['host_pass'])
+
+        assert session.http_request("POST", "panel/setting/all").status_code == 200
+        assert session.http_request("POST", "panel/setting/all").status_code == 200
+        assert fake_http.logins == 1
+
+        fake_http.expired = True
+        response = session.http_request("POST", "/panel/setting/all")
+
+        assert response.status_code == 200
+        assert response.url == "https://panel.example:2053/panel/setting/all"
+        assert fake_http.logins == 2
+
+    @allure.title("Смена пароля хоста создаёт новую сессию")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "session", "unit")
+    def test_password_change_replaces_session(self, fake_login):
+        """Сессия с устаревшим паролем не переиспользуется"""
+        xui_api.get_panel_api(HOST['host_url'], HOST['host_username'], HOST['host_pass'], 1)
+        xui_api.get_panel_api(HOST['host_url'], HOST['host_username'], "new-secret", 1)
+
+        assert len(fake_login) == 2
+        assert xui_api.get_panel_session_stats()['sessions'] == 1
+
+    @allure.title("Одновременные промахи кэша выполняют одну загрузку inbound")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("xui", "cache", "concurrency", "unit")
+    def test_concurrent_misses_single_load(self, fake_login):
+        """Параллельные чтения одного inbound (пакетное обновление ключей) ждут одну загрузку"""
+        import time as time_module
+        from concurrent.futures import ThreadPoolExecutor
+
+        api, _ = xui_api.get_panel_api(HOST['host_url'], HOST['host_username'], HOST['host_pass'], 1)
+
+        def slow_get(inbound_id):
+            time_module.sleep(0.2)
+            return SimpleNamespace(id=inbound_id, settings=SimpleNamespace(clients=[]))
+
+        api.inbound.get_by_id.side_effect = slow_get
+
+        def read(_):
+            return xui_api.run_panel_operation(HOST, lambda api, inbound, session: session.get_inbound(api, inbound.id))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(read, range(8)))
+
+        assert api.inbound.get_by_id.call_count == 1
+        assert all(result is results[0] for result in results)
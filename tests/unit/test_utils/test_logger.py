@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для очереди логов StructuredLogger
+
+Проверяет, что в режиме очереди запись и форматирование (включая JSON)
+выполняет поток-слушатель, а при переполнении очереди работают политики
+drop и drop_oldest с сообщением о потерянных записях.
+"""
+
+import pytest
+import sys
+import allure
+import json
+import logging
+import threading
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.utils.logger import (
+    JSONFormatter, LogPipeline, LogQueueConfig, OVERFLOW_DROP, OVERFLOW_DROP_OLDEST, StructuredLogger,
+)
+
+
+def _messages(path: Path) -> list:
+    return [line.rsplit(" - ", 1)[1] for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@allure.epic("Утилиты")
+@allure.feature("Логирование")
+@allure.label("package", "src.shop_bot.utils.logger")
+@pytest.mark.unit
+class TestLogQueue:
+    """Тесты для LogPipeline и StructuredLogger в режиме очереди"""
+
+    @allure.title("Файлы и JSON пишет поток-слушатель, а не вызывающий поток")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("logging", "queue", "unit")
+    def test_listener_owns_formatting(self, tmp_path, monkeypatch):
+        """Логгер держит один QueueHandler; JSONFormatter.format вызывается только в потоке log-listener"""
+        pipeline = LogPipeline(LogQueueConfig(max_size=100))
+        format_threads = set()
+        original_format = JSONFormatter.format
+
+        def tracking_format(formatter, record):
+            format_threads.add(threading.current_thread().name)
+            return original_format(formatter, record)
+
+        monkeypatch.setattr(JSONFormatter, "format", tracking_format)
+        structured = StructuredLogger("test.log_queue", log_dir=str(tmp_path), pipeline=pipeline)
+        structured.logger.propagate = False
+        pipeline.start()
+        try:
+            structured.info("Key synced", user_id=42)
+            structured.error("Panel unavailable")
+            pipeline.queue.join()
+        finally:
+            pipeline.stop()
+
+        assert len(structured.logger.handlers) == 1
+        assert format_threads == {"log-listener"}
+        assert _messages(tmp_path / "dark_maximus.log") == ["Key synced", "Panel unavailable"]
+        assert _messages(tmp_path / "errors.log") == ["Panel unavailable"]
+        entry = json.loads((tmp_path / "structured.log").read_text(encoding="utf-8").splitlines()[0])
+        assert (entry["message"], entry["user_id"]) == ("Key synced", 42)
+        assert pipeline.get_stats()["processed"] == 2
+
+    @allure.title("Переполнение очереди: drop теряет новые записи, drop_oldest — старые")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("logging", "queue", "overflow", "unit")
+    @pytest.mark.parametrize("overflow,expected", [
+        (OVERFLOW_DROP, ["record 0", "record 1"]),
+        (OVERFLOW_DROP_OLDEST, ["record 3", "record 4"]),
+    ])
+    def test_overflow_policies(self, tmp_path, overflow, expected):
+        """Вызывающий поток не ждёт; число потерянных записей попадает в лог предупреждением"""
+        pipeline = LogPipeline(LogQueueConfig(max_size=2, overflow=overflow))
+        structured = StructuredLogger("test.log_queue.overflow", log_dir=str(tmp_path), pipeline=pipeline)
+        structured.logger.propagate = False
+        for i in range(5):
+            structured.info(f"record {i}")
+
+        stats = pipeline.get_stats()
+        assert (stats["queue_size"], stats["dropped"], stats["listener_alive"]) == (2, 3, False)
+
+        pipeline.start()
+        pipeline.stop()
+        assert _messages(tmp_path / "dark_maximus.log") == [
+            f"Log queue overflow ({overflow}): dropped 3 records", *expected,
+        ]
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для гистограмм задержек performance_monitor.py
+
+Тестирует точность перцентилей логарифмической гистограммы, скользящее
+окно RollingHistogram, запись метрик PerformanceMonitor из потоков и
+выгрузку накопленных гистограмм в формате OpenMetrics.
+"""
+
+import pytest
+import sys
+import allure
+import threading
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.utils.performance_monitor import (
+    METRICS_BUCKETS, LatencyHistogram, PerformanceMonitor, RollingHistogram, measure_performance_sync,
+    render_openmetrics,
+)
+from shop_bot.utils import performance_monitor
+
+
+@allure.epic("Утилиты")
+@allure.feature("Мониторинг производительности")
+@allure.label("package", "src.shop_bot.utils.performance_monitor")
+@pytest.mark.unit
+class TestLatencyHistograms:
+    """Тесты для LatencyHistogram и RollingHistogram"""
+
+    @allure.title("Перцентили гистограммы совпадают с точными с погрешностью корзины")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("performance", "histogram", "unit")
+    def test_percentile_accuracy(self):
+        """Для 1..10000 мс p50/p95/p99 отличаются от точных значений не больше чем на 6.25%"""
+        histogram = LatencyHistogram()
+        for ms in range(1, 10001):
+            histogram.record(ms / 1000)
+
+        for pct, exact in ((50, 5.0), (95, 9.5), (99, 9.9)):
+            assert abs(histogram.percentile(pct) - exact) / exact <= 0.0625
+        assert histogram.count == 10000
+        assert histogram.percentile(100) <= histogram.max == 10.0
+        assert len(histogram.buckets) < 300
+
+    @allure.title("Скользящее окно отбрасывает устаревшие интервалы")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("performance", "histogram", "unit")
+    def test_rolling_window(self):
+        """Значения старше windows * window_seconds не входят в сводку и удаляются"""
+        rolling = RollingHistogram(window_seconds=10, windows=3)
+        rolling.record(5.0, now=100, slow=True)
+        rolling.record(0.1, now=125, error=True)
+        rolling.record(0.2, now=129)
+
+        assert rolling.snapshot(now=129).count == 3
+        recent = rolling.snapshot(now=135)
+        assert (recent.count, recent.slow, recent.errors) == (2, 0, 1)
+        rolling.record(0.3, now=145)
+        assert len(rolling._buckets) == 2
+
+
+@allure.epic("Утилиты")
+@allure.feature("Мониторинг производительности")
+@allure.label("package", "src.shop_bot.utils.performance_monitor")
+@pytest.mark.unit
+class TestPerformanceMonitorPercentiles:
+    """Тесты для перцентилей PerformanceMonitor"""
+
+    @allure.title("Метрики из потоков и event loop попадают в сводку с p50/p95/p99")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("performance", "percentiles", "unit")
+    async def test_summary_percentiles(self, monkeypatch):
+        """Сводка считается по гистограммам, а не по deque последних метрик"""
+        monitor = PerformanceMonitor(max_metrics=10, slow_threshold=0.5)
+        monkeypatch.setattr(performance_monitor, "_performance_monitor", monitor)
+
+        def worker():
+            for i in range(200):
+                monitor.record_metric_sync("db_query", (i % 100 + 1) / 1000)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        await monitor.record_metric("payment", 1.0, success=False)
+
+        @measure_performance_sync("webhook")
+        def webhook():
+            return "ok"
+
+        assert webhook() == "ok"
+
+        summary = await monitor.get_performance_summary()
+        assert summary['total_operations'] == 802
+        assert summary['slow_operations'] == 1
+        assert len(monitor.metrics) == 10
+        operations = {op['operation']: op for op in summary['top_operations']}
+        assert operations['db_query']['count'] == 800
+        assert abs(operations['db_query']['p50'] - 0.05) <= 0.05 * 0.0625
+        assert abs(operations['db_query']['p99'] - 0.099) <= 0.099 * 0.0625
+        assert operations['webhook']['count'] == 1
+        assert summary['p99'] <= 1.0 and summary['p50'] < 0.1
+        assert (await monitor.get_operation_stats("db_query"))['p95'] > 0
+
+    @allure.title("Накопленные гистограммы выгружаются в OpenMetrics с метками операции и цели")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("performance", "openmetrics", "unit")
+    async def test_openmetrics_export(self):
+        """Корзины le накопительные и не уменьшаются при сдвиге окна; 'panel_api:host' даёт метку target"""
+        monitor = PerformanceMonitor(max_metrics=10, slow_threshold=1.0)
+        for duration in (0.002, 0.02, 0.2, 2.0):
+            monitor.record_metric_sync("panel_api:panel.example:2053", duration, success=duration < 1)
+        monitor.overall_histogram = RollingHistogram()
+        monitor.histograms.clear()
+        await monitor.record_count("notifications_enqueued", 5)
+
+        text = render_openmetrics(monitor.get_metric_families())
+        lines = text.splitlines()
+        labels = 'operation="panel_api",target="panel.example:2053"'
+        buckets = [line for line in lines if line.startswith(f'shop_bot_operation_duration_seconds_bucket{{{labels}')]
+
+        assert len(buckets) == len(METRICS_BUCKETS) + 1
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        assert counts == sorted(counts) and counts[-1] == 4
+        assert f'shop_bot_operation_duration_seconds_bucket{{{labels},le="0.01"}} 1' in lines
+        assert f'shop_bot_operation_duration_seconds_count{{{labels}}} 4' in lines
+        assert f'shop_bot_operation_errors_total{{{labels}}} 1' in lines
+        assert 'shop_bot_events_total{name="notifications_enqueued"} 5' in lines
+        assert lines[-1] == "# EOF"
+
+        escaped = render_openmetrics([("x", "gauge", "help", [("", {"name": 'a"b\\c'}, 1)])])
+        assert 'shop_bot_x{name="a\\"b\\\\c"} 1' in escaped
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для TelegramLoggerHandler
+
+Проверяет дедупликацию повторяющихся ошибок в сводку «×N», ограничение
+очереди с подсчётом отброшенных записей, бюджет сообщений в минуту и
+доставку из отдельного потока отправки.
+"""
+
+import pytest
+import sys
+import allure
+import logging
+import time
+from pathlib import Path
+
+# Добавляем путь к проекту
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.utils.telegram_logger import TelegramLoggerHandler
+
+
+def _record(lineno: int, message: str = "Panel unavailable", level: int = logging.ERROR) -> logging.LogRecord:
+    return logging.LogRecord("shop_bot.test", level, "/app/scheduler.py", lineno, message, None, None, func="sync")
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    """Обработчик без потока отправки: шаги выполняются вызовом _run_once"""
+    test_handler = TelegramLoggerHandler(bot_token="token", admin_chat_id="1", log_level="error")
+    sent = []
+    monkeypatch.setattr(test_handler, "_ensure_sender", lambda: None)
+    monkeypatch.setattr(test_handler, "_post_message", lambda text: sent.append(text) or True)
+    test_handler.sent = sent
+    return test_handler
+
+
+@allure.epic("Утилиты")
+@allure.feature("Логирование")
+@allure.label("package", "src.shop_bot.utils.telegram_logger")
+@pytest.mark.unit
+class TestTelegramLoggerHandler:
+    """Тесты для TelegramLoggerHandler"""
+
+    @allure.title("Повторы одной ошибки сворачиваются в сводку ×N")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("logging", "telegram", "dedup", "unit")
+    def test_duplicates_coalesced(self, handler):
+        """Первая запись уходит сразу, повторы с того же места вызова — одной сводкой после окна"""
+        for i in range(524):
+            handler.emit(_record(42, f"Panel unavailable: host-{i % 3}"))
+
+        assert handler.get_stats()['queue_size'] == 1
+        assert handler._run_once() == 1
+        assert "Panel unavailable: host-0" in handler.sent[0]
+
+        assert handler._run_once(now=time.monotonic() + handler.DEDUP_WINDOW_SECONDS) == 1
+        assert "×523" in handler.sent[1]
+        stats = handler.get_stats()
+        assert stats['total_coalesced'] == 523
+        assert stats['dedup_windows'] == 0 and stats['queue_size'] == 0
+
+    @allure.title("Очередь ограничена, отброшенные записи считаются и упоминаются в сообщении")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("logging", "telegram", "queue", "unit")
+    def test_bounded_queue_and_budget(self, handler):
+        """При переполнении записи отбрасываются; сверх бюджета в минуту сообщения не отправляются"""
+        handler.QUEUE_MAX_SIZE = 5
+        handler.MAX_MESSAGES_PER_MINUTE = 1
+        handler._max_logs_per_group = 2
+        for lineno in range(1, 21):
+            handler.emit(_record(lineno))
+
+        stats = handler.get_stats()
+        assert (stats['queue_size'], stats['total_dropped']) == (5, 15)
+
+        now = time.monotonic()
+        assert handler._run_once(now=now) == 1
+        assert "Группа логов (2 записей)" in handler.sent[0]
+        assert "Пропущено записей</b> (очередь переполнена): 15" in handler.sent[0]
+        assert handler._run_once(now=now + 1) == 0
+        assert handler.get_stats()['budget_remaining'] == 0
+        assert handler._run_once(now=now + 60) == 1
+        assert handler.get_stats()['queue_size'] == 1
+
+    @allure.title("Записи доставляются из отдельного потока и досылаются при закрытии")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("logging", "telegram", "thread", "unit")
+    def test_sender_thread(self, monkeypatch):
+        """emit не отправляет сообщения в вызывающем потоке; close() ждёт поток и досылает сводку повторов"""
+        test_handler = TelegramLoggerHandler(bot_token="token", admin_chat_id="1", log_level="warning")
+        sent = []
+        monkeypatch.setattr(test_handler, "_post_message", lambda text: sent.append(text) or True)
+        logger = logging.getLogger("shop_bot.test.telegram_logger")
+        logger.addHandler(test_handler)
+        try:
+            for _ in range(2):
+                logger.warning("Disk almost full")
+            deadline = time.monotonic() + 5
+            while not sent and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            logger.removeHandler(test_handler)
+            test_handler.close()
+
+        assert "Disk almost full" in sent[0]
+        assert "×1" in sent[-1]
+        assert not test_handler._sender.is_alive()
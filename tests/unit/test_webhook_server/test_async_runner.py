@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для общего фонового event loop веб-сервера (webhook_server.async_runner)
+
+Проверяет выполнение корутин из синхронного кода в одном loop, таймаут
+с отменой, ограничение конкурентности gather_limited и пакетное
+обновление ключей fetch_keys_details.
+"""
+
+import asyncio
+import concurrent.futures
+import pytest
+import allure
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.webhook_server import async_runner
+
+
+@pytest.mark.unit
+@allure.epic("Веб-панель")
+@allure.feature("Фоновый event loop")
+@allure.label("package", "src.shop_bot.webhook_server")
+class TestAsyncRunner:
+    """Тесты для run_async, gather_limited и fetch_keys_details"""
+
+    @allure.title("Корутины выполняются в одном долгоживущем loop")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("async_runner", "event_loop", "unit")
+    def test_run_async_reuses_loop(self):
+        """Повторные вызовы run_async используют один и тот же loop в отдельном потоке"""
+        async def current_loop():
+            return asyncio.get_running_loop()
+
+        first = async_runner.run_async(current_loop())
+        second = async_runner.run_async(current_loop())
+
+        assert first is second
+        assert first.is_running()
+
+        async def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            async_runner.run_async(fail())
+
+    @allure.title("Таймаут отменяет корутину")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("async_runner", "timeout", "unit")
+    def test_run_async_timeout_cancels(self):
+        """Корутина, не уложившаяся в timeout, отменяется в фоновом loop"""
+        state = {}
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                state['cancelled'] = True
+                raise
+
+        with pytest.raises(concurrent.futures.TimeoutError):
+            async_runner.run_async(slow(), timeout=0.1)
+        time.sleep(0.1)
+        assert state.get('cancelled') is True
+
+    @allure.title("gather_limited ограничивает число одновременных корутин")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("async_runner", "concurrency", "unit")
+    def test_gather_limited(self):
+        """Не более limit корутин одновременно, порядок результатов и исключения сохраняются"""
+        state = {'active': 0, 'peak': 0}
+
+        async def work(i):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            await asyncio.sleep(0.02)
+            state['active'] -= 1
+            if i == 3:
+                raise RuntimeError("key 3")
+            return i * 10
+
+        results = async_runner.run_async(async_runner.gather_limited((work(i) for i in range(10)), limit=3))
+
+        assert state['peak'] == 3
+        assert results[:3] == [0, 10, 20]
+        assert isinstance(results[3], RuntimeError)
+        assert results[9] == 90
+
+    @allure.title("Пакетное обновление ключей занимает время самого медленного хоста")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("async_runner", "keys", "refresh", "unit")
+    def test_fetch_keys_details_concurrent(self):
+        """50 ключей на медленных хостах обновляются параллельно, ошибки остаются на месте ключа"""
+        from shop_bot.webhook_server.app import fetch_keys_details
+
+        keys = [{'key_id': i, 'host_name': f"host-{i % 5}"} for i in range(50)]
+
+        async def details(key):
+            await asyncio.sleep(0.1)
+            if key['key_id'] == 7:
+                raise ConnectionError("panel unreachable")
+            return {'status': 'active', 'key_id': key['key_id']}
+
+        started = time.perf_counter()
+        result = fetch_keys_details(keys, details)
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 1.0, f"ключи обновлялись последовательно ({elapsed:.2f}s)"
+        assert result[0] == {'status': 'active', 'key_id': 0}
+        assert isinstance(result[7], ConnectionError)
+        assert len(result) == 50
+        assert fetch_keys_details([], details) == {}
@@ -92,18 +92,16 @@ class TestWebhookServerDashboard:
             
             with allure.step("Запрос страницы Dashboard"):
                 # Мокируем функции получения данных
-                with patch('src.shop_bot.webhook_server.app.get_all_hosts', return_value=[]):
-                    with patch('src.shop_bot.webhook_server.app.get_user_count', return_value=0):
-                        with patch('src.shop_bot.webhook_server.app.get_total_keys_count', return_value=0):
-                            with patch('src.shop_bot.webhook_server.app.get_total_earned_sum', return_value=0.0):
-                                with patch('src.shop_bot.webhook_server.app.get_total_notifications_count', return_value=0):
-                                    with patch('src.shop_bot.webhook_server.app.get_paginated_transactions', return_value=([], 0)):
-                                        with patch('src.shop_bot.webhook_server.app.get_daily_stats_for_charts', return_value=chart_data):
-                                            response = client.get('/dashboard')
-                                            allure.attach(str(response.status_code), "Статус ответа", allure.attachment_type.TEXT)
-                                            
-                                            with allure.step("Проверка статуса ответа"):
-                                                assert response.status_code == 200, f"Ожидался статус 200, получен {response.status_code}"
+                dashboard_stats = {
+                    'stats': {'user_count': 0, 'total_keys': 0, 'total_spent': 0.0, 'host_count': 0, 'total_notifications': 0},
+                    'chart_data': chart_data
+                }
+                with patch('src.shop_bot.webhook_server.app.get_dashboard_stats', return_value=dashboard_stats):
+                    response = client.get('/dashboard')
+                    allure.attach(str(response.status_code), "Статус ответа", allure.attachment_type.TEXT)
+
+                    with allure.step("Проверка статуса ответа"):
+                        assert response.status_code == 200, f"Ожидался статус 200, получен {response.status_code}"
 
     @allure.story("Dashboard: производительность")
     @allure.title("Страница производительности")
@@ -110,3 +110,37 @@ class TestMonitoring:
             response = authenticated_session.get('/api/monitoring/hourly-stats?hours=24')
             assert response.status_code in [200, 500]
 
+
+    @allure.story("Мониторинг: экспорт в Prometheus")
+    @allure.title("/metrics отдаёт OpenMetrics по токену или из сессии панели")
+    @allure.description("""
+    Проверяет эндпоинт /metrics.
+    
+    **Что проверяется:**
+    - Без токена и сессии — 401
+    - С неверным Bearer-токеном (в том числе с не-ASCII символами) — 401
+    - С токеном metrics_token — гистограммы операций, счётчики SQLite и глубина очередей в формате OpenMetrics
+    """)
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("monitoring", "metrics", "openmetrics", "webhook_server", "unit")
+    def test_metrics_endpoint(self, temp_db, flask_app, monkeypatch):
+        from shop_bot.data_manager import database
+        from shop_bot.utils import performance_monitor
+
+        monitor = performance_monitor.PerformanceMonitor()
+        monkeypatch.setattr(performance_monitor, "_performance_monitor", monitor)
+        monitor.record_metric_sync("telegram_api:sendMessage", 0.12)
+
+        assert flask_app.get('/metrics').status_code == 401
+        database.update_setting('metrics_token', 'scrape-secret')
+        assert flask_app.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+        assert flask_app.get('/metrics', headers={'Authorization': 'Bearer scrape-secrét'}).status_code == 401
+
+        response = flask_app.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        body = response.get_data(as_text=True)
+        assert response.status_code == 200
+        assert response.content_type.startswith('application/openmetrics-text')
+        assert 'shop_bot_operation_duration_seconds_count{operation="telegram_api",target="sendMessage"} 1' in body
+        assert 'shop_bot_queue_depth{queue="notification_outbox"} 0' in body
+        assert 'shop_bot_sqlite_statements_total' in body
+        assert body.endswith('# EOF\n')
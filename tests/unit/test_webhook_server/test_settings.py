@@ -288,3 +288,45 @@ class TestSettings:
             response = authenticated_session.post('/stop-support-bot')
             assert response.status_code in [200, 302]
 
+
+    @allure.story("Настройки: управление конфигурацией")
+    @allure.title("Скачивание базы данных согласованным gzip-потоком")
+    @allure.description("""
+    Проверяет, что /api/database/download отдаёт снимок БД, снятый через
+    SQLite backup API, сжатым потоком без временных файлов.
+    
+    **Что проверяется:**
+    - Ответ — gzip-вложение, тело читается фрагментами
+    - Распакованный снимок — корректная БД с данными
+    - Временный снимок большой БД удаляется после отправки
+    
+    **Ожидаемый результат:**
+    Статус 200, в снимке есть созданный пользователь, каталог снимков пуст.
+    """)
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("settings", "database", "download", "webhook_server", "unit")
+    def test_database_download_stream(self, temp_db, authenticated_session, tmp_path, monkeypatch):
+        """Тест потокового скачивания снимка БД"""
+        import gzip
+        import sqlite3
+        from shop_bot.data_manager import backup, database
+
+        database.register_user_if_not_exists(8001, "download_user", referrer_id=None)
+        manager = backup.DatabaseBackupManager(backup_dir=str(tmp_path / "backups"))
+        manager.memory_snapshot_limit = 0
+        monkeypatch.setattr(backup, "DB_FILE", temp_db)
+        monkeypatch.setattr(backup, "backup_manager", manager)
+
+        response = authenticated_session.get('/api/database/download', buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/gzip'
+        assert 'attachment; filename="database_backup_' in response.headers['Content-Disposition']
+        assert response.is_streamed and 'Content-Length' not in response.headers
+
+        snapshot = tmp_path / "downloaded.db"
+        snapshot.write_bytes(gzip.decompress(b"".join(response.response)))
+        response.close()
+        with sqlite3.connect(snapshot) as conn:
+            assert conn.execute("SELECT username FROM users WHERE telegram_id = 8001").fetchone() == ("download_user",)
+        conn.close()
+        assert list((tmp_path / "backups").iterdir()) == []
@@ -105,6 +105,35 @@ class TestTransactions:
             response = authenticated_session.get('/transactions')
             assert response.status_code == 200, "Страница транзакций должна возвращать 200"
 
+    @allure.story("Транзакции: просмотр и управление")
+    @allure.title("API списка транзакций с курсорной пагинацией")
+    @allure.description("""
+    Проверяет endpoint /api/transactions: страницу транзакций по курсору.
+
+    **Ожидаемый результат:**
+    Первая страница из одной транзакции содержит next_cursor, вторая страница
+    по этому курсору — оставшуюся транзакцию, даты возвращаются строками ISO.
+    """)
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("transactions", "api", "pagination", "webhook_server", "unit")
+    def test_transactions_api_pagination(self, authenticated_session, sample_transaction, temp_db):
+        import sqlite3
+
+        with sqlite3.connect(str(temp_db), timeout=30) as conn:
+            conn.execute(
+                "INSERT INTO transactions (payment_id, user_id, status, amount_rub, payment_method, created_date) VALUES ('test_payment_124', 123456789, 'paid', 50.0, 'Balance', '2020-01-01 00:00:00')"
+            )
+
+        first = authenticated_session.get('/api/transactions?per_page=1').get_json()
+        assert first['success'] is True
+        assert first['total'] == 2
+        assert [item['transaction_id'] for item in first['items']] == [sample_transaction]
+        assert isinstance(first['items'][0]['created_date'], str)
+
+        second = authenticated_session.get(f"/api/transactions?per_page=1&cursor={first['next_cursor']}").get_json()
+        assert [item['payment_id'] for item in second['items']] == ['test_payment_124']
+        assert second['next_cursor'] is None and second['prev_cursor'] is not None
+
     @allure.story("Транзакции: просмотр и управление")
     @allure.title("Получение детальной информации о транзакции через API")
     @allure.description("""
@@ -60,6 +60,46 @@ class TestWebhookServerUsers:
             response = client.get('/users')
             assert response.status_code == 200
 
+    @allure.story("Управление пользователями: просмотр списка")
+    @allure.title("API списка пользователей с курсорной пагинацией")
+    @allure.description("""
+    Проверяет endpoint /api/users: страницу пользователей по курсору,
+    ключи пользователей страницы и сумму оплат.
+
+    **Ожидаемый результат:**
+    Две страницы по 2 пользователя содержат всех трёх пользователей без повторов,
+    у пользователя с ключом заполнены user_keys и user_keys_count.
+    """)
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("users", "list", "pagination", "webhook_server", "unit")
+    def test_users_api_pagination(self, temp_db, admin_credentials):
+        """Тест API списка пользователей (/api/users)"""
+        from src.shop_bot.webhook_server.app import create_webhook_app
+        from shop_bot.data_manager.database import register_user_if_not_exists, _get_db_connection
+
+        for user_id in (123490, 123491, 123492):
+            register_user_if_not_exists(user_id, f"list_user{user_id}", referrer_id=None)
+        with _get_db_connection() as conn:
+            conn.execute(
+                "INSERT INTO vpn_keys (user_id, host_name, xui_client_uuid, key_email) VALUES (123491, 'host', 'uuid-list', 'list@test')"
+            )
+
+        app = create_webhook_app(MagicMock())
+        with app.test_client() as client:
+            with patch('src.shop_bot.webhook_server.app.verify_admin_credentials', return_value=True):
+                client.post('/login', data=admin_credentials)
+
+            first = client.get('/api/users?per_page=25&sort=telegram_id&order=asc').get_json()
+            assert first['success'] is True
+            assert first['total'] == 3 and first['next_cursor'] is None
+            users = {user['telegram_id']: user for user in first['users']}
+            assert [key['key_email'] for key in users[123491]['user_keys']] == ['list@test']
+            assert users[123491]['user_keys_count'] == 1
+
+            response = client.get('/users?per_page=25&search=list_user12349')
+            assert response.status_code == 200
+            assert 'Всего: 3' in response.get_data(as_text=True)
+
     @allure.story("Управление пользователями: детали пользователя")
     @allure.title("Получение деталей пользователя через API")
     @allure.description("""
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit-тесты для запуска веб-сервера (webhook_server.server)
+
+Проверяет разбор настроек WEB_SERVER_*, параллельную обработку запросов
+в пуле потоков waitress, мост вебхуков в event loop ботов через
+run_coroutine_threadsafe и корректную остановку сервера.
+"""
+
+import asyncio
+import json
+import pytest
+import allure
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from flask import Flask, current_app, request
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from shop_bot.webhook_server import server as web_server
+
+
+def _bridge_app(loop: asyncio.AbstractEventLoop) -> Flask:
+    """Приложение с вебхуком, передающим обработку в event loop как платёжные вебхуки"""
+    app = Flask("bridge-test")
+    app.config['EVENT_LOOP'] = loop
+    processed = []
+    app.config['PROCESSED'] = processed
+
+    async def process_payment(payload: dict) -> str:
+        await asyncio.sleep(0.2)
+        processed.append(payload['id'])
+        return f"paid:{payload['id']}"
+
+    @app.route('/test-webhook', methods=['POST'])
+    def webhook():
+        future = asyncio.run_coroutine_threadsafe(process_payment(request.get_json()), current_app.config['EVENT_LOOP'])
+        return future.result(timeout=5), 200
+
+    return app
+
+
+@pytest.mark.unit
+@allure.epic("Веб-панель")
+@allure.feature("Веб-сервер")
+@allure.label("package", "src.shop_bot.webhook_server")
+class TestWebServer:
+    """Тесты для WebServerConfig и WebServer"""
+
+    @allure.title("Настройки сервера из переменных окружения")
+    @allure.severity(allure.severity_level.NORMAL)
+    @allure.tag("web_server", "config", "unit")
+    def test_config_from_env(self, monkeypatch):
+        """По умолчанию waitress, некорректные значения заменяются значениями по умолчанию"""
+        for name in ("WEB_SERVER", "WEB_SERVER_THREADS", "WEB_SERVER_CONNECTION_LIMIT", "WEB_SERVER_WORKERS"):
+            monkeypatch.delenv(name, raising=False)
+        config = web_server.WebServerConfig.from_env()
+        assert config.kind == web_server.SERVER_WAITRESS
+        assert config.threads == web_server.DEFAULT_THREADS
+
+        monkeypatch.setenv("WEB_SERVER", "Werkzeug")
+        monkeypatch.setenv("WEB_SERVER_THREADS", "16")
+        monkeypatch.setenv("WEB_SERVER_CONNECTION_LIMIT", "abc")
+        monkeypatch.setenv("WEB_SERVER_WORKERS", "4")
+        config = web_server.WebServerConfig.from_env()
+        assert config.kind == web_server.SERVER_WERKZEUG
+        assert config.threads == 16
+        assert config.connection_limit == web_server.DEFAULT_CONNECTION_LIMIT
+
+        monkeypatch.setenv("WEB_SERVER", "gunicorn")
+        assert web_server.WebServerConfig.from_env().kind == web_server.SERVER_WAITRESS
+
+    @allure.title("Вебхуки обрабатываются параллельно через event loop ботов")
+    @allure.severity(allure.severity_level.CRITICAL)
+    @allure.tag("web_server", "webhooks", "event_loop", "unit")
+    @pytest.mark.parametrize("kind", [web_server.SERVER_WAITRESS, web_server.SERVER_WERKZEUG])
+    def test_webhook_bridge_to_event_loop(self, kind):
+        """Запросы из потоков сервера выполняются в loop ботов; остановка освобождает поток"""
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+        loop_thread.start()
+        app = _bridge_app(loop)
+        server = web_server.WebServer(app, host="127.0.0.1", port=0, config=web_server.WebServerConfig(kind=kind, threads=4))
+        thread = server.start()
+        try:
+            def post(payment_id: int) -> str:
+                req = urllib.request.Request(
+                    f"http://127.0.0.1:{server.port}/test-webhook",
+                    data=json.dumps({'id': payment_id}).encode(),
+                    headers={'Content-Type': 'application/json'},
+                )
+                with urllib.request.urlopen(req, timeout=5) as response:
+                    return response.read().decode()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(post, range(4)))
+            elapsed = time.perf_counter() - started
+
+            assert results == [f"paid:{i}" for i in range(4)]
+            assert sorted(app.config['PROCESSED']) == [0, 1, 2, 3]
+            assert elapsed < 0.7, f"вебхуки обрабатывались последовательно ({elapsed:.2f}s)"
+        finally:
+            server.stop()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join(5)
+            loop.close()
+        assert not thread.is_alive()